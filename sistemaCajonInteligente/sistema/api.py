@@ -0,0 +1,260 @@
+"""
+API JSON de solo lectura para cajas, objetos de una caja e historial de acciones, y
+sugerencia del tipo y el tamaño de un objeto por su foto (formulario de añadir objetos).
+
+- ?campos=id,nombre  devuelve solo esos campos (la consulta solo lee esas columnas)
+- ?limite=50         tamaño de página (máximo LIMITE_MAXIMO)
+- ?despues=<cursor>  siguiente página (paginación por cursor)
+
+Cada respuesta lleva un ETag calculado con una consulta barata (versiones de las
+cajas, o el último id y la última fecha de Accion con la versión del historial), así
+un cliente con If-None-Match recibe 304 sin que se lean ni serialicen los datos.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Subquery
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .models import Cajon, Objeto, Accion, VersionHistorial
+from . import busqueda, clasificador, instrumentacion
+from .paginacion import CursorInvalido, decodificar_cursor, filtrar_despues, paginar
+
+LIMITE_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+CAMPOS_CAJON = ['id', 'nombre', 'capacidadMaxima', 'total_objetos', 'total_pequenos',
+                'total_medianos', 'total_grandes', 'version']
+CAMPOS_OBJETO = ['id', 'nombre', 'tipo', 'tamanio', 'cantidad', 'imagen', 'miniatura', 'imagen_hash']
+CAMPOS_ACCION = ['id', 'tipo', 'descripcion', 'fecha_hora', 'cajon_id', 'objetos']
+
+# Campos de archivo que se devuelven como URL
+CAMPOS_ARCHIVO = {'imagen', 'miniatura'}
+
+
+class ErrorParametros(ValueError):
+    pass
+
+
+def _leer_campos(request, permitidos):
+    texto = request.GET.get('campos')
+    if not texto:
+        return list(permitidos)
+    campos = [campo.strip() for campo in texto.split(',') if campo.strip()]
+    invalidos = [campo for campo in campos if campo not in permitidos]
+    if invalidos:
+        raise ErrorParametros(f'Campos no válidos: {", ".join(invalidos)}')
+    return campos
+
+
+def _leer_limite(request):
+    try:
+        limite = int(request.GET.get('limite', LIMITE_DEFECTO))
+    except ValueError:
+        raise ErrorParametros('El límite debe ser un número')
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+
+def _etag(*partes):
+    """
+    ETag fuerte a partir del estado de los datos y de los parámetros de la petición
+    """
+    return hashlib.sha1('|'.join(str(parte) for parte in partes).encode()).hexdigest()
+
+
+def _respuesta(pagina, campos, extra=None):
+    resultados = []
+    for fila in pagina:
+        datos = {campo: fila[campo] for campo in campos if campo in fila}
+        for campo in CAMPOS_ARCHIVO & datos.keys():
+            datos[campo] = settings.MEDIA_URL + datos[campo] if datos[campo] else None
+        if extra:
+            extra(fila, datos)
+        resultados.append(datos)
+    return JsonResponse(
+        {'resultados': resultados, 'siguiente': pagina.cursor_siguiente},
+        encoder=DjangoJSONEncoder,
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+def _error(mensaje, estado=400):
+    return JsonResponse({'error': mensaje}, status=estado, json_dumps_params={'ensure_ascii': False})
+
+
+# Cajas
+
+def _etag_cajones(request):
+    # Ids y versiones de la página pedida: cambia si alguna caja de la página cambia
+    try:
+        limite = _leer_limite(request)
+        valores = decodificar_cursor(request.GET.get('despues'), ['id'], Cajon)
+    except ValueError:
+        # La vista responde con el error de parámetros
+        return None
+    cajas = filtrar_despues(Cajon.objects.order_by('id'), ['id'], valores)
+    estado = list(cajas.values_list('id', 'version')[:limite + 1])
+    return _etag('cajones', estado, request.GET.urlencode())
+
+
+@require_GET
+@condition(etag_func=_etag_cajones)
+def api_cajones(request):
+    """
+    Lista de cajas con sus contadores de ocupación
+    """
+    try:
+        campos = _leer_campos(request, CAMPOS_CAJON)
+        limite = _leer_limite(request)
+    except ErrorParametros as e:
+        return _error(str(e))
+
+    try:
+        pagina = paginar(
+            Cajon.objects.values(*{'id', *campos}),
+            campos=['id'],
+            tamanio=limite,
+            despues=request.GET.get('despues'),
+        )
+    except CursorInvalido as e:
+        return _error(str(e))
+    return _respuesta(pagina, campos)
+
+
+# Objetos de una caja
+
+def _etag_objetos_caja(request, caja_id):
+    version = Cajon.objects.filter(id=caja_id).values_list('version', flat=True).first()
+    # La vista lo usa para responder 404 sin volver a consultar la caja
+    request.version_caja = version
+    if version is None:
+        return None
+    return _etag('objetos', caja_id, version, request.GET.urlencode())
+
+
+@require_GET
+@condition(etag_func=_etag_objetos_caja)
+def api_objetos_caja(request, caja_id):
+    """
+    Objetos de una caja con sus unidades (cantidad), ordenados por id
+    """
+    if request.version_caja is None:
+        return _error('La caja no existe.', estado=404)
+    try:
+        campos = _leer_campos(request, CAMPOS_OBJETO)
+        limite = _leer_limite(request)
+    except ErrorParametros as e:
+        return _error(str(e))
+
+    try:
+        pagina = paginar(
+            Objeto.objects.filter(contenido__cajon_id=caja_id)
+            .annotate(cantidad=F('contenido__cantidad'))
+            .values(*{'id', *campos}),
+            campos=['id'],
+            tamanio=limite,
+            despues=request.GET.get('despues'),
+        )
+    except CursorInvalido as e:
+        return _error(str(e))
+    return _respuesta(pagina, campos)
+
+
+# Historial
+
+def _etag_historial(request):
+    # Último id y última fecha (cada uno con su índice) y la versión guardada del
+    # historial, que se incrementa al archivar acciones y al eliminar cajas u objetos
+    ultima = Accion.objects.order_by('-id').values('id')[:1]
+    ultima_fecha = Accion.objects.order_by('-fecha_hora', '-id').values('fecha_hora')[:1]
+    estado = (
+        VersionHistorial.objects.filter(pk=1)
+        .annotate(ultimo=Subquery(ultima), ultima_fecha=Subquery(ultima_fecha))
+        .values_list('version', 'ultimo', 'ultima_fecha')
+        .first()
+    )
+    return _etag('historial', estado, request.GET.urlencode())
+
+
+@require_GET
+@condition(etag_func=_etag_historial)
+def api_historial(request):
+    """
+    Historial de acciones, de la más reciente a la más antigua, con los filtros del historial HTML
+    """
+    from .views import filtrar_acciones
+
+    try:
+        campos = _leer_campos(request, CAMPOS_ACCION)
+        limite = _leer_limite(request)
+    except ErrorParametros as e:
+        return _error(str(e))
+
+    acciones, _ = filtrar_acciones(Accion.objects.all(), request.GET)
+    columnas = {'id', 'fecha_hora', *campos} - {'objetos'}
+    try:
+        pagina = paginar(
+            acciones.values(*columnas),
+            campos=['-fecha_hora', '-id'],
+            tamanio=limite,
+            despues=request.GET.get('despues'),
+        )
+    except CursorInvalido as e:
+        return _error(str(e))
+
+    objetos_por_accion = {}
+
+    def extra(fila, datos):
+        datos['objetos'] = objetos_por_accion.get(fila['id'], [])
+
+    if 'objetos' in campos:
+        # Objetos afectados de toda la página en una sola consulta
+        AccionObjetos = Accion.objetosAfectados.through
+        filas = AccionObjetos.objects.filter(accion_id__in=[fila['id'] for fila in pagina]).values_list('accion_id', 'objeto_id')
+        for accion_id, objeto_id in filas:
+            objetos_por_accion.setdefault(accion_id, []).append(objeto_id)
+
+    return _respuesta(pagina, campos, extra if 'objetos' in campos else None)
+
+
+# Búsqueda (sugerencias mientras se escribe)
+
+@require_GET
+def api_buscar(request):
+    """
+    Objetos cuyo nombre, tipo o caja empiezan por las palabras de ?q=, uno por cada caja en la que están
+    """
+    try:
+        limite = _leer_limite(request) if 'limite' in request.GET else None
+    except ErrorParametros as e:
+        return _error(str(e))
+    consulta = request.GET.get('q', '').strip()
+    resultados = busqueda.buscar(consulta, limite) if consulta else []
+    return JsonResponse({'resultados': resultados}, json_dumps_params={'ensure_ascii': False})
+
+
+# Clasificación de la foto al añadir un objeto
+
+@require_POST
+def api_clasificar(request):
+    """
+    Tipo y tamaño sugeridos para la foto subida en `foto` (null si no hay una sugerencia fiable)
+    """
+    foto = request.FILES.get('foto')
+    if foto is None:
+        return _error('Falta la foto')
+    return JsonResponse({'sugerencia': clasificador.sugerir_foto(foto)})
+
+
+# Rendimiento
+
+@require_GET
+@staff_member_required
+def api_instrumentacion(request):
+    """
+    Histogramas de tiempos por vista y contadores de caché y bitácora de este proceso
+    """
+    return JsonResponse(instrumentacion.estadisticas(), json_dumps_params={'ensure_ascii': False})
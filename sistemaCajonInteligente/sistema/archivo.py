@@ -0,0 +1,473 @@
+"""
+Archivo de acciones antiguas. Las acciones con más de DIAS días se sacan de la tabla
+sistema_accion (y de su tabla de objetos afectados) a segmentos mensuales comprimidos
+en settings.ARCHIVO_ACCIONES['DIRECTORIO']:
+
+- acciones-AAAA-MM.ndjson.gz: una acción por línea (JSON) con los nombres de la caja y
+  de los objetos en el momento de archivarla. Solo se añade al final, un miembro gzip
+  por bloque, así que el archivo completo se puede leer con zcat.
+- indice.json: por bloque, su posición en el archivo, número de acciones, primera y
+  última clave (fecha_hora, id), acciones por tipo y cajas. Se reemplaza de forma atómica.
+
+Cada bloque se escribe y se registra en el índice antes de borrar sus acciones de la
+base de datos; si el proceso se interrumpe entre las dos cosas, el bloque queda como
+pendiente y la siguiente ejecución termina de borrarlo.
+
+El historial lee los bloques al pasar de la última acción en la base de datos
+(ver lector_historial y paginacion.paginar).
+"""
+import gzip
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone as zona
+from functools import lru_cache
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .bitacora import invalidar_historial
+from .models import Accion
+
+NOMBRE_INDICE = 'indice.json'
+NOMBRE_CANDADO = 'archivando.lock'
+
+# Acciones por sentencia DELETE (límite de variables de SQLite)
+TAMANIO_BORRADO = 500
+
+AccionObjetos = Accion.objetosAfectados.through
+ETIQUETAS_TIPO = dict(Accion._meta.get_field('tipo').choices)
+
+
+class ErrorArchivo(Exception):
+    pass
+
+
+def _directorio():
+    return os.fspath(settings.ARCHIVO_ACCIONES['DIRECTORIO'])
+
+
+def _fecha_texto(fecha):
+    # Siempre en UTC y con microsegundos para que el orden de los textos sea el de las fechas
+    return fecha.astimezone(zona.utc).isoformat(timespec='microseconds')
+
+
+def _clave(valores):
+    """
+    Clave (fecha en texto, id) a partir de los valores de un cursor, o None si no son válidos
+    """
+    if not valores or len(valores) < 2:
+        return None
+    fecha, id_accion = valores[0], valores[1]
+    if isinstance(fecha, str):
+        try:
+            fecha = parse_datetime(fecha.replace(' ', 'T'))
+        except ValueError:
+            fecha = None
+    if not isinstance(fecha, datetime):
+        return None
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    try:
+        return _fecha_texto(fecha), int(id_accion)
+    except (TypeError, ValueError):
+        return None
+
+
+# Índice
+
+_candado_indice = threading.Lock()
+# (firma del archivo, índice, cajas de cada bloque como conjuntos)
+_indice_en_memoria = (None, None, None)
+
+
+def _indice_vacio():
+    return {'version': 1, 'segmentos': {}, 'bloques': [], 'pendientes': []}
+
+
+def _cargar():
+    global _indice_en_memoria
+    ruta = os.path.join(_directorio(), NOMBRE_INDICE)
+    try:
+        estado = os.stat(ruta)
+    except FileNotFoundError:
+        return _indice_vacio(), {}
+    firma = (ruta, estado.st_mtime_ns, estado.st_size)
+    with _candado_indice:
+        if _indice_en_memoria[0] != firma:
+            with open(ruta, encoding='utf-8') as archivo:
+                indice = json.load(archivo)
+            cajas = {(b['archivo'], b['inicio']): frozenset(b['cajas']) for b in indice['bloques']}
+            _indice_en_memoria = (firma, indice, cajas)
+        return _indice_en_memoria[1], _indice_en_memoria[2]
+
+
+def cargar_indice():
+    """
+    Índice del archivo; se vuelve a leer solo si el archivo cambió
+    """
+    return _cargar()[0]
+
+
+def _guardar_indice(indice):
+    ruta = os.path.join(_directorio(), NOMBRE_INDICE)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(indice, archivo, ensure_ascii=False, separators=(',', ':'))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+
+
+class _Candado:
+    """
+    Evita que dos procesos archiven o compacten a la vez
+    """
+
+    def __enter__(self):
+        os.makedirs(_directorio(), exist_ok=True)
+        self.ruta = os.path.join(_directorio(), NOMBRE_CANDADO)
+        try:
+            os.close(os.open(self.ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            raise ErrorArchivo(
+                f'Hay otro proceso archivando (existe {self.ruta}); si no es así, borre ese archivo'
+            ) from None
+        return self
+
+    def __exit__(self, *exc):
+        os.remove(self.ruta)
+
+
+# Escritura
+
+def _registros(acciones):
+    """
+    Registros del archivo de las acciones (diccionarios de .values()), con los objetos
+    afectados leídos en una consulta por cada TAMANIO_BORRADO acciones
+    """
+    objetos = {}
+    ids = [accion['id'] for accion in acciones]
+    for posicion in range(0, len(ids), TAMANIO_BORRADO):
+        filas = (
+            AccionObjetos.objects.filter(accion_id__in=ids[posicion:posicion + TAMANIO_BORRADO])
+            .order_by('id').values_list('accion_id', 'objeto_id', 'objeto__nombre')
+        )
+        for accion_id, objeto_id, nombre in filas:
+            objetos.setdefault(accion_id, []).append([objeto_id, nombre])
+
+    return [
+        {
+            'id': accion['id'],
+            'fecha': _fecha_texto(accion['fecha_hora']),
+            'tipo': accion['tipo'],
+            'cajon_id': accion['cajon_id'],
+            'cajon': accion['cajon__nombre'],
+            'descripcion': accion['descripcion'],
+            'objetos': objetos.get(accion['id'], []),
+        }
+        for accion in acciones
+    ]
+
+
+def _anadir_bloque(indice, mes, registros):
+    """
+    Comprime los registros (ya ordenados) como un miembro gzip al final del segmento
+    del mes y devuelve la entrada del índice del bloque
+    """
+    nombre = indice['segmentos'].setdefault(mes, f'acciones-{mes}.ndjson.gz')
+    contenido = ''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in registros)
+    comprimido = gzip.compress(contenido.encode('utf-8'), mtime=0)
+    with open(os.path.join(_directorio(), nombre), 'ab') as archivo:
+        inicio = archivo.seek(0, os.SEEK_END)
+        archivo.write(comprimido)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+    tipos = {}
+    for registro in registros:
+        tipos[registro['tipo']] = tipos.get(registro['tipo'], 0) + 1
+    cajas = sorted({registro['cajon_id'] for registro in registros if registro['cajon_id'] is not None})
+    return {
+        'mes': mes,
+        'archivo': nombre,
+        'inicio': inicio,
+        'longitud': len(comprimido),
+        'acciones': len(registros),
+        'desde': [registros[0]['fecha'], registros[0]['id']],
+        'hasta': [registros[-1]['fecha'], registros[-1]['id']],
+        'tipos': tipos,
+        'cajas': cajas,
+    }
+
+
+def _borrar_acciones(ids):
+    # Una transacción por bloque. DELETE directos: el borrado del ORM cargaría antes
+    # cada acción para resolver la relación con los objetos
+    tablas = [
+        (connection.ops.quote_name(AccionObjetos._meta.db_table), 'accion_id'),
+        (connection.ops.quote_name(Accion._meta.db_table), 'id'),
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for posicion in range(0, len(ids), TAMANIO_BORRADO):
+            bloque = ids[posicion:posicion + TAMANIO_BORRADO]
+            marcadores = ', '.join(['%s'] * len(bloque))
+            for tabla, columna in tablas:
+                cursor.execute(f'DELETE FROM {tabla} WHERE {columna} IN ({marcadores})', bloque)
+        invalidar_historial()
+
+
+def _terminar_pendientes(indice):
+    """
+    Borra de la base de datos las acciones de bloques que se escribieron pero cuyo
+    borrado no llegó a confirmarse
+    """
+    if not indice['pendientes']:
+        return 0
+    borradas = 0
+    for bloque in indice['bloques']:
+        if [bloque['archivo'], bloque['inicio']] in indice['pendientes']:
+            ids = [registro['id'] for registro in _leer_bloque(bloque['archivo'], bloque['inicio'], bloque['longitud'])[1]]
+            _borrar_acciones(ids)
+            borradas += len(ids)
+    indice['pendientes'] = []
+    _guardar_indice(indice)
+    return borradas
+
+
+def archivar(dias=None, tamanio_bloque=None, simular=False, progreso=None):
+    """
+    Mueve al archivo las acciones con más de `dias` días, de la más antigua a la más
+    reciente y en bloques de `tamanio_bloque`. Devuelve el número de acciones archivadas.
+    """
+    opciones = settings.ARCHIVO_ACCIONES
+    dias = opciones['DIAS'] if dias is None else dias
+    tamanio_bloque = tamanio_bloque or opciones['TAMANIO_BLOQUE']
+    limite = timezone.now() - timedelta(days=dias)
+    antiguas = Accion.objects.filter(fecha_hora__lt=limite)
+    if simular:
+        return antiguas.count()
+
+    consulta = antiguas.order_by('fecha_hora', 'id').values(
+        'id', 'fecha_hora', 'tipo', 'descripcion', 'cajon_id', 'cajon__nombre'
+    )
+    archivadas = 0
+    with _Candado():
+        indice = json.loads(json.dumps(cargar_indice()))  # copia para modificarla
+        _terminar_pendientes(indice)
+
+        while True:
+            # Siempre desde el principio: el bloque anterior ya no está en la tabla
+            acciones = list(consulta[:tamanio_bloque])
+            if not acciones:
+                break
+
+            por_mes = {}
+            for registro in _registros(acciones):
+                por_mes.setdefault(registro['fecha'][:7], []).append(registro)
+            nuevos = [_anadir_bloque(indice, mes, registros) for mes, registros in por_mes.items()]
+
+            indice['bloques'].extend(nuevos)
+            indice['pendientes'] = [[bloque['archivo'], bloque['inicio']] for bloque in nuevos]
+            _guardar_indice(indice)
+
+            _borrar_acciones([accion['id'] for accion in acciones])
+            indice['pendientes'] = []
+            _guardar_indice(indice)
+
+            archivadas += len(acciones)
+            if progreso:
+                progreso(archivadas)
+    return archivadas
+
+
+def compactar(tamanio_bloque=None):
+    """
+    Reescribe cada mes con más de un bloque incompleto en bloques de `tamanio_bloque`
+    acciones (cada ejecución de archivar añade bloques pequeños). El segmento nuevo
+    tiene otro nombre para que los lectores con el índice anterior no lean datos
+    mezclados. Devuelve el número de meses compactados.
+    """
+    tamanio_bloque = tamanio_bloque or settings.ARCHIVO_ACCIONES['TAMANIO_BLOQUE']
+    compactados = 0
+    with _Candado():
+        indice = json.loads(json.dumps(cargar_indice()))
+        _terminar_pendientes(indice)
+
+        for mes, nombre in sorted(indice['segmentos'].items()):
+            bloques = [bloque for bloque in indice['bloques'] if bloque['mes'] == mes]
+            if sum(bloque['acciones'] < tamanio_bloque for bloque in bloques) < 2:
+                continue
+
+            registros = [r for b in bloques for r in _leer_bloque(b['archivo'], b['inicio'], b['longitud'])[1]]
+            registros.sort(key=lambda r: (r['fecha'], r['id']))
+
+            version = int(nombre.split('.')[1]) + 1 if nombre.count('.') == 3 else 2
+            indice['segmentos'][mes] = f'acciones-{mes}.{version}.ndjson.gz'
+            nuevos = [
+                _anadir_bloque(indice, mes, registros[posicion:posicion + tamanio_bloque])
+                for posicion in range(0, len(registros), tamanio_bloque)
+            ]
+            indice['bloques'] = [bloque for bloque in indice['bloques'] if bloque['mes'] != mes] + nuevos
+            _guardar_indice(indice)
+            os.remove(os.path.join(_directorio(), nombre))
+            compactados += 1
+    return compactados
+
+
+# Lectura
+
+@lru_cache(maxsize=16)
+def _leer_bloque_en_cache(ruta, inicio, longitud):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        contenido = gzip.decompress(archivo.read(longitud))
+    registros = [json.loads(linea) for linea in contenido.splitlines()]
+    return [(r['fecha'], r['id']) for r in registros], registros
+
+
+def _leer_bloque(nombre, inicio, longitud):
+    """
+    Claves y registros de un bloque, en orden ascendente. Los bloques no cambian
+    una vez escritos, así que se guardan los últimos leídos.
+    """
+    return _leer_bloque_en_cache(os.path.join(_directorio(), nombre), inicio, longitud)
+
+
+class _Relacion(list):
+    # Imita lo que usa la plantilla de una relación (accion.objetosAfectados.all)
+    def all(self):
+        return self
+
+
+class AccionArchivada:
+    """
+    Acción leída del archivo, con los atributos de Accion que usa el historial
+    """
+    archivada = True
+
+    def __init__(self, registro):
+        self.id = registro['id']
+        self.tipo = registro['tipo']
+        self.descripcion = registro['descripcion']
+        self.fecha_hora = parse_datetime(registro['fecha'])
+        self.cajon_id = registro['cajon_id']
+        self.cajon = SimpleNamespace(id=registro['cajon_id'], nombre=registro['cajon']) if registro['cajon_id'] else None
+        self.objetosAfectados = _Relacion(SimpleNamespace(id=i, nombre=nombre) for i, nombre in registro['objetos'])
+
+    def get_tipo_display(self):
+        return ETIQUETAS_TIPO.get(self.tipo, self.tipo)
+
+
+def leer(inferior=None, superior=None, cantidad=20, descendente=True, cajon_id=None, tipo=None):
+    """
+    Hasta `cantidad` acciones archivadas con clave (fecha, id) estrictamente entre
+    `inferior` y `superior` (claves de _clave, None = sin límite), de la más reciente a la
+    más antigua si `descendente`. Solo se descomprimen los bloques que pueden aportar.
+    """
+    indice, cajas = _cargar()
+    bloques = [
+        bloque for bloque in indice['bloques']
+        if (inferior is None or tuple(bloque['hasta']) > inferior)
+        and (superior is None or tuple(bloque['desde']) < superior)
+        and (tipo is None or tipo in bloque['tipos'])
+        and (cajon_id is None or cajon_id in cajas[bloque['archivo'], bloque['inicio']])
+    ]
+    # Primero los bloques con la clave más cercana al punto de partida
+    if descendente:
+        bloques.sort(key=lambda bloque: tuple(bloque['hasta']), reverse=True)
+    else:
+        bloques.sort(key=lambda bloque: tuple(bloque['desde']))
+
+    encontrados = []
+    for bloque in bloques:
+        if len(encontrados) >= cantidad:
+            # Los bloques restantes empiezan más lejos que el último encontrado
+            limite = tuple(bloque['hasta'] if descendente else bloque['desde'])
+            ultimo = encontrados[cantidad - 1][0]
+            if (limite < ultimo) if descendente else (limite > ultimo):
+                break
+
+        claves, registros = _leer_bloque(bloque['archivo'], bloque['inicio'], bloque['longitud'])
+        desde = bisect_right(claves, inferior) if inferior is not None else 0
+        hasta = bisect_left(claves, superior) if superior is not None else len(claves)
+        posiciones = range(hasta - 1, desde - 1, -1) if descendente else range(desde, hasta)
+
+        candidatos = 0
+        for posicion in posiciones:
+            registro = registros[posicion]
+            if (cajon_id is not None and registro['cajon_id'] != cajon_id) or (tipo is not None and registro['tipo'] != tipo):
+                continue
+            encontrados.append((claves[posicion], registro))
+            candidatos += 1
+            if candidatos >= cantidad:
+                break
+
+        encontrados.sort(key=lambda par: par[0], reverse=descendente)
+        del encontrados[cantidad:]
+
+    return [AccionArchivada(registro) for _, registro in encontrados]
+
+
+def recorrer(cajon_id=None, tipo=None, inicio=None, fin=None):
+    """
+    Registros archivados en orden (fecha, id), bloque a bloque. Con filtros (caja, tipo
+    y fechas [inicio, fin)) solo se descomprimen los bloques que pueden aportar.
+    """
+    indice, cajas = _cargar()
+    inferior = (_fecha_texto(inicio), -1) if inicio else None
+    superior = (_fecha_texto(fin), -1) if fin else None
+    for bloque in sorted(indice['bloques'], key=lambda bloque: tuple(bloque['desde'])):
+        if superior is not None and tuple(bloque['desde']) >= superior:
+            break
+        if (
+            (inferior is not None and tuple(bloque['hasta']) <= inferior)
+            or (tipo is not None and tipo not in bloque['tipos'])
+            or (cajon_id is not None and cajon_id not in cajas[bloque['archivo'], bloque['inicio']])
+        ):
+            continue
+        claves, registros = _leer_bloque(bloque['archivo'], bloque['inicio'], bloque['longitud'])
+        desde = bisect_right(claves, inferior) if inferior is not None else 0
+        hasta = bisect_left(claves, superior) if superior is not None else len(claves)
+        for registro in registros[desde:hasta]:
+            if (cajon_id is None or registro['cajon_id'] == cajon_id) and (tipo is None or registro['tipo'] == tipo):
+                yield registro
+
+
+def total(tipo=None):
+    """
+    Acciones archivadas (de un tipo, si se indica) según el índice
+    """
+    bloques = cargar_indice()['bloques']
+    if tipo:
+        return sum(bloque['tipos'].get(tipo, 0) for bloque in bloques)
+    return sum(bloque['acciones'] for bloque in bloques)
+
+
+def lector_historial(cajon_id=None, tipo=None, inicio=None, fin=None):
+    """
+    Función para paginacion.paginar(adicionales=...) que completa las páginas del
+    historial (orden -fecha_hora, -id) con acciones archivadas, o None si el archivo está vacío
+    """
+    if not cargar_indice()['bloques']:
+        return None
+
+    # Rango de fechas de los filtros: [inicio, fin)
+    limite_inferior = (_fecha_texto(inicio), -1) if inicio else None
+    limite_superior = (_fecha_texto(fin), -1) if fin else None
+
+    def adicionales(cursor, tope, cantidad, descendente):
+        # Las claves del recorrido van del cursor al tope (en orden descendente o ascendente)
+        inicio_recorrido, fin_recorrido = _clave(cursor), _clave(tope)
+        superior, inferior = (inicio_recorrido, fin_recorrido) if descendente else (fin_recorrido, inicio_recorrido)
+        if limite_superior is not None:
+            superior = min(superior, limite_superior) if superior is not None else limite_superior
+        if limite_inferior is not None:
+            inferior = max(inferior, limite_inferior) if inferior is not None else limite_inferior
+        return leer(inferior, superior, cantidad, descendente, cajon_id=cajon_id, tipo=tipo)
+
+    return adicionales
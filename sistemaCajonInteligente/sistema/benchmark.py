@@ -0,0 +1,238 @@
+"""
+Medición del rendimiento de las vistas con el cliente de pruebas de Django.
+
+Cada escenario hace una petición a una vista y se repite varias veces; se guardan la
+latencia (p50, p95, máximo), las consultas por petición y el pico de memoria de Python
+(tracemalloc, en una petición aparte para no alterar los tiempos). Los escenarios que
+modifican datos (crear, añadir, eliminar) cambian la base de datos: conviene ejecutarlo
+sobre datos generados con generar_datos.
+"""
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .bitacora import obtener_bitacora
+from .duplicados import cajas_con_duplicados
+from .models import Cajon, Objeto
+
+# Diferencia mínima de p95 (ms) para considerar una regresión, por debajo es ruido
+MARGEN_MS = 1.0
+
+
+class Contexto:
+    """
+    Ids de cajas y objetos que usan los escenarios, elegidos con una semilla fija
+    """
+
+    def __init__(self, semilla):
+        self.rng = random.Random(semilla)
+        self.caja_ids = list(Cajon.objects.order_by('id').values_list('id', flat=True))
+        self.objeto_ids = list(Objeto.objects.order_by('id').values_list('id', flat=True))
+        self.rng.shuffle(self.objeto_ids)
+        self.cajas_con_duplicados = list(cajas_con_duplicados())
+        self.contador = 0
+
+    def caja_al_azar(self):
+        return self.rng.choice(self.caja_ids)
+
+    def siguiente_objeto(self):
+        # Objetos distintos en cada iteración para no eliminar dos veces el mismo
+        return self.objeto_ids.pop() if self.objeto_ids else None
+
+    def siguiente_caja_con_duplicados(self):
+        return self.cajas_con_duplicados.pop() if self.cajas_con_duplicados else None
+
+
+def _crear_caja(cliente, contexto):
+    contexto.contador += 1
+    return cliente.post(reverse('crear_caja'), {'nombre': f'Benchmark {contexto.contador}', 'capacidadMax': '50'})
+
+
+def _añadir_objeto(cliente, contexto):
+    contexto.contador += 1
+    return cliente.post(reverse('añadir_objeto'), {
+        'nombre': f'Objeto benchmark {contexto.contador}',
+        'tipoObjeto': 'cables',
+        'tamanio': 'pequeno',
+        'caja': contexto.caja_al_azar(),
+    })
+
+
+def _lista_cajas(cliente, contexto):
+    return cliente.get(reverse('crear_caja'))
+
+
+def _lista_objetos(cliente, contexto):
+    return cliente.get(reverse('añadir_objeto'))
+
+
+def _estadisticas(cliente, contexto):
+    return cliente.get(reverse('estadisticas'))
+
+
+def _historial(cliente, contexto):
+    return cliente.get(reverse('historial_acciones'))
+
+
+def _historial_filtrado(cliente, contexto):
+    return cliente.get(reverse('historial_acciones'), {'tipo': 'agregar_objeto', 'caja': contexto.caja_al_azar()})
+
+
+def _detalle_caja(orden):
+    def escenario(cliente, contexto):
+        return cliente.get(reverse('detalle_caja', args=[contexto.caja_al_azar()]), {'orden': orden})
+    return escenario
+
+
+def _eliminar_objeto(cliente, contexto):
+    objeto_id = contexto.siguiente_objeto()
+    if objeto_id is None:
+        return None
+    return cliente.post(reverse('eliminar_objeto', args=[objeto_id]))
+
+
+def _eliminar_duplicados(cliente, contexto):
+    caja_id = contexto.siguiente_caja_con_duplicados()
+    if caja_id is None:
+        return None
+    return cliente.post(reverse('eliminar_duplicados', args=[caja_id]))
+
+
+# Primero los de solo lectura, para que los que borran datos no los alteren
+ESCENARIOS = {
+    'lista_cajas': _lista_cajas,
+    'lista_objetos': _lista_objetos,
+    'estadisticas': _estadisticas,
+    'historial_acciones': _historial,
+    'historial_acciones_filtrado': _historial_filtrado,
+    'detalle_caja_nombre': _detalle_caja('nombre'),
+    'detalle_caja_tipo': _detalle_caja('tipo'),
+    'detalle_caja_tamanio': _detalle_caja('tamanio'),
+    'crear_caja': _crear_caja,
+    'añadir_objeto': _añadir_objeto,
+    'eliminar_objeto': _eliminar_objeto,
+    'eliminar_duplicados': _eliminar_duplicados,
+}
+
+
+def percentil(valores, porcentaje):
+    """
+    Percentil de los valores (el valor de la posición más cercana), para los tiempos de
+    las mediciones de carga
+    """
+    ordenados = sorted(valores)
+    posicion = min(len(ordenados) - 1, max(0, round(porcentaje / 100 * (len(ordenados) - 1))))
+    return ordenados[posicion]
+
+
+def medir(escenario, cliente, contexto, iteraciones, calentamiento=2):
+    """
+    Ejecuta el escenario y devuelve sus métricas, o None si no tenía datos con los que trabajar
+    """
+    for _ in range(calentamiento):
+        escenario(cliente, contexto)
+
+    tiempos = []
+    consultas = []
+    for _ in range(iteraciones):
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            respuesta = escenario(cliente, contexto)
+            duracion = time.perf_counter() - inicio
+        if respuesta is None:
+            break
+        if respuesta.status_code >= 400:
+            raise RuntimeError(f'La petición respondió {respuesta.status_code}')
+        tiempos.append(duracion * 1000)
+        consultas.append(len(capturadas))
+
+    if not tiempos:
+        return None
+
+    # Pico de memoria en una petición más, con tracemalloc activo
+    tracemalloc.start()
+    try:
+        escenario(cliente, contexto)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iteraciones': len(tiempos),
+        'p50_ms': round(statistics.median(tiempos), 3),
+        'p95_ms': round(percentil(tiempos, 95), 3),
+        'max_ms': round(max(tiempos), 3),
+        'media_ms': round(statistics.fmean(tiempos), 3),
+        'consultas': max(consultas),
+        'memoria_pico_kb': round(pico / 1024, 1),
+    }
+
+
+def ejecutar(iteraciones=20, semilla=42, nombres=None, progreso=None):
+    """
+    Mide los escenarios indicados (todos por defecto) y devuelve los resultados con sus metadatos
+    """
+    contexto = Contexto(semilla)
+    cliente = Client()
+    resultados = {}
+    for nombre, escenario in ESCENARIOS.items():
+        if nombres and nombre not in nombres:
+            continue
+        resultados[nombre] = medir(escenario, cliente, contexto, iteraciones)
+        if progreso:
+            progreso(nombre, resultados[nombre])
+
+    # Que las acciones en cola no se escriban durante la siguiente medición
+    obtener_bitacora().vaciar()
+
+    return {
+        'meta': {
+            'fecha': timezone.now().isoformat(),
+            'semilla': semilla,
+            'iteraciones': iteraciones,
+            'cajas': len(contexto.caja_ids),
+            'objetos': Objeto.objects.count(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'base_de_datos': connection.vendor,
+        },
+        'escenarios': resultados,
+    }
+
+
+def comparar(actuales, base, tolerancia=0.25):
+    """
+    Compara con unos resultados anteriores. Devuelve la lista de regresiones (texto):
+    p95 más de un `tolerancia` peor (y más de MARGEN_MS) o más consultas por petición.
+    """
+    regresiones = []
+    for nombre, actual in actuales['escenarios'].items():
+        anterior = base['escenarios'].get(nombre)
+        if not actual or not anterior:
+            continue
+        limite = anterior['p95_ms'] * (1 + tolerancia)
+        if actual['p95_ms'] > limite and actual['p95_ms'] - anterior['p95_ms'] > MARGEN_MS:
+            regresiones.append(f'{nombre}: p95 {anterior["p95_ms"]} ms -> {actual["p95_ms"]} ms')
+        if actual['consultas'] > anterior['consultas']:
+            regresiones.append(f'{nombre}: consultas {anterior["consultas"]} -> {actual["consultas"]}')
+    return regresiones
+
+
+def leer_resultados(ruta):
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def guardar_resultados(resultados, ruta):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(resultados, archivo, ensure_ascii=False, indent=2)
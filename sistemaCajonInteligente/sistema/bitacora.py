@@ -0,0 +1,310 @@
+"""
+Bitácora de acciones: escritura de registros de Accion con backends intercambiables.
+
+- BitacoraSincrona: escribe en el momento (útil para pruebas y scripts).
+- BitacoraEnCola: encola las acciones en memoria y un hilo las escribe por lotes
+  con bulk_create cuando se llena el lote o pasa el intervalo configurado.
+
+El backend se elige con settings.BITACORA_ACCIONES.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Cajon, Objeto, Accion, VersionHistorial
+from . import eventos, resumenes
+
+logger = logging.getLogger(__name__)
+
+
+class EntradaAccion:
+    """
+    Acción pendiente de escribir. Guarda solo ids para no retener instancias de modelos.
+    """
+
+    __slots__ = ('tipo', 'cajon_id', 'objeto_ids', 'descripcion', 'fecha_hora')
+
+    def __init__(self, tipo, cajon_id=None, objeto_ids=(), descripcion='', fecha_hora=None):
+        self.tipo = tipo
+        self.cajon_id = cajon_id
+        self.objeto_ids = tuple(objeto_ids)
+        self.descripcion = descripcion
+        # La fecha se fija al registrar, no al escribir el lote
+        self.fecha_hora = fecha_hora or timezone.now()
+
+    @classmethod
+    def crear(cls, tipo, cajon=None, objetos=(), descripcion=''):
+        return cls(
+            tipo=tipo,
+            cajon_id=cajon.id if cajon else None,
+            objeto_ids=[objeto.id for objeto in objetos if objeto],
+            descripcion=descripcion,
+        )
+
+
+def crear_en_bloque(objetos):
+    """
+    bulk_create que garantiza que los objetos tengan id. Algunos motores (MySQL)
+    no devuelven los ids en inserciones masivas, en ese caso se guardan uno a uno.
+    """
+    if not objetos:
+        return objetos
+    if connection.features.can_return_rows_from_bulk_insert:
+        return type(objetos[0]).objects.bulk_create(objetos)
+    for objeto in objetos:
+        objeto.save()
+    return objetos
+
+
+def escribir_entradas(entradas):
+    """
+    Escribe un lote de acciones y sus objetos afectados con dos bulk_create en una transacción.
+    Las cajas u objetos que ya no existen (p. ej. objetos eliminados justo después de
+    registrar la acción) se omiten, igual que haría el borrado en cascada. Al confirmarse
+    se publican en sistema/eventos.py para las páginas abiertas.
+    """
+    if not entradas:
+        return []
+
+    # Con los nombres y contadores que necesitan los eventos en vivo, en las mismas consultas
+    cajas_existentes = {caja['id']: caja for caja in Cajon.objects.filter(
+        id__in={e.cajon_id for e in entradas if e.cajon_id}
+    ).values('id', *eventos.CAMPOS_CAJA)}
+    objetos_existentes = dict(Objeto.objects.filter(
+        id__in={objeto_id for e in entradas for objeto_id in e.objeto_ids}
+    ).values_list('id', 'nombre'))
+
+    with transaction.atomic():
+        acciones = crear_en_bloque([
+            Accion(
+                tipo=e.tipo,
+                cajon_id=e.cajon_id if e.cajon_id in cajas_existentes else None,
+                descripcion=e.descripcion,
+                fecha_hora=e.fecha_hora,
+            )
+            for e in entradas
+        ])
+
+        AccionObjetos = Accion.objetosAfectados.through
+        AccionObjetos.objects.bulk_create([
+            AccionObjetos(accion_id=accion.id, objeto_id=objeto_id)
+            for accion, e in zip(acciones, entradas)
+            for objeto_id in e.objeto_ids
+            if objeto_id in objetos_existentes
+        ])
+        resumenes.registrar_acciones(acciones)
+        if eventos.canal.hay_suscripciones():
+            transaction.on_commit(lambda: eventos.publicar_acciones(acciones, entradas, cajas_existentes, objetos_existentes))
+
+    return acciones
+
+
+def invalidar_historial():
+    """
+    Incrementa la versión del historial (parte del ETag de la API). Se llama al borrar
+    acciones o filas de su relación con los objetos, dentro de la misma transacción
+    """
+    if not VersionHistorial.objects.filter(pk=1).update(version=F('version') + 1):
+        VersionHistorial.objects.create(pk=1, version=1)
+
+
+class BitacoraSincrona:
+    """
+    Escribe cada acción en el momento de registrarla
+    """
+
+    def __init__(self, **opciones):
+        self.encoladas = 0
+        self.escritas = 0
+        self.descartadas = 0
+        self.fallidas = 0
+
+    def registrar(self, entrada):
+        self.registrar_varias([entrada])
+
+    async def aregistrar(self, entrada):
+        """
+        registrar() para las vistas asíncronas: la escritura se hace en un hilo
+        """
+        await sync_to_async(self.registrar)(entrada)
+
+    def registrar_varias(self, entradas):
+        self.encoladas += len(entradas)
+        self._escribir(entradas)
+
+    def _escribir(self, entradas):
+        try:
+            escribir_entradas(entradas)
+            self.escritas += len(entradas)
+        except Exception:
+            self.fallidas += len(entradas)
+            logger.exception('Error al registrar %d acciones', len(entradas))
+
+    def pendientes(self):
+        return 0
+
+    def vaciar(self):
+        pass
+
+    def cerrar(self):
+        pass
+
+    def estadisticas(self):
+        return {
+            'encoladas': self.encoladas,
+            'escritas': self.escritas,
+            'descartadas': self.descartadas,
+            'fallidas': self.fallidas,
+            'pendientes': self.pendientes(),
+        }
+
+
+class BitacoraEnCola(BitacoraSincrona):
+    """
+    Encola las acciones en una cola acotada y las escribe por lotes desde un hilo.
+    Si la cola está llena la acción se descarta y se cuenta en `descartadas`.
+    """
+
+    def __init__(self, TAMANIO_LOTE=200, INTERVALO=1.0, TAMANIO_COLA=10000, **opciones):
+        super().__init__(**opciones)
+        self.tamanio_lote = TAMANIO_LOTE
+        self.intervalo = INTERVALO
+        self.cola = queue.Queue(maxsize=TAMANIO_COLA)
+        self._hilo = None
+        self._candado = threading.Lock()
+        self._detener = threading.Event()
+
+    def registrar_varias(self, entradas):
+        entradas = list(entradas)
+        if len(entradas) >= self.tamanio_lote:
+            # Las operaciones masivas ya traen un lote completo: se escribe directamente,
+            # en la misma transacción, sin pasar por la cola
+            self.encoladas += len(entradas)
+            self._escribir(entradas)
+            return
+        # Dentro de una transacción se encola al confirmarla: así el hilo ve los objetos
+        # creados y no se registran acciones de transacciones deshechas
+        transaction.on_commit(lambda: self._encolar(entradas))
+
+    async def aregistrar(self, entrada):
+        # En una vista asíncrona no hay transacción abierta en el hilo del bucle de eventos:
+        # se encola directamente, sin salir del bucle
+        self._encolar([entrada])
+
+    def _encolar(self, entradas):
+        self._iniciar_hilo()
+        for entrada in entradas:
+            try:
+                self.cola.put_nowait(entrada)
+                self.encoladas += 1
+            except queue.Full:
+                self.descartadas += 1
+                if self.descartadas % 1000 == 1:
+                    logger.warning('Cola de la bitácora llena, %d acciones descartadas', self.descartadas)
+
+    def _iniciar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._candado:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._trabajar, name='bitacora-acciones', daemon=True)
+                self._hilo.start()
+
+    def _tomar_lote(self):
+        """
+        Espera hasta completar un lote o hasta que pase el intervalo desde la primera acción
+        """
+        try:
+            lote = [self.cola.get(timeout=self.intervalo)]
+        except queue.Empty:
+            return []
+
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamanio_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _trabajar(self):
+        while not (self._detener.is_set() and self.cola.empty()):
+            lote = self._tomar_lote()
+            if not lote:
+                continue
+            close_old_connections()
+            try:
+                self._escribir(lote)
+            finally:
+                for _ in lote:
+                    self.cola.task_done()
+        connection.close()
+
+    def pendientes(self):
+        return self.cola.qsize()
+
+    def vaciar(self):
+        """
+        Bloquea hasta que todas las acciones encoladas estén escritas
+        """
+        if self._hilo is not None and self._hilo.is_alive():
+            self.cola.join()
+
+    def cerrar(self):
+        """
+        Escribe lo pendiente y detiene el hilo (se llama al terminar el proceso)
+        """
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+_bitacora = None
+_candado_bitacora = threading.Lock()
+
+
+def obtener_bitacora():
+    """
+    Devuelve la bitácora configurada en settings.BITACORA_ACCIONES (una por proceso)
+    """
+    global _bitacora
+    if _bitacora is None:
+        with _candado_bitacora:
+            if _bitacora is None:
+                configuracion = dict(settings.BITACORA_ACCIONES)
+                clase = import_string(configuracion.pop('BACKEND'))
+                _bitacora = clase(**configuracion)
+    return _bitacora
+
+
+@atexit.register
+def cerrar_bitacora():
+    """
+    Al terminar el proceso, escribe las acciones que queden en la cola
+    """
+    global _bitacora
+    if _bitacora is not None:
+        _bitacora.cerrar()
+        _bitacora = None
+
+
+@receiver(setting_changed)
+def _reiniciar_bitacora(setting, **kwargs):
+    # Permite cambiar de backend en las pruebas con override_settings
+    if setting == 'BITACORA_ACCIONES':
+        cerrar_bitacora()
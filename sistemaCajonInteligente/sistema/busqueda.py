@@ -0,0 +1,330 @@
+"""
+Búsqueda de objetos por nombre, tipo y nombre de la caja en todo el inventario.
+
+Si la base de datos es SQLite con FTS5 se usa la tabla virtual sistema_busqueda
+(creada en la migración 0010), que se actualiza dentro de la misma transacción
+que el cambio. Si no, se mantiene un índice invertido en memoria por proceso.
+En los dos casos se ignoran mayúsculas y acentos ("camara" encuentra "Cámara") y
+la última palabra de la consulta se busca como prefijo, para poder sugerir mientras
+se escribe ("cable hd" encuentra "Cable HDMI").
+
+Cada entrada del índice es una fila de Contenido (un objeto en una caja): un objeto
+repartido en varias cajas aparece una vez por caja, con sus unidades en esa caja.
+Las altas y bajas llegan desde inventario.alta_objetos / baja_objetos, y los cambios
+de nombre o tipo desde Objeto.save.
+"""
+import re
+import sys
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Contenido
+from .recarga import IndiceRecargable
+
+TABLA = 'sistema_busqueda'
+CONTENIDO = Contenido._meta.db_table
+
+# Filas por sentencia al borrar del índice (límite de variables de SQLite)
+TAMANIO_BLOQUE = 500
+
+# Contenido del índice a partir de la relación caja-objeto (rowid = id de la fila de Contenido)
+SQL_LLENAR = (
+    f"INSERT OR REPLACE INTO {TABLA}(rowid, nombre, tipo, caja, cajon_id) "
+    "SELECT co.id, o.nombre, o.tipo, c.nombre, c.id "
+    f"FROM {CONTENIDO} co "
+    "JOIN sistema_objeto o ON o.id = co.objeto_id "
+    "JOIN sistema_cajon c ON c.id = co.cajon_id"
+)
+
+
+def normalizar(texto):
+    """
+    Minúsculas y sin acentos
+    """
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def terminos(texto):
+    return re.findall(r'\w+', normalizar(texto))
+
+
+def _en_bloques(ids):
+    for inicio in range(0, len(ids), TAMANIO_BLOQUE):
+        bloque = ids[inicio:inicio + TAMANIO_BLOQUE]
+        yield bloque, ', '.join(['%s'] * len(bloque))
+
+
+_usa_fts = None
+
+
+def usa_fts():
+    """
+    True si el índice es la tabla FTS5 de la base de datos
+    """
+    global _usa_fts
+    if _usa_fts is None:
+        backend = settings.BUSQUEDA['BACKEND']
+        if backend == 'memoria' or connection.vendor != 'sqlite':
+            _usa_fts = False
+        else:
+            _usa_fts = TABLA in connection.introspection.table_names()
+            if backend == 'fts5' and not _usa_fts:
+                raise RuntimeError(f'La tabla {TABLA} no existe: SQLite sin FTS5 o migraciones pendientes')
+    return _usa_fts
+
+
+# Índice en memoria
+
+class IndiceInvertido:
+    """
+    Índice invertido de términos a ids de filas de Contenido. El vocabulario se mantiene ordenado
+    para resolver prefijos con una búsqueda binaria.
+    """
+
+    def __init__(self):
+        self._candado = threading.RLock()
+        self._publicaciones = {}
+        self._vocabulario = []
+        self._vocabulario_al_dia = True
+        self._terminos_fila = {}
+
+    def __len__(self):
+        return len(self._terminos_fila)
+
+    def agregar(self, fila_id, *textos):
+        propios = tuple(sorted({sys.intern(t) for texto in textos for t in terminos(texto)}))
+        with self._candado:
+            self.quitar(fila_id)
+            self._terminos_fila[fila_id] = propios
+            for termino in propios:
+                ids = self._publicaciones.get(termino)
+                if ids is None:
+                    ids = self._publicaciones[termino] = set()
+                    if self._vocabulario_al_dia:
+                        insort(self._vocabulario, termino)
+                ids.add(fila_id)
+
+    def quitar(self, fila_id):
+        with self._candado:
+            for termino in self._terminos_fila.pop(fila_id, ()):
+                ids = self._publicaciones[termino]
+                ids.discard(fila_id)
+                if not ids:
+                    del self._publicaciones[termino]
+                    if self._vocabulario_al_dia:
+                        del self._vocabulario[bisect_left(self._vocabulario, termino)]
+
+    def _con_prefijo(self, prefijo):
+        """
+        Términos del vocabulario que empiezan por `prefijo`, en orden alfabético
+        """
+        for posicion in range(bisect_left(self._vocabulario, prefijo), len(self._vocabulario)):
+            termino = self._vocabulario[posicion]
+            if not termino.startswith(prefijo):
+                break
+            yield termino
+
+    def buscar(self, consulta, limite):
+        """
+        Ids de las filas que tienen todas las palabras de la consulta (la última como prefijo)
+        """
+        palabras = terminos(consulta)
+        if not palabras:
+            return []
+        completas, prefijo = palabras[:-1], palabras[-1]
+
+        with self._candado:
+            if completas:
+                # Se recorre la palabra completa con menos filas y se comprueban las demás
+                candidatos = min((self._publicaciones.get(p, ()) for p in completas), key=len)
+            else:
+                candidatos = (fila_id for termino in self._con_prefijo(prefijo) for fila_id in self._publicaciones[termino])
+
+            encontrados = []
+            vistos = set()
+            for fila_id in candidatos:
+                if fila_id in vistos:
+                    continue
+                vistos.add(fila_id)
+                propios = self._terminos_fila[fila_id]
+                if all(p in propios for p in completas) and any(t.startswith(prefijo) for t in propios):
+                    encontrados.append(fila_id)
+                    if len(encontrados) >= limite:
+                        break
+            return encontrados
+
+    def cargar(self):
+        with self._candado:
+            # El vocabulario se ordena una sola vez al final de la carga
+            self._vocabulario_al_dia = False
+            for fila_id, nombre, tipo, caja in _filas(Contenido.objects.all()).iterator(chunk_size=10000):
+                self.agregar(fila_id, nombre, tipo, caja)
+            self._vocabulario = sorted(self._publicaciones)
+            self._vocabulario_al_dia = True
+
+
+def _filas(contenido):
+    """
+    Datos que se indexan de cada fila de Contenido
+    """
+    return contenido.values_list('id', 'objeto__nombre', 'objeto__tipo', 'cajon__nombre')
+
+
+def _construir():
+    indice = IndiceInvertido()
+    indice.cargar()
+    return indice
+
+
+_indice = IndiceRecargable(_construir, 'indice-busqueda')
+
+
+def obtener_indice():
+    """
+    Índice en memoria del proceso. Cada BUSQUEDA['RECARGA_SEGUNDOS'] se reconstruye en
+    segundo plano para recoger cambios hechos por otros procesos, sin esperar en la petición.
+    """
+    return _indice.obtener(settings.BUSQUEDA['RECARGA_SEGUNDOS'])
+
+
+# Mantenimiento incremental
+
+def _agregar_en_memoria(contenido):
+    filas = list(_filas(contenido))
+
+    def agregar(indice):
+        for fila_id, nombre, tipo, caja in filas:
+            indice.agregar(fila_id, nombre, tipo, caja)
+    transaction.on_commit(lambda: _indice.aplicar(agregar))
+
+
+def _quitar_de_memoria(fila_ids):
+    def quitar(indice):
+        for fila_id in fila_ids:
+            indice.quitar(fila_id)
+    transaction.on_commit(lambda: _indice.aplicar(quitar))
+
+
+def indexar(cajon_id, objetos):
+    """
+    Agrega al índice las filas de objetos recién guardados en la caja
+    """
+    objeto_ids = [objeto.id for objeto in objetos]
+    if not objeto_ids:
+        return
+
+    if usa_fts():
+        with connection.cursor() as cursor:
+            for bloque, marcadores in _en_bloques(objeto_ids):
+                cursor.execute(f'{SQL_LLENAR} WHERE co.cajon_id = %s AND co.objeto_id IN ({marcadores})', [cajon_id, *bloque])
+    elif _indice.indice is not None:
+        _agregar_en_memoria(Contenido.objects.filter(cajon_id=cajon_id, objeto_id__in=objeto_ids))
+
+
+def quitar(objeto_ids):
+    """
+    Quita del índice todas las filas de los objetos. Debe llamarse antes de borrarlos,
+    mientras existen sus filas de Contenido.
+    """
+    objeto_ids = list(objeto_ids)
+    if usa_fts():
+        with connection.cursor() as cursor:
+            for bloque, marcadores in _en_bloques(objeto_ids):
+                cursor.execute(
+                    f'DELETE FROM {TABLA} WHERE rowid IN (SELECT id FROM {CONTENIDO} WHERE objeto_id IN ({marcadores}))',
+                    bloque,
+                )
+    elif _indice.indice is not None:
+        _quitar_de_memoria(list(Contenido.objects.filter(objeto_id__in=objeto_ids).values_list('id', flat=True)))
+
+
+def quitar_filas(fila_ids):
+    """
+    Quita del índice filas de Contenido por su id (también si ya se borraron)
+    """
+    fila_ids = list(fila_ids)
+    if usa_fts():
+        with connection.cursor() as cursor:
+            for bloque, marcadores in _en_bloques(fila_ids):
+                cursor.execute(f'DELETE FROM {TABLA} WHERE rowid IN ({marcadores})', bloque)
+    elif _indice.indice is not None:
+        _quitar_de_memoria(fila_ids)
+
+
+def actualizar(objeto_ids, filas_borradas=()):
+    """
+    Vuelve a leer del inventario las filas de objetos que cambiaron de caja, después de
+    quitar las filas de Contenido que se borraron al moverlos
+    """
+    quitar_filas(filas_borradas)
+    objeto_ids = list(objeto_ids)
+    if usa_fts():
+        with connection.cursor() as cursor:
+            for bloque, marcadores in _en_bloques(objeto_ids):
+                cursor.execute(f'{SQL_LLENAR} WHERE co.objeto_id IN ({marcadores})', bloque)
+    elif _indice.indice is not None:
+        _agregar_en_memoria(Contenido.objects.filter(objeto_id__in=objeto_ids))
+
+
+def reconstruir():
+    """
+    Vuelve a generar el índice completo. Devuelve el número de filas indexadas.
+    """
+    if usa_fts():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLA}')
+            cursor.execute(SQL_LLENAR)
+            # Fusionar los segmentos del índice para que las consultas lean menos páginas
+            cursor.execute(f"INSERT INTO {TABLA}({TABLA}) VALUES ('optimize')")
+            cursor.execute(f'SELECT count(*) FROM {TABLA}')
+            return cursor.fetchone()[0]
+
+    _indice.descartar()
+    return len(obtener_indice())
+
+
+# Consultas
+
+def buscar(consulta, limite=None):
+    """
+    Devuelve hasta `limite` resultados {id, nombre, tipo, caja, cajon_id, cantidad} para la consulta,
+    uno por cada caja en la que está el objeto. `cantidad` son las unidades del objeto en esa caja.
+    """
+    limite = limite or settings.BUSQUEDA['LIMITE']
+    palabras = terminos(consulta)
+    if not palabras:
+        return []
+
+    if usa_fts():
+        # Palabras completas y la última como prefijo. FTS5 tiene índices de prefijos de
+        # hasta 6 letras; las comillas evitan que se lea como sintaxis de FTS5.
+        expresion = ' '.join([f'"{palabra}"' for palabra in palabras[:-1]] + [f'"{palabras[-1]}"*'])
+        # El objeto y sus unidades se leen de la fila de Contenido (rowid)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT co.objeto_id, {TABLA}.nombre, {TABLA}.tipo, caja, {TABLA}.cajon_id, co.cantidad FROM {TABLA} '
+                f'JOIN {CONTENIDO} co ON co.id = {TABLA}.rowid '
+                f'WHERE {TABLA} MATCH %s LIMIT %s',
+                [expresion, limite],
+            )
+            return [
+                {'id': fila[0], 'nombre': fila[1], 'tipo': fila[2], 'caja': fila[3], 'cajon_id': fila[4], 'cantidad': fila[5]}
+                for fila in cursor.fetchall()
+            ]
+
+    fila_ids = obtener_indice().buscar(consulta, limite)
+    filas = (
+        Contenido.objects.filter(id__in=fila_ids)
+        .values_list('id', 'objeto_id', 'objeto__nombre', 'objeto__tipo', 'cajon__nombre', 'cajon_id', 'cantidad')
+    )
+    por_id = {fila[0]: fila for fila in filas}
+    return [
+        {'id': fila[1], 'nombre': fila[2], 'tipo': fila[3], 'caja': fila[4], 'cajon_id': fila[5], 'cantidad': fila[6]}
+        for fila_id in fila_ids
+        if (fila := por_id.get(fila_id))
+    ]
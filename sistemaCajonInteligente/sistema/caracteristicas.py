@@ -0,0 +1,104 @@
+"""
+Vector de características de una foto para el clasificador (sistema/clasificador.py).
+
+Solo usa Pillow y NumPy, sin Django: los procesos del grupo de clasificación importan este
+módulo sin configurar el proyecto. La foto se reduce a LADO x LADO y se describe con:
+
+- forma: fracción de la foto que ocupa el objeto (píxeles distintos del fondo, estimado
+  con el borde de la foto), tamaño de su recuadro y relación de aspecto de la foto,
+- color del objeto: histograma de tono x saturación (TONOS x SATURACIONES) y de brillo
+  (BRILLOS) de sus píxeles; el fondo es parecido en todas las fotos y no distingue nada,
+- bordes: histograma de orientaciones de los gradientes ponderado por su magnitud,
+  densidad de bordes y magnitud media.
+
+Cada bloque se normaliza para que ninguno domine y el vector final tiene norma 1: la
+similitud entre dos fotos es el producto escalar de sus vectores.
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+# Cambiarla invalida los índices guardados (se reconstruyen con reconstruir_clasificador)
+VERSION = 1
+
+LADO = 64
+TONOS = 12
+SATURACIONES = 3
+BRILLOS = 8
+ORIENTACIONES = 8
+UMBRAL_BORDE = 24.0
+UMBRAL_FONDO = 40.0
+
+DIMENSION = TONOS * SATURACIONES + BRILLOS + ORIENTACIONES + 2 + 3
+
+# Peso de cada bloque (color, brillo, orientaciones, bordes, forma)
+PESOS = (1.0, 0.6, 0.8, 0.6, 1.0)
+
+
+def _abrir(origen):
+    # Ruta del archivo o contenido en bytes (fotos subidas que aún no están en disco)
+    return Image.open(io.BytesIO(origen) if isinstance(origen, (bytes, bytearray)) else origen)
+
+
+def calcular(imagen):
+    """
+    Vector float32 de DIMENSION componentes de una imagen de Pillow
+    """
+    ancho, alto = imagen.size
+    # En JPEG la decodificación ya reduce la imagen (mucho más rápido que decodificarla entera)
+    imagen.draft('RGB', (LADO * 2, LADO * 2))
+    rgb = imagen.convert('RGB').resize((LADO, LADO), Image.Resampling.BILINEAR)
+    pixeles = LADO * LADO
+
+    # Objeto: píxeles que se alejan del fondo (mediana del color del borde de la foto)
+    pixeles_rgb = np.asarray(rgb, dtype=np.float32)
+    marco = np.concatenate([pixeles_rgb[0], pixeles_rgb[-1], pixeles_rgb[:, 0], pixeles_rgb[:, -1]])
+    objeto = np.abs(pixeles_rgb - np.median(marco, axis=0)).sum(axis=2) > UMBRAL_FONDO
+    filas, columnas = np.nonzero(objeto.any(axis=1))[0], np.nonzero(objeto.any(axis=0))[0]
+    recuadro = ((filas[-1] - filas[0] + 1) * (columnas[-1] - columnas[0] + 1) / pixeles) if len(filas) else 0.0
+    forma = np.array([objeto.mean(), recuadro, min(ancho, alto) / max(ancho, alto, 1)])
+
+    # Color y brillo del objeto (de toda la foto si no se distingue del fondo)
+    hsv = np.asarray(rgb.convert('HSV'), dtype=np.int32)
+    seleccion = hsv[objeto] if objeto.any() else hsv.reshape(-1, 3)
+    tono, saturacion, brillo = seleccion[:, 0], seleccion[:, 1], seleccion[:, 2]
+    color = np.bincount(
+        ((tono * TONOS) >> 8) * SATURACIONES + ((saturacion * SATURACIONES) >> 8),
+        minlength=TONOS * SATURACIONES,
+    ) / len(seleccion)
+    brillos = np.bincount((brillo * BRILLOS) >> 8, minlength=BRILLOS) / len(seleccion)
+
+    gris = hsv[..., 2].astype(np.float32)
+    gx = gris[1:-1, 2:] - gris[1:-1, :-2]
+    gy = gris[2:, 1:-1] - gris[:-2, 1:-1]
+    magnitud = np.hypot(gx, gy)
+    angulo = (np.arctan2(gy, gx) % np.pi) * (ORIENTACIONES / np.pi)
+    orientaciones = np.bincount(
+        np.minimum(angulo.astype(np.int32), ORIENTACIONES - 1).ravel(),
+        weights=magnitud.ravel(), minlength=ORIENTACIONES,
+    )
+    total = orientaciones.sum()
+    orientaciones = orientaciones / total if total else orientaciones
+    bordes = np.array([(magnitud > UMBRAL_BORDE).mean(), min(1.0, magnitud.mean() / 128)])
+
+    bloques = [color, brillos, orientaciones, bordes, forma]
+    vector = np.concatenate([
+        peso * bloque / (np.linalg.norm(bloque) or 1.0) for peso, bloque in zip(PESOS, bloques)
+    ]).astype(np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def calcular_lote(origenes):
+    """
+    Matriz (len(origenes), DIMENSION) de las fotos (rutas o bytes). Las que no se pueden
+    abrir quedan con una fila de ceros. Se ejecuta en los procesos del grupo.
+    """
+    matriz = np.zeros((len(origenes), DIMENSION), dtype=np.float32)
+    for fila, origen in enumerate(origenes):
+        try:
+            with _abrir(origen) as imagen:
+                matriz[fila] = calcular(imagen)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            pass
+    return matriz
@@ -0,0 +1,230 @@
+"""
+Prueba de carga de las vistas de lectura con peticiones concurrentes, comparando los dos
+puntos de entrada del proyecto dentro del mismo proceso (sin red ni servidor externo):
+
+- WSGI: la aplicación de wsgi.py atendida por un grupo fijo de `hilos`, como un servidor
+  con hilos (p. ej. gunicorn --threads). Con más clientes que hilos las peticiones esperan.
+- ASGI: la aplicación de asgi.py en un bucle de eventos, como uvicorn o daphne
+  (uvicorn sistemaCajonInteligente.asgi:application). Las vistas asíncronas esperan a la
+  base de datos sin ocupar el bucle.
+
+Cada nivel de concurrencia lanza `clientes` que repiten peticiones (una detrás de otra) hasta
+completar `peticiones`; se mide el rendimiento (peticiones por segundo) y la latencia vista
+por el cliente, que incluye la espera por un hilo libre.
+"""
+import asyncio
+import io
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+
+from .benchmark import percentil
+from .bitacora import obtener_bitacora
+from .models import Cajon
+
+HOST = 'localhost'
+
+
+class Rutas:
+    """
+    Peticiones de lectura al azar (con semilla fija): detalle de una caja, historial y lista de cajas
+    """
+
+    def __init__(self, semilla):
+        self.rng = random.Random(semilla)
+        self.caja_ids = list(Cajon.objects.order_by('id').values_list('id', flat=True))
+        self._candado = threading.Lock()
+
+    def siguiente(self):
+        with self._candado:
+            eleccion = self.rng.random()
+            if eleccion < 0.6 and self.caja_ids:
+                orden = self.rng.choice(('nombre', 'tipo', 'tamanio'))
+                return reverse('detalle_caja', args=[self.rng.choice(self.caja_ids)]), urlencode({'orden': orden})
+            if eleccion < 0.9:
+                return reverse('historial_acciones'), ''
+            return reverse('crear_caja'), ''
+
+
+def _resumen(tiempos, errores, duracion):
+    return {
+        'peticiones': len(tiempos),
+        'errores': errores,
+        'por_segundo': round(len(tiempos) / duracion, 1) if duracion else 0,
+        'p50_ms': round(statistics.median(tiempos), 2) if tiempos else 0,
+        'p95_ms': round(percentil(tiempos, 95), 2) if tiempos else 0,
+        'max_ms': round(max(tiempos), 2) if tiempos else 0,
+    }
+
+
+# WSGI
+
+def _entorno_wsgi(ruta, consulta):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': ruta,
+        'QUERY_STRING': consulta,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': HOST,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def _peticion_wsgi(aplicacion, ruta, consulta):
+    estado = []
+
+    def start_response(status, headers, exc_info=None):
+        estado.append(int(status.split(' ', 1)[0]))
+
+    respuesta = aplicacion(_entorno_wsgi(ruta, consulta), start_response)
+    try:
+        for _ in respuesta:
+            pass
+    finally:
+        if hasattr(respuesta, 'close'):
+            respuesta.close()
+    return estado[0]
+
+
+def medir_wsgi(rutas, clientes, peticiones, hilos):
+    """
+    `clientes` hilos cliente que envían las peticiones a un grupo de `hilos` trabajadores
+    """
+    aplicacion = get_wsgi_application()
+    tiempos = []
+    errores = [0]
+    restantes = [peticiones]
+    candado = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='wsgi') as servidor:
+        def cliente():
+            while True:
+                with candado:
+                    if restantes[0] <= 0:
+                        return
+                    restantes[0] -= 1
+                ruta, consulta = rutas.siguiente()
+                inicio = time.perf_counter()
+                estado = servidor.submit(_peticion_wsgi, aplicacion, ruta, consulta).result()
+                duracion = (time.perf_counter() - inicio) * 1000
+                with candado:
+                    tiempos.append(duracion)
+                    if estado >= 400:
+                        errores[0] += 1
+
+        inicio = time.perf_counter()
+        lanzados = [threading.Thread(target=cliente) for _ in range(clientes)]
+        for hilo in lanzados:
+            hilo.start()
+        for hilo in lanzados:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+    return _resumen(tiempos, errores[0], duracion)
+
+
+# ASGI
+
+async def _peticion_asgi(aplicacion, ruta, consulta):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': ruta,
+        'raw_path': ruta.encode(),
+        'query_string': consulta.encode(),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+    cuerpo_enviado = False
+    terminada = asyncio.Event()
+    estado = []
+
+    async def receive():
+        nonlocal cuerpo_enviado
+        if not cuerpo_enviado:
+            cuerpo_enviado = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Django escucha la desconexión del cliente mientras atiende la petición
+        await terminada.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(mensaje):
+        if mensaje['type'] == 'http.response.start':
+            estado.append(mensaje['status'])
+
+    try:
+        await aplicacion(scope, receive, send)
+    finally:
+        terminada.set()
+    return estado[0]
+
+
+def medir_asgi(rutas, clientes, peticiones):
+    """
+    `clientes` corrutinas cliente en un mismo bucle de eventos
+    """
+    aplicacion = get_asgi_application()
+
+    async def ejecutar():
+        tiempos = []
+        errores = 0
+        restantes = peticiones
+
+        async def cliente():
+            nonlocal errores, restantes
+            while restantes > 0:
+                restantes -= 1
+                ruta, consulta = rutas.siguiente()
+                inicio = time.perf_counter()
+                estado = await _peticion_asgi(aplicacion, ruta, consulta)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+                if estado >= 400:
+                    errores += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente() for _ in range(clientes)))
+        return _resumen(tiempos, errores, time.perf_counter() - inicio)
+
+    return asyncio.run(ejecutar())
+
+
+def ejecutar(concurrencias=(1, 4, 16, 64), peticiones=200, hilos=4, semilla=42, modos=('wsgi', 'asgi'), progreso=None):
+    """
+    Mide cada modo con cada nivel de concurrencia. Devuelve {modo: {clientes: métricas}}
+    """
+    rutas = Rutas(semilla)
+    resultados = {}
+    for modo in modos:
+        resultados[modo] = {}
+        for clientes in concurrencias:
+            if modo == 'wsgi':
+                metricas = medir_wsgi(rutas, clientes, peticiones, hilos)
+            else:
+                metricas = medir_asgi(rutas, clientes, peticiones)
+            resultados[modo][clientes] = metricas
+            if progreso:
+                progreso(modo, clientes, metricas)
+            # Que las acciones en cola no se escriban durante la siguiente medición
+            obtener_bitacora().vaciar()
+    return resultados
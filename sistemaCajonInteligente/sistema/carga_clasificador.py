@@ -0,0 +1,119 @@
+"""
+Prueba del clasificador (sistema/clasificador.py) con fotos sintéticas: cada tipo tiene su
+color y su forma, y el tamaño decide la parte de la foto que ocupa el objeto, con
+variaciones al azar de posición, tono, fondo y ruido. Las fotos son JPEG de 800x600, como
+las de un móvil reducidas, guardadas en un directorio temporal.
+
+Se mide:
+
+- fotos por segundo al calcular las características en este proceso, una detrás de otra,
+- y en el grupo de procesos (Lotes) con varios procesos y tamaños de lote, pidiendo todas
+  las fotos a la vez como cuando se procesan muchas subidas,
+- consultas por segundo del k-NN y acierto del tipo y el tamaño sugeridos sobre una parte
+  de las fotos (`prueba`) que no se añade al índice.
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from PIL import Image, ImageDraw
+
+from .caracteristicas import calcular_lote
+from .clasificador import TAMANIOS, TIPOS, Indice, Lotes, _codigos
+
+# Parte del lado menor de la foto que ocupa el objeto según su tamaño
+ESCALAS = {'pequeno': 0.3, 'mediano': 0.55, 'grande': 0.85}
+
+
+def foto_sintetica(ruta, tipo, tamanio, rng, ancho=800, alto=600):
+    """
+    Guarda en `ruta` un JPEG de un objeto de prueba de ese tipo y tamaño
+    """
+    numero = TIPOS.index(tipo)
+    imagen = Image.new('RGB', (ancho, alto), tuple(rng.randrange(200, 245) for _ in range(3)))
+    dibujo = ImageDraw.Draw(imagen)
+    lado = ESCALAS[tamanio] * min(ancho, alto) * rng.uniform(0.85, 1.15)
+    x, y = rng.uniform(lado / 2, ancho - lado / 2), rng.uniform(lado / 2, alto - lado / 2)
+    recuadro = [x - lado / 2, y - lado / 2, x + lado / 2, y + lado / 2]
+    tono = (numero * 360 // len(TIPOS) + rng.randrange(-12, 13)) % 360
+    color = f'hsv({tono}, {rng.randrange(55, 90)}%, {rng.randrange(50, 85)}%)'
+    forma = numero % 3
+    if forma == 0:
+        dibujo.ellipse(recuadro, fill=color)
+    elif forma == 1:
+        dibujo.rectangle(recuadro, fill=color)
+    else:
+        # Objetos alargados (cables, herramientas): trazos dentro del recuadro
+        for _ in range(6):
+            puntos = [(rng.uniform(recuadro[0], recuadro[2]), rng.uniform(recuadro[1], recuadro[3])) for _ in range(2)]
+            dibujo.line(puntos, fill=color, width=max(2, int(lado / 25)))
+    imagen = Image.blend(imagen, Image.effect_noise((ancho, alto), 30).convert('RGB'), 0.15)
+    imagen.save(ruta, quality=85)
+
+
+def ejecutar(fotos=2000, procesos=(1, 2, 4), lotes=(1, 8, 32), prueba=0.2, semilla=0, progreso=None):
+    """
+    Mide cada escenario. Devuelve una lista de métricas, una por escenario.
+    """
+    rng = random.Random(semilla)
+    directorio = tempfile.mkdtemp(prefix='clasificador-')
+    resultados = []
+
+    def anotar(escenario, cantidad, segundos, **extra):
+        resultados.append({
+            'escenario': escenario,
+            'fotos': cantidad,
+            'segundos': round(segundos, 3),
+            'fotos_por_segundo': round(cantidad / segundos, 1) if segundos else 0,
+            'lotes': None,
+            'acierto_tipo': None,
+            'acierto_tamanio': None,
+            **extra,
+        })
+        if progreso:
+            progreso(resultados[-1])
+
+    try:
+        etiquetas = [(rng.choice(TIPOS), rng.choice(TAMANIOS)) for _ in range(fotos)]
+        rutas = [os.path.join(directorio, f'{numero}.jpg') for numero in range(fotos)]
+        for ruta, (tipo, tamanio) in zip(rutas, etiquetas):
+            foto_sintetica(ruta, tipo, tamanio, rng)
+
+        inicio = time.perf_counter()
+        matriz = calcular_lote(rutas)
+        anotar('en el proceso', fotos, time.perf_counter() - inicio)
+
+        for numero in procesos:
+            for tamanio_lote in lotes:
+                grupo = Lotes(numero, tamanio_lote, settings.CLASIFICADOR['ESPERA_MS'])
+                try:
+                    # El arranque de los procesos no se mide
+                    for futuro in [grupo.calcular(ruta) for ruta in rutas[:numero * 2]]:
+                        futuro.result()
+                    lotes_antes = grupo.lotes
+                    inicio = time.perf_counter()
+                    for futuro in [grupo.calcular(ruta) for ruta in rutas]:
+                        futuro.result()
+                    anotar(f'{numero} procesos, lote {tamanio_lote}', fotos, time.perf_counter() - inicio,
+                           lotes=grupo.lotes - lotes_antes)
+                finally:
+                    grupo.cerrar()
+
+        separadas = int(fotos * prueba)
+        indice = Indice(os.path.join(directorio, 'indice'))
+        indice.reemplazar(range(separadas, fotos), matriz[separadas:],
+                          [_codigos(*etiqueta) for etiqueta in etiquetas[separadas:]])
+        inicio = time.perf_counter()
+        sugerencias = indice.predecir(matriz[:separadas])
+        segundos = time.perf_counter() - inicio
+        aciertos_tipo = sum(bool(s) and s['tipo'] == tipo for s, (tipo, _) in zip(sugerencias, etiquetas))
+        aciertos_tamanio = sum(bool(s) and s['tamanio'] == tamanio for s, (_, tamanio) in zip(sugerencias, etiquetas))
+        anotar(f'k-NN ({indice.filas} fotos)', separadas, segundos,
+               acierto_tipo=round(aciertos_tipo / max(separadas, 1), 3),
+               acierto_tamanio=round(aciertos_tamanio / max(separadas, 1), 3))
+        return resultados
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
@@ -0,0 +1,173 @@
+"""
+Prueba de una página con muchas fotos (p. ej. el detalle de una caja con 200 miniaturas):
+el navegador pide todas las miniaturas a la vez por unas pocas conexiones (`conexiones`,
+6 como un navegador con HTTP/1.1) y cada una ocupa un hilo de la aplicación WSGI.
+
+Se generan `fotos` fotos de prueba en un MEDIA_ROOT temporal, procesadas como las de los
+objetos (sistema/imagenes.py), y se compara:
+
+- antes: django.views.static.serve, lo que servía static() en urls.py. Sin Cache-Control,
+  el navegador vuelve a preguntar por cada foto en cada visita (If-Modified-Since).
+- despues: sistema/medios.py. La primera visita descarga las fotos; en las siguientes las
+  miniaturas nombradas por su hash están en caché (immutable) y no se piden. Se mide
+  también la recarga forzada, que las revalida con If-None-Match (304).
+- proxy: MEDIOS['ENVIO'] = 'x-accel-redirect'. Django solo responde con las cabeceras.
+- rango: la primera parte de cada foto grande (Range), como un visor que carga por partes.
+
+La aplicación se llama dentro del proceso, con el wsgi.file_wrapper de wsgiref: un servidor
+con sendfile (gunicorn) envía además el cuerpo sin copiarlo, lo que aquí no se mide.
+"""
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from django.urls import path
+from django.utils.http import http_date
+from django.views.static import serve
+from PIL import Image
+
+from .benchmark import percentil
+from .carga import _entorno_wsgi
+from .imagenes import opciones_imagenes, procesar_archivo
+from .views import servir_medio
+from . import medios
+
+
+def _servir_antes(request, ruta):
+    return serve(request, ruta, document_root=settings.MEDIA_ROOT)
+
+
+# URLconf de la medición: las dos formas de servir las fotos
+urlpatterns = [
+    path('antes/<path:ruta>', _servir_antes),
+    path('media/<path:ruta>', servir_medio),
+]
+
+
+def crear_fotos(media_root, cantidad, lado=1200, semilla=0):
+    """
+    Procesa `cantidad` fotos de prueba distintas. Devuelve los nombres de las miniaturas y de las fotos.
+    """
+    rng = random.Random(semilla)
+    opciones = opciones_imagenes()
+    originales = os.path.join(media_root, 'originales')
+    os.makedirs(originales)
+    miniaturas, fotos = [], []
+    for numero in range(cantidad):
+        # Degradado con ruido: comprime como una foto y no como un color plano
+        imagen = Image.linear_gradient('L').resize((lado, lado)).convert('RGB')
+        imagen = Image.blend(imagen, Image.effect_noise((lado, lado), 40).convert('RGB'), 0.3)
+        imagen.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (0, 0, lado // 4, lado // 4))
+        ruta = os.path.join(originales, f'{numero}.jpg')
+        imagen.save(ruta, quality=90)
+        resultado = procesar_archivo(ruta, media_root, opciones)
+        miniaturas.append(resultado['miniatura'])
+        fotos.append(resultado['imagen'])
+    shutil.rmtree(originales)
+    return miniaturas, fotos
+
+
+def _peticion(aplicacion, ruta, cabeceras):
+    entorno = _entorno_wsgi(ruta, '')
+    entorno['wsgi.file_wrapper'] = FileWrapper
+    for cabecera, valor in cabeceras.items():
+        entorno['HTTP_' + cabecera.upper().replace('-', '_')] = valor
+    estado = []
+
+    def start_response(status, headers, exc_info=None):
+        estado.append(int(status.split(' ', 1)[0]))
+
+    respuesta = aplicacion(entorno, start_response)
+    try:
+        cuerpo = sum(len(parte) for parte in respuesta)
+    finally:
+        if hasattr(respuesta, 'close'):
+            respuesta.close()
+    return estado[0], cuerpo
+
+
+def cargar_pagina(aplicacion, peticiones, conexiones):
+    """
+    Pide todas las `peticiones` [(ruta, cabeceras)] con `conexiones` hilos
+    """
+    tiempos = []
+    candado = threading.Lock()
+
+    def pedir(peticion):
+        inicio = time.perf_counter()
+        resultado = _peticion(aplicacion, *peticion)
+        with candado:
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return resultado
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=conexiones) as conexion:
+        respuestas = list(conexion.map(pedir, peticiones))
+    duracion = (time.perf_counter() - inicio) * 1000
+    return {
+        'peticiones': len(peticiones),
+        'estados': sorted({estado for estado, _ in respuestas}),
+        'kb': round(sum(cuerpo for _, cuerpo in respuestas) / 1024, 1),
+        'pagina_ms': round(duracion, 1),
+        'p50_ms': round(statistics.median(tiempos), 3) if tiempos else 0,
+        'p95_ms': round(percentil(tiempos, 95), 3) if tiempos else 0,
+    }
+
+
+def ejecutar(fotos=200, conexiones=6, repeticiones=3, semilla=0, progreso=None):
+    """
+    Mide cada forma de servir la página de fotos (la mejor de `repeticiones`). Devuelve {escenario: métricas}.
+    """
+    media_root = tempfile.mkdtemp(prefix='medios-')
+    try:
+        miniaturas, grandes = crear_fotos(media_root, fotos, semilla=semilla)
+        ajustes = override_settings(
+            MEDIA_ROOT=media_root,
+            ROOT_URLCONF=__name__,
+            ALLOWED_HOSTS=['*'],
+            INSTRUMENTACION={**settings.INSTRUMENTACION, 'ACTIVA': False},
+        )
+        with ajustes:
+            aplicacion = get_wsgi_application()
+            resultados = {}
+
+            def modificada(nombre_foto):
+                return {'If-Modified-Since': http_date(os.stat(os.path.join(media_root, nombre_foto)).st_mtime)}
+
+            def etag(nombre_foto):
+                ruta = os.path.join(media_root, nombre_foto)
+                return {'If-None-Match': medios.etag_archivo(nombre_foto, ruta, os.stat(ruta))[0]}
+
+            def medir(escenario, prefijo, nombres, cabeceras=lambda nombre_foto: {}, opciones=None):
+                peticiones = [(f'/{prefijo}/{nombre_foto}', cabeceras(nombre_foto)) for nombre_foto in nombres]
+                with override_settings(MEDIOS={**settings.MEDIOS, **(opciones or {})}):
+                    metricas = min(
+                        (cargar_pagina(aplicacion, peticiones, conexiones) for _ in range(repeticiones)),
+                        key=lambda metricas: metricas['pagina_ms'],
+                    )
+                resultados[escenario] = metricas
+                if progreso:
+                    progreso(escenario, metricas)
+
+            medir('antes: primera visita', 'antes', miniaturas)
+            medir('antes: visita siguiente', 'antes', miniaturas, modificada)
+            medir('despues: primera visita', 'media', miniaturas)
+            # Miniaturas immutable: en las visitas siguientes el navegador no las pide
+            medir('despues: visita siguiente', 'media', [])
+            medir('despues: recarga (304)', 'media', miniaturas, etag)
+            medir('proxy: primera visita', 'media', miniaturas, opciones={'ENVIO': 'x-accel-redirect'})
+            medir('antes: fotos grandes', 'antes', grandes)
+            medir('despues: fotos grandes', 'media', grandes)
+            medir('rango: primeros 16 KB', 'media', grandes, lambda nombre_foto: {'Range': 'bytes=0-16383'})
+        return resultados
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
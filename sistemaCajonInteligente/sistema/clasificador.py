@@ -0,0 +1,410 @@
+"""
+Sugerencia del tipo y del tamaño de un objeto a partir de su foto.
+
+k vecinos más cercanos (k-NN) entre las características (sistema/caracteristicas.py) de
+las fotos de los objetos guardados, etiquetadas con el tipo y el tamaño que tienen. Cada
+uno de los CLASIFICADOR['VECINOS'] vecinos vota con el inverso de su distancia al cuadrado;
+la confianza es la fracción de los votos que se lleva la etiqueta ganadora.
+
+El índice está en CLASIFICADOR['DIRECTORIO'] y cada proceso lo lee como memmap:
+
+- indice.json: versión de las características, generación y filas válidas.
+- <generación>/caracteristicas.f32, ids.i64 y etiquetas.u8 (código del tipo y del tamaño).
+
+Las fotos procesadas (sistema/imagenes.py) se añaden al final de los archivos y después se
+reescribe indice.json con las filas nuevas, así un lector nunca ve una fila a medias.
+manage.py reconstruir_clasificador escribe una generación nueva y cambia indice.json de
+una vez; los procesos que tenían abierta la anterior la siguen leyendo hasta recargarla.
+
+Las características se calculan en un grupo de procesos (CLASIFICADOR['PROCESOS']). Las
+fotos pendientes (las subidas que esperan su sugerencia y las que se añaden al índice) se
+juntan en lotes de hasta LOTE, esperando como mucho ESPERA_MS a que lleguen más, y cada
+lote va a un proceso. Con CLASIFICADOR['SINCRONO'] se calculan en el proceso que las pide.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .caracteristicas import DIMENSION, VERSION, calcular_lote
+from .models import Objeto
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso escribe en el índice
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TIPOS = [valor for valor, _ in Objeto._meta.get_field('tipo').choices]
+TAMANIOS = [valor for valor, _ in Objeto._meta.get_field('tamanio').choices]
+
+# Archivos de cada generación: (nombre, tipo de NumPy, columnas)
+ARCHIVOS = {
+    'caracteristicas': ('caracteristicas.f32', np.float32, DIMENSION),
+    'ids': ('ids.i64', np.int64, 1),
+    'etiquetas': ('etiquetas.u8', np.uint8, 2),
+}
+
+# Filas del índice por producto de matrices al buscar vecinos
+BLOQUE_FILAS = 65536
+
+
+def _codigos(tipo, tamanio):
+    return (
+        TIPOS.index(tipo) if tipo in TIPOS else 255,
+        TAMANIOS.index(tamanio) if tamanio in TAMANIOS else 255,
+    )
+
+
+def _generacion_nueva(directorio):
+    generacion = int(time.time() * 1000)
+    while os.path.exists(os.path.join(directorio, str(generacion))):
+        generacion += 1
+    return str(generacion)
+
+
+@contextmanager
+def _bloqueo(directorio):
+    # Varios procesos de la aplicación pueden añadir filas a la vez
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, '.bloqueo'), 'w') as archivo:
+        if fcntl:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+        yield
+
+
+class Indice:
+    """
+    Características y etiquetas de las fotos de los objetos, leídas como memmap
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.filas = 0
+        self.caracteristicas = np.empty((0, DIMENSION), dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.etiquetas = np.empty((0, 2), dtype=np.uint8)
+        self._marca = None
+        # Los hilos que consultan ven los tres archivos de la misma versión
+        self._candado = threading.RLock()
+
+    def _cabecera(self):
+        try:
+            with open(os.path.join(self.directorio, 'indice.json')) as archivo:
+                cabecera = json.load(archivo)
+        except (OSError, ValueError):
+            return None
+        if cabecera.get('version') != VERSION or cabecera.get('dimension') != DIMENSION:
+            # Índice de otras características: hay que reconstruirlo
+            return None
+        return cabecera
+
+    def _escribir_cabecera(self, generacion, filas):
+        ruta = os.path.join(self.directorio, 'indice.json')
+        temporal = f'{ruta}.{os.getpid()}.tmp'
+        with open(temporal, 'w') as archivo:
+            json.dump({'version': VERSION, 'dimension': DIMENSION, 'generacion': generacion, 'filas': filas}, archivo)
+        os.replace(temporal, ruta)
+
+    def _ruta(self, generacion, clave):
+        return os.path.join(self.directorio, generacion, ARCHIVOS[clave][0])
+
+    def actualizar(self):
+        """
+        Vuelve a abrir los archivos si cambió indice.json (filas nuevas o generación nueva)
+        """
+        try:
+            info = os.stat(os.path.join(self.directorio, 'indice.json'))
+            marca = (info.st_ino, info.st_mtime_ns)
+        except OSError:
+            marca = None
+        with self._candado:
+            if marca == self._marca:
+                return self
+            cabecera = self._cabecera() if marca else None
+            self._marca = marca
+            self.filas = cabecera['filas'] if cabecera else 0
+            for clave, (_, tipo, columnas) in ARCHIVOS.items():
+                forma = (self.filas, columnas) if columnas > 1 else (self.filas,)
+                datos = np.empty(forma, dtype=tipo)
+                if self.filas:
+                    datos = np.memmap(self._ruta(cabecera['generacion'], clave), dtype=tipo, mode='r', shape=forma)
+                setattr(self, clave, datos)
+        return self
+
+    def _escribir(self, generacion, filas, ids, matriz, etiquetas):
+        # Escribe las filas tras las `filas` válidas (descarta lo que dejara una escritura
+        # interrumpida) y después la cabecera. Las características vacías (fotos que no se
+        # pudieron leer) no se añaden.
+        validas = np.abs(matriz).sum(axis=1) > 0
+        datos = {
+            'caracteristicas': np.ascontiguousarray(matriz[validas], dtype=np.float32),
+            'ids': np.asarray(ids, dtype=np.int64)[validas],
+            'etiquetas': np.asarray(etiquetas, dtype=np.uint8).reshape(-1, 2)[validas],
+        }
+        os.makedirs(os.path.join(self.directorio, generacion), exist_ok=True)
+        for clave, valores in datos.items():
+            ruta = self._ruta(generacion, clave)
+            with open(ruta, 'r+b' if os.path.exists(ruta) else 'wb') as archivo:
+                archivo.seek(filas * valores.itemsize * ARCHIVOS[clave][2])
+                archivo.write(valores.tobytes())
+                archivo.truncate()
+        self._escribir_cabecera(generacion, filas + len(datos['ids']))
+
+    def agregar(self, ids, matriz, etiquetas):
+        """
+        Añade filas al final del índice
+        """
+        with _bloqueo(self.directorio):
+            cabecera = self._cabecera() or {'generacion': _generacion_nueva(self.directorio), 'filas': 0}
+            self._escribir(cabecera['generacion'], cabecera['filas'], ids, matriz, etiquetas)
+        return self.actualizar()
+
+    def reemplazar(self, ids, matriz, etiquetas):
+        """
+        Escribe una generación nueva con estas filas, la pone en uso y borra las anteriores
+        """
+        with _bloqueo(self.directorio):
+            generacion = _generacion_nueva(self.directorio)
+            self._escribir(generacion, 0, ids, matriz, etiquetas)
+            for nombre in os.listdir(self.directorio):
+                if nombre != generacion and os.path.isdir(os.path.join(self.directorio, nombre)):
+                    shutil.rmtree(os.path.join(self.directorio, nombre), ignore_errors=True)
+        return self.actualizar()
+
+    def vecinos(self, consultas, k, caracteristicas=None):
+        """
+        (similitudes, posiciones) de los k vecinos de cada consulta, de mayor a menor similitud.
+        El índice se recorre por bloques de BLOQUE_FILAS filas con un producto de matrices.
+        """
+        if caracteristicas is None:
+            caracteristicas = self.caracteristicas
+        consultas = np.asarray(consultas, dtype=np.float32)
+        k = min(k, len(caracteristicas))
+        similitudes = np.empty((len(consultas), 0), dtype=np.float32)
+        posiciones = np.empty((len(consultas), 0), dtype=np.int64)
+        for inicio in range(0, len(caracteristicas), BLOQUE_FILAS):
+            bloque = consultas @ caracteristicas[inicio:inicio + BLOQUE_FILAS].T
+            similitudes = np.concatenate([similitudes, bloque], axis=1)
+            posiciones = np.concatenate([
+                posiciones, np.broadcast_to(np.arange(inicio, inicio + bloque.shape[1]), bloque.shape)
+            ], axis=1)
+            if similitudes.shape[1] > k:
+                mejores = np.argpartition(-similitudes, k - 1, axis=1)[:, :k]
+                similitudes = np.take_along_axis(similitudes, mejores, axis=1)
+                posiciones = np.take_along_axis(posiciones, mejores, axis=1)
+        orden = np.argsort(-similitudes, axis=1)
+        return np.take_along_axis(similitudes, orden, axis=1), np.take_along_axis(posiciones, orden, axis=1)
+
+    def predecir(self, matriz, k=None):
+        """
+        Sugerencia de cada fila: {'tipo', 'tamanio', 'confianza_tipo', 'confianza_tamanio'}
+        con la etiqueta más votada, o None (sin índice o sin características)
+        """
+        opciones = settings.CLASIFICADOR
+        with self._candado:
+            self.actualizar()
+            caracteristicas, etiquetas = self.caracteristicas, self.etiquetas
+        matriz = np.asarray(matriz, dtype=np.float32)
+        if not len(caracteristicas):
+            return [None] * len(matriz)
+        similitudes, posiciones = self.vecinos(matriz, k or opciones['VECINOS'], caracteristicas)
+        # Voto por el inverso de la distancia al cuadrado (vectores de norma 1: 2 - 2 * similitud),
+        # así pesan mucho más las fotos casi iguales que las solo parecidas
+        pesos = 1 / (np.maximum(2 - 2 * similitudes, 0) + 1e-3)
+        etiquetas = etiquetas[posiciones]
+        sugerencias = []
+        for fila in range(len(matriz)):
+            if not matriz[fila].any():
+                sugerencias.append(None)
+                continue
+            sugerencia = {}
+            for columna, (campo, valores) in enumerate((('tipo', TIPOS), ('tamanio', TAMANIOS))):
+                votos = np.bincount(etiquetas[fila, :, columna], weights=pesos[fila], minlength=256)[:len(valores)]
+                ganadora = int(votos.argmax())
+                confianza = float(votos[ganadora] / pesos[fila].sum())
+                sugerencia[campo] = valores[ganadora] if confianza >= opciones['CONFIANZA_MINIMA'] else None
+                sugerencia[f'confianza_{campo}'] = round(confianza, 3)
+            sugerencias.append(sugerencia)
+        return sugerencias
+
+
+class Lotes:
+    """
+    Reparte las fotos pendientes en lotes entre los procesos del grupo
+    """
+
+    def __init__(self, procesos, lote, espera_ms):
+        self.lote = lote
+        self.espera = espera_ms / 1000
+        self.lotes = 0
+        self.fotos = 0
+        self._cola = queue.SimpleQueue()
+        # spawn: los procesos no heredan los hilos ni las conexiones de la aplicación
+        self._grupo = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'))
+        threading.Thread(target=self._repartir, name='clasificador', daemon=True).start()
+
+    def calcular(self, origen):
+        """
+        Future con el vector de características de la foto (ruta o bytes)
+        """
+        futuro = Future()
+        self._cola.put((origen, futuro))
+        return futuro
+
+    def _repartir(self):
+        while True:
+            pendientes = [self._cola.get()]
+            limite = time.monotonic() + self.espera
+            while len(pendientes) < self.lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    pendientes.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self.lotes += 1
+            self.fotos += len(pendientes)
+            futuros = [futuro for _, futuro in pendientes]
+            try:
+                enviado = self._grupo.submit(calcular_lote, [origen for origen, _ in pendientes])
+            except RuntimeError as error:
+                # El grupo se cerró (fin del proceso)
+                for futuro in futuros:
+                    futuro.set_exception(error)
+                continue
+            enviado.add_done_callback(lambda enviado, futuros=futuros: self._entregar(enviado, futuros))
+
+    @staticmethod
+    def _entregar(enviado, futuros):
+        error = enviado.exception()
+        for fila, futuro in enumerate(futuros):
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(enviado.result()[fila])
+
+    def cerrar(self):
+        self._grupo.shutdown(wait=True, cancel_futures=True)
+
+
+_indice = None
+_lotes = None
+_candado = threading.Lock()
+
+
+def obtener_indice():
+    global _indice
+    with _candado:
+        if _indice is None or _indice.directorio != settings.CLASIFICADOR['DIRECTORIO']:
+            _indice = Indice(settings.CLASIFICADOR['DIRECTORIO'])
+    return _indice.actualizar()
+
+
+def obtener_lotes():
+    global _lotes
+    if _lotes is None:
+        with _candado:
+            if _lotes is None:
+                opciones = settings.CLASIFICADOR
+                _lotes = Lotes(opciones['PROCESOS'], opciones['LOTE'], opciones['ESPERA_MS'])
+    return _lotes
+
+
+def calcular(origenes):
+    """
+    Matriz de características de las fotos (rutas o bytes), en el grupo de procesos
+    """
+    if settings.CLASIFICADOR['SINCRONO']:
+        return calcular_lote(origenes)
+    futuros = [obtener_lotes().calcular(origen) for origen in origenes]
+    espera = settings.CLASIFICADOR['ESPERA_SEGUNDOS']
+    return np.stack([futuro.result(timeout=espera) for futuro in futuros]) if futuros else np.empty((0, DIMENSION), np.float32)
+
+
+def sugerir_foto(foto):
+    """
+    Sugerencia de tipo y tamaño para una foto subida (UploadedFile), o None
+    """
+    datos = b''.join(foto.chunks())
+    foto.seek(0)
+    try:
+        return obtener_indice().predecir(calcular([datos]))[0]
+    except Exception:
+        logger.exception('Error al clasificar la foto %s', foto.name)
+        return None
+
+
+def _agregar_calculado(objeto_id, codigos, futuro):
+    try:
+        obtener_indice().agregar([objeto_id], futuro.result()[np.newaxis], [codigos])
+    except Exception:
+        logger.exception('Error al añadir al clasificador la foto del objeto %s', objeto_id)
+
+
+def indexar(objeto_id, ruta):
+    """
+    Añade al índice la foto procesada del objeto, etiquetada con su tipo y su tamaño. Sin
+    CLASIFICADOR['SINCRONO'] no espera: la fila se añade cuando el grupo calcula el lote.
+    """
+    etiquetas = Objeto.objects.filter(id=objeto_id).values_list('tipo', 'tamanio').first()
+    if etiquetas is None:
+        return
+    codigos = _codigos(*etiquetas)
+    if settings.CLASIFICADOR['SINCRONO']:
+        obtener_indice().agregar([objeto_id], calcular_lote([ruta]), [codigos])
+        return
+    futuro = obtener_lotes().calcular(ruta)
+    futuro.add_done_callback(lambda futuro: _agregar_calculado(objeto_id, codigos, futuro))
+
+
+def reconstruir(progreso=None, procesos=None, lote=256):
+    """
+    Vuelve a calcular el índice con las fotos de todos los objetos (la miniatura si ya está
+    procesada), repartidas en lotes de `lote` entre `procesos` procesos. Devuelve las filas.
+    """
+    filas = list(
+        Objeto.objects.exclude(imagen='').exclude(imagen__isnull=True)
+        .order_by('id').values_list('id', 'imagen', 'miniatura', 'tipo', 'tamanio')
+    )
+    media_root = str(settings.MEDIA_ROOT)
+    rutas = [os.path.join(media_root, miniatura or imagen) for _, imagen, miniatura, _, _ in filas]
+    bloques = [rutas[inicio:inicio + lote] for inicio in range(0, len(rutas), lote)]
+
+    matrices = []
+    hechas = 0
+    grupo = None
+    if bloques and not settings.CLASIFICADOR['SINCRONO']:
+        grupo = ProcessPoolExecutor(
+            max_workers=procesos or settings.CLASIFICADOR['PROCESOS'],
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    try:
+        for matriz in (grupo.map if grupo else map)(calcular_lote, bloques):
+            matrices.append(matriz)
+            hechas += len(matriz)
+            if progreso:
+                progreso(hechas, len(rutas))
+    finally:
+        if grupo:
+            grupo.shutdown()
+
+    matriz = np.concatenate(matrices) if matrices else np.empty((0, DIMENSION), np.float32)
+    indice = obtener_indice()
+    indice.reemplazar(
+        [objeto_id for objeto_id, *_ in filas], matriz,
+        [_codigos(tipo, tamanio) for *_, tipo, tamanio in filas],
+    )
+    return indice.filas
+
@@ -0,0 +1,166 @@
+"""
+Medición de la contención de bloqueos de SQLite: varios hilos escriben acciones (como la
+bitácora y las vistas que modifican datos) mientras otros leen páginas del historial.
+
+Se compara la configuración anterior (diario DELETE, synchronous=FULL) con la de
+settings.PRAGMAS_SQLITE (WAL, synchronous=NORMAL). Se trabaja con sqlite3 sobre una copia
+de la base de datos en un directorio temporal, así que la base de datos real no cambia.
+Los errores "database is locked" son operaciones que esperaron más de `espera` segundos.
+"""
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .benchmark import percentil
+from .models import Accion, Contenido
+
+PERFILES = {
+    'antes': 'PRAGMA journal_mode=DELETE; PRAGMA synchronous=FULL',
+    'despues': settings.PRAGMAS_SQLITE,
+}
+
+
+def _conectar(ruta, pragmas, espera):
+    # Sin transacción implícita: las escrituras abren BEGIN IMMEDIATE como la aplicación
+    conexion = sqlite3.connect(ruta, timeout=espera, isolation_level=None, check_same_thread=False)
+    for pragma in pragmas.split(';'):
+        if pragma.strip():
+            conexion.execute(pragma)
+    return conexion
+
+
+class _Resultados:
+    def __init__(self):
+        self.candado = threading.Lock()
+        self.tiempos = {'escritura': [], 'lectura': []}
+        self.errores = {'escritura': 0, 'lectura': 0}
+
+    def agregar(self, clase, inicio, error=False):
+        duracion = (time.perf_counter() - inicio) * 1000
+        with self.candado:
+            if error:
+                self.errores[clase] += 1
+            else:
+                self.tiempos[clase].append(duracion)
+
+    def resumen(self, duracion):
+        resumen = {}
+        for clase, tiempos in self.tiempos.items():
+            resumen[clase] = {
+                'por_segundo': round(len(tiempos) / duracion, 1),
+                'errores': self.errores[clase],
+                'p50_ms': round(statistics.median(tiempos), 2) if tiempos else 0,
+                'p95_ms': round(percentil(tiempos, 95), 2) if tiempos else 0,
+                'max_ms': round(max(tiempos), 2) if tiempos else 0,
+            }
+        return resumen
+
+
+def _sql():
+    tabla = f'"{Accion._meta.db_table}"'
+    intermedia = f'"{Accion.objetosAfectados.through._meta.db_table}"'
+    contenido = f'"{Contenido._meta.db_table}"'
+    return {
+        'accion': f'INSERT INTO {tabla} (cajon_id, tipo, descripcion, fecha_hora) VALUES (?, ?, ?, ?)',
+        'objeto': f'INSERT INTO {intermedia} (accion_id, objeto_id) VALUES (?, ?)',
+        'pagina': f'SELECT id, tipo, descripcion, fecha_hora, cajon_id FROM {tabla} ORDER BY fecha_hora DESC, id DESC LIMIT 20',
+        'caja': f'SELECT COUNT(*) FROM {tabla} WHERE cajon_id = ?',
+        'ids': f'SELECT cajon_id, objeto_id FROM {contenido} LIMIT 1',
+    }
+
+
+def _escritor(ruta, pragmas, espera, fin, resultados, sql, cajon_id, objeto_id):
+    conexion = _conectar(ruta, pragmas, espera)
+    try:
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            try:
+                conexion.execute('BEGIN IMMEDIATE')
+                cursor = conexion.execute(sql['accion'], (
+                    cajon_id, 'visualizar_caja', 'Prueba de bloqueos',
+                    datetime.now(timezone.utc).isoformat(sep=' ').replace('+00:00', ''),
+                ))
+                conexion.execute(sql['objeto'], (cursor.lastrowid, objeto_id))
+                conexion.execute('COMMIT')
+                resultados.agregar('escritura', inicio)
+            except sqlite3.OperationalError:
+                if conexion.in_transaction:
+                    conexion.execute('ROLLBACK')
+                resultados.agregar('escritura', inicio, error=True)
+    finally:
+        conexion.close()
+
+
+def _lector(ruta, pragmas, espera, fin, resultados, sql, cajon_id):
+    conexion = _conectar(ruta, pragmas, espera)
+    try:
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            try:
+                conexion.execute(sql['pagina']).fetchall()
+                conexion.execute(sql['caja'], (cajon_id,)).fetchone()
+                resultados.agregar('lectura', inicio)
+            except sqlite3.OperationalError:
+                resultados.agregar('lectura', inicio, error=True)
+    finally:
+        conexion.close()
+
+
+def medir(ruta, pragmas, escritores, lectores, segundos, espera):
+    """
+    Lanza los hilos durante `segundos` sobre la base de datos de `ruta` con los PRAGMA dados
+    """
+    sql = _sql()
+    conexion = _conectar(ruta, pragmas, espera)
+    cajon_id, objeto_id = conexion.execute(sql['ids']).fetchone()
+    conexion.close()
+
+    resultados = _Resultados()
+    fin = time.perf_counter() + segundos
+    hilos = [
+        threading.Thread(target=_escritor, args=(ruta, pragmas, espera, fin, resultados, sql, cajon_id, objeto_id))
+        for _ in range(escritores)
+    ] + [
+        threading.Thread(target=_lector, args=(ruta, pragmas, espera, fin, resultados, sql, cajon_id))
+        for _ in range(lectores)
+    ]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados.resumen(time.perf_counter() - inicio)
+
+
+def ejecutar(origen, escritores=4, lectores=8, segundos=5.0, espera=2.0, perfiles=('antes', 'despues'), progreso=None):
+    """
+    Copia la base de datos `origen` y la mide con cada perfil. Devuelve {perfil: métricas}
+    """
+    directorio = tempfile.mkdtemp(prefix='bloqueos-')
+    try:
+        ruta = os.path.join(directorio, 'copia.sqlite3')
+        fuente = sqlite3.connect(origen)
+        copia = sqlite3.connect(ruta)
+        try:
+            fuente.backup(copia)
+        finally:
+            copia.close()
+            fuente.close()
+
+        resultados = {}
+        for perfil in perfiles:
+            # El modo del diario queda guardado en el archivo: se fija antes de cada medición
+            _conectar(ruta, PERFILES[perfil], espera).close()
+            resultados[perfil] = medir(ruta, PERFILES[perfil], escritores, lectores, segundos, espera)
+            if progreso:
+                progreso(perfil, resultados[perfil])
+        return resultados
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
@@ -0,0 +1,160 @@
+"""
+Generador de datos sintéticos reproducibles (cajas, objetos, su relación y acciones)
+para las pruebas y las mediciones de rendimiento. Con la misma semilla y los mismos
+parámetros genera siempre los mismos datos. Los objetos se reparten sin pasar del
+volumen de ninguna caja, como las altas de la aplicación.
+"""
+import random
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .bitacora import crear_en_bloque
+from .inventario import recalcular_ocupacion
+from .models import Cajon, Contenido, Objeto, Accion
+from . import busqueda, parecidos, resumenes
+
+# Número de objetos de cada escala de los benchmarks
+ESCALAS = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+SUSTANTIVOS = [
+    'cable', 'cargador', 'camiseta', 'pantalón', 'calcetín', 'libreta', 'lápiz', 'tijeras',
+    'destornillador', 'martillo', 'muñeca', 'pelota', 'teclado', 'ratón', 'router', 'cámara',
+    'bufanda', 'grapadora', 'linterna', 'pilas', 'peine', 'cepillo', 'taladro', 'rompecabezas',
+]
+ADJETIVOS = [
+    'rojo', 'azul', 'negro', 'blanco', 'viejo', 'nuevo', 'grande', 'pequeño', 'usb', 'hdmi',
+    'de repuesto', 'roto', 'de viaje', 'infantil', 'eléctrico', 'plegable',
+]
+TIPOS = [valor for valor, _ in Objeto._meta.get_field('tipo').choices]
+TAMANIOS = [valor for valor, _ in Objeto._meta.get_field('tamanio').choices]
+
+# Cajas al azar que se prueban para un objeto que no cabe en la suya antes de recorrerlas todas
+INTENTOS_CAJA = 20
+
+
+class ErrorDatos(Exception):
+    pass
+
+
+def _caja_con_sitio(rng, caja_ids, libre, volumen):
+    """
+    Una caja con al menos `volumen` libre: primero al azar y si no, la primera que quede
+    """
+    for _ in range(INTENTOS_CAJA):
+        caja_id = rng.choice(caja_ids)
+        if libre[caja_id] >= volumen:
+            return caja_id
+    for caja_id in caja_ids:
+        if libre[caja_id] >= volumen:
+            return caja_id
+    raise ErrorDatos('Las cajas no tienen sitio para todos los objetos; use más cajas (objetos_por_caja menor)')
+
+
+def generar(objetos=1000, objetos_por_caja=20, proporcion_duplicados=0.05, dias_historial=365,
+            semilla=42, lote=5000, progreso=None):
+    """
+    Crea `objetos` objetos repartidos al azar en objetos / objetos_por_caja cajas, sin
+    pasar de su capacidad, con una acción de alta por caja y por objeto. Una parte de los objetos repite el nombre,
+    tipo y tamaño de otro de su caja (duplicados). Devuelve un resumen con los totales.
+    La base de datos debe estar vacía.
+    """
+    if Cajon.objects.exists() or Objeto.objects.exists():
+        raise ErrorDatos('La base de datos ya tiene cajas u objetos; use una base de datos vacía (manage.py flush)')
+
+    rng = random.Random(semilla)
+    total_cajas = max(1, objetos // objetos_por_caja)
+    # Las acciones se reparten en el periodo, de la más antigua a la más reciente
+    inicio = timezone.now() - timedelta(days=dias_historial)
+    paso = timedelta(days=dias_historial) / max(1, total_cajas + objetos)
+    AccionObjetos = Accion.objetosAfectados.through
+
+    with transaction.atomic():
+        cajas = crear_en_bloque([
+            Cajon(nombre=f'Caja {numero + 1}', capacidadMaxima=rng.randint(objetos_por_caja, objetos_por_caja * 2))
+            for numero in range(total_cajas)
+        ])
+        crear_en_bloque([
+            Accion(
+                tipo='crear_cajon', cajon=caja, fecha_hora=inicio + paso * numero,
+                descripcion=f'Se creó la caja "{caja.nombre}" con capacidad para {caja.descripcion_capacidad}',
+            )
+            for numero, caja in enumerate(cajas)
+        ])
+
+    caja_ids = [caja.id for caja in cajas]
+    nombres_cajas = {caja.id: caja.nombre for caja in cajas}
+    libre = {caja.id: Cajon.calcular_capacidad(caja.capacidadMaxima) for caja in cajas}
+    ultimo_de_caja = {}
+    creados = 0
+    duplicados = 0
+
+    while creados < objetos:
+        cantidad = min(lote, objetos - creados)
+        nuevos = []
+        destinos = []
+        for _ in range(cantidad):
+            caja_id = rng.choice(caja_ids)
+            anterior = ultimo_de_caja.get(caja_id)
+            duplicado = anterior and rng.random() < proporcion_duplicados
+            if duplicado:
+                nombre, tipo, tamanio = anterior
+            else:
+                nombre = f'{rng.choice(SUSTANTIVOS).capitalize()} {rng.choice(ADJETIVOS)} {rng.randint(1, 9999)}'
+                tipo, tamanio = rng.choice(TIPOS), rng.choice(TAMANIOS)
+            volumen = Objeto.calcular_volumen(tamanio)
+            if libre[caja_id] < volumen:
+                # En otra caja ya no es un duplicado del último de la suya
+                caja_id = _caja_con_sitio(rng, caja_ids, libre, volumen)
+                duplicado = False
+            libre[caja_id] -= volumen
+            duplicados += bool(duplicado)
+            ultimo_de_caja[caja_id] = (nombre, tipo, tamanio)
+            nuevos.append(Objeto(
+                nombre=nombre, tipo=tipo, tamanio=tamanio,
+                clave_duplicado=Objeto.calcular_clave(nombre, tipo, tamanio),
+                rango_tamanio=Objeto.calcular_rango(tamanio),
+            ))
+            destinos.append(caja_id)
+
+        for objeto, firma in zip(nuevos, parecidos.calcular_firmas([objeto.nombre for objeto in nuevos])):
+            objeto.firma_nombre = firma
+
+        with transaction.atomic():
+            nuevos = crear_en_bloque(nuevos)
+            Contenido.objects.bulk_create([
+                Contenido.de(caja_id, objeto) for objeto, caja_id in zip(nuevos, destinos)
+            ])
+            acciones = crear_en_bloque([
+                Accion(
+                    tipo='agregar_objeto', cajon_id=caja_id, fecha_hora=inicio + paso * (total_cajas + creados + numero),
+                    descripcion=f'Se agregó el objeto "{objeto.nombre}" (tipo: {objeto.tipo}, tamaño: {objeto.tamanio}) a la caja "{nombres_cajas[caja_id]}"',
+                )
+                for numero, (objeto, caja_id) in enumerate(zip(nuevos, destinos))
+            ])
+            AccionObjetos.objects.bulk_create([
+                AccionObjetos(accion_id=accion.id, objeto_id=objeto.id) for accion, objeto in zip(acciones, nuevos)
+            ])
+
+        creados += cantidad
+        if progreso:
+            progreso(creados, objetos)
+
+    # Contadores de ocupación, resúmenes e índice de búsqueda a partir de lo creado
+    for posicion in range(0, len(caja_ids), 500):
+        recalcular_ocupacion(caja_ids[posicion:posicion + 500])
+    resumenes.reconstruir()
+    busqueda.reconstruir()
+
+    return {
+        'cajas': total_cajas,
+        'objetos': objetos,
+        'duplicados': duplicados,
+        'acciones': total_cajas + objetos,
+        'semilla': semilla,
+    }
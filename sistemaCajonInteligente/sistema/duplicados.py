@@ -0,0 +1,119 @@
+"""
+Detección y apilado de objetos duplicados (mismo nombre, tipo y tamaño) usando la clave
+normalizada guardada en Objeto.clave_duplicado.
+
+Las altas apilan las unidades iguales en una fila de Contenido, pero pueden quedar
+duplicados en filas separadas (datos anteriores, organizador, datos sintéticos). Apilarlos
+suma sus unidades a la fila del objeto más antiguo: no se pierde ninguna unidad.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, Min, Sum, Value, When
+
+from .bitacora import EntradaAccion, obtener_bitacora
+from .models import Contenido, Objeto
+from . import inventario
+
+TAMANIO_BLOQUE = 500
+
+
+def grupos_duplicados(caja, claves=None):
+    """
+    Devuelve los grupos de duplicados de la caja con una sola consulta GROUP BY ... HAVING:
+    [{'clave_duplicado', 'objetos', 'unidades', 'conservar_id',
+    'nombre_objeto', 'tipo_objeto', 'tamanio_objeto'}] (los de uno de sus objetos, para mostrarlo).
+    Con `claves` (p. ej. las de una página) solo los de esas claves, sin recorrer la caja.
+    """
+    filas = Contenido.objects.filter(cajon=caja)
+    if claves is not None:
+        filas = filas.filter(objeto__clave_duplicado__in=claves)
+    return list(
+        filas
+        .values(clave_duplicado=F('objeto__clave_duplicado'))
+        .annotate(
+            objetos=Count('id'), unidades=Sum('cantidad'), conservar_id=Min('objeto_id'),
+            nombre_objeto=Min('objeto__nombre'), tipo_objeto=Min('objeto__tipo'), tamanio_objeto=Min('objeto__tamanio'),
+        )
+        .filter(objetos__gt=1)
+        .order_by('clave_duplicado')
+    )
+
+
+def cajas_con_duplicados():
+    """
+    Ids de todas las cajas que tienen al menos un grupo de duplicados
+    """
+    return (
+        Contenido.objects.values('cajon_id', 'objeto__clave_duplicado')
+        .annotate(objetos=Count('id'))
+        .filter(objetos__gt=1)
+        .values_list('cajon_id', flat=True)
+        .distinct()
+        .order_by('cajon_id')
+    )
+
+
+def _calcular_apilado(caja):
+    """
+    Grupos de duplicados de la caja, objetos que se apilarían y objetos distintos que quedarían
+    """
+    grupos = grupos_duplicados(caja)
+    if not grupos:
+        return [], [], Contenido.objects.filter(cajon=caja).count()
+
+    # Por bloques de grupos para no superar el límite de parámetros de la consulta
+    apilados = []
+    for inicio in range(0, len(grupos), TAMANIO_BLOQUE):
+        bloque = grupos[inicio:inicio + TAMANIO_BLOQUE]
+        apilados.extend(
+            caja.objetos.filter(clave_duplicado__in=[g['clave_duplicado'] for g in bloque])
+            .exclude(id__in=[g['conservar_id'] for g in bloque])
+            .only('id', 'nombre', 'tipo', 'tamanio')
+        )
+    return grupos, apilados, Contenido.objects.filter(cajon=caja).count() - len(apilados)
+
+
+def apilar_duplicados(caja, simular=False):
+    """
+    Apila los duplicados de la caja sobre el objeto más antiguo de cada grupo, que pasa a
+    tener las unidades de todos. Los objetos apilados se eliminan si no están en otra caja.
+    Todo ocurre en una transacción con un número fijo de sentencias por bloque de grupos.
+    Con `simular` solo se calcula, sin transacción, para no tomar el bloqueo de escritura.
+    Devuelve (objetos apilados, objetos distintos que quedan en la caja).
+    """
+    if simular:
+        _, apilados, conservados = _calcular_apilado(caja)
+        return apilados, conservados
+
+    with transaction.atomic():
+        grupos, apilados, conservados = _calcular_apilado(caja)
+        if not grupos:
+            return apilados, conservados
+
+        for inicio in range(0, len(grupos), TAMANIO_BLOQUE):
+            bloque = grupos[inicio:inicio + TAMANIO_BLOQUE]
+            Contenido.objects.filter(cajon=caja, objeto_id__in=[g['conservar_id'] for g in bloque]).update(
+                cantidad=Case(*[When(objeto_id=g['conservar_id'], then=Value(g['unidades'])) for g in bloque])
+            )
+
+        ids = [objeto.id for objeto in apilados]
+        filas = []
+        huerfanos = []
+        for inicio in range(0, len(ids), TAMANIO_BLOQUE):
+            bloque = ids[inicio:inicio + TAMANIO_BLOQUE]
+            borrar = Contenido.objects.filter(cajon=caja, objeto_id__in=bloque)
+            filas.extend(borrar.values_list('id', flat=True))
+            borrar.delete()
+            huerfanos.extend(Objeto.objects.filter(id__in=bloque, contenido__isnull=True).values_list('id', flat=True))
+
+        obtener_bitacora().registrar(EntradaAccion(
+            tipo='organizar_caja',
+            cajon_id=caja.id,
+            objeto_ids=[g['conservar_id'] for g in grupos],
+            descripcion=f'Se apilaron {len(apilados)} objetos duplicados de la caja "{caja.nombre}" en {len(grupos)} objetos. Quedan {conservados} objetos distintos con las mismas unidades.'
+        ))
+
+        inventario.baja_apilados(caja.id, filas, huerfanos)
+        for inicio in range(0, len(huerfanos), TAMANIO_BLOQUE):
+            Objeto.objects.filter(id__in=huerfanos[inicio:inicio + TAMANIO_BLOQUE]).delete()
+
+    return apilados, conservados
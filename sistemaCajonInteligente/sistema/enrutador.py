@@ -0,0 +1,45 @@
+"""
+Enrutador de lecturas y escrituras. Con una réplica de MySQL configurada (alias 'replica'
+de settings.DATABASES, ver BD_REPLICA_NOMBRE) las lecturas van a la réplica y las
+escrituras a 'default'. Con SQLite no se usa.
+
+La réplica puede ir con retraso, así que se lee de 'default':
+- dentro de una transacción en 'default' (lo que se lee decide lo que se escribe),
+- en el resto de la petición después de escribir, para ver los propios cambios.
+  Fuera de una petición (comandos, hilo de la bitácora) vale para todo el hilo.
+
+Las consultas SQL directas (búsqueda, resúmenes, archivo) usan `connection`, es decir 'default'.
+"""
+import contextvars
+
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+ALIAS_REPLICA = 'replica'
+
+_escribio = contextvars.ContextVar('enrutador_escribio', default=False)
+
+
+@receiver(request_started)
+def _empezar_peticion(sender, **kwargs):
+    _escribio.set(False)
+
+
+class EnrutadorReplica:
+    def db_for_read(self, model, **hints):
+        if _escribio.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return ALIAS_REPLICA
+
+    def db_for_write(self, model, **hints):
+        _escribio.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las dos son la misma base de datos
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica recibe el esquema desde 'default' por la replicación
+        return db == DEFAULT_DB_ALIAS
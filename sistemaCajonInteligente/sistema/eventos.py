@@ -0,0 +1,249 @@
+"""
+Actividad de las cajas en vivo (server-sent events) para el historial y el detalle de una caja.
+
+La bitácora publica cada lote de acciones cuando se confirma su escritura (escribir_entradas)
+en un canal en memoria del proceso. Cada conexión se suscribe con un filtro (una caja, un
+tipo de acción) y recibe solo las acciones nuevas; el id de cada evento es el de la Accion.
+
+- Al reconectar, el navegador envía Last-Event-ID y se repiten desde la base de datos las
+  acciones posteriores, como mucho REPETICION_MAXIMA (si hay más, se pide recargar la página).
+- Cada suscripción tiene una cola acotada (TAMANIO_COLA). Si un cliente lento la llena, la
+  cola se vacía y el cliente se pone al día leyendo la base de datos por páginas de
+  REPETICION_MAXIMA, a su ritmo: un cliente lento no retiene memoria ni frena a la bitácora.
+- Tras LATIDO_SEGUNDOS sin eventos se envía un comentario, que mantiene abierta la conexión
+  en los proxies, y se consulta la base de datos desde el último id: así llegan también las
+  acciones escritas por otros procesos.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import Accion, Objeto
+
+CAMPOS_CAJA = ('nombre', 'capacidadMaxima', 'total_objetos', 'total_pequenos', 'total_medianos', 'total_grandes')
+
+
+def datos_accion(accion, caja, objetos):
+    """
+    Evento de una acción: `caja` es un dict con CAMPOS_CAJA (o None) y `objetos` una lista
+    de {id, nombre}
+    """
+    return {
+        'id': accion.id,
+        'tipo': accion.tipo,
+        'tipo_nombre': accion.get_tipo_display(),
+        'descripcion': accion.descripcion,
+        'fecha_hora': accion.fecha_hora,
+        'cajon_id': accion.cajon_id,
+        'caja': caja,
+        'objetos': objetos,
+    }
+
+
+def formatear(datos):
+    """
+    Evento SSE 'accion' con el id de la acción (el navegador lo devuelve en Last-Event-ID)
+    """
+    texto = json.dumps(datos, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return f'id: {datos["id"]}\nevent: accion\ndata: {texto}\n\n'
+
+
+class Suscripcion:
+    """
+    Eventos pendientes de una conexión. Se crea y se lee en el bucle de eventos de la
+    conexión; el canal le entrega los eventos desde cualquier hilo.
+    """
+
+    def __init__(self, cajon_id=None, tipo=None, tamanio=100):
+        self.cajon_id = cajon_id
+        self.tipo = tipo
+        self.tamanio = tamanio
+        self.bucle = asyncio.get_running_loop()
+        self.pendientes = deque()
+        self.aviso = asyncio.Event()
+        self.desbordada = False
+        self.desbordes = 0
+
+    def acepta(self, datos):
+        return (
+            (self.cajon_id is None or datos['cajon_id'] == self.cajon_id)
+            and (self.tipo is None or datos['tipo'] == self.tipo)
+        )
+
+    def _recibir(self, eventos):
+        if len(self.pendientes) + len(eventos) > self.tamanio:
+            # Cliente lento: se descarta lo pendiente y se pondrá al día con la base de datos
+            self.pendientes.clear()
+            self.desbordada = True
+            self.desbordes += 1
+        else:
+            self.pendientes.extend(eventos)
+        self.aviso.set()
+
+    async def esperar(self, segundos):
+        """
+        Eventos recibidos, esperando hasta `segundos` (lista vacía si no llega ninguno)
+        """
+        try:
+            await asyncio.wait_for(self.aviso.wait(), segundos)
+        except asyncio.TimeoutError:
+            pass
+        self.aviso.clear()
+        eventos = list(self.pendientes)
+        self.pendientes.clear()
+        return eventos
+
+
+class Canal:
+    """
+    Reparte los eventos publicados entre las suscripciones de este proceso
+    """
+
+    def __init__(self):
+        self._suscripciones = set()
+        self._candado = threading.Lock()
+        self.publicados = 0
+        self.desbordes = 0
+
+    def suscribir(self, cajon_id=None, tipo=None):
+        suscripcion = Suscripcion(cajon_id, tipo, settings.EVENTOS['TAMANIO_COLA'])
+        with self._candado:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._candado:
+            if suscripcion in self._suscripciones:
+                self._suscripciones.discard(suscripcion)
+                self.desbordes += suscripcion.desbordes
+
+    def lleno(self):
+        return len(self._suscripciones) >= settings.EVENTOS['MAXIMO_SUSCRIPCIONES']
+
+    def hay_suscripciones(self):
+        return bool(self._suscripciones)
+
+    def publicar(self, eventos):
+        """
+        Entrega a cada suscripción los eventos que le interesan (se llama desde cualquier hilo)
+        """
+        with self._candado:
+            suscripciones = list(self._suscripciones)
+        self.publicados += len(eventos)
+        for suscripcion in suscripciones:
+            propios = [datos for datos in eventos if suscripcion.acepta(datos)]
+            if not propios:
+                continue
+            try:
+                suscripcion.bucle.call_soon_threadsafe(suscripcion._recibir, propios)
+            except RuntimeError:
+                # El bucle de la conexión ya se cerró
+                self.cancelar(suscripcion)
+
+    def estadisticas(self):
+        return {
+            'suscripciones': len(self._suscripciones),
+            'publicados': self.publicados,
+            'desbordes': self.desbordes,
+        }
+
+
+canal = Canal()
+
+
+def publicar_acciones(acciones, entradas, cajas, objetos):
+    """
+    Publica las acciones recién escritas de las entradas de la bitácora. `cajas` es
+    {id: dict con CAMPOS_CAJA} y `objetos` {id: nombre}, leídos al escribirlas.
+    """
+    canal.publicar([
+        datos_accion(
+            accion,
+            cajas.get(accion.cajon_id),
+            [{'id': objeto_id, 'nombre': objetos[objeto_id]} for objeto_id in entrada.objeto_ids if objeto_id in objetos],
+        )
+        for accion, entrada in zip(acciones, entradas)
+    ])
+
+
+def acciones_posteriores(ultimo_id=None, desde=None, cajon_id=None, tipo=None, limite=None):
+    """
+    Eventos de las acciones posteriores a `ultimo_id` (o, sin id, desde la fecha `desde`),
+    en orden de id. Devuelve (eventos, completos): completos es False si había más de `limite`.
+    """
+    limite = limite or settings.EVENTOS['REPETICION_MAXIMA']
+    acciones = Accion.objects.all()
+    if ultimo_id is not None:
+        acciones = acciones.filter(id__gt=ultimo_id)
+    elif desde is not None:
+        acciones = acciones.filter(fecha_hora__gte=desde)
+    else:
+        return [], True
+    if cajon_id is not None:
+        acciones = acciones.filter(cajon_id=cajon_id)
+    if tipo:
+        acciones = acciones.filter(tipo=tipo)
+
+    acciones = list(
+        acciones.select_related('cajon')
+        .prefetch_related(Prefetch('objetosAfectados', queryset=Objeto.objects.only('id', 'nombre')))
+        .order_by('id')[:limite + 1]
+    )
+    eventos = [
+        datos_accion(
+            accion,
+            {campo: getattr(accion.cajon, campo) for campo in CAMPOS_CAJA} if accion.cajon else None,
+            [{'id': objeto.id, 'nombre': objeto.nombre} for objeto in accion.objetosAfectados.all()],
+        )
+        for accion in acciones[:limite]
+    ]
+    return eventos, len(acciones) <= limite
+
+
+async def flujo(ultimo_id=None, desde=None, cajon_id=None, tipo=None):
+    """
+    Texto del flujo SSE de una conexión: primero las acciones que se perdió (desde
+    `ultimo_id` o la fecha `desde`) y después las nuevas según se publican
+    """
+    opciones = settings.EVENTOS
+    posteriores = sync_to_async(acciones_posteriores)
+    suscripcion = canal.suscribir(cajon_id, tipo)
+    if ultimo_id is None and desde is None:
+        # Sin punto de partida: las acciones desde ahora (para ponerse al día si hace falta)
+        desde = timezone.now()
+    try:
+        # Con la suscripción ya activa no se pierde nada entre la consulta y los eventos
+        eventos, completos = await posteriores(ultimo_id, desde, cajon_id, tipo)
+        yield f'retry: {opciones["REINTENTO_MS"]}\n\n'
+        if not completos:
+            # Demasiadas acciones perdidas para repetirlas una a una
+            yield 'event: recargar\ndata: {}\n\n'
+            return
+
+        while True:
+            for datos in eventos:
+                # Las acciones ya enviadas (consulta y evento a la vez) se omiten
+                if ultimo_id is None or datos['id'] > ultimo_id:
+                    ultimo_id = datos['id']
+                    yield formatear(datos)
+
+            if not completos:
+                # Poniéndose al día: la página siguiente se lee cuando el cliente recibió esta
+                eventos, completos = await posteriores(ultimo_id, desde, cajon_id, tipo)
+                continue
+
+            eventos = await suscripcion.esperar(opciones['LATIDO_SEGUNDOS'])
+            if suscripcion.desbordada or not eventos:
+                suscripcion.desbordada = False
+                if not eventos:
+                    yield ': latido\n\n'
+                eventos, completos = await posteriores(ultimo_id, desde, cajon_id, tipo)
+    finally:
+        canal.cancelar(suscripcion)
@@ -0,0 +1,217 @@
+"""
+Exportación de los objetos (con sus cajas) y del historial completo de acciones, incluidas
+las archivadas, en CSV o NDJSON (una línea JSON por fila).
+
+Los datos se leen por lotes de TAMANIO_LOTE filas con paginación por clave: cada lote es
+una consulta corta más otra a la tabla intermedia para sus relaciones, y se escribe antes
+de leer el siguiente. Así la memoria no depende del número de filas, la primera parte (la
+cabecera) sale enseguida y no queda una lectura abierta durante toda la descarga, que en
+SQLite impediría escribir a la bitácora mientras el cliente descarga.
+"""
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .models import Contenido, Objeto, Accion
+from .paginacion import filtrar_despues
+from . import archivo
+
+AccionObjetos = Accion.objetosAfectados.through
+
+TAMANIO_LOTE = 1000
+
+TIPOS_CONTENIDO = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# Columnas del CSV; las listas de relaciones ({id, nombre}) ocupan dos columnas: ids y nombres.
+# La cantidad de un objeto son sus unidades en todas sus cajas.
+COLUMNAS_CSV = {
+    'objetos': ['id', 'nombre', 'tipo', 'tamanio', 'imagen', 'cantidad', 'cajas', 'nombres_cajas'],
+    'acciones': ['id', 'fecha_hora', 'tipo', 'cajon_id', 'cajon', 'descripcion', 'archivada',
+                 'objetos', 'nombres_objetos'],
+}
+
+
+def _por_lotes(consulta, campos, tamanio):
+    """
+    Lotes de `tamanio` filas (diccionarios de .values()) en el orden de `campos`, uno por consulta
+    """
+    ultimo = None
+    while True:
+        lote = list(filtrar_despues(consulta, campos, ultimo).order_by(*campos)[:tamanio])
+        if not lote:
+            return
+        yield lote
+        if len(lote) < tamanio:
+            return
+        ultimo = [lote[-1][campo] for campo in campos]
+
+
+def _relacionados(filas, campo, id_relacionado, nombre, cantidad=None):
+    """
+    {id: [{'id', 'nombre'}]} de los relacionados de todas las filas del lote en una sola
+    consulta a la tabla intermedia (sin instanciar modelos, como un prefetch por lote).
+    Con `cantidad` (campo de la tabla intermedia) cada relacionado lleva también 'cantidad'.
+    """
+    relacionados = {}
+    columnas = [campo, id_relacionado, nombre] + ([cantidad] if cantidad else [])
+    for propio, otro, texto, *unidades in filas.order_by(id_relacionado).values_list(*columnas):
+        relacionado = {'id': otro, 'nombre': texto}
+        if unidades:
+            relacionado['cantidad'] = unidades[0]
+        relacionados.setdefault(propio, []).append(relacionado)
+    return relacionados
+
+
+def objetos(cajon_id=None, tipo=None, tamanio=None, tamanio_lote=TAMANIO_LOTE):
+    """
+    Lotes de filas (diccionarios) de los objetos con sus cajas y unidades, por id
+    """
+    consulta = Objeto.objects.values('id', 'nombre', 'tipo', 'tamanio', 'imagen')
+    if cajon_id is not None:
+        consulta = consulta.filter(cajones=cajon_id)
+    if tipo:
+        consulta = consulta.filter(tipo=tipo)
+    if tamanio:
+        consulta = consulta.filter(tamanio=tamanio)
+
+    for lote in _por_lotes(consulta, ['id'], tamanio_lote):
+        cajas = _relacionados(
+            Contenido.objects.filter(objeto_id__in=[fila['id'] for fila in lote]),
+            'objeto_id', 'cajon_id', 'cajon__nombre', cantidad='cantidad',
+        )
+        for fila in lote:
+            fila['imagen'] = fila['imagen'] or ''
+            fila['cantidad'] = sum(caja['cantidad'] for caja in cajas.get(fila['id'], []))
+            fila['cajas'] = cajas.get(fila['id'], [])
+        yield lote
+
+
+def acciones(cajon_id=None, tipo=None, inicio=None, fin=None, tamanio_lote=TAMANIO_LOTE):
+    """
+    Lotes de filas de las acciones en orden (fecha_hora, id): primero las archivadas, que
+    son las más antiguas, y después las de la base de datos. Fechas en [inicio, fin).
+    """
+    lote = []
+    for registro in archivo.recorrer(cajon_id=cajon_id, tipo=tipo, inicio=inicio, fin=fin):
+        lote.append({
+            'id': registro['id'],
+            'fecha_hora': registro['fecha'],
+            'tipo': registro['tipo'],
+            'cajon_id': registro['cajon_id'],
+            'cajon': registro['cajon'],
+            'descripcion': registro['descripcion'] or '',
+            'archivada': True,
+            'objetos': [{'id': objeto_id, 'nombre': nombre} for objeto_id, nombre in registro['objetos']],
+        })
+        if len(lote) >= tamanio_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+    consulta = Accion.objects.values('id', 'fecha_hora', 'tipo', 'cajon_id', 'cajon__nombre', 'descripcion')
+    if cajon_id is not None:
+        consulta = consulta.filter(cajon_id=cajon_id)
+    if tipo:
+        consulta = consulta.filter(tipo=tipo)
+    if inicio:
+        consulta = consulta.filter(fecha_hora__gte=inicio)
+    if fin:
+        consulta = consulta.filter(fecha_hora__lt=fin)
+
+    for lote in _por_lotes(consulta, ['fecha_hora', 'id'], tamanio_lote):
+        objetos_afectados = _relacionados(
+            AccionObjetos.objects.filter(accion_id__in=[fila['id'] for fila in lote]),
+            'accion_id', 'objeto_id', 'objeto__nombre',
+        )
+        yield [
+            {
+                'id': fila['id'],
+                'fecha_hora': archivo._fecha_texto(fila['fecha_hora']),
+                'tipo': fila['tipo'],
+                'cajon_id': fila['cajon_id'],
+                'cajon': fila['cajon__nombre'],
+                'descripcion': fila['descripcion'] or '',
+                'archivada': False,
+                'objetos': objetos_afectados.get(fila['id'], []),
+            }
+            for fila in lote
+        ]
+
+
+EXPORTACIONES = {
+    'objetos': objetos,
+    'acciones': acciones,
+}
+
+
+def _aplanar(fila):
+    valores = []
+    for valor in fila.values():
+        if isinstance(valor, list):
+            valores.append(';'.join(str(elemento['id']) for elemento in valor))
+            valores.append(';'.join(elemento['nombre'] for elemento in valor))
+        else:
+            valores.append('' if valor is None else valor)
+    return valores
+
+
+def a_csv(lotes, columnas):
+    """
+    Partes del CSV: la cabecera y después una por lote
+    """
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(columnas)
+    yield salida.getvalue()
+    for lote in lotes:
+        salida.seek(0)
+        salida.truncate()
+        escritor.writerows(_aplanar(fila) for fila in lote)
+        yield salida.getvalue()
+
+
+def a_ndjson(lotes):
+    """
+    Partes del NDJSON, una por lote
+    """
+    for lote in lotes:
+        yield ''.join(json.dumps(fila, ensure_ascii=False) + '\n' for fila in lote)
+
+
+def exportar(que, formato, **filtros):
+    """
+    Partes (texto) de la exportación `que` ('objetos' o 'acciones') en `formato` ('csv' o 'ndjson')
+    """
+    lotes = EXPORTACIONES[que](**filtros)
+    if formato == 'csv':
+        return a_csv(lotes, COLUMNAS_CSV[que])
+    return a_ndjson(lotes)
+
+
+async def _en_hilo(partes):
+    # Con ASGI, Django acumularía un iterador síncrono completo antes de enviarlo; se
+    # recorre parte a parte en el hilo de la petición (donde está su conexión)
+    fin = object()
+    siguiente = sync_to_async(next)
+    while (parte := await siguiente(partes, fin)) is not fin:
+        yield parte
+
+
+def respuesta(request, que, formato, **filtros):
+    """
+    StreamingHttpResponse con la exportación, como archivo adjunto
+    """
+    partes = exportar(que, formato, **filtros)
+    if isinstance(request, ASGIRequest):
+        partes = _en_hilo(partes)
+    resultado = StreamingHttpResponse(partes, content_type=TIPOS_CONTENIDO[formato])
+    resultado['Content-Disposition'] = f'attachment; filename="{que}.{formato}"'
+    return resultado
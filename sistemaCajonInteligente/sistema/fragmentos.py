@@ -0,0 +1,80 @@
+"""
+Caché del contenido calculado de detalle_caja (primera página de objetos y sugerencias de duplicados).
+
+La clave incluye la versión de la caja (Cajon.version), que se incrementa en cada
+cambio de su contenido (ver sistema/inventario.py). Así nunca se sirve un contenido
+desactualizado y las versiones viejas simplemente caducan o se desalojan por tamaño
+(MAX_ENTRIES del backend de caché configurado en settings.CACHES['fragmentos']).
+
+Se guarda el contexto calculado y no el HTML: la página incluye formularios con el
+token CSRF de cada usuario.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+ALIAS_CACHE = 'fragmentos'
+
+_candado = threading.Lock()
+_contadores = {'aciertos': 0, 'fallos': 0}
+
+
+def _contar(nombre):
+    with _candado:
+        _contadores[nombre] += 1
+
+
+def clave_detalle(caja, orden):
+    return f'detalle_caja:{caja.id}:{orden}:{caja.version}'
+
+
+def obtener_detalle(caja, orden, calcular):
+    """
+    Devuelve el contenido de la caja para el orden dado, calculándolo con
+    `calcular(caja, orden)` solo si no está en caché para la versión actual
+    """
+    cache = caches[ALIAS_CACHE]
+    clave = clave_detalle(caja, orden)
+
+    contenido = cache.get(clave)
+    if contenido is not None:
+        _contar('aciertos')
+        return contenido
+
+    _contar('fallos')
+    contenido = calcular(caja, orden)
+    cache.set(clave, contenido)
+    return contenido
+
+
+async def aobtener_detalle(caja, orden, calcular):
+    """
+    obtener_detalle() para las vistas asíncronas; `calcular` es síncrona y se ejecuta en un hilo
+    """
+    cache = caches[ALIAS_CACHE]
+    clave = clave_detalle(caja, orden)
+
+    contenido = await cache.aget(clave)
+    if contenido is not None:
+        _contar('aciertos')
+        return contenido
+
+    _contar('fallos')
+    contenido = await sync_to_async(calcular)(caja, orden)
+    await cache.aset(clave, contenido)
+    return contenido
+
+
+def estadisticas():
+    """
+    Aciertos y fallos de la caché en este proceso
+    """
+    with _candado:
+        aciertos, fallos = _contadores['aciertos'], _contadores['fallos']
+    total = aciertos + fallos
+    return {
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'tasa_aciertos': round(aciertos / total, 3) if total else 0,
+    }
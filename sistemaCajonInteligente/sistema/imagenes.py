@@ -0,0 +1,152 @@
+"""
+Procesamiento de las fotos de los objetos fuera de la petición: se reescalan, se
+quitan los metadatos EXIF, se recodifican a un formato compacto y se genera una
+miniatura. Los archivos se nombran por el hash de su contenido, así dos fotos
+idénticas comparten el mismo archivo en disco.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+from .models import Objeto
+from .similitud import calcular_dhash
+from . import clasificador, inventario, similitud
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+
+
+def opciones_imagenes():
+    return dict(settings.IMAGENES)
+
+
+def _guardar(imagen, ruta, opciones):
+    """
+    Guarda la imagen sin metadatos en un archivo temporal y lo mueve a su sitio
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    imagen.save(temporal, format=opciones['FORMATO'], quality=opciones['CALIDAD'], optimize=True)
+    os.replace(temporal, ruta)
+
+
+def procesar_archivo(ruta_original, media_root, opciones):
+    """
+    Procesa una foto y devuelve los nombres relativos a MEDIA_ROOT de la imagen
+    recodificada y su miniatura, junto con el hash del contenido original y el
+    hash perceptual.
+    No usa la base de datos, así que puede ejecutarse en otro proceso.
+    """
+    contenido_hash = hashlib.sha256()
+    with open(ruta_original, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+            contenido_hash.update(bloque)
+    contenido_hash = contenido_hash.hexdigest()
+
+    extension = EXTENSIONES[opciones['FORMATO']]
+    nombre_imagen = f'objetos/{contenido_hash[:2]}/{contenido_hash}.{extension}'
+    nombre_miniatura = f'objetos/miniaturas/{contenido_hash[:2]}/{contenido_hash}.{extension}'
+    ruta_imagen = os.path.join(media_root, nombre_imagen)
+    ruta_miniatura = os.path.join(media_root, nombre_miniatura)
+
+    # Si ya se procesó una foto idéntica se reutilizan sus archivos
+    if os.path.exists(ruta_imagen) and os.path.exists(ruta_miniatura):
+        # El hash perceptual se calcula sobre la miniatura, que es pequeña
+        with Image.open(ruta_miniatura) as miniatura:
+            phash = calcular_dhash(miniatura)
+    else:
+        with Image.open(ruta_original) as original:
+            # Aplicar la orientación del EXIF antes de descartarlo
+            imagen = ImageOps.exif_transpose(original).convert('RGB')
+
+        lado = opciones['LADO_MAXIMO']
+        imagen.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+        _guardar(imagen, ruta_imagen, opciones)
+
+        lado = opciones['TAMANIO_MINIATURA']
+        imagen.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+        _guardar(imagen, ruta_miniatura, opciones)
+        phash = calcular_dhash(imagen)
+
+    return {
+        'imagen_hash': contenido_hash,
+        'imagen_phash': phash,
+        'imagen': nombre_imagen,
+        'miniatura': nombre_miniatura,
+    }
+
+
+def aplicar_resultado(objeto_id, nombre_original, resultado):
+    """
+    Guarda en el objeto los archivos procesados y borra la foto original si ya nadie la usa
+    """
+    actualizados = Objeto.objects.filter(id=objeto_id, imagen=nombre_original).update(**resultado)
+
+    if actualizados:
+        similitud.registrar_hash(objeto_id, resultado['imagen_phash'])
+        inventario.invalidar_cajas_de([objeto_id])
+        try:
+            clasificador.indexar(objeto_id, os.path.join(str(settings.MEDIA_ROOT), resultado['miniatura']))
+        except Exception:
+            logger.exception('Error al añadir al clasificador la foto del objeto %s', objeto_id)
+
+    if actualizados and nombre_original != resultado['imagen']:
+        if not Objeto.objects.filter(imagen=nombre_original).exists():
+            default_storage.delete(nombre_original)
+
+
+def procesar_objeto(objeto_id):
+    """
+    Procesa la foto de un objeto (si tiene y aún no está procesada)
+    """
+    objeto = Objeto.objects.filter(id=objeto_id).only('id', 'imagen', 'imagen_hash').first()
+    if objeto is None or not objeto.imagen or objeto.imagen_hash:
+        return
+
+    nombre_original = objeto.imagen.name
+    resultado = procesar_archivo(default_storage.path(nombre_original), str(settings.MEDIA_ROOT), opciones_imagenes())
+    aplicar_resultado(objeto_id, nombre_original, resultado)
+
+
+def _procesar_en_hilo(objeto_id):
+    close_old_connections()
+    try:
+        procesar_objeto(objeto_id)
+    except Exception:
+        logger.exception('Error al procesar la imagen del objeto %s', objeto_id)
+    finally:
+        close_old_connections()
+
+
+_ejecutor = None
+_candado = threading.Lock()
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    if _ejecutor is None:
+        with _candado:
+            if _ejecutor is None:
+                _ejecutor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGENES['HILOS'],
+                    thread_name_prefix='imagenes',
+                )
+    return _ejecutor
+
+
+def encolar(objeto_id):
+    """
+    Programa el procesamiento de la foto de un objeto. Con IMAGENES['SINCRONO'] se procesa en el momento.
+    """
+    if settings.IMAGENES['SINCRONO']:
+        procesar_objeto(objeto_id)
+    else:
+        _obtener_ejecutor().submit(_procesar_en_hilo, objeto_id)
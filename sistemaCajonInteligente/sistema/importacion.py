@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .bitacora import EntradaAccion, obtener_bitacora
+from .models import Cajon, Objeto
+from . import inventario
+
+TIPOS_VALIDOS = {valor for valor, _ in Objeto._meta.get_field('tipo').choices}
+TAMANIOS_VALIDOS = {valor for valor, _ in Objeto._meta.get_field('tamanio').choices}
+
+
+class ResultadoImportacion:
+    """
+    Acumula las estadísticas de una importación (filas, objetos creados, errores y tiempo)
+    """
+
+    # Máximo de errores que se guardan con detalle, para no crecer sin límite
+    MAX_ERRORES = 1000
+
+    def __init__(self):
+        self.filas = 0
+        self.creados = 0
+        self.total_errores = 0
+        self.errores = []
+        self.inicio = time.monotonic()
+        self.duracion = 0.0
+
+    def agregar_error(self, fila, mensaje):
+        self.total_errores += 1
+        if len(self.errores) < self.MAX_ERRORES:
+            self.errores.append((fila, mensaje))
+
+    def terminar(self):
+        self.duracion = time.monotonic() - self.inicio
+
+    @property
+    def filas_por_segundo(self):
+        return round(self.filas / self.duracion, 1) if self.duracion > 0 else 0
+
+
+def detectar_formato(nombre_archivo):
+    """
+    Deduce el formato (csv o ndjson) a partir de la extensión del archivo
+    """
+    nombre = (nombre_archivo or '').lower()
+    if nombre.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return 'csv'
+
+
+def leer_filas(archivo_texto, formato):
+    """
+    Genera (número de fila, diccionario) leyendo el archivo línea a línea, sin cargarlo completo
+    """
+    if formato == 'ndjson':
+        for numero, linea in enumerate(archivo_texto, start=1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                yield numero, None
+                continue
+            yield numero, fila if isinstance(fila, dict) else None
+    else:
+        lector = csv.DictReader(archivo_texto)
+        # La fila 1 es la cabecera
+        for numero, fila in enumerate(lector, start=2):
+            yield numero, fila
+
+
+def validar_fila(fila):
+    """
+    Valida una fila y devuelve (datos, error). Usa las mismas opciones de tipo y tamaño que el modelo.
+    """
+    if fila is None:
+        return None, 'Fila con formato inválido'
+
+    nombre = str(fila.get('nombre') or '').strip()
+    tipo = str(fila.get('tipo') or '').strip().lower()
+    tamanio = str(fila.get('tamanio') or 'mediano').strip().lower()
+    caja = str(fila.get('caja') or '').strip()
+
+    if not nombre or not tipo or not caja:
+        return None, 'Faltan campos requeridos (nombre, tipo, caja)'
+    if len(nombre) > Objeto._meta.get_field('nombre').max_length:
+        return None, 'El nombre es demasiado largo'
+    if tipo not in TIPOS_VALIDOS:
+        return None, f'Tipo de objeto inválido: "{tipo}"'
+    if tamanio not in TAMANIOS_VALIDOS:
+        return None, f'Tamaño inválido: "{tamanio}"'
+    try:
+        caja_id = int(caja)
+    except ValueError:
+        return None, f'Identificador de caja inválido: "{caja}"'
+
+    return {'nombre': nombre, 'tipo': tipo, 'tamanio': tamanio, 'caja_id': caja_id}, None
+
+
+def _guardar_lote(lote, resultado):
+    """
+    Escribe un lote de filas válidas en una sola transacción: reserva de sitio, objetos, filas
+    de la relación caja-objeto y datos derivados. Las filas que no caben en su caja se
+    rechazan y las iguales a un objeto de la caja se apilan sobre él.
+    Se registra una acción por caja con sus objetos afectados.
+    """
+    cajas = Cajon.objects.in_bulk({datos['caja_id'] for _, datos in lote})
+
+    filas_por_caja = {}
+    for numero, datos in lote:
+        if datos['caja_id'] not in cajas:
+            resultado.agregar_error(numero, f'La caja {datos["caja_id"]} no existe')
+            continue
+        filas_por_caja.setdefault(datos['caja_id'], []).append((numero, Objeto(
+            nombre=datos['nombre'],
+            tipo=datos['tipo'],
+            tamanio=datos['tamanio'],
+        )))
+
+    if not filas_por_caja:
+        return
+
+    with transaction.atomic():
+        # Sitio en cada caja (un UPDATE condicional por caja en el lote) para las primeras
+        # filas que quepan
+        objetos_por_caja = {}
+        for caja_id, filas in filas_por_caja.items():
+            admitidas = inventario.reservar(caja_id, [objeto for _, objeto in filas], parcial=True)
+            for numero, _ in filas[admitidas:]:
+                resultado.agregar_error(numero, f'La caja {caja_id} está llena')
+            if admitidas:
+                objetos_por_caja[caja_id] = [objeto for _, objeto in filas[:admitidas]]
+
+        if not objetos_por_caja:
+            return
+
+        # Objetos y filas de Contenido; los iguales a uno de la caja se apilan sobre él
+        for caja_id, objetos_caja in objetos_por_caja.items():
+            inventario.guardar_reservados(caja_id, objetos_caja)
+
+        # Una acción por caja en el lote, con todos sus objetos afectados
+        obtener_bitacora().registrar_varias([
+            EntradaAccion(
+                tipo='agregar_objeto',
+                cajon_id=caja_id,
+                objeto_ids=list(dict.fromkeys(objeto.id for objeto in objetos_caja)),
+                descripcion=f'Se importaron {len(objetos_caja)} objetos a la caja "{cajas[caja_id].nombre}"'
+            )
+            for caja_id, objetos_caja in objetos_por_caja.items()
+        ])
+
+    resultado.creados += sum(len(objetos_caja) for objetos_caja in objetos_por_caja.values())
+
+
+def importar_objetos(archivo_texto, formato='csv', tamanio_lote=None):
+    """
+    Importa objetos desde un archivo de texto (CSV o NDJSON) en lotes.
+    Cada lote se guarda en su propia transacción, así un error no deshace lo ya importado.
+    """
+    tamanio_lote = tamanio_lote or settings.IMPORTACION_TAMANIO_LOTE
+    resultado = ResultadoImportacion()
+    lote = []
+
+    for numero, fila in leer_filas(archivo_texto, formato):
+        resultado.filas += 1
+        datos, error = validar_fila(fila)
+        if error:
+            resultado.agregar_error(numero, error)
+            continue
+
+        lote.append((numero, datos))
+        if len(lote) >= tamanio_lote:
+            _guardar_lote(lote, resultado)
+            lote = []
+
+    if lote:
+        _guardar_lote(lote, resultado)
+
+    resultado.terminar()
+    return resultado
+
+
+def importar_archivo_subido(archivo, formato=None, tamanio_lote=None):
+    """
+    Importa desde un archivo subido (request.FILES), leyéndolo como flujo de texto
+    """
+    formato = formato or detectar_formato(archivo.name)
+    archivo.seek(0)
+    texto = io.TextIOWrapper(archivo.file, encoding='utf-8-sig', newline='')
+    try:
+        return importar_objetos(texto, formato, tamanio_lote)
+    finally:
+        # Evitar que el wrapper cierre el archivo subido
+        texto.detach()
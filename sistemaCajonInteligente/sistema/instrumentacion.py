@@ -0,0 +1,392 @@
+"""
+Medición del tiempo de cada petición: consultas y tiempo en la base de datos, tiempo
+de renderizado de plantillas, tiempo de la vista y secciones marcadas en el código
+(p. ej. el registro de acciones). Se configura en settings.INSTRUMENTACION.
+
+- Cabecera Server-Timing con los tiempos, visible en las herramientas del navegador.
+  Solo se envía a usuarios staff o con DEBUG: describe las consultas y secciones internas.
+- Histogramas por vista en ventanas de tiempo, consultables en /instrumentacion/ (solo staff).
+- Las peticiones más lentas que UMBRAL_LENTO_MS se escriben en el logger
+  'sistema.instrumentacion.lentas' como JSON, con sus consultas más lentas.
+
+Solo se mide la fracción MUESTREO de las peticiones (por defecto ninguna); con ACTIVA = False
+o MUESTREO = 0 el middleware se desactiva por completo. Funciona con WSGI y con ASGI: la medición en curso va en una
+variable de contexto, que también ven los hilos de sync_to_async donde se hacen las consultas.
+"""
+import contextvars
+import functools
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as PlantillaDjango
+
+logger_lentas = logging.getLogger('sistema.instrumentacion.lentas')
+
+# Límites superiores (ms) de los intervalos de los histogramas
+LIMITES_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+_medicion_actual = contextvars.ContextVar('medicion_actual', default=None)
+_orden = itertools.count()
+
+
+class Medicion:
+    """
+    Tiempos acumulados durante una petición (en segundos)
+    """
+
+    def __init__(self, consultas_guardadas):
+        self.consultas = 0
+        self.tiempo_bd = 0.0
+        self.tiempo_plantillas = 0.0
+        self.secciones = {}
+        self._consultas_guardadas = consultas_guardadas
+        # Montículo con las consultas más lentas: (duración, orden, sql)
+        self.mas_lentas = []
+
+    def registrar_consulta(self, sql, duracion):
+        self.consultas += 1
+        self.tiempo_bd += duracion
+        if self._consultas_guardadas:
+            elemento = (duracion, next(_orden), sql)
+            if len(self.mas_lentas) < self._consultas_guardadas:
+                heapq.heappush(self.mas_lentas, elemento)
+            elif duracion > self.mas_lentas[0][0]:
+                heapq.heapreplace(self.mas_lentas, elemento)
+
+    def consultas_lentas(self):
+        return [
+            {'ms': round(duracion * 1000, 3), 'sql': sql[:1000]}
+            for duracion, _, sql in sorted(self.mas_lentas, reverse=True)
+        ]
+
+
+def _medir_consulta(ejecutar, sql, params, many, contexto):
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        return ejecutar(sql, params, many, contexto)
+    inicio = time.perf_counter()
+    try:
+        return ejecutar(sql, params, many, contexto)
+    finally:
+        medicion.registrar_consulta(sql, time.perf_counter() - inicio)
+
+
+def _agregar_medicion(conexion):
+    if _medir_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(_medir_consulta)
+
+
+def _al_crear_conexion(sender, connection, **kwargs):
+    _agregar_medicion(connection)
+
+
+def _al_empezar_peticion(sender, **kwargs):
+    for conexion in connections.all(initialized_only=True):
+        _agregar_medicion(conexion)
+
+
+def _instalar_medicion_consultas():
+    """
+    Instala el contador de consultas en cada conexión nueva y, al empezar cada petición,
+    en las ya abiertas del hilo. Con ASGI las consultas se hacen en los hilos de
+    sync_to_async (cada uno con su conexión) y request_started se envía en ese mismo
+    hilo, así que no basta con envolver las conexiones del hilo que recibe la petición.
+    Fuera de una petición medida el contador no hace nada.
+    """
+    connection_created.connect(_al_crear_conexion, dispatch_uid='instrumentacion_consultas')
+    request_started.connect(_al_empezar_peticion, dispatch_uid='instrumentacion_consultas')
+
+
+@contextmanager
+def medir_seccion(nombre):
+    """
+    Suma al tiempo de la sección `nombre` de la petición en curso (si se está midiendo)
+    """
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion.secciones[nombre] = medicion.secciones.get(nombre, 0.0) + time.perf_counter() - inicio
+
+
+def _instalar_medicion_plantillas():
+    """
+    Envuelve el renderizado de plantillas del backend de Django (solo el de nivel
+    superior: los {% include %} quedan dentro de su tiempo)
+    """
+    original = PlantillaDjango.render
+    if getattr(original, 'instrumentado', False):
+        return
+
+    @functools.wraps(original)
+    def render(self, context=None, request=None):
+        medicion = _medicion_actual.get()
+        if medicion is None:
+            return original(self, context, request)
+        inicio = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            medicion.tiempo_plantillas += time.perf_counter() - inicio
+
+    render.instrumentado = True
+    PlantillaDjango.render = render
+
+
+# Histogramas
+
+class Histograma:
+    def __init__(self):
+        self.cuentas = [0] * len(LIMITES_MS)
+        self.total = 0
+        self.suma_ms = 0.0
+        self.maximo_ms = 0.0
+        self.consultas = 0
+
+    def agregar(self, ms, consultas):
+        for posicion, limite in enumerate(LIMITES_MS):
+            if ms <= limite:
+                self.cuentas[posicion] += 1
+                break
+        self.total += 1
+        self.suma_ms += ms
+        self.maximo_ms = max(self.maximo_ms, ms)
+        self.consultas += consultas
+
+    def combinar(self, otro):
+        self.cuentas = [a + b for a, b in zip(self.cuentas, otro.cuentas)]
+        self.total += otro.total
+        self.suma_ms += otro.suma_ms
+        self.maximo_ms = max(self.maximo_ms, otro.maximo_ms)
+        self.consultas += otro.consultas
+
+    def percentil(self, porcentaje):
+        """
+        Límite superior del intervalo donde cae el percentil (estimación por intervalos),
+        acotado por el máximo observado
+        """
+        objetivo = porcentaje / 100 * self.total
+        acumulado = 0
+        for limite, cuenta in zip(LIMITES_MS, self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo and cuenta:
+                return round(min(limite, self.maximo_ms), 2)
+        return 0
+
+    def resumen(self):
+        return {
+            'peticiones': self.total,
+            'media_ms': round(self.suma_ms / self.total, 2) if self.total else 0,
+            'p50_ms': self.percentil(50),
+            'p95_ms': self.percentil(95),
+            'p99_ms': self.percentil(99),
+            'max_ms': round(self.maximo_ms, 2),
+            'consultas_media': round(self.consultas / self.total, 1) if self.total else 0,
+            'intervalos': {
+                ('+inf' if limite == float('inf') else f'<={limite}'): cuenta
+                for limite, cuenta in zip(LIMITES_MS, self.cuentas)
+            },
+        }
+
+
+class HistogramasPorVista:
+    """
+    Histogramas por vista en ventanas de `duracion_ventana` segundos; se conservan las
+    últimas `ventanas` para que las estadísticas reflejen el tráfico reciente
+    """
+
+    def __init__(self, duracion_ventana, ventanas):
+        self.duracion_ventana = duracion_ventana
+        self._ventanas = deque(maxlen=ventanas)
+        self._candado = threading.Lock()
+
+    def agregar(self, vista, ms, consultas):
+        ahora = time.monotonic()
+        with self._candado:
+            if not self._ventanas or ahora - self._ventanas[-1][0] >= self.duracion_ventana:
+                self._ventanas.append((ahora, {}))
+            por_vista = self._ventanas[-1][1]
+            histograma = por_vista.get(vista)
+            if histograma is None:
+                histograma = por_vista[vista] = Histograma()
+            histograma.agregar(ms, consultas)
+
+    def resumen(self):
+        ahora = time.monotonic()
+        limite = self.duracion_ventana * self._ventanas.maxlen
+        combinados = {}
+        with self._candado:
+            for inicio, por_vista in self._ventanas:
+                if ahora - inicio > limite:
+                    continue
+                for vista, histograma in por_vista.items():
+                    combinados.setdefault(vista, Histograma()).combinar(histograma)
+        return {vista: histograma.resumen() for vista, histograma in sorted(combinados.items())}
+
+
+_histogramas = None
+_candado_histogramas = threading.Lock()
+
+
+def obtener_histogramas():
+    global _histogramas
+    if _histogramas is None:
+        with _candado_histogramas:
+            if _histogramas is None:
+                opciones = settings.INSTRUMENTACION
+                _histogramas = HistogramasPorVista(opciones['SEGUNDOS_VENTANA'], opciones['VENTANAS'])
+    return _histogramas
+
+
+def estadisticas():
+    """
+    Histogramas por vista y contadores de la caché, de la bitácora y de los eventos en
+    vivo de este proceso
+    """
+    from . import eventos, fragmentos
+    from .bitacora import obtener_bitacora
+
+    return {
+        'vistas': obtener_histogramas().resumen(),
+        'cache_fragmentos': fragmentos.estadisticas(),
+        'bitacora': obtener_bitacora().estadisticas(),
+        'eventos': eventos.canal.estadisticas(),
+    }
+
+
+# Middleware
+
+def _nombre_vista(request):
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return 'sin_vista'
+    return coincidencia.view_name or coincidencia._func_path
+
+
+def _server_timing(medicion, total, vista):
+    partes = [
+        f'bd;dur={medicion.tiempo_bd * 1000:.1f};desc="{medicion.consultas} consultas"',
+        f'plantillas;dur={medicion.tiempo_plantillas * 1000:.1f}',
+    ]
+    partes.extend(f'{nombre};dur={segundos * 1000:.1f}' for nombre, segundos in medicion.secciones.items())
+    if vista is not None:
+        partes.append(f'vista;dur={vista * 1000:.1f}')
+    partes.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(partes)
+
+
+class InstrumentacionMiddleware:
+    """
+    Debe ir el último en MIDDLEWARE para que el tiempo de la vista no incluya otros middleware
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        opciones = settings.INSTRUMENTACION
+        if not opciones['ACTIVA'] or opciones['MUESTREO'] <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.muestreo = opciones['MUESTREO']
+        self.umbral_lento = opciones['UMBRAL_LENTO_MS'] / 1000
+        self.consultas_guardadas = opciones['CONSULTAS_LENTAS']
+        self.server_timing = opciones['SERVER_TIMING']
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+            # Django pasaría un process_view síncrono a un hilo en cada petición
+            self.process_view = self._aprocess_view
+        _instalar_medicion_plantillas()
+        _instalar_medicion_consultas()
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        if self.muestreo < 1 and random.random() >= self.muestreo:
+            return self.get_response(request)
+
+        # Antes de medir: leer el usuario puede consultar la sesión
+        server_timing = self.server_timing and (settings.DEBUG or self._es_staff(getattr(request, 'user', None)))
+        medicion = Medicion(self.consultas_guardadas)
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        return self._terminar(request, response, medicion, inicio, server_timing)
+
+    async def __acall__(self, request):
+        if self.muestreo < 1 and random.random() >= self.muestreo:
+            return await self.get_response(request)
+
+        server_timing = self.server_timing and (
+            settings.DEBUG or (hasattr(request, 'auser') and self._es_staff(await request.auser()))
+        )
+        medicion = Medicion(self.consultas_guardadas)
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        return self._terminar(request, response, medicion, inicio, server_timing)
+
+    @staticmethod
+    def _es_staff(usuario):
+        return usuario is not None and usuario.is_staff
+
+    def _terminar(self, request, response, medicion, inicio, server_timing):
+        fin = time.perf_counter()
+        total = fin - inicio
+
+        # Desde process_view hasta aquí solo se ejecuta la vista (este middleware va el último)
+        inicio_vista = getattr(request, '_instrumentacion_inicio_vista', None)
+        vista = fin - inicio_vista if inicio_vista is not None else None
+
+        nombre = _nombre_vista(request)
+        obtener_histogramas().agregar(nombre, total * 1000, medicion.consultas)
+        if server_timing:
+            response['Server-Timing'] = _server_timing(medicion, total, vista)
+        if total >= self.umbral_lento:
+            _registrar_lenta(request, response, nombre, medicion, total, vista)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumentacion_inicio_vista = time.perf_counter()
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumentacion_inicio_vista = time.perf_counter()
+
+
+def _registrar_lenta(request, response, nombre, medicion, total, vista):
+    logger_lentas.warning(json.dumps({
+        'vista': nombre,
+        'metodo': request.method,
+        'ruta': request.get_full_path(),
+        'estado': response.status_code,
+        'total_ms': round(total * 1000, 2),
+        'vista_ms': round(vista * 1000, 2) if vista is not None else None,
+        'bd_ms': round(medicion.tiempo_bd * 1000, 2),
+        'consultas': medicion.consultas,
+        'plantillas_ms': round(medicion.tiempo_plantillas * 1000, 2),
+        'secciones_ms': {nombre: round(s * 1000, 2) for nombre, s in medicion.secciones.items()},
+        'consultas_lentas': medicion.consultas_lentas(),
+    }, ensure_ascii=False))
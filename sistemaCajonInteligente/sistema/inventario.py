@@ -0,0 +1,334 @@
+"""
+Mantenimiento de los datos derivados del inventario (contadores de ocupación y versión
+de cada caja, resúmenes del panel de estadísticas, índice de similitud de fotos e
+índice de búsqueda).
+
+Todas las rutas que agregan o quitan objetos de una caja deben pasar por
+alta_objetos / baja_objetos dentro de la misma transacción que el cambio.
+
+Para agregar objetos respetando la capacidad se usa agregar_objetos (o reservar y después
+guardar_reservados): la reserva es un UPDATE condicional que suma a los contadores solo si
+los objetos caben, así dos peticiones concurrentes no pueden llenar la caja de más aunque
+hayan leído la misma ocupación.
+
+Los contadores cuentan unidades: las unidades iguales de una caja (misma clave_duplicado)
+se apilan en una fila de Contenido con su cantidad. La ocupación de una caja es el volumen
+de sus unidades (pequeño 1, mediano 2, grande 4, ver Objeto.VOLUMENES_TAMANIO) y su
+capacidad es capacidadMaxima medida en objetos medianos: es la única medida de la
+capacidad, la que usan la reserva, porcentaje_ocupacion, los tramos del panel de
+estadísticas y el organizador (sistema/organizador.py).
+"""
+from collections import Counter, defaultdict
+from itertools import accumulate
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .bitacora import crear_en_bloque, invalidar_historial
+from .models import Cajon, Contenido, Objeto
+from . import busqueda, parecidos, resumenes, similitud
+
+# Campo contador de Cajon para cada tamaño de objeto
+CAMPOS_TAMANIO = Cajon.CAMPOS_TAMANIO
+
+# Cajas por sentencia UPDATE (límite de variables de SQLite)
+TAMANIO_BLOQUE = 500
+
+# Cajas candidatas que se prueban al redirigir a otra caja, e intentos de una reserva
+# parcial cuando otra petición ocupa el sitio entre la lectura y el UPDATE
+CANDIDATAS_REDIRIGIR = 5
+INTENTOS_RESERVA = 3
+
+
+class CajaLlena(Exception):
+    """
+    No hay sitio para los objetos en la caja (ni en otra, si se pidió redirigir)
+    """
+
+
+def _cambios_contadores(por_tamanio):
+    """
+    Argumentos de update() que suman por_tamanio ({tamanio: n}) a los contadores de
+    ocupación e incrementan la versión
+    """
+    cambios = {
+        'total_objetos': F('total_objetos') + sum(por_tamanio.values()),
+        'version': F('version') + 1,
+    }
+    for tamanio, cantidad in por_tamanio.items():
+        campo = CAMPOS_TAMANIO.get(tamanio)
+        if campo and cantidad:
+            cambios[campo] = F(campo) + cantidad
+    return cambios
+
+
+def _aplicar_deltas(deltas):
+    """
+    Suma (o resta) a los contadores de cada caja con UPDATE ... SET campo = campo + n,
+    de forma atómica aunque haya peticiones concurrentes, e incrementa su versión.
+    Las cajas con los mismos cambios se actualizan con una sola sentencia.
+    deltas: {cajon_id: Counter({(tipo, tamanio): n})}
+    """
+    grupos = defaultdict(list)
+    for cajon_id, cambios in deltas.items():
+        por_tamanio = Counter()
+        for (_, tamanio), cantidad in cambios.items():
+            por_tamanio[tamanio] += cantidad
+        grupos[tuple(sorted((t, n) for t, n in por_tamanio.items() if n))].append(cajon_id)
+
+    for cambios_tamanio, cajon_ids in grupos.items():
+        cambios = _cambios_contadores(dict(cambios_tamanio))
+        for inicio in range(0, len(cajon_ids), TAMANIO_BLOQUE):
+            Cajon.objects.filter(id__in=cajon_ids[inicio:inicio + TAMANIO_BLOQUE]).update(**cambios)
+
+    resumenes.registrar_cambios(deltas)
+
+
+def alta_cajas(cajas):
+    """
+    Registra cajas nuevas
+    """
+    resumenes.registrar_cajas(cajas)
+
+
+def baja_cajas(cajas):
+    """
+    Registra que las cajas (ya vacías) se van a eliminar con sus acciones
+    """
+    resumenes.quitar_cajas(cajas)
+    invalidar_historial()
+
+
+def alta_objetos(cajon_id, objetos):
+    """
+    Registra que los objetos se agregaron a la caja
+    """
+    _aplicar_deltas({cajon_id: Counter((objeto.tipo, objeto.tamanio) for objeto in objetos)})
+    busqueda.indexar(cajon_id, objetos)
+
+
+def _volumenes(objetos):
+    return [Objeto.calcular_volumen(objeto.tamanio) for objeto in objetos]
+
+
+def reservar(cajon_id, objetos, parcial=False):
+    """
+    Reserva sitio en la caja para los objetos (aún sin guardar): suma a los contadores con
+    un UPDATE condicional (volumen ocupado + volumen de los objetos <= capacidad) que solo
+    afecta a la fila si caben. Sin `parcial` es todo o nada; con `parcial` reserva para los
+    primeros que quepan. Devuelve cuántos objetos (los primeros de la lista) tienen sitio.
+    """
+    # Volumen acumulado de los primeros 1, 2, ... objetos
+    acumulado = list(accumulate(_volumenes(objetos)))
+    cantidad = len(objetos)
+    for _ in range(INTENTOS_RESERVA if parcial else 1):
+        if parcial:
+            libre = (
+                Cajon.objects.filter(id=cajon_id)
+                .annotate(libre=Cajon.volumen_libre())
+                .values_list('libre', flat=True)
+                .first()
+            )
+            cantidad = sum(1 for volumen in acumulado if volumen <= (libre or 0))
+        if not cantidad:
+            return 0
+        cambios = _cambios_contadores(Counter(objeto.tamanio for objeto in objetos[:cantidad]))
+        reservadas = (
+            Cajon.objects.alias(libre=Cajon.volumen_libre())
+            .filter(id=cajon_id, libre__gte=acumulado[cantidad - 1])
+            .update(**cambios)
+        )
+        if reservadas:
+            return cantidad
+    return 0
+
+
+def reservar_en_otra(objetos, excluir):
+    """
+    Reserva sitio para todos los objetos en la caja con menos volumen libre que los admita,
+    distinta de `excluir`. Devuelve el id de la caja o None si no cabe en ninguna.
+    """
+    candidatas = (
+        Cajon.objects.exclude(id=excluir)
+        .annotate(libre=Cajon.volumen_libre())
+        .filter(libre__gte=sum(_volumenes(objetos)))
+        .order_by('libre', 'id')
+        .values_list('id', flat=True)[:CANDIDATAS_REDIRIGIR]
+    )
+    # Otra petición puede llenar una candidata entre la consulta y la reserva: se pasa a la siguiente
+    for cajon_id in candidatas:
+        if reservar(cajon_id, objetos):
+            return cajon_id
+    return None
+
+
+def guardar_reservados(cajon_id, objetos):
+    """
+    Guarda en la caja objetos nuevos (una unidad cada uno) cuyo sitio ya se reservó y
+    registra los datos derivados. Los iguales a uno que ya está en la caja (misma
+    clave_duplicado) o a otro de la lista se apilan: se suma a la cantidad de su fila y el
+    objeto recibe el id del que ya estaba. Devuelve los objetos que se crearon.
+    """
+    for objeto in objetos:
+        # bulk_create no llama a save(), los campos calculados se asignan aquí
+        objeto.clave_duplicado = Objeto.calcular_clave(objeto.nombre, objeto.tipo, objeto.tamanio)
+        objeto.rango_tamanio = Objeto.calcular_rango(objeto.tamanio)
+
+    # La reserva bloquea la fila de la caja (en SQLite, la base de datos) hasta el final de
+    # la transacción: otra petición no puede crear a la vez la misma clave en esta caja.
+    # Si ya hay varias filas con la clave (duplicados sin apilar) se usa la más antigua.
+    existentes = dict(
+        Contenido.objects.filter(cajon_id=cajon_id, objeto__clave_duplicado__in={objeto.clave_duplicado for objeto in objetos})
+        .order_by('-objeto_id')
+        .values_list('objeto__clave_duplicado', 'objeto_id')
+    )
+    primeros = {}
+    for objeto in objetos:
+        if objeto.clave_duplicado not in existentes:
+            primeros.setdefault(objeto.clave_duplicado, objeto)
+    nuevos = list(primeros.values())
+    for objeto, firma in zip(nuevos, parecidos.calcular_firmas([objeto.nombre for objeto in nuevos])):
+        objeto.firma_nombre = firma
+    nuevos = crear_en_bloque(nuevos)
+    for objeto in objetos:
+        objeto.id = existentes.get(objeto.clave_duplicado) or primeros[objeto.clave_duplicado].id
+
+    unidades = Counter(objeto.id for objeto in objetos)
+    Contenido.objects.bulk_create([
+        Contenido.de(cajon_id, objeto, unidades[objeto.id]) for objeto in nuevos
+    ])
+    # Una sentencia por cada número de unidades distinto
+    por_unidades = defaultdict(list)
+    for objeto_id in set(existentes.values()) & set(unidades):
+        por_unidades[unidades[objeto_id]].append(objeto_id)
+    for cantidad, objeto_ids in por_unidades.items():
+        Contenido.objects.filter(cajon_id=cajon_id, objeto_id__in=objeto_ids).update(cantidad=F('cantidad') + cantidad)
+
+    resumenes.registrar_cambios({cajon_id: Counter((objeto.tipo, objeto.tamanio) for objeto in objetos)})
+    busqueda.indexar(cajon_id, nuevos)
+    return nuevos
+
+
+def agregar_objetos(cajon_id, objetos, redirigir=False):
+    """
+    Guarda los objetos nuevos en la caja si caben todos, en una transacción: reserva,
+    objetos, filas de Contenido (apilando los iguales) y datos derivados. Si no caben y
+    `redirigir` es cierto se guardan en otra caja con sitio. Devuelve (id de la caja donde
+    quedaron, objetos creados); lanza CajaLlena si no hay sitio.
+    """
+    with transaction.atomic():
+        if not reservar(cajon_id, objetos):
+            otra = reservar_en_otra(objetos, cajon_id) if redirigir else None
+            if otra is None:
+                raise CajaLlena(f'No hay sitio para {len(objetos)} objeto(s) en la caja')
+            cajon_id = otra
+        nuevos = guardar_reservados(cajon_id, objetos)
+    return cajon_id, nuevos
+
+
+def quitar_unidades(cajon_id, objeto, unidades=1):
+    """
+    Quita unidades de un objeto apilado en la caja, si le quedan más. Devuelve False (sin
+    cambiar nada) si no tiene más de `unidades`: entonces se elimina el objeto entero.
+    """
+    quitadas = (
+        Contenido.objects.filter(cajon_id=cajon_id, objeto_id=objeto.id, cantidad__gt=unidades)
+        .update(cantidad=F('cantidad') - unidades)
+    )
+    if quitadas:
+        _aplicar_deltas({cajon_id: Counter({(objeto.tipo, objeto.tamanio): -unidades})})
+    return bool(quitadas)
+
+
+def baja_apilados(cajon_id, fila_ids, objeto_ids):
+    """
+    Registra que las unidades de las filas de Contenido `fila_ids` (ya borradas) se sumaron a
+    otras iguales de la caja y que los objetos `objeto_ids`, sin otra fila, se van a eliminar:
+    la ocupación no cambia, solo la versión de la caja.
+    """
+    Cajon.objects.filter(id=cajon_id).update(version=F('version') + 1)
+    invalidar_historial()
+    similitud.quitar_objetos(objeto_ids)
+    busqueda.quitar_filas(fila_ids)
+
+
+def baja_objetos(objeto_ids):
+    """
+    Registra que los objetos se van a eliminar: descuenta de todas las cajas que los contienen.
+    Debe llamarse antes de borrarlos, mientras existen las filas de la relación.
+    """
+    filas = (
+        Contenido.objects.filter(objeto_id__in=objeto_ids)
+        .values('cajon_id', 'objeto__tipo', 'objeto__tamanio')
+        .annotate(cantidad=Sum('cantidad'))
+    )
+
+    deltas = defaultdict(Counter)
+    for fila in filas:
+        deltas[fila['cajon_id']][fila['objeto__tipo'], fila['objeto__tamanio']] -= fila['cantidad']
+    _aplicar_deltas(deltas)
+    # Al borrarlos desaparecen sus filas en las acciones que los afectaron
+    invalidar_historial()
+    similitud.quitar_objetos(objeto_ids)
+    busqueda.quitar(objeto_ids)
+
+
+def mover_objetos(objeto_ids, origenes, destinos, tipos, tamanios, filas_borradas=()):
+    """
+    Registra que los objetos pasaron de la caja origenes[i] a destinos[i]. `filas_borradas`
+    son los ids de las filas de Contenido que se borraron al moverlos.
+    """
+    deltas = defaultdict(Counter)
+    for origen, destino, tipo, tamanio in zip(origenes, destinos, tipos, tamanios):
+        deltas[origen][tipo, tamanio] -= 1
+        deltas[destino][tipo, tamanio] += 1
+    _aplicar_deltas(deltas)
+    busqueda.actualizar(objeto_ids, filas_borradas)
+
+
+def invalidar_cajas_de(objeto_ids):
+    """
+    Incrementa la versión de las cajas que contienen los objetos, para cambios
+    que no alteran la ocupación (p. ej. la foto de un objeto ya procesada)
+    """
+    Cajon.objects.filter(objetos__id__in=objeto_ids).update(version=F('version') + 1)
+
+
+def recalcular_ocupacion(cajon_ids, reparar=True):
+    """
+    Recalcula los contadores de las cajas indicadas a partir de las unidades de Contenido.
+    Devuelve una lista (caja, guardado, real) con las cajas cuyos contadores no coincidían.
+    """
+    diferencias = []
+
+    with transaction.atomic():
+        cajas = Cajon.objects.select_for_update().filter(id__in=cajon_ids)
+        cambio_por_caja = {}
+
+        reales = defaultdict(dict)
+        filas = (
+            Contenido.objects.filter(cajon_id__in=cajon_ids)
+            .values('cajon_id', 'objeto__tamanio')
+            .annotate(cantidad=Sum('cantidad'))
+        )
+        for fila in filas:
+            reales[fila['cajon_id']][fila['objeto__tamanio']] = fila['cantidad']
+
+        for caja in cajas:
+            por_tamanio = reales[caja.id]
+            esperado = {'total_objetos': sum(por_tamanio.values())}
+            for tamanio, campo in CAMPOS_TAMANIO.items():
+                esperado[campo] = por_tamanio.get(tamanio, 0)
+
+            guardado = {campo: getattr(caja, campo) for campo in esperado}
+            if guardado != esperado:
+                diferencias.append((caja, guardado, esperado))
+                if reparar:
+                    Cajon.objects.filter(id=caja.id).update(version=F('version') + 1, **esperado)
+                    cambio_por_caja[caja.id] = Counter({
+                        tamanio: esperado[campo] - guardado[campo] for tamanio, campo in CAMPOS_TAMANIO.items()
+                    })
+
+        resumenes.actualizar_tramos(cambio_por_caja)
+
+    return diferencias
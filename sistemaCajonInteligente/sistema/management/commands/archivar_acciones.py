@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema import archivo
+
+
+class Command(BaseCommand):
+    help = 'Mueve las acciones antiguas a segmentos mensuales comprimidos y las borra de la base de datos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None,
+                            help=f'Archiva las acciones con más días (por defecto {settings.ARCHIVO_ACCIONES["DIAS"]})')
+        parser.add_argument('--bloque', type=int, default=None, help='Acciones por bloque y por transacción')
+        parser.add_argument('--simular', action='store_true', help='Solo cuenta las acciones que se archivarían')
+        parser.add_argument('--compactar', action='store_true', help='Después, reescribe los meses con bloques pequeños')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            total = archivo.archivar(
+                dias=options['dias'],
+                tamanio_bloque=options['bloque'],
+                simular=options['simular'],
+                progreso=lambda archivadas: self.stdout.write(f'{archivadas} acciones archivadas...'),
+            )
+            if options['simular']:
+                self.stdout.write(f'Se archivarían {total} acciones')
+                return
+            compactados = archivo.compactar(options['bloque']) if options['compactar'] else 0
+        except archivo.ErrorArchivo as error:
+            raise CommandError(str(error))
+
+        mensaje = f'{total} acciones archivadas en {time.perf_counter() - inicio:.2f} s'
+        if options['compactar']:
+            mensaje += f', {compactados} meses compactados'
+        self.stdout.write(self.style.SUCCESS(mensaje))
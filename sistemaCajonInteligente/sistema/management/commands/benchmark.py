@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from sistema.benchmark import ESCENARIOS, comparar, ejecutar, guardar_resultados, leer_resultados
+
+
+class Command(BaseCommand):
+    help = 'Mide latencia, consultas y memoria de las vistas (modifica la base de datos: usar con datos de generar_datos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=20, help='Peticiones medidas por escenario')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--escenarios', help=f'Lista separada por comas. Disponibles: {", ".join(ESCENARIOS)}')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument('--comparar', help='Resultados anteriores (JSON) con los que comparar')
+        parser.add_argument('--tolerancia', type=float, default=0.25, help='Empeoramiento de p95 permitido (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        nombres = None
+        if options['escenarios']:
+            nombres = [nombre.strip() for nombre in options['escenarios'].split(',')]
+            desconocidos = [nombre for nombre in nombres if nombre not in ESCENARIOS]
+            if desconocidos:
+                raise CommandError(f'Escenarios desconocidos: {", ".join(desconocidos)}')
+        base = leer_resultados(options['comparar']) if options['comparar'] else None
+
+        self.stdout.write(f'{"escenario":<30}{"p50 ms":>10}{"p95 ms":>10}{"máx ms":>10}{"consultas":>11}{"memoria KB":>12}')
+
+        def progreso(nombre, metricas):
+            if metricas is None:
+                self.stdout.write(f'{nombre:<30}  sin datos')
+                return
+            self.stdout.write(
+                f'{nombre:<30}{metricas["p50_ms"]:>10}{metricas["p95_ms"]:>10}{metricas["max_ms"]:>10}'
+                f'{metricas["consultas"]:>11}{metricas["memoria_pico_kb"]:>12}'
+            )
+
+        # El cliente de pruebas necesita el entorno de pruebas (ALLOWED_HOSTS con testserver)
+        setup_test_environment()
+        try:
+            resultados = ejecutar(options['iteraciones'], options['semilla'], nombres, progreso)
+        finally:
+            teardown_test_environment()
+
+        if options['salida']:
+            guardar_resultados(resultados, options['salida'])
+            self.stdout.write(f'Resultados guardados en {options["salida"]}')
+
+        if base is not None:
+            regresiones = comparar(resultados, base, options['tolerancia'])
+            if regresiones:
+                for regresion in regresiones:
+                    self.stdout.write(self.style.ERROR(regresion))
+                raise CommandError(f'{len(regresiones)} regresiones respecto a {options["comparar"]}')
+            self.stdout.write(self.style.SUCCESS(f'Sin regresiones respecto a {options["comparar"]}'))
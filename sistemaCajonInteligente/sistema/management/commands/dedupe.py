@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from sistema.duplicados import apilar_duplicados, cajas_con_duplicados
+from sistema.models import Cajon
+
+
+class Command(BaseCommand):
+    help = 'Apila los objetos duplicados de todas las cajas (sus unidades se suman al más antiguo), por lotes de cajas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Muestra lo que se apilaría sin cambiar nada')
+        parser.add_argument('--lote', type=int, default=100, help='Cajas que se cargan por consulta')
+
+    def handle(self, *args, **options):
+        ids = list(cajas_con_duplicados())
+        total_apilados = 0
+
+        for inicio in range(0, len(ids), options['lote']):
+            for caja in Cajon.objects.filter(id__in=ids[inicio:inicio + options['lote']]).order_by('id'):
+                apilados, conservados = apilar_duplicados(caja, simular=options['simular'])
+                total_apilados += len(apilados)
+                self.stdout.write(f'Caja {caja.id} "{caja.nombre}": {len(apilados)} duplicados, {conservados} objetos distintos')
+
+        verbo = 'se apilarían' if options['simular'] else 'apilados'
+        self.stdout.write(self.style.SUCCESS(f'{len(ids)} cajas con duplicados, {total_apilados} objetos {verbo}'))
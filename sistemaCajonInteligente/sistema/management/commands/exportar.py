@@ -0,0 +1,47 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from sistema.exportacion import EXPORTACIONES, TIPOS_CONTENIDO, exportar
+
+
+class Command(BaseCommand):
+    help = 'Exporta los objetos (con sus cajas) o el historial completo de acciones, incluidas las archivadas, en CSV o NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('que', choices=list(EXPORTACIONES), help='Qué exportar')
+        parser.add_argument('--formato', choices=list(TIPOS_CONTENIDO), default='csv')
+        parser.add_argument('--salida', help='Archivo de salida (por defecto la salida estándar)')
+        parser.add_argument('--caja', type=int, help='Solo los de esta caja')
+        parser.add_argument('--tipo', help='Tipo de objeto o de acción')
+        parser.add_argument('--tamanio', help='Tamaño de objeto (solo objetos)')
+        parser.add_argument('--desde', help='Fecha AAAA-MM-DD, incluida (solo acciones)')
+        parser.add_argument('--hasta', help='Fecha AAAA-MM-DD, incluida (solo acciones)')
+
+    def fecha(self, texto, dias=0):
+        if not texto:
+            return None
+        fecha = parse_date(texto)
+        if fecha is None:
+            raise CommandError(f'Fecha no válida: "{texto}" (use AAAA-MM-DD)')
+        return timezone.make_aware(datetime.combine(fecha + timedelta(days=dias), time.min))
+
+    def handle(self, *args, **options):
+        filtros = {'cajon_id': options['caja'], 'tipo': options['tipo']}
+        if options['que'] == 'objetos':
+            filtros['tamanio'] = options['tamanio']
+        else:
+            filtros['inicio'] = self.fecha(options['desde'])
+            filtros['fin'] = self.fecha(options['hasta'], dias=1)
+        partes = exportar(options['que'], options['formato'], **filtros)
+
+        if not options['salida']:
+            for parte in partes:
+                self.stdout.write(parte, ending='')
+            return
+        with open(options['salida'], 'w', encoding='utf-8', newline='') as salida:
+            for parte in partes:
+                salida.write(parte)
+        self.stderr.write(self.style.SUCCESS(f'Exportación guardada en {options["salida"]}'))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema.datos_sinteticos import ESCALAS, ErrorDatos, generar
+
+
+class Command(BaseCommand):
+    help = 'Llena una base de datos vacía con cajas, objetos y acciones sintéticos reproducibles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', choices=ESCALAS, default='1k', help='Número de objetos: 1k, 100k o 1m')
+        parser.add_argument('--objetos', type=int, help='Número exacto de objetos (en lugar de --escala)')
+        parser.add_argument('--objetos-por-caja', type=int, default=20, help='Objetos por caja en promedio')
+        parser.add_argument('--duplicados', type=float, default=0.05, help='Proporción de objetos duplicados')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--lote', type=int, default=5000, help='Objetos por transacción')
+
+    def handle(self, *args, **options):
+        objetos = options['objetos'] or ESCALAS[options['escala']]
+        inicio = time.perf_counter()
+
+        def progreso(creados, total):
+            self.stdout.write(f'{creados}/{total} objetos', ending='\r')
+            self.stdout.flush()
+
+        try:
+            resumen = generar(
+                objetos=objetos,
+                objetos_por_caja=options['objetos_por_caja'],
+                proporcion_duplicados=options['duplicados'],
+                semilla=options['semilla'],
+                lote=options['lote'],
+                progreso=progreso,
+            )
+        except ErrorDatos as e:
+            raise CommandError(str(e))
+        self.stdout.write('')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{resumen["cajas"]} cajas, {resumen["objetos"]} objetos ({resumen["duplicados"]} duplicados) '
+            f'y {resumen["acciones"]} acciones en {time.perf_counter() - inicio:.1f} s'
+        ))
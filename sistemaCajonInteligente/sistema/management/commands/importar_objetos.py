@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema.importacion import detectar_formato, importar_objetos
+
+
+class Command(BaseCommand):
+    help = 'Importa objetos de forma masiva desde un archivo CSV o NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo a importar')
+        parser.add_argument('--formato', choices=['csv', 'ndjson'], help='Formato del archivo (por defecto se deduce de la extensión)')
+        parser.add_argument('--lote', type=int, default=settings.IMPORTACION_TAMANIO_LOTE, help='Filas por transacción')
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or detectar_formato(options['archivo'])
+
+        try:
+            with open(options['archivo'], encoding='utf-8-sig', newline='') as archivo:
+                resultado = importar_objetos(archivo, formato, options['lote'])
+        except OSError as e:
+            raise CommandError(f'No se pudo abrir el archivo: {e}')
+
+        for fila, mensaje in resultado.errores:
+            self.stderr.write(f'Fila {fila}: {mensaje}')
+        if resultado.total_errores > len(resultado.errores):
+            self.stderr.write(f'... y {resultado.total_errores - len(resultado.errores)} errores más')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado.creados} objetos creados de {resultado.filas} filas '
+            f'({resultado.total_errores} con error) en {resultado.duracion:.2f} s '
+            f'- {resultado.filas_por_segundo} filas/s'
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sistema.organizador import organizar
+
+
+class Command(BaseCommand):
+    help = 'Reparte los objetos entre las cajas según su tamaño y la capacidad de cada caja'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Muestra el plan sin mover nada')
+        parser.add_argument('--reorganizar', action='store_true', help='Recolocar todos los objetos, no solo los que sobran')
+        parser.add_argument('--sin-agrupar', action='store_true', help='No agrupar los objetos por tipo')
+        parser.add_argument('--mostrar', type=int, default=20, help='Movimientos que se muestran')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        plan = organizar(
+            reorganizar=options['reorganizar'],
+            agrupar_por_tipo=not options['sin_agrupar'],
+            simular=options['simular'],
+        )
+        duracion = time.perf_counter() - inicio
+
+        for objeto_id, origen, destino in plan.movimientos(limite=options['mostrar']):
+            self.stdout.write(f'Objeto {objeto_id}: caja {origen} -> caja {destino}')
+        if len(plan) > options['mostrar']:
+            self.stdout.write(f'... y {len(plan) - options["mostrar"]} movimientos más')
+
+        self.stdout.write(
+            f'{plan.total_cajas} cajas, volumen ocupado {plan.volumen_total} de {plan.capacidad_total}'
+        )
+        verbo = 'se moverían' if options['simular'] else 'movidos'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(plan)} objetos {verbo} en {duracion:.2f} s. {plan.descripcion}'
+        ))
@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from sistema.imagenes import aplicar_resultado, opciones_imagenes, procesar_archivo
+from sistema.models import Objeto
+
+
+class Command(BaseCommand):
+    help = 'Procesa en paralelo las fotos de objetos que aún no tienen miniatura ni hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=None, help='Procesos en paralelo (por defecto, uno por CPU)')
+        parser.add_argument('--lote', type=int, default=500, help='Objetos que se leen por consulta')
+
+    def handle(self, *args, **options):
+        opciones = opciones_imagenes()
+        media_root = str(settings.MEDIA_ROOT)
+        procesados = errores = 0
+        inicio = time.monotonic()
+        ultimo_id = 0
+
+        with ProcessPoolExecutor(max_workers=options['procesos']) as ejecutor:
+            while True:
+                # Lotes por id creciente para no cargar todos los objetos en memoria
+                lote = list(
+                    Objeto.objects.filter(id__gt=ultimo_id, imagen_hash='')
+                    .exclude(imagen='').exclude(imagen__isnull=True)
+                    .order_by('id').values_list('id', 'imagen')[:options['lote']]
+                )
+                if not lote:
+                    break
+                ultimo_id = lote[-1][0]
+
+                tareas = {
+                    ejecutor.submit(procesar_archivo, default_storage.path(imagen), media_root, opciones): (objeto_id, imagen)
+                    for objeto_id, imagen in lote
+                }
+                for tarea in as_completed(tareas):
+                    objeto_id, imagen = tareas[tarea]
+                    try:
+                        aplicar_resultado(objeto_id, imagen, tarea.result())
+                        procesados += 1
+                    except Exception as e:
+                        errores += 1
+                        self.stderr.write(f'Objeto {objeto_id} ({imagen}): {e}')
+
+        duracion = time.monotonic() - inicio
+        velocidad = procesados / duracion if duracion > 0 else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{procesados} imágenes procesadas, {errores} con error en {duracion:.1f} s ({velocidad:.1f} imágenes/s)'
+        ))
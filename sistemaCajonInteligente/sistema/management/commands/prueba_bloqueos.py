@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from sistema.contencion import PERFILES, ejecutar
+
+
+class Command(BaseCommand):
+    help = 'Compara la contención de bloqueos de SQLite (escritores y lectores concurrentes) antes y después de WAL, sobre una copia de la base de datos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escritores', type=int, default=4, help='Hilos que escriben acciones')
+        parser.add_argument('--lectores', type=int, default=8, help='Hilos que leen páginas del historial')
+        parser.add_argument('--segundos', type=float, default=5.0, help='Duración de cada medición')
+        parser.add_argument('--espera', type=float, default=2.0,
+                            help='Segundos que una operación espera un bloqueo antes de fallar con "database is locked"')
+        parser.add_argument('--perfiles', default='antes,despues', help=f'Disponibles: {", ".join(PERFILES)}')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Solo para SQLite')
+        perfiles = [perfil.strip() for perfil in options['perfiles'].split(',')]
+        desconocidos = [perfil for perfil in perfiles if perfil not in PERFILES]
+        if desconocidos:
+            raise CommandError(f'Perfiles desconocidos: {", ".join(desconocidos)}')
+
+        self.stdout.write(f'{"perfil":<10}{"operación":<12}{"por s":>10}{"errores":>9}{"p50 ms":>10}{"p95 ms":>10}{"máx ms":>10}')
+
+        def progreso(perfil, metricas):
+            for clase, valores in metricas.items():
+                self.stdout.write(
+                    f'{perfil:<10}{clase:<12}{valores["por_segundo"]:>10}{valores["errores"]:>9}'
+                    f'{valores["p50_ms"]:>10}{valores["p95_ms"]:>10}{valores["max_ms"]:>10}'
+                )
+
+        ejecutar(
+            settings.DATABASES['default']['NAME'], options['escritores'], options['lectores'],
+            options['segundos'], options['espera'], perfiles, progreso,
+        )
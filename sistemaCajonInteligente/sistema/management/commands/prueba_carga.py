@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema.carga import ejecutar
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga de las vistas de lectura: WSGI con un grupo de hilos frente a ASGI, con varios niveles de concurrencia'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrencia', default='1,4,16,64', help='Clientes simultáneos, separados por comas')
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones por nivel de concurrencia')
+        parser.add_argument('--hilos', type=int, default=4, help='Hilos del servidor WSGI simulado')
+        parser.add_argument('--modos', default='wsgi,asgi', help='wsgi, asgi o ambos')
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            concurrencias = [int(valor) for valor in options['concurrencia'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrencia debe ser una lista de enteros')
+        modos = [modo.strip() for modo in options['modos'].split(',')]
+        desconocidos = [modo for modo in modos if modo not in ('wsgi', 'asgi')]
+        if desconocidos:
+            raise CommandError(f'Modos desconocidos: {", ".join(desconocidos)}')
+
+        self.stdout.write(f'{"modo":<8}{"clientes":>10}{"pet/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"máx ms":>10}{"errores":>9}')
+
+        def progreso(modo, clientes, metricas):
+            self.stdout.write(
+                f'{modo:<8}{clientes:>10}{metricas["por_segundo"]:>10}{metricas["p50_ms"]:>10}'
+                f'{metricas["p95_ms"]:>10}{metricas["max_ms"]:>10}{metricas["errores"]:>9}'
+            )
+
+        ejecutar(concurrencias, options['peticiones'], options['hilos'], options['semilla'], modos, progreso)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema.carga_clasificador import ejecutar
+
+
+class Command(BaseCommand):
+    help = 'Mide las fotos por segundo del clasificador (en el proceso y en el grupo de procesos) y su acierto con fotos sintéticas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fotos', type=int, default=2000, help='Fotos sintéticas')
+        parser.add_argument('--procesos', default='1,2,4', help='Procesos del grupo, separados por comas')
+        parser.add_argument('--lotes', default='1,8,32', help='Fotos por lote, separadas por comas')
+        parser.add_argument('--prueba', type=float, default=0.2, help='Parte de las fotos que se clasifica sin estar en el índice')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            procesos = [int(numero) for numero in options['procesos'].split(',')]
+            lotes = [int(numero) for numero in options['lotes'].split(',')]
+        except ValueError:
+            raise CommandError('--procesos y --lotes deben ser listas de números, p. ej. 1,2,4')
+
+        self.stdout.write(
+            f'{"escenario":<24}{"fotos":>7}{"segundos":>10}{"fotos/s":>9}{"lotes":>7}{"acierto tipo":>14}{"acierto tamaño":>16}'
+        )
+
+        def progreso(metricas):
+            self.stdout.write(
+                f'{metricas["escenario"]:<24}{metricas["fotos"]:>7}{metricas["segundos"]:>10}'
+                f'{metricas["fotos_por_segundo"]:>9}{metricas["lotes"] or "-":>7}'
+                f'{metricas["acierto_tipo"] or "-":>14}{metricas["acierto_tamanio"] or "-":>16}'
+            )
+
+        ejecutar(options['fotos'], procesos, lotes, options['prueba'], options['semilla'], progreso)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from sistema.carga_medios import ejecutar
+
+
+class Command(BaseCommand):
+    help = 'Prueba de una página con muchas fotos: static() frente a sistema/medios.py (caché, 304, rangos y envío por el proxy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fotos', type=int, default=200, help='Fotos de la página')
+        parser.add_argument('--conexiones', type=int, default=6, help='Peticiones simultáneas, como las conexiones de un navegador')
+        parser.add_argument('--repeticiones', type=int, default=3, help='Se toma la mejor de estas cargas de la página')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"escenario":<28}{"peticiones":>11}{"estados":>12}{"KB":>10}{"página ms":>11}{"p50 ms":>9}{"p95 ms":>9}')
+
+        def progreso(escenario, metricas):
+            estados = ','.join(map(str, metricas['estados'])) or '-'
+            self.stdout.write(
+                f'{escenario:<28}{metricas["peticiones"]:>11}{estados:>12}{metricas["kb"]:>10}'
+                f'{metricas["pagina_ms"]:>11}{metricas["p50_ms"]:>9}{metricas["p95_ms"]:>9}'
+            )
+
+        ejecutar(options['fotos'], options['conexiones'], options['repeticiones'], options['semilla'], progreso)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema.parecidos import ejecutar
+
+
+class Command(BaseCommand):
+    help = 'Mide el cálculo de firmas y la agrupación de nombres parecidos con nombres sintéticos de varios tamaños'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objetos', default='10000,100000,1000000', help='Números de objetos, separados por comas')
+        parser.add_argument('--umbral', type=float, help='Similitud mínima de los nombres (de 0 a 1)')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            cantidades = [int(cantidad) for cantidad in options['objetos'].split(',')]
+        except ValueError:
+            raise CommandError('--objetos debe ser una lista de números, p. ej. 10000,100000')
+
+        self.stdout.write(
+            f'{"objetos":>9}{"firmas s":>10}{"agrupar s":>11}{"µs/obj":>9}{"candidatas":>12}'
+            f'{"cand/obj":>10}{"grupos":>9}{"variantes":>11}'
+        )
+
+        def progreso(metricas):
+            self.stdout.write(
+                f'{metricas["objetos"]:>9}{metricas["firmas_s"]:>10}{metricas["agrupar_s"]:>11}'
+                f'{metricas["us_por_objeto"]:>9}{metricas["candidatas"]:>12}{metricas["candidatas_por_objeto"]:>10}'
+                f'{metricas["grupos"]:>9}{metricas["variantes_encontradas"]:>11}'
+            )
+
+        ejecutar(cantidades, options['umbral'], options['semilla'], progreso)
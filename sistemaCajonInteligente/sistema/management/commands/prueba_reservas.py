@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sistema.reservas import ejecutar
+
+
+class Command(BaseCommand):
+    help = 'Prueba de estrés de la reserva de sitio: varios hilos llenan a la vez cajas de prueba y se comprueba que ninguna pasa de su capacidad'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escritores', default='1,2,4,8,16', help='Niveles de concurrencia (hilos escritores), separados por comas')
+        parser.add_argument('--cajas', type=int, default=4, help='Cajas de prueba por nivel')
+        parser.add_argument('--capacidad', type=int, default=500, help='Capacidad de cada caja de prueba')
+        parser.add_argument('--lote', type=int, default=1, help='Objetos por reserva (agregados en bloque)')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            niveles = [int(nivel) for nivel in options['escritores'].split(',')]
+        except ValueError:
+            raise CommandError('--escritores debe ser una lista de números, p. ej. 1,2,4,8')
+
+        self.stdout.write(
+            f'{"escritores":>10}{"objetos":>9}{"obj/s":>9}{"rechazos":>10}{"errores":>9}'
+            f'{"p50 ms":>9}{"p95 ms":>9}{"de más":>8}{"desajustes":>12}{"perdidos":>10}'
+        )
+        fallos = []
+
+        def progreso(metricas):
+            self.stdout.write(
+                f'{metricas["escritores"]:>10}{metricas["objetos"]:>9}{metricas["objetos_por_segundo"]:>9}'
+                f'{metricas["rechazos"]:>10}{metricas["errores"]:>9}{metricas["p50_ms"]:>9}{metricas["p95_ms"]:>9}'
+                f'{metricas["cajas_de_mas"]:>8}{metricas["desajustes"]:>12}{metricas["perdidos"]:>10}'
+            )
+            if metricas['cajas_de_mas'] or metricas['desajustes'] or metricas['perdidos']:
+                fallos.append(metricas['escritores'])
+
+        ejecutar(niveles, options['cajas'], options['capacidad'], options['lote'], options['semilla'], progreso)
+        if fallos:
+            raise CommandError(f'Cajas llenadas de más o contadores incorrectos con {", ".join(map(str, fallos))} escritores')
+        self.stdout.write(self.style.SUCCESS('Ninguna caja pasó de su capacidad'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from sistema.inventario import recalcular_ocupacion
+from sistema.models import Cajon
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores de ocupación de las cajas y corrige las diferencias'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solo-revisar', action='store_true', help='Muestra las diferencias sin corregirlas')
+        parser.add_argument('--lote', type=int, default=500, help='Cajas por transacción')
+
+    def handle(self, *args, **options):
+        reparar = not options['solo_revisar']
+        ids = list(Cajon.objects.order_by('id').values_list('id', flat=True))
+        total_diferencias = 0
+
+        for inicio in range(0, len(ids), options['lote']):
+            diferencias = recalcular_ocupacion(ids[inicio:inicio + options['lote']], reparar=reparar)
+            total_diferencias += len(diferencias)
+            for caja, guardado, real in diferencias:
+                self.stdout.write(f'Caja {caja.id} "{caja.nombre}": guardado {guardado}, real {real}')
+
+        accion = 'corregidas' if reparar else 'con diferencias'
+        self.stdout.write(self.style.SUCCESS(f'{len(ids)} cajas revisadas, {total_diferencias} {accion}'))
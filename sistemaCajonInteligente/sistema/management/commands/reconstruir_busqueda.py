@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sistema import busqueda
+
+
+class Command(BaseCommand):
+    help = 'Vuelve a generar el índice de búsqueda de objetos'
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        total = busqueda.reconstruir()
+        tipo = 'FTS5' if busqueda.usa_fts() else 'en memoria'
+        self.stdout.write(self.style.SUCCESS(
+            f'Índice {tipo} reconstruido: {total} objetos en {time.perf_counter() - inicio:.2f} s'
+        ))
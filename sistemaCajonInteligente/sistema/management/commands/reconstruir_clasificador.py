@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sistema import clasificador
+
+
+class Command(BaseCommand):
+    help = 'Vuelve a calcular el índice del clasificador con las fotos y las etiquetas actuales de los objetos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, help='Procesos que calculan las características (por defecto CLASIFICADOR["PROCESOS"])')
+        parser.add_argument('--lote', type=int, default=256, help='Fotos por lote enviado a un proceso')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+
+        def progreso(hechas, total):
+            self.stdout.write(f'\r{hechas}/{total} fotos', ending='')
+
+        filas = clasificador.reconstruir(progreso, options['procesos'], options['lote'])
+        segundos = time.perf_counter() - inicio
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'Índice reconstruido: {filas} fotos en {segundos:.2f} s ({filas / segundos if segundos else 0:.1f} fotos/s)'
+        ))
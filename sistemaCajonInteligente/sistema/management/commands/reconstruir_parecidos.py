@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sistema import parecidos
+
+
+class Command(BaseCommand):
+    help = 'Vuelve a calcular las firmas de los nombres de los objetos (nombres parecidos)'
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        cambiadas = parecidos.reconstruir()
+        self.stdout.write(self.style.SUCCESS(
+            f'Firmas reconstruidas: {cambiadas} cambiadas en {time.perf_counter() - inicio:.2f} s'
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sistema import resumenes
+
+
+class Command(BaseCommand):
+    help = 'Vuelve a calcular los resúmenes del panel de estadísticas a partir del inventario y del historial'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sin-archivo', action='store_true', help='No cuenta las acciones archivadas')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        totales = resumenes.reconstruir(incluir_archivo=not options['sin_archivo'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Resúmenes reconstruidos en {time.perf_counter() - inicio:.2f} s: {totales["cajas"]} cajas, '
+            f'{totales["existencias"]} objetos, {totales["dias_con_acciones"]} días con acciones, '
+            f'{totales["filas_inventario"]} filas de altas por caja'
+        ))
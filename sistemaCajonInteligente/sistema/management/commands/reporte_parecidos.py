@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sistema.models import Objeto
+from sistema.parecidos import grupos_inventario
+
+
+class Command(BaseCommand):
+    help = 'Muestra los grupos de objetos con nombres parecidos en todo el inventario o en una caja'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--caja', type=int, help='Solo los objetos de esta caja')
+        parser.add_argument('--umbral', type=float, help='Similitud mínima de los nombres (de 0 a 1)')
+        parser.add_argument('--limite', type=int, default=50, help='Grupos que se muestran (los más grandes)')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        metricas = {}
+        grupos = grupos_inventario(options['umbral'], options['caja'], metricas)
+        duracion = time.perf_counter() - inicio
+
+        for numero, miembros in enumerate(grupos[:options['limite']], start=1):
+            objetos = Objeto.objects.filter(id__in=miembros).prefetch_related('cajones').order_by('id')
+            self.stdout.write(f'Grupo {numero} ({len(miembros)} objetos):')
+            for objeto in objetos:
+                cajas = ', '.join(caja.nombre for caja in objeto.cajones.all()) or 'sin caja'
+                self.stdout.write(f'  #{objeto.id} {objeto.nombre} [{cajas}]')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(grupos)} grupos de nombres parecidos entre {metricas["distintos"]} nombres distintos '
+            f'({metricas["candidatas"]} parejas candidatas) en {duracion:.2f} s'
+        ))
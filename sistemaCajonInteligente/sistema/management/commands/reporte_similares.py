@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sistema.models import Objeto
+from sistema.similitud import obtener_indice
+
+
+class Command(BaseCommand):
+    help = 'Muestra los grupos de objetos con fotos parecidas en todo el inventario'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--distancia', type=int, default=settings.SIMILITUD['DISTANCIA'], help='Bits distintos permitidos (de 64)')
+
+    def handle(self, *args, **options):
+        indice = obtener_indice()
+        distancia = options['distancia']
+
+        # Unir en grupos los objetos conectados por alguna pareja parecida (union-find)
+        padre = {}
+
+        def raiz(x):
+            while padre.get(x, x) != x:
+                padre[x] = padre.get(padre[x], padre[x])
+                x = padre[x]
+            return x
+
+        filas = Objeto.objects.filter(imagen_phash__isnull=False).values_list('id', 'imagen_phash')
+        for objeto_id, valor in filas.iterator(chunk_size=10000):
+            for otro_id, _ in indice.buscar(valor, distancia):
+                if otro_id != objeto_id:
+                    a, b = raiz(objeto_id), raiz(otro_id)
+                    if a != b:
+                        padre[max(a, b)] = min(a, b)
+
+        grupos = {}
+        for objeto_id in padre:
+            grupos.setdefault(raiz(objeto_id), set()).add(objeto_id)
+        for objeto_id, miembros in list(grupos.items()):
+            miembros.add(objeto_id)
+
+        for numero, miembros in enumerate(sorted(grupos.values(), key=len, reverse=True), start=1):
+            objetos = Objeto.objects.filter(id__in=miembros).prefetch_related('cajones').order_by('id')
+            self.stdout.write(f'Grupo {numero} ({len(miembros)} objetos):')
+            for objeto in objetos:
+                cajas = ', '.join(caja.nombre for caja in objeto.cajones.all()) or 'sin caja'
+                self.stdout.write(f'  #{objeto.id} {objeto.nombre} [{cajas}]')
+
+        self.stdout.write(self.style.SUCCESS(f'{len(indice)} fotos indexadas, {len(grupos)} grupos de fotos parecidas'))
@@ -0,0 +1,185 @@
+"""
+Entrega de las fotos de los objetos (MEDIA_ROOT), en lugar de django.views.static.serve.
+
+- Las fotos procesadas se nombran por el hash de su contenido (sistema/imagenes.py): ese
+  hash es su ETag y el navegador las guarda en caché sin volver a pedirlas (immutable).
+  Los demás archivos (fotos aún sin procesar) usan el SHA-256 de su contenido, calculado
+  una vez por versión del archivo, y el navegador los revalida en cada visita.
+- If-None-Match / If-Modified-Since responden 304 sin abrir el archivo.
+- Range con un solo rango responde 206 con ese tramo; con varios rangos, o con If-Range de
+  otra versión, se envía el archivo entero.
+- Con WSGI el archivo entero va en un FileResponse, que el servidor envía con sendfile
+  (wsgi.file_wrapper) sin copiarlo en Python. Con ASGI se lee por bloques en un hilo.
+- Con MEDIOS['ENVIO'] el envío se delega en el proxy de delante (X-Accel-Redirect de nginx
+  o X-Sendfile de Apache/lighttpd): Django solo resuelve la ruta y las cabeceras y el
+  proxy atiende también los rangos.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+from functools import lru_cache
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+# Nombre de las fotos procesadas: objetos/ab/<sha256>.webp (y lo mismo en miniaturas/)
+NOMBRE_CON_HASH = re.compile(r'(?:^|/)([0-9a-f]{64})\.[0-9a-z]+$')
+RANGO = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+@lru_cache(maxsize=4096)
+def _hash_contenido(ruta, modificado_ns, tamanio):
+    # La fecha y el tamaño son parte de la clave: un archivo reemplazado se vuelve a leer
+    contenido_hash = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+            contenido_hash.update(bloque)
+    return contenido_hash.hexdigest()
+
+
+def etag_archivo(nombre, ruta, info):
+    """
+    (ETag, inmutable): el hash del nombre si lo tiene o el del contenido del archivo
+    """
+    coincidencia = NOMBRE_CON_HASH.search(nombre)
+    if coincidencia:
+        return quote_etag(coincidencia.group(1)), True
+    return quote_etag(_hash_contenido(ruta, info.st_mtime_ns, info.st_size)), False
+
+
+def leer_rango(cabecera, tamanio):
+    """
+    (inicio, fin) incluidos del rango pedido. None si se envía el archivo entero (sin
+    cabecera, varios rangos o formato no válido) y False si no se puede satisfacer.
+    """
+    coincidencia = RANGO.fullmatch(cabecera.replace(' ', '')) if cabecera else None
+    if coincidencia is None or coincidencia.groups() == ('', ''):
+        return None
+    inicio, fin = coincidencia.groups()
+    if not inicio:
+        # bytes=-N: los últimos N bytes
+        longitud = int(fin)
+        return (max(0, tamanio - longitud), tamanio - 1) if longitud and tamanio else False
+    inicio = int(inicio)
+    if fin and int(fin) < inicio:
+        # Rango mal formado (el final antes del inicio): se ignora
+        return None
+    if inicio >= tamanio:
+        return False
+    return inicio, min(int(fin), tamanio - 1) if fin else tamanio - 1
+
+
+class _Tramo:
+    """
+    Parte de un archivo abierto: se leen como mucho `longitud` bytes desde `inicio`
+    """
+
+    def __init__(self, archivo, inicio, longitud):
+        archivo.seek(inicio)
+        self.archivo = archivo
+        self.restante = longitud
+
+    def read(self, tamanio=-1):
+        if tamanio < 0 or tamanio > self.restante:
+            tamanio = self.restante
+        datos = self.archivo.read(tamanio)
+        self.restante -= len(datos)
+        return datos
+
+    def close(self):
+        self.archivo.close()
+
+
+async def _bloques(archivo, tamanio_bloque):
+    # Lectura por bloques en un hilo para no bloquear el bucle de eventos (ASGI)
+    leer = sync_to_async(archivo.read, thread_sensitive=False)
+    try:
+        while bloque := await leer(tamanio_bloque):
+            yield bloque
+    finally:
+        archivo.close()
+
+
+def _cuerpo(request, archivo):
+    opciones = settings.MEDIOS
+    if isinstance(request, ASGIRequest):
+        return StreamingHttpResponse(_bloques(archivo, opciones['TAMANIO_BLOQUE']))
+    respuesta_medio = FileResponse(archivo)
+    respuesta_medio.block_size = opciones['TAMANIO_BLOQUE']
+    return respuesta_medio
+
+
+def _delegar(respuesta_medio, nombre, ruta):
+    envio = settings.MEDIOS['ENVIO']
+    if envio == 'x-accel-redirect':
+        respuesta_medio['X-Accel-Redirect'] = quote(settings.MEDIOS['PREFIJO_INTERNO'] + nombre)
+    else:
+        respuesta_medio['X-Sendfile'] = ruta
+    return respuesta_medio
+
+
+def respuesta(request, nombre):
+    """
+    Respuesta para el archivo `nombre` (relativo a MEDIA_ROOT) de una petición GET o HEAD
+    """
+    try:
+        ruta = safe_join(settings.MEDIA_ROOT, nombre)
+        info = os.stat(ruta)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('El archivo no existe')
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404('El archivo no existe')
+
+    etag, inmutable = etag_archivo(nombre, ruta, info)
+    cabeceras = {
+        'ETag': etag,
+        'Last-Modified': http_date(info.st_mtime),
+        'Cache-Control': f'public, max-age={settings.MEDIOS["CACHE_SEGUNDOS"]}, immutable' if inmutable else 'no-cache',
+        'Accept-Ranges': 'bytes',
+    }
+
+    condicional = get_conditional_response(request, etag=etag, last_modified=int(info.st_mtime))
+    if condicional is not None:
+        # 304 (o 412 con If-Match): sin abrir el archivo
+        for cabecera, valor in cabeceras.items():
+            condicional[cabecera] = valor
+        return condicional
+
+    tipo, codificacion = mimetypes.guess_type(nombre)
+    cabeceras['Content-Type'] = tipo or 'application/octet-stream'
+    if codificacion:
+        cabeceras['Content-Encoding'] = codificacion
+
+    if settings.MEDIOS['ENVIO']:
+        return _delegar(HttpResponse(headers=cabeceras), nombre, ruta)
+
+    rango = None
+    if request.headers.get('If-Range', etag) == etag:
+        rango = leer_rango(request.headers.get('Range'), info.st_size)
+    if rango is False:
+        cabeceras['Content-Range'] = f'bytes */{info.st_size}'
+        return HttpResponse(status=416, headers=cabeceras)
+
+    inicio, fin = rango or (0, info.st_size - 1)
+    cabeceras['Content-Length'] = str(fin - inicio + 1)
+    if rango:
+        cabeceras['Content-Range'] = f'bytes {inicio}-{fin}/{info.st_size}'
+
+    if request.method == 'HEAD':
+        respuesta_medio = HttpResponse(status=206 if rango else 200)
+    else:
+        archivo = open(ruta, 'rb')
+        respuesta_medio = _cuerpo(request, _Tramo(archivo, inicio, fin - inicio + 1) if rango else archivo)
+        respuesta_medio.status_code = 206 if rango else 200
+    for cabecera, valor in cabeceras.items():
+        respuesta_medio[cabecera] = valor
+    return respuesta_medio
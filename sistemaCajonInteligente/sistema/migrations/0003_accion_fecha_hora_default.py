@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0002_alter_accion_tipo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accion',
+            name='fecha_hora',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:46
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def calcular_contadores(apps, schema_editor):
+    """
+    Inicializa los contadores de ocupación de las cajas existentes
+    """
+    Cajon = apps.get_model('sistema', 'Cajon')
+    CajonObjetos = Cajon.objetos.through
+    campos = {'pequeno': 'total_pequenos', 'mediano': 'total_medianos', 'grande': 'total_grandes'}
+
+    contadores = {}
+    filas = CajonObjetos.objects.values('cajon_id', 'objeto__tamanio').annotate(cantidad=Count('id'))
+    for fila in filas:
+        caja = contadores.setdefault(fila['cajon_id'], {'total_objetos': 0})
+        caja['total_objetos'] += fila['cantidad']
+        campo = campos.get(fila['objeto__tamanio'])
+        if campo:
+            caja[campo] = caja.get(campo, 0) + fila['cantidad']
+
+    for cajon_id, valores in contadores.items():
+        Cajon.objects.filter(id=cajon_id).update(**valores)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0003_accion_fecha_hora_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cajon',
+            name='total_grandes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cajon',
+            name='total_medianos',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cajon',
+            name='total_objetos',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cajon',
+            name='total_pequenos',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0004_cajon_contadores_ocupacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accion',
+            index=models.Index(fields=['fecha_hora', 'id'], name='accion_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accion',
+            index=models.Index(fields=['cajon', 'fecha_hora', 'id'], name='accion_cajon_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accion',
+            index=models.Index(fields=['tipo', 'fecha_hora', 'id'], name='accion_tipo_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+def calcular_claves(apps, schema_editor):
+    """
+    Calcula la clave de duplicado de los objetos existentes, por lotes
+    """
+    Objeto = apps.get_model('sistema', 'Objeto')
+    lote = []
+    for objeto in Objeto.objects.only('id', 'nombre', 'tipo', 'tamanio').iterator(chunk_size=2000):
+        objeto.clave_duplicado = f"{objeto.nombre.lower().strip()}_{objeto.tipo}_{objeto.tamanio}"
+        lote.append(objeto)
+        if len(lote) >= 2000:
+            Objeto.objects.bulk_update(lote, ['clave_duplicado'])
+            lote = []
+    if lote:
+        Objeto.objects.bulk_update(lote, ['clave_duplicado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0005_accion_indices_historial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objeto',
+            name='clave_duplicado',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=210),
+        ),
+        migrations.RunPython(calcular_claves, migrations.RunPython.noop),
+    ]
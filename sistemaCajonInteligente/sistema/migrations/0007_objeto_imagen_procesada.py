@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0006_objeto_clave_duplicado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objeto',
+            name='imagen_hash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='objeto',
+            name='miniatura',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='objetos/miniaturas/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0007_objeto_imagen_procesada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objeto',
+            name='imagen_phash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
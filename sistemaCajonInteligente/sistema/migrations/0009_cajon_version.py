@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0008_objeto_imagen_phash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cajon',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+TABLA = 'sistema_busqueda'
+
+
+def crear_indice(apps, schema_editor):
+    """
+    Tabla FTS5 para la búsqueda de objetos (ver sistema/busqueda.py). Si la base de
+    datos no es SQLite o no tiene FTS5 no se crea y se usa el índice en memoria.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {TABLA} USING fts5("
+                "nombre, tipo, caja, cajon_id UNINDEXED, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3 4 5 6')"
+            )
+        except Exception:
+            return
+        # Una entrada por fila de la relación caja-objeto (rowid = id de la fila)
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {TABLA}(rowid, nombre, tipo, caja, cajon_id) "
+            "SELECT co.id, o.nombre, o.tipo, c.nombre, c.id "
+            "FROM sistema_cajon_objetos co "
+            "JOIN sistema_objeto o ON o.id = co.objeto_id "
+            "JOIN sistema_cajon c ON c.id = co.cajon_id"
+        )
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLA}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0009_cajon_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def llenar_resumenes(apps, schema_editor):
+    """
+    Resúmenes iniciales a partir de los datos existentes (ver sistema/resumenes.py)
+    """
+    from sistema.resumenes import reconstruir
+
+    reconstruir(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0010_busqueda_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionTramo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tramo', models.CharField(max_length=20, unique=True)),
+                ('cajas', models.IntegerField(default=0)),
+                ('objetos', models.IntegerField(default=0)),
+                ('capacidad', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExistenciaTipo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('tamanio', models.CharField(max_length=50)),
+                ('cantidad', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'tamanio'), name='existencia_tipo_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenAcciones',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo', models.CharField(max_length=50)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dia', 'tipo'), name='resumen_acciones_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo', models.CharField(max_length=50)),
+                ('tamanio', models.CharField(max_length=50)),
+                ('altas', models.IntegerField(default=0)),
+                ('bajas', models.IntegerField(default=0)),
+                ('cajon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='sistema.cajon')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cajon', 'dia', 'tipo', 'tamanio'), name='resumen_inventario_unico')],
+            },
+        ),
+        migrations.RunPython(llenar_resumenes, migrations.RunPython.noop),
+    ]
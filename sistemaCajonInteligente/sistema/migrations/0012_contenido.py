@@ -0,0 +1,128 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+TAMANIO_BLOQUE = 500
+
+
+def apilar_duplicados(apps, schema_editor):
+    """
+    Junta en una sola fila los objetos iguales (misma clave_duplicado) de cada caja: la fila
+    del objeto más antiguo suma las unidades de las demás, que se borran, y los objetos
+    apilados se eliminan si ya no quedan en ninguna caja. Los contadores de ocupación y los
+    resúmenes no cambian: cuentan unidades.
+    """
+    Contenido = apps.get_model('sistema', 'Contenido')
+    Objeto = apps.get_model('sistema', 'Objeto')
+
+    filas = (
+        Contenido.objects.order_by('cajon_id', 'objeto__clave_duplicado', 'objeto_id')
+        .values_list('id', 'cajon_id', 'objeto__clave_duplicado', 'objeto_id')
+    )
+    cantidades = {}
+    sobrantes = []
+    apilados = []
+    grupo = conservada = None
+    for fila_id, cajon_id, clave, objeto_id in filas.iterator(chunk_size=5000):
+        if (cajon_id, clave) == grupo:
+            cantidades[conservada] = cantidades.get(conservada, 1) + 1
+            sobrantes.append(fila_id)
+            apilados.append(objeto_id)
+        else:
+            grupo, conservada = (cajon_id, clave), fila_id
+
+    Contenido.objects.bulk_update(
+        [Contenido(id=fila_id, cantidad=cantidad) for fila_id, cantidad in cantidades.items()],
+        ['cantidad'], batch_size=TAMANIO_BLOQUE,
+    )
+    for inicio in range(0, len(sobrantes), TAMANIO_BLOQUE):
+        Contenido.objects.filter(id__in=sobrantes[inicio:inicio + TAMANIO_BLOQUE]).delete()
+    for inicio in range(0, len(apilados), TAMANIO_BLOQUE):
+        Objeto.objects.filter(id__in=apilados[inicio:inicio + TAMANIO_BLOQUE], contenido__isnull=True).delete()
+
+    # Índice de búsqueda (migración 0010, una entrada por fila): sin las filas borradas
+    tablas = schema_editor.connection.introspection.table_names()
+    if sobrantes and 'sistema_busqueda' in tablas:
+        schema_editor.execute(
+            'DELETE FROM sistema_busqueda WHERE rowid NOT IN (SELECT id FROM sistema_cajon_objetos)'
+        )
+
+
+def desapilar(apps, schema_editor):
+    """
+    Deshace el apilado: cada fila vuelve a ser una unidad y las demás unidades pasan a ser
+    copias del objeto (mismos datos y misma foto), cada una con su fila en la caja. Los
+    contadores no cambian. Las acciones registradas siguen apuntando al objeto conservado,
+    no a las copias.
+    """
+    Contenido = apps.get_model('sistema', 'Contenido')
+    Objeto = apps.get_model('sistema', 'Objeto')
+    campos = [campo.attname for campo in Objeto._meta.concrete_fields if not campo.primary_key]
+
+    apiladas = list(Contenido.objects.filter(cantidad__gt=1).order_by('id').values_list('cajon_id', 'objeto_id', 'cantidad'))
+    for inicio in range(0, len(apiladas), TAMANIO_BLOQUE):
+        bloque = apiladas[inicio:inicio + TAMANIO_BLOQUE]
+        originales = Objeto.objects.in_bulk([objeto_id for _, objeto_id, _ in bloque])
+        copias, cajas = [], []
+        for cajon_id, objeto_id, cantidad in bloque:
+            datos = {campo: getattr(originales[objeto_id], campo) for campo in campos}
+            for _ in range(cantidad - 1):
+                copias.append(Objeto(**datos))
+                cajas.append(cajon_id)
+        Objeto.objects.bulk_create(copias, batch_size=TAMANIO_BLOQUE)
+        Contenido.objects.bulk_create(
+            [Contenido(cajon_id=cajon_id, objeto_id=copia.id, cantidad=1) for cajon_id, copia in zip(cajas, copias)],
+            batch_size=TAMANIO_BLOQUE,
+        )
+    Contenido.objects.filter(cantidad__gt=1).update(cantidad=1)
+
+    # Índice de búsqueda (migración 0010): las copias también se encuentran
+    tablas = schema_editor.connection.introspection.table_names()
+    if apiladas and 'sistema_busqueda' in tablas:
+        schema_editor.execute(
+            'INSERT INTO sistema_busqueda(rowid, nombre, tipo, caja, cajon_id) '
+            'SELECT co.id, o.nombre, o.tipo, c.nombre, c.id '
+            'FROM sistema_cajon_objetos co '
+            'JOIN sistema_objeto o ON o.id = co.objeto_id '
+            'JOIN sistema_cajon c ON c.id = co.cajon_id '
+            'WHERE co.id NOT IN (SELECT rowid FROM sistema_busqueda)'
+        )
+
+
+# La relación caja-objeto pasa a un modelo intermedio explícito (Contenido) sobre la misma
+# tabla, con la cantidad de unidades apiladas. Al deshacerla cada unidad vuelve a ser un objeto.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0011_resumenes'),
+    ]
+
+    operations = [
+        # La tabla ya existe (la creó el ManyToMany automático): solo cambia el estado
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Contenido',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('cajon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sistema.cajon')),
+                        ('objeto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sistema.objeto')),
+                    ],
+                    options={
+                        'db_table': 'sistema_cajon_objetos',
+                        'unique_together': {('cajon', 'objeto')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='cajon',
+                    name='objetos',
+                    field=models.ManyToManyField(related_name='cajones', through='sistema.Contenido', to='sistema.objeto'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contenido',
+            name='cantidad',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(apilar_duplicados, desapilar),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+# Las firmas de los objetos existentes se guardan con manage.py reconstruir_parecidos;
+# mientras falten, sistema/parecidos.py las calcula al agrupar.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0012_contenido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objeto',
+            name='firma_nombre',
+            field=models.CharField(blank=True, default='', editable=False, max_length=160),
+        ),
+    ]
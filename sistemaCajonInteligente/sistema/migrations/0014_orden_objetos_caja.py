@@ -0,0 +1,69 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+RANGOS_TAMANIO = {'pequeno': 1, 'mediano': 2, 'grande': 3}
+
+
+def copiar_campos_orden(apps, schema_editor):
+    """
+    Rango del tamaño de los objetos existentes (un UPDATE por tamaño) y copia de los campos
+    de orden en las filas de Contenido
+    """
+    Objeto = apps.get_model('sistema', 'Objeto')
+    Contenido = apps.get_model('sistema', 'Contenido')
+    for tamanio, rango in RANGOS_TAMANIO.items():
+        Objeto.objects.filter(tamanio=tamanio).update(rango_tamanio=rango)
+    Objeto.objects.exclude(tamanio__in=RANGOS_TAMANIO).update(rango_tamanio=len(RANGOS_TAMANIO) + 1)
+
+    objeto = Objeto.objects.filter(id=OuterRef('objeto_id'))
+    Contenido.objects.update(
+        nombre=Subquery(objeto.values('nombre')[:1]),
+        tipo=Subquery(objeto.values('tipo')[:1]),
+        rango_tamanio=Subquery(objeto.values('rango_tamanio')[:1]),
+    )
+
+
+# detalle_caja se pagina por cursor en cada orden (nombre; tipo, nombre; tamaño, nombre).
+# Los índices están en Contenido, con una copia de los campos de orden del objeto, para
+# leer una página de la caja sin ordenar todos sus objetos.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0013_objeto_firma_nombre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objeto',
+            name='rango_tamanio',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='contenido',
+            name='nombre',
+            field=models.CharField(default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='contenido',
+            name='rango_tamanio',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='contenido',
+            name='tipo',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(copiar_campos_orden, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='contenido',
+            index=models.Index(fields=['cajon', 'nombre', 'objeto'], name='contenido_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contenido',
+            index=models.Index(fields=['cajon', 'tipo', 'nombre', 'objeto'], name='contenido_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contenido',
+            index=models.Index(fields=['cajon', 'rango_tamanio', 'nombre', 'objeto'], name='contenido_tamanio_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+def crear_version(apps, schema_editor):
+    """
+    La única fila de VersionHistorial, que bitacora.invalidar_historial incrementa
+    """
+    VersionHistorial = apps.get_model('sistema', 'VersionHistorial')
+    VersionHistorial.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0014_orden_objetos_caja'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionHistorial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(crear_version, migrations.RunPython.noop),
+    ]
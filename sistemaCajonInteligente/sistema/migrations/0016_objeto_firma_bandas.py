@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:58
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sistema', '0015_version_historial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 1, 8), name='objeto_firma_banda0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 9, 8), name='objeto_firma_banda1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 17, 8), name='objeto_firma_banda2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 25, 8), name='objeto_firma_banda3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 33, 8), name='objeto_firma_banda4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 41, 8), name='objeto_firma_banda5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 49, 8), name='objeto_firma_banda6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 57, 8), name='objeto_firma_banda7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 65, 8), name='objeto_firma_banda8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 73, 8), name='objeto_firma_banda9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 81, 8), name='objeto_firma_banda10_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 89, 8), name='objeto_firma_banda11_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 97, 8), name='objeto_firma_banda12_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 105, 8), name='objeto_firma_banda13_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 113, 8), name='objeto_firma_banda14_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 121, 8), name='objeto_firma_banda15_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 129, 8), name='objeto_firma_banda16_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 137, 8), name='objeto_firma_banda17_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 145, 8), name='objeto_firma_banda18_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objeto',
+            index=models.Index(django.db.models.functions.text.Substr('firma_nombre', 153, 8), name='objeto_firma_banda19_idx'),
+        ),
+    ]
@@ -1,11 +1,85 @@
 from django.db import models
+from django.db.models.functions import Substr
+from django.utils import timezone
+
+# Bandas de Objeto.firma_nombre (sistema/parecidos.py): una clave de 8 caracteres
+# hexadecimales por banda, cada una con su índice
+BANDAS_FIRMA = 20
 
 
 # Create your models here.
 class Cajon(models.Model):
     nombre = models.CharField(max_length=100)
     capacidadMaxima = models.IntegerField()
-    objetos = models.ManyToManyField('Objeto', related_name='cajones')
+    # Cada fila de la relación (Contenido) guarda las unidades iguales apiladas
+    objetos = models.ManyToManyField('Objeto', related_name='cajones', through='Contenido')
+
+    # Contadores de ocupación (en unidades), mantenidos por sistema/inventario.py. La
+    # ocupación es el volumen de esas unidades según su tamaño (Objeto.VOLUMENES_TAMANIO)
+    total_objetos = models.PositiveIntegerField(default=0)
+    total_pequenos = models.PositiveIntegerField(default=0)
+    total_medianos = models.PositiveIntegerField(default=0)
+    total_grandes = models.PositiveIntegerField(default=0)
+    # Se incrementa con cada cambio del contenido; invalida la caché de detalle_caja
+    version = models.PositiveIntegerField(default=0)
+
+    # Contador de ocupación de cada tamaño de objeto
+    CAMPOS_TAMANIO = {
+        'pequeno': 'total_pequenos',
+        'mediano': 'total_medianos',
+        'grande': 'total_grandes',
+    }
+
+    @staticmethod
+    def calcular_capacidad(capacidad_maxima):
+        """
+        Capacidad en volumen: capacidadMaxima cuenta objetos medianos
+        """
+        return max(capacidad_maxima, 0) * Objeto.calcular_volumen('mediano')
+
+    @staticmethod
+    def calcular_volumen_ocupado(por_tamanio):
+        """
+        Volumen que ocupan las unidades de cada tamaño ({tamanio: unidades})
+        """
+        return sum(cantidad * Objeto.calcular_volumen(tamanio) for tamanio, cantidad in por_tamanio.items())
+
+    @classmethod
+    def volumen_libre(cls):
+        """
+        Expresión SQL del volumen libre de la caja según sus contadores (negativo si
+        está sobrecargada), para reservar sitio con un UPDATE condicional
+        """
+        ocupado = sum(models.F(campo) * Objeto.calcular_volumen(tamanio) for tamanio, campo in cls.CAMPOS_TAMANIO.items())
+        return models.F('capacidadMaxima') * Objeto.calcular_volumen('mediano') - ocupado
+
+    @property
+    def volumen_ocupado(self):
+        return self.calcular_volumen_ocupado({tamanio: getattr(self, campo) for tamanio, campo in self.CAMPOS_TAMANIO.items()})
+
+    @property
+    def descripcion_capacidad(self):
+        """
+        Capacidad en objetos de cada tamaño, para los textos de las acciones
+        """
+        capacidad = self.calcular_capacidad(self.capacidadMaxima)
+        return (
+            f'{self.capacidadMaxima} objetos medianos '
+            f'({capacidad // Objeto.calcular_volumen("pequeno")} pequeños o {capacidad // Objeto.calcular_volumen("grande")} grandes)'
+        )
+
+    @property
+    def porcentaje_ocupacion(self):
+        capacidad = self.calcular_capacidad(self.capacidadMaxima)
+        if capacidad > 0:
+            return round((self.volumen_ocupado / capacidad) * 100, 1)
+        return 0
+
+    def objetos_con_cantidad(self):
+        """
+        Objetos de la caja con el atributo `cantidad` (unidades apiladas en la caja)
+        """
+        return Objeto.objects.filter(contenido__cajon=self).annotate(cantidad=models.F('contenido__cantidad'))
 
 
 class Objeto(models.Model):
@@ -24,11 +98,129 @@ class Objeto(models.Model):
         ('mediano', 'Mediano'),
         ('grande', 'Grande'),
     ]
+    # Orden de los tamaños (de menor a mayor) guardado en rango_tamanio
+    RANGOS_TAMANIO = {valor: rango for rango, (valor, _) in enumerate(tamanio, start=1)}
+    # Volumen que ocupa una unidad de cada tamaño en una caja
+    VOLUMENES_TAMANIO = {'pequeno': 1, 'mediano': 2, 'grande': 4}
 
     nombre = models.CharField(max_length=100)
     tipo = models.CharField(max_length=50, choices=tipo)
     tamanio = models.CharField(max_length=50, choices=tamanio)
     imagen = models.ImageField(upload_to='objetos/', null=True, blank=True)
+    # Variantes generadas por sistema/imagenes.py (hash del contenido y miniatura)
+    imagen_hash = models.CharField(max_length=64, db_index=True, editable=False, blank=True, default='')
+    miniatura = models.ImageField(upload_to='objetos/miniaturas/', null=True, blank=True, editable=False)
+    # Hash perceptual (dHash de 64 bits) para buscar fotos parecidas, ver sistema/similitud.py
+    imagen_phash = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    # Clave normalizada para detectar duplicados (mismo nombre, tipo y tamaño) en la base de datos
+    clave_duplicado = models.CharField(max_length=210, db_index=True, editable=False, default='')
+    # Posición del tamaño en RANGOS_TAMANIO, para ordenar por tamaño con un índice
+    rango_tamanio = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Claves MinHash del nombre para buscar nombres parecidos, ver sistema/parecidos.py
+    firma_nombre = models.CharField(max_length=160, editable=False, blank=True, default='')
+
+    class Meta:
+        # Un índice por banda de la firma: los objetos que comparten una clave con otro se
+        # buscan sin recorrer la caja (parecidos.grupos_de)
+        indexes = [
+            models.Index(Substr('firma_nombre', banda * 8 + 1, 8), name=f'objeto_firma_banda{banda}_idx')
+            for banda in range(BANDAS_FIRMA)
+        ]
+
+    @staticmethod
+    def clave_banda(banda):
+        """
+        Expresión SQL de la clave de la banda en firma_nombre, la de su índice
+        """
+        return Substr('firma_nombre', banda * 8 + 1, 8)
+
+    @staticmethod
+    def calcular_clave(nombre, tipo, tamanio):
+        return f"{nombre.lower().strip()}_{tipo}_{tamanio}"
+
+    @classmethod
+    def calcular_rango(cls, tamanio):
+        return cls.RANGOS_TAMANIO.get(tamanio, len(cls.RANGOS_TAMANIO) + 1)
+
+    @classmethod
+    def calcular_volumen(cls, tamanio):
+        return cls.VOLUMENES_TAMANIO.get(tamanio, cls.VOLUMENES_TAMANIO['mediano'])
+
+    @staticmethod
+    def calcular_firma(nombre):
+        from .parecidos import calcular_firmas
+        return calcular_firmas([nombre])[0]
+
+    @property
+    def url_miniatura(self):
+        """
+        URL de la miniatura, o de la foto original si todavía no se ha procesado
+        """
+        if self.miniatura:
+            return self.miniatura.url
+        if self.imagen:
+            return self.imagen.url
+        return ''
+
+    def save(self, *args, **kwargs):
+        self.clave_duplicado = self.calcular_clave(self.nombre, self.tipo, self.tamanio)
+        self.rango_tamanio = self.calcular_rango(self.tamanio)
+        campos = kwargs.get('update_fields')
+        if campos is None or 'nombre' in campos:
+            self.firma_nombre = self.calcular_firma(self.nombre)
+        cambia_orden = campos is None or bool({'nombre', 'tipo', 'tamanio'} & set(campos))
+        if campos is not None and cambia_orden:
+            kwargs['update_fields'] = {*campos, 'clave_duplicado', 'rango_tamanio', 'firma_nombre'}
+        nuevo = self._state.adding
+        super().save(*args, **kwargs)
+        if not nuevo and cambia_orden:
+            from . import busqueda
+
+            # Copia de los campos de orden en las filas de las cajas que lo contienen, y
+            # el nombre y el tipo en sus entradas del índice de búsqueda
+            Contenido.objects.filter(objeto_id=self.pk).update(
+                **{campo: getattr(self, campo) for campo in Contenido.CAMPOS_ORDEN}
+            )
+            busqueda.actualizar([self.pk])
+
+
+class Contenido(models.Model):
+    """
+    Objeto guardado en una caja. Las unidades iguales (misma clave_duplicado) se apilan
+    en una sola fila con su `cantidad` en lugar de repetir el objeto.
+    """
+    cajon = models.ForeignKey(Cajon, on_delete=models.CASCADE)
+    objeto = models.ForeignKey(Objeto, on_delete=models.CASCADE)
+    cantidad = models.PositiveIntegerField(default=1)
+
+    # Copia de los campos del objeto por los que se ordena la caja (la mantiene Objeto.save):
+    # con ellos los índices de la caja sirven cada orden de detalle_caja sin ordenar
+    # todos sus objetos
+    nombre = models.CharField(max_length=100, default='', editable=False)
+    tipo = models.CharField(max_length=50, default='', editable=False)
+    rango_tamanio = models.PositiveSmallIntegerField(default=0, editable=False)
+    CAMPOS_ORDEN = ('nombre', 'tipo', 'rango_tamanio')
+
+    class Meta:
+        # La tabla de la relación ManyToMany automática que había antes
+        db_table = 'sistema_cajon_objetos'
+        unique_together = [('cajon', 'objeto')]
+        indexes = [
+            models.Index(fields=['cajon', 'nombre', 'objeto'], name='contenido_nombre_idx'),
+            models.Index(fields=['cajon', 'tipo', 'nombre', 'objeto'], name='contenido_tipo_idx'),
+            models.Index(fields=['cajon', 'rango_tamanio', 'nombre', 'objeto'], name='contenido_tamanio_idx'),
+        ]
+
+    @classmethod
+    def de(cls, cajon_id, objeto, cantidad=1):
+        """
+        Fila de la caja para el objeto, con la copia de sus campos de orden
+        """
+        return cls(
+            cajon_id=cajon_id, objeto_id=objeto.id, cantidad=cantidad,
+            **{campo: getattr(objeto, campo) for campo in cls.CAMPOS_ORDEN},
+        )
 
 
 class Accion(models.Model):
@@ -46,12 +238,85 @@ class Accion(models.Model):
     objetosAfectados = models.ManyToManyField(Objeto, related_name='acciones', blank=True)
     tipo = models.CharField(max_length=50, choices=tipo)
     descripcion = models.TextField(blank=True, null=True)  # Descripción detallada de la acción
-    fecha_hora = models.DateTimeField(auto_now_add=True)  # Timestamp automático
+    fecha_hora = models.DateTimeField(default=timezone.now, editable=False)  # Timestamp automático (se fija al registrar la acción)
     
     class Meta:
         ordering = ['-fecha_hora']  # Ordenar por fecha más reciente primero
+        # Índices para la paginación por cursor (fecha_hora, id) del historial y sus filtros
+        indexes = [
+            models.Index(fields=['fecha_hora', 'id'], name='accion_fecha_id_idx'),
+            models.Index(fields=['cajon', 'fecha_hora', 'id'], name='accion_cajon_fecha_idx'),
+            models.Index(fields=['tipo', 'fecha_hora', 'id'], name='accion_tipo_fecha_idx'),
+        ]
         verbose_name = 'Acción'
         verbose_name_plural = 'Acciones'
     
     def __str__(self):
         return f"{self.get_tipo_display()} - {self.fecha_hora.strftime('%d/%m/%Y %H:%M')}"
+
+
+class VersionHistorial(models.Model):
+    """
+    Versión del historial (una sola fila): se incrementa cuando se borran acciones o
+    relaciones de acciones con objetos, cambios que no mueven el último id ni la
+    última fecha (ver bitacora.invalidar_historial)
+    """
+    version = models.PositiveIntegerField(default=0)
+
+
+# Resúmenes del inventario, mantenidos por sistema/resumenes.py (manage.py reconstruir_resumenes)
+
+class ResumenInventario(models.Model):
+    """
+    Altas y bajas de objetos de un día en una caja, por tipo y tamaño
+    """
+    dia = models.DateField()
+    cajon = models.ForeignKey(Cajon, on_delete=models.CASCADE, related_name='resumenes')
+    tipo = models.CharField(max_length=50)
+    tamanio = models.CharField(max_length=50)
+    altas = models.IntegerField(default=0)
+    bajas = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # También sirve para leer los días de una caja
+            models.UniqueConstraint(fields=['cajon', 'dia', 'tipo', 'tamanio'], name='resumen_inventario_unico'),
+        ]
+
+
+class ResumenAcciones(models.Model):
+    """
+    Acciones registradas en un día, por tipo (incluye las ya archivadas)
+    """
+    dia = models.DateField()
+    tipo = models.CharField(max_length=50)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'tipo'], name='resumen_acciones_unico'),
+        ]
+
+
+class ExistenciaTipo(models.Model):
+    """
+    Objetos guardados en cajas de cada tipo y tamaño
+    """
+    tipo = models.CharField(max_length=50)
+    tamanio = models.CharField(max_length=50)
+    cantidad = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'tamanio'], name='existencia_tipo_unico'),
+        ]
+
+
+class OcupacionTramo(models.Model):
+    """
+    Cajas en cada tramo de ocupación (vacía, hasta 50 %, ...) con sus objetos y capacidad
+    """
+    tramo = models.CharField(max_length=20, unique=True)
+    cajas = models.IntegerField(default=0)
+    objetos = models.IntegerField(default=0)
+    capacidad = models.IntegerField(default=0)
@@ -0,0 +1,238 @@
+"""
+Organizador automático de objetos en cajas.
+
+Cada tamaño ocupa un volumen (pequeño 1, mediano 2, grande 4, Objeto.VOLUMENES_TAMANIO) y
+la capacidad de una caja es capacidadMaxima medida en objetos medianos: la misma medida
+que aplican la reserva de sitio (inventario.reservar) y porcentaje_ocupacion, así que un
+plan aplicado no deja ninguna caja más llena de lo que la reserva admitiría. El plan se
+calcula con una heurística de primer ajuste decreciente (primero los grandes, después
+los medianos y al final los pequeños), opcionalmente agrupando por tipo.
+
+Como solo hay tres volúmenes, el primer ajuste de n objetos iguales se resuelve sin
+recorrerlos uno a uno: cada caja admite libre // volumen objetos y, con la suma
+acumulada de esas plazas, searchsorted da la caja de cada objeto.
+
+El plan trabaja con unidades: una fila de Contenido con cantidad n ocupa n posiciones, así
+que una pila puede repartirse entre varias cajas.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+from django.db import transaction
+
+from .bitacora import EntradaAccion, obtener_bitacora
+from .models import Cajon, Contenido, Objeto
+from . import inventario
+
+TAMANIO_BLOQUE = 500
+
+
+@dataclass
+class Plan:
+    """
+    Movimientos propuestos: cada posición es una unidad de una fila de Contenido
+    que pasa de la caja `origenes[i]` a `destinos[i]`
+    """
+    fila_ids: np.ndarray
+    objeto_ids: np.ndarray
+    tipos: np.ndarray
+    tamanios: np.ndarray
+    origenes: np.ndarray
+    destinos: np.ndarray
+    sin_lugar: int = 0
+    sobrecargadas_antes: int = 0
+    sobrecargadas_despues: int = 0
+    volumen_total: int = 0
+    capacidad_total: int = 0
+    total_cajas: int = 0
+    cajas_afectadas: set = field(default_factory=set)
+
+    def __len__(self):
+        return len(self.fila_ids)
+
+    def movimientos(self, limite=None):
+        """
+        [(objeto_id, origen_id, destino_id)] de los primeros `limite` movimientos
+        """
+        fin = len(self) if limite is None else min(limite, len(self))
+        return list(zip(self.objeto_ids[:fin].tolist(), self.origenes[:fin].tolist(), self.destinos[:fin].tolist()))
+
+    @property
+    def descripcion(self):
+        texto = f'Se reorganizaron {len(self)} objetos entre {len(self.cajas_afectadas)} cajas'
+        if self.sin_lugar:
+            texto += f'; {self.sin_lugar} objetos no caben en ninguna caja'
+        return texto + f'. Cajas sobrecargadas: {self.sobrecargadas_antes} antes, {self.sobrecargadas_despues} después.'
+
+
+def _primer_ajuste(libre, volumen, cantidad):
+    """
+    Coloca `cantidad` objetos de `volumen` en la primera caja con sitio, en orden.
+    Devuelve la posición de la caja de cada objeto (-1 si no cabe) y descuenta `libre`.
+    """
+    destinos = np.full(cantidad, -1, dtype=np.int64)
+    if not cantidad or not len(libre):
+        return destinos
+    plazas = np.cumsum(np.maximum(libre, 0) // volumen)
+    colocados = int(min(cantidad, plazas[-1]))
+    destinos[:colocados] = np.searchsorted(plazas, np.arange(colocados), side='right')
+    libre -= np.bincount(destinos[:colocados], minlength=len(libre)) * volumen
+    return destinos
+
+
+def _cargar():
+    cajas = list(Cajon.objects.order_by('id').values_list('id', 'capacidadMaxima'))
+    caja_ids = np.array([caja_id for caja_id, _ in cajas], dtype=np.int64)
+    capacidad = np.array([Cajon.calcular_capacidad(c) for _, c in cajas], dtype=np.int64)
+
+    filas = list(Contenido.objects.order_by('id').values_list('id', 'objeto_id', 'cajon_id', 'objeto__tamanio', 'objeto__tipo', 'cantidad'))
+    # Una posición por unidad: cada fila se repite tantas veces como su cantidad
+    unidades = np.fromiter((f[5] for f in filas), dtype=np.int64, count=len(filas))
+    fila_ids = np.repeat(np.fromiter((f[0] for f in filas), dtype=np.int64, count=len(filas)), unidades)
+    objeto_ids = np.repeat(np.fromiter((f[1] for f in filas), dtype=np.int64, count=len(filas)), unidades)
+    posiciones = np.repeat(np.searchsorted(caja_ids, np.fromiter((f[2] for f in filas), dtype=np.int64, count=len(filas))), unidades)
+    tamanios = np.repeat(np.array([f[3] for f in filas], dtype=object), unidades)
+    volumen = np.repeat(np.fromiter((Objeto.calcular_volumen(f[3]) for f in filas), dtype=np.int64, count=len(filas)), unidades)
+    tipos, tipo_codigos = np.unique(np.array([f[4] for f in filas], dtype=object), return_inverse=True)
+    return caja_ids, capacidad, fila_ids, objeto_ids, posiciones, tamanios, volumen, tipos, np.repeat(tipo_codigos, unidades)
+
+
+def calcular_plan(reorganizar=False, agrupar_por_tipo=True):
+    """
+    Calcula el plan sin modificar nada.
+
+    Por defecto solo se sacan objetos de las cajas que superan su capacidad (los más
+    grandes primero, para mover lo mínimo) y se colocan en el sitio libre de las demás,
+    prefiriendo cajas cuyo tipo predominante coincide. Con `reorganizar` se vuelven a
+    colocar todos los objetos desde cero.
+    """
+    caja_ids, capacidad, fila_ids, objeto_ids, posiciones, tamanios, volumen, tipos, tipo_codigos = _cargar()
+    n_cajas = len(caja_ids)
+    ocupado = np.bincount(posiciones, weights=volumen, minlength=n_cajas).astype(np.int64)
+
+    if reorganizar:
+        mover = np.ones(len(fila_ids), dtype=bool)
+        libre = capacidad.copy()
+        predominante = np.full(n_cajas, -1)
+    else:
+        # Dentro de cada caja, del objeto más grande al más pequeño: se saca cada uno
+        # mientras el volumen ya sacado no cubra el exceso de la caja
+        orden = np.lexsort((-volumen, posiciones))
+        acumulado = np.cumsum(volumen[orden])
+        inicio_caja = np.concatenate([[0], np.cumsum(ocupado)[:-1]])
+        sacado_antes = acumulado - volumen[orden] - inicio_caja[posiciones[orden]]
+        exceso = ocupado - capacidad
+        mover = np.zeros(len(fila_ids), dtype=bool)
+        mover[orden] = sacado_antes < exceso[posiciones[orden]]
+        libre = capacidad - ocupado + np.bincount(posiciones[mover], weights=volumen[mover], minlength=n_cajas).astype(np.int64)
+
+        # Tipo con más volumen en lo que se queda en cada caja
+        predominante = np.full(n_cajas, -1)
+        if len(tipos) and n_cajas:
+            quedan = ~mover
+            por_tipo = np.zeros((n_cajas, len(tipos)), dtype=np.int64)
+            np.add.at(por_tipo, (posiciones[quedan], tipo_codigos[quedan]), volumen[quedan])
+            predominante = np.where(por_tipo.max(axis=1) > 0, por_tipo.argmax(axis=1), -1)
+
+    candidatos = np.flatnonzero(mover)
+    destinos = posiciones.copy()
+
+    if agrupar_por_tipo and len(candidatos):
+        # Primero el tipo con más volumen; cada tipo empieza por las cajas donde ya predomina
+        volumen_tipo = np.bincount(tipo_codigos[candidatos], weights=volumen[candidatos], minlength=len(tipos))
+        grupos = [(candidatos[tipo_codigos[candidatos] == t], t) for t in np.argsort(-volumen_tipo, kind='stable')]
+    else:
+        grupos = [(candidatos, -1)]
+
+    colocados = np.zeros(len(fila_ids), dtype=bool)
+    for indices, tipo in grupos:
+        orden_cajas = np.argsort(predominante != tipo, kind='stable') if tipo >= 0 else np.arange(n_cajas)
+        libre_ordenado = libre[orden_cajas]
+        for valor in np.unique(volumen[indices])[::-1]:
+            del_volumen = indices[volumen[indices] == valor]
+            asignados = _primer_ajuste(libre_ordenado, valor, len(del_volumen))
+            caben = asignados >= 0
+            destinos[del_volumen[caben]] = orden_cajas[asignados[caben]]
+            colocados[del_volumen[caben]] = True
+        libre[orden_cajas] = libre_ordenado
+
+    # Los que no caben en ninguna caja se quedan donde están
+    sin_lugar = int(len(candidatos) - colocados[candidatos].sum())
+    cambian = np.flatnonzero(colocados & (destinos != posiciones))
+    ocupado_despues = np.bincount(destinos, weights=volumen, minlength=n_cajas)
+
+    return Plan(
+        fila_ids=fila_ids[cambian],
+        objeto_ids=objeto_ids[cambian],
+        tipos=tipos[tipo_codigos[cambian]],
+        tamanios=tamanios[cambian],
+        origenes=caja_ids[posiciones[cambian]],
+        destinos=caja_ids[destinos[cambian]],
+        sin_lugar=sin_lugar,
+        sobrecargadas_antes=int((ocupado > capacidad).sum()),
+        sobrecargadas_despues=int((ocupado_despues > capacidad).sum()),
+        volumen_total=int(volumen.sum()),
+        capacidad_total=int(capacidad.sum()),
+        total_cajas=n_cajas,
+        cajas_afectadas=set(caja_ids[posiciones[cambian]].tolist()) | set(caja_ids[destinos[cambian]].tolist()),
+    )
+
+
+def _aplicar(plan):
+    """
+    Aplica el plan: las filas de Contenido afectadas (las de origen y las que ya tenía el
+    objeto en la caja de destino) se borran y se crean de nuevo en bloque con sus unidades
+    finales. Debe llamarse dentro de la transacción en la que se calculó el plan.
+    """
+    objeto_ids = sorted(set(plan.objeto_ids.tolist()))
+    filas = {}
+    # Campos de orden de cada objeto, que se copian en sus filas nuevas
+    orden = {}
+    for inicio in range(0, len(objeto_ids), TAMANIO_BLOQUE):
+        consulta = Contenido.objects.filter(objeto_id__in=objeto_ids[inicio:inicio + TAMANIO_BLOQUE])
+        filas_consulta = consulta.values_list('id', 'objeto_id', 'cajon_id', 'cantidad', *Contenido.CAMPOS_ORDEN)
+        for fila_id, objeto_id, cajon_id, cantidad, *campos in filas_consulta:
+            filas[objeto_id, cajon_id] = (fila_id, cantidad)
+            orden[objeto_id] = campos
+
+    cantidades = Counter({clave: cantidad for clave, (_, cantidad) in filas.items()})
+    cantidades.subtract(zip(plan.objeto_ids.tolist(), plan.origenes.tolist()))
+    cantidades.update(zip(plan.objeto_ids.tolist(), plan.destinos.tolist()))
+    afectadas = set(zip(plan.objeto_ids.tolist(), plan.origenes.tolist())) | set(zip(plan.objeto_ids.tolist(), plan.destinos.tolist()))
+
+    borrar = [filas[clave][0] for clave in afectadas if clave in filas]
+    for inicio in range(0, len(borrar), TAMANIO_BLOQUE):
+        Contenido.objects.filter(id__in=borrar[inicio:inicio + TAMANIO_BLOQUE]).delete()
+    Contenido.objects.bulk_create(
+        [
+            Contenido(
+                objeto_id=objeto_id, cajon_id=cajon_id, cantidad=cantidades[objeto_id, cajon_id],
+                **dict(zip(Contenido.CAMPOS_ORDEN, orden[objeto_id])),
+            )
+            for objeto_id, cajon_id in sorted(afectadas) if cantidades[objeto_id, cajon_id] > 0
+        ],
+        batch_size=TAMANIO_BLOQUE,
+    )
+
+    inventario.mover_objetos(
+        plan.objeto_ids.tolist(), plan.origenes.tolist(), plan.destinos.tolist(),
+        plan.tipos.tolist(), plan.tamanios.tolist(), borrar,
+    )
+    obtener_bitacora().registrar(EntradaAccion(tipo='organizar_caja', descripcion=plan.descripcion))
+
+
+def organizar(reorganizar=False, agrupar_por_tipo=True, simular=False):
+    """
+    Calcula y aplica el plan en una sola transacción.
+    Con `simular` solo devuelve el plan: se calcula sin transacción, así la vista previa
+    no toma el bloqueo de escritura de la base de datos.
+    """
+    if simular:
+        return calcular_plan(reorganizar=reorganizar, agrupar_por_tipo=agrupar_por_tipo)
+
+    with transaction.atomic():
+        plan = calcular_plan(reorganizar=reorganizar, agrupar_por_tipo=agrupar_por_tipo)
+        if len(plan):
+            _aplicar(plan)
+    return plan
@@ -0,0 +1,176 @@
+"""
+Paginación por cursor (keyset): en lugar de OFFSET se filtra por los valores de orden
+del último elemento mostrado, así cualquier página cuesta lo mismo que la primera
+si hay un índice que cubra el orden.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class CursorInvalido(ValueError):
+    """
+    El cursor no se puede decodificar o sus valores no corresponden a los campos del orden
+    """
+
+
+def codificar_cursor(valores):
+    texto = json.dumps(valores, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def _convertir(modelo, campo, valor):
+    # Valor del cursor con el tipo del campo del modelo (las anotaciones se dejan como vienen)
+    try:
+        return modelo._meta.get_field(campo.lstrip('-')).to_python(valor)
+    except FieldDoesNotExist:
+        return valor
+
+
+def decodificar_cursor(cursor, campos, modelo=None):
+    """
+    Devuelve la lista de valores del cursor para los `campos` (None si no hay cursor). Con
+    `modelo` cada valor se convierte al tipo de su campo. Lanza CursorInvalido si el cursor
+    no es de estos campos: el cliente lo puede modificar, no debe llegar a la consulta.
+    """
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        raise CursorInvalido('El cursor no se puede decodificar')
+    if not isinstance(valores, list) or len(valores) != len(campos):
+        raise CursorInvalido('El cursor no corresponde al orden')
+    # Los campos de orden no admiten nulos: solo texto y números
+    if any(isinstance(valor, bool) or not isinstance(valor, (str, int, float)) for valor in valores):
+        raise CursorInvalido('El cursor tiene valores no válidos')
+    if modelo is not None:
+        try:
+            valores = [_convertir(modelo, campo, valor) for campo, valor in zip(campos, valores)]
+        except (ValidationError, TypeError, ValueError):
+            raise CursorInvalido('El cursor tiene valores no válidos')
+    return valores
+
+
+def _filtro_posterior(campos, valores):
+    """
+    Construye (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ... respetando el sentido de cada campo
+    ('-campo' es descendente)
+    """
+    filtro = Q()
+    iguales = {}
+    for campo, valor in zip(campos, valores):
+        nombre = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        filtro |= Q(**iguales, **{f'{nombre}__{operador}': valor})
+        iguales[nombre] = valor
+
+    # Cota sobre el primer campo para que la base de datos haga una búsqueda por rango
+    # en el índice en lugar de recorrerlo desde el principio
+    primero = campos[0]
+    operador = 'lte' if primero.startswith('-') else 'gte'
+    return Q(**{f'{primero.lstrip("-")}__{operador}': valores[0]}) & filtro
+
+
+def filtrar_despues(queryset, campos, valores):
+    """
+    Filas del queryset posteriores a `valores` en el orden de `campos` (todas si es None).
+    `valores` son los de un cursor decodificado o los de la última fila de un lote.
+    """
+    if valores is None:
+        return queryset
+    return queryset.filter(_filtro_posterior(campos, valores))
+
+
+def _invertir(campos):
+    return [campo[1:] if campo.startswith('-') else f'-{campo}' for campo in campos]
+
+
+def _valores(elemento, campos):
+    # Admite instancias de modelos y diccionarios (querysets con .values())
+    if isinstance(elemento, dict):
+        return [elemento[campo.lstrip('-')] for campo in campos]
+    return [getattr(elemento, campo.lstrip('-')) for campo in campos]
+
+
+class PaginaCursor:
+    """
+    Página de resultados con los cursores para ir a la siguiente y a la anterior
+    """
+
+    def __init__(self, elementos, cursor_siguiente=None, cursor_anterior=None):
+        self.elementos = elementos
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+
+    def __iter__(self):
+        return iter(self.elementos)
+
+    def __len__(self):
+        return len(self.elementos)
+
+    @property
+    def tiene_otras_paginas(self):
+        return bool(self.cursor_siguiente or self.cursor_anterior)
+
+
+def _completar(filas, adicionales, valores, campos, tamanio):
+    """
+    Mezcla las filas de la base de datos con las de `adicionales` (p. ej. el archivo de
+    acciones) en el orden de `campos`. Solo se le piden las que quedan antes de la
+    última fila ya obtenida, así que normalmente no tiene nada que añadir.
+    """
+    if adicionales is None:
+        return filas
+    tope = _valores(filas[-1], campos) if len(filas) > tamanio else None
+    extra = adicionales(valores, tope, tamanio + 1, campos[0].startswith('-'))
+    if not extra:
+        return filas
+
+    mezcla = {}
+    for elemento in [*filas, *extra]:
+        mezcla.setdefault(tuple(_valores(elemento, campos)), elemento)
+    ordenadas = sorted(mezcla, reverse=campos[0].startswith('-'))
+    return [mezcla[clave] for clave in ordenadas[:tamanio + 1]]
+
+
+def paginar(queryset, campos, tamanio, despues=None, antes=None, adicionales=None):
+    """
+    Pagina el queryset ordenado por `campos` (el último debe ser único, p. ej. 'id').
+    `despues` y `antes` son cursores devueltos en una página previa.
+
+    `adicionales(cursor, tope, cantidad, descendente)` completa las páginas con elementos
+    que no están en el queryset: devuelve hasta `cantidad` elementos en el orden del
+    recorrido, posteriores a `cursor` y anteriores a `tope` (valores de los campos o None).
+    Todos los campos deben tener el mismo sentido.
+
+    Lanza CursorInvalido si `despues` o `antes` no son cursores de estos campos.
+    """
+    valores_despues = decodificar_cursor(despues, campos, queryset.model)
+    valores_antes = decodificar_cursor(antes, campos, queryset.model) if valores_despues is None else None
+
+    if valores_antes is not None:
+        # Hacia atrás: se recorre en orden inverso y se da la vuelta al resultado
+        filas = list(filtrar_despues(queryset, _invertir(campos), valores_antes)
+                     .order_by(*_invertir(campos))[:tamanio + 1])
+        filas = _completar(filas, adicionales, valores_antes, _invertir(campos), tamanio)
+        hay_mas = len(filas) > tamanio
+        elementos = filas[:tamanio][::-1]
+        return PaginaCursor(
+            elementos,
+            cursor_siguiente=codificar_cursor(_valores(elementos[-1], campos)) if elementos else despues,
+            cursor_anterior=codificar_cursor(_valores(elementos[0], campos)) if hay_mas else None,
+        )
+
+    filas = list(filtrar_despues(queryset, campos, valores_despues).order_by(*campos)[:tamanio + 1])
+    filas = _completar(filas, adicionales, valores_despues, campos, tamanio)
+    hay_mas = len(filas) > tamanio
+    elementos = filas[:tamanio]
+    return PaginaCursor(
+        elementos,
+        cursor_siguiente=codificar_cursor(_valores(elementos[-1], campos)) if hay_mas else None,
+        cursor_anterior=codificar_cursor(_valores(elementos[0], campos)) if valores_despues is not None and elementos else None,
+    )
@@ -0,0 +1,97 @@
+"""
+Índices en memoria del proceso que se reconstruyen en segundo plano.
+
+La primera petición construye el índice. Cuando pasa el intervalo de recarga las
+peticiones siguen usando el índice anterior mientras un hilo construye uno nuevo con
+los datos actuales de la base de datos, y al terminar se cambia la referencia. Los
+cambios que llegan mientras tanto se aplican a los dos índices.
+"""
+import logging
+import threading
+import time
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class IndiceRecargable:
+    """
+    Referencia al índice del proceso. `construir()` devuelve un índice nuevo y completo.
+    """
+
+    def __init__(self, construir, nombre):
+        self.construir = construir
+        self.nombre = nombre
+        self.indice = None
+        self.cargado_en = 0.0
+        self._candado = threading.Lock()
+        self._hilo = None
+        self._cambios = []
+        self._generacion = 0
+
+    def obtener(self, recarga):
+        """
+        Índice actual. Solo se construye en la llamada si todavía no hay ninguno; si tiene
+        más de `recarga` segundos se devuelve igualmente y se reconstruye en un hilo.
+        """
+        with self._candado:
+            if self.indice is None:
+                self.indice = self.construir()
+                self.cargado_en = time.monotonic()
+            elif self._hilo is None and time.monotonic() - self.cargado_en > recarga:
+                self._cambios = []
+                self._hilo = threading.Thread(
+                    target=self._reconstruir, args=(self._generacion,), name=self.nombre, daemon=True,
+                )
+                self._hilo.start()
+            return self.indice
+
+    def _reconstruir(self, generacion):
+        try:
+            indice = self.construir()
+        except Exception:
+            logger.exception('Error al reconstruir el índice %s', self.nombre)
+            indice = None
+        finally:
+            connection.close()
+
+        with self._candado:
+            # Si se descartó el índice mientras tanto, este ya no vale
+            if indice is not None and generacion == self._generacion:
+                for cambio in self._cambios:
+                    cambio(indice)
+                self.indice = indice
+            # También tras un error: se vuelve a intentar en el siguiente intervalo
+            self.cargado_en = time.monotonic()
+            self._cambios = []
+            self._hilo = None
+
+    def aplicar(self, cambio):
+        """
+        Aplica `cambio(indice)` al índice actual, si ya está construido. Si se está
+        construyendo uno nuevo también se le aplica al terminar: puede haber leído la base
+        de datos antes del cambio.
+        """
+        with self._candado:
+            indice = self.indice
+            if self._hilo is not None:
+                self._cambios.append(cambio)
+        if indice is not None:
+            cambio(indice)
+
+    def descartar(self):
+        """
+        Olvida el índice: la siguiente llamada a obtener() lo construye de nuevo
+        """
+        with self._candado:
+            self.indice = None
+            self._generacion += 1
+
+    def esperar(self):
+        """
+        Espera a que termine la reconstrucción en curso, si la hay
+        """
+        hilo = self._hilo
+        if hilo is not None:
+            hilo.join()
@@ -0,0 +1,149 @@
+"""
+Prueba de estrés de la reserva de sitio al agregar objetos (inventario.agregar_objetos).
+
+`escritores` hilos agregan lotes de objetos a la vez a unas pocas cajas de prueba, elegidas
+al azar, así compiten por las mismas filas, hasta que todas se llenan. Al terminar se
+comprueba que ninguna caja pasó de su capacidad y que sus contadores coinciden con la
+relación caja-objeto, y se borran las cajas y los objetos de prueba.
+
+Cada nivel de concurrencia trabaja sobre la base de datos configurada (igual que el
+comando benchmark); con SQLite las escrituras se serializan (BEGIN IMMEDIATE), así que lo
+que se mide es que el rendimiento no caiga al añadir escritores.
+"""
+import random
+import statistics
+import threading
+import time
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+
+from .benchmark import percentil
+from .models import Cajon, Contenido, Objeto
+from . import inventario
+
+PREFIJO = 'Prueba de reservas'
+
+
+def _crear_cajas(cantidad, capacidad):
+    with transaction.atomic():
+        cajas = Cajon.objects.bulk_create([
+            Cajon(nombre=f'{PREFIJO} {numero + 1}', capacidadMaxima=capacidad) for numero in range(cantidad)
+        ])
+        inventario.alta_cajas(cajas)
+    return cajas
+
+
+def _borrar(cajas):
+    """
+    Quita los objetos y las cajas de prueba, con sus datos derivados
+    """
+    objeto_ids = list(Contenido.objects.filter(cajon__in=cajas).values_list('objeto_id', flat=True))
+    with transaction.atomic():
+        for inicio in range(0, len(objeto_ids), inventario.TAMANIO_BLOQUE):
+            bloque = objeto_ids[inicio:inicio + inventario.TAMANIO_BLOQUE]
+            inventario.baja_objetos(bloque)
+            Objeto.objects.filter(id__in=bloque).delete()
+        cajas = list(Cajon.objects.filter(id__in=[caja.id for caja in cajas]))
+        inventario.baja_cajas(cajas)
+        Cajon.objects.filter(id__in=[caja.id for caja in cajas]).delete()
+
+
+def _escritor(numero, caja_ids, lote, semilla, resultados):
+    rng = random.Random(semilla + numero)
+    pendientes = list(caja_ids)
+    tiempos, agregados, rechazos, errores = [], 0, 0, 0
+    try:
+        while pendientes:
+            caja_id = rng.choice(pendientes)
+            objetos = [
+                Objeto(nombre=f'Objeto {numero}-{agregados + indice}', tipo='papeleria', tamanio=rng.choice(('pequeno', 'mediano', 'grande')))
+                for indice in range(lote)
+            ]
+            inicio = time.perf_counter()
+            try:
+                inventario.agregar_objetos(caja_id, objetos)
+            except inventario.CajaLlena:
+                # Para este escritor la caja queda descartada (en bloque puede quedar un hueco menor que el lote)
+                pendientes.remove(caja_id)
+                rechazos += 1
+                continue
+            except OperationalError:
+                errores += 1
+                continue
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            agregados += lote
+    finally:
+        connection.close()
+        resultados.append((tiempos, agregados, rechazos, errores))
+
+
+def _comprobar(cajas):
+    """
+    (cajas llenadas de más, cajas cuyos contadores no coinciden con la relación, objetos guardados)
+    """
+    reales = {}
+    filas = (
+        Contenido.objects.filter(cajon__in=cajas).values('cajon_id', 'objeto__tamanio')
+        .annotate(unidades=Sum('cantidad')).values_list('cajon_id', 'objeto__tamanio', 'unidades')
+    )
+    for cajon_id, tamanio, unidades in filas:
+        reales.setdefault(cajon_id, {})[tamanio] = unidades
+    de_mas = desajustes = guardados = 0
+    for caja in Cajon.objects.filter(id__in=[caja.id for caja in cajas]):
+        real = reales.get(caja.id, {})
+        volumen = max(caja.volumen_ocupado, Cajon.calcular_volumen_ocupado(real))
+        de_mas += volumen > Cajon.calcular_capacidad(caja.capacidadMaxima)
+        desajustes += caja.total_objetos != sum(real.values())
+        guardados += sum(real.values())
+    return de_mas, desajustes, guardados
+
+
+def medir(escritores, cajas=4, capacidad=500, lote=1, semilla=0):
+    """
+    Llena `cajas` cajas de prueba con `escritores` hilos y devuelve las métricas y la comprobación
+    """
+    cajas = _crear_cajas(cajas, capacidad)
+    try:
+        resultados = []
+        hilos = [
+            threading.Thread(target=_escritor, args=(numero, [caja.id for caja in cajas], lote, semilla, resultados))
+            for numero in range(escritores)
+        ]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        tiempos = [tiempo for parcial, *_ in resultados for tiempo in parcial]
+        agregados = sum(resultado[1] for resultado in resultados)
+        de_mas, desajustes, guardados = _comprobar(cajas)
+        return {
+            'escritores': escritores,
+            'objetos': agregados,
+            'objetos_por_segundo': round(agregados / duracion, 1) if duracion else 0,
+            'rechazos': sum(resultado[2] for resultado in resultados),
+            'errores': sum(resultado[3] for resultado in resultados),
+            'p50_ms': round(statistics.median(tiempos), 2) if tiempos else 0,
+            'p95_ms': round(percentil(tiempos, 95), 2) if tiempos else 0,
+            'cajas_de_mas': de_mas,
+            'desajustes': desajustes,
+            # Lo que los hilos creen haber guardado coincide con lo que hay en la base de datos
+            'perdidos': agregados - guardados,
+        }
+    finally:
+        _borrar(cajas)
+
+
+def ejecutar(niveles=(1, 2, 4, 8, 16), cajas=4, capacidad=500, lote=1, semilla=0, progreso=None):
+    """
+    Mide cada nivel de concurrencia (número de escritores). Devuelve la lista de métricas.
+    """
+    resultados = []
+    for escritores in niveles:
+        resultados.append(medir(escritores, cajas, capacidad, lote, semilla))
+        if progreso:
+            progreso(resultados[-1])
+    return resultados
@@ -0,0 +1,349 @@
+"""
+Resúmenes del inventario para el panel de estadísticas, mantenidos de forma incremental:
+
+- ResumenInventario: altas y bajas de cada día por caja, tipo y tamaño.
+- ResumenAcciones: acciones de cada día por tipo.
+- ExistenciaTipo: objetos guardados por tipo y tamaño.
+- OcupacionTramo: cajas por tramo de ocupación, con sus objetos y capacidad.
+
+Los cambios llegan desde inventario (altas, bajas y movimientos de objetos, cajas nuevas)
+y desde bitacora.escribir_entradas (acciones), dentro de la misma transacción. Cada
+cambio suma a su fila con INSERT ... ON CONFLICT DO UPDATE, así que las peticiones
+concurrentes no se pisan. El panel lee solo estas tablas: su coste depende de los días
+mostrados, no del número de cajas, objetos o acciones.
+
+reconstruir() los vuelve a calcular desde cero (manage.py reconstruir_resumenes).
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.apps import apps as apps_globales
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Solo para el volumen y los contadores de cada tamaño: las consultas usan _modelo(),
+# que con `apps` devuelve los modelos históricos de una migración
+from .models import Cajon
+
+CAMPOS_TAMANIO = Cajon.CAMPOS_TAMANIO
+
+# Filas por sentencia INSERT (límite de variables de SQLite)
+TAMANIO_BLOQUE = 100
+
+# Tramos de ocupación (volumen ocupado / capacidad en volumen, como Cajon.porcentaje_ocupacion)
+TRAMOS = [
+    ('vacias', 'Vacías'),
+    ('hasta_50', 'Hasta 50 %'),
+    ('hasta_90', 'Del 50 al 90 %'),
+    ('casi_llenas', 'Del 90 al 100 %'),
+    ('llenas', 'Llenas o sobrecargadas'),
+]
+
+
+def tramo(por_tamanio, capacidad_maxima):
+    """
+    Tramo de una caja con las unidades de cada tamaño de `por_tamanio` ({tamanio: n})
+    """
+    ocupado = Cajon.calcular_volumen_ocupado(por_tamanio)
+    capacidad = Cajon.calcular_capacidad(capacidad_maxima)
+    if ocupado <= 0:
+        return 'vacias'
+    if capacidad <= 0 or ocupado >= capacidad:
+        return 'llenas'
+    porcentaje = ocupado * 100 / capacidad
+    if porcentaje <= 50:
+        return 'hasta_50'
+    if porcentaje < 90:
+        return 'hasta_90'
+    return 'casi_llenas'
+
+
+def _modelo(nombre, apps=None):
+    return (apps or apps_globales).get_model('sistema', nombre)
+
+
+def _sumar(modelo, claves, filas):
+    """
+    Suma a las filas del modelo con INSERT ... ON CONFLICT (claves) DO UPDATE (en MySQL
+    ON DUPLICATE KEY UPDATE), creando las que no existen. Los campos que no son clave son contadores.
+    filas: {tupla de valores de las claves: {campo: cantidad}}
+    """
+    filas = {clave: valores for clave, valores in filas.items() if any(valores.values())}
+    if not filas:
+        return
+    campos = [f.name for f in modelo._meta.concrete_fields if not f.primary_key and f.name not in claves]
+    tabla = connection.ops.quote_name(modelo._meta.db_table)
+    columnas_clave = [modelo._meta.get_field(clave) for clave in claves]
+    columnas = [connection.ops.quote_name(f.column) for f in columnas_clave]
+    columnas += [connection.ops.quote_name(modelo._meta.get_field(campo).column) for campo in campos]
+    if connection.vendor == 'mysql':
+        actualizar = ', '.join(f'{c} = {c} + VALUES({c})' for c in columnas[len(claves):])
+        conflicto = f'ON DUPLICATE KEY UPDATE {actualizar}'
+    else:
+        actualizar = ', '.join(f'{c} = {tabla}.{c} + excluded.{c}' for c in columnas[len(claves):])
+        conflicto = f'ON CONFLICT ({", ".join(columnas[:len(claves)])}) DO UPDATE SET {actualizar}'
+    marcadores = '(' + ', '.join(['%s'] * len(columnas)) + ')'
+
+    elementos = list(filas.items())
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(elementos), TAMANIO_BLOQUE):
+            bloque = elementos[inicio:inicio + TAMANIO_BLOQUE]
+            parametros = []
+            for clave, valores in bloque:
+                parametros += [f.get_db_prep_value(v, connection) for f, v in zip(columnas_clave, clave)]
+                parametros += [valores.get(campo, 0) for campo in campos]
+            cursor.execute(
+                f'INSERT INTO {tabla} ({", ".join(columnas)}) VALUES {", ".join([marcadores] * len(bloque))} {conflicto}',
+                parametros,
+            )
+
+
+# Cambios incrementales
+
+def registrar_cambios(deltas):
+    """
+    Registra una operación del inventario ya aplicada a los contadores de las cajas.
+    deltas: {cajon_id: Counter({(tipo, tamanio): n})}, n negativo para las bajas.
+    """
+    hoy = timezone.localdate()
+    inventario = {}
+    existencias = Counter()
+    for cajon_id, cambios in deltas.items():
+        for (tipo, tamanio), cantidad in cambios.items():
+            if cantidad:
+                inventario[(hoy, cajon_id, tipo, tamanio)] = {'altas': max(cantidad, 0), 'bajas': max(-cantidad, 0)}
+                existencias[(tipo, tamanio)] += cantidad
+
+    _sumar(_modelo('ResumenInventario'), ['dia', 'cajon', 'tipo', 'tamanio'], inventario)
+    _sumar(_modelo('ExistenciaTipo'), ['tipo', 'tamanio'], {clave: {'cantidad': n} for clave, n in existencias.items()})
+    cambio_por_caja = defaultdict(Counter)
+    for cajon_id, cambios in deltas.items():
+        for (_, tamanio), cantidad in cambios.items():
+            cambio_por_caja[cajon_id][tamanio] += cantidad
+    actualizar_tramos(cambio_por_caja)
+
+
+def actualizar_tramos(cambio_por_caja):
+    """
+    Mueve de tramo las cajas cuya ocupación cambió. cambio_por_caja: {cajon_id:
+    Counter({tamanio: n})}. Los contadores de las cajas ya están actualizados, así que
+    la ocupación anterior es la actual menos el cambio.
+    """
+    Cajon = _modelo('Cajon')
+    cajon_ids = [cajon_id for cajon_id, cambio in cambio_por_caja.items() if any(cambio.values())]
+    tramos = defaultdict(Counter)
+    for inicio in range(0, len(cajon_ids), 500):
+        cajas = Cajon.objects.filter(id__in=cajon_ids[inicio:inicio + 500]).values_list(
+            'id', 'capacidadMaxima', *CAMPOS_TAMANIO.values()
+        )
+        for cajon_id, capacidad, *contadores in cajas:
+            actual = dict(zip(CAMPOS_TAMANIO, contadores))
+            anterior = {tamanio: n - cambio_por_caja[cajon_id][tamanio] for tamanio, n in actual.items()}
+            tramo_anterior, tramo_actual = tramo(anterior, capacidad), tramo(actual, capacidad)
+            tramos[tramo_anterior].update({'cajas': -1, 'objetos': -sum(anterior.values()), 'capacidad': -capacidad})
+            tramos[tramo_actual].update({'cajas': 1, 'objetos': sum(actual.values()), 'capacidad': capacidad})
+    _sumar(_modelo('OcupacionTramo'), ['tramo'], {(nombre,): dict(valores) for nombre, valores in tramos.items()})
+
+
+def registrar_cajas(cajas):
+    """
+    Cajas nuevas (vacías)
+    """
+    tramos = defaultdict(Counter)
+    for caja in cajas:
+        tramos[tramo({}, caja.capacidadMaxima)].update({'cajas': 1, 'capacidad': caja.capacidadMaxima})
+    _sumar(_modelo('OcupacionTramo'), ['tramo'], {(nombre,): dict(valores) for nombre, valores in tramos.items()})
+
+
+def quitar_cajas(cajas):
+    """
+    Cajas que se van a eliminar (ya vacías)
+    """
+    tramos = defaultdict(Counter)
+    for caja in cajas:
+        tramos[tramo({}, caja.capacidadMaxima)].update({'cajas': -1, 'capacidad': -caja.capacidadMaxima})
+    _sumar(_modelo('OcupacionTramo'), ['tramo'], {(nombre,): dict(valores) for nombre, valores in tramos.items()})
+
+
+def registrar_acciones(acciones):
+    """
+    Acciones recién escritas (instancias de Accion)
+    """
+    por_dia = Counter((timezone.localdate(accion.fecha_hora), accion.tipo) for accion in acciones)
+    _sumar(_modelo('ResumenAcciones'), ['dia', 'tipo'], {clave: {'total': n} for clave, n in por_dia.items()})
+
+
+# Reconstrucción
+
+def _unidades(CajonObjetos):
+    """
+    Unidades de cada fila de la relación caja-objeto. Con los modelos históricos anteriores
+    a la migración 0012 (sin cantidad) cada fila es una unidad.
+    """
+    try:
+        CajonObjetos._meta.get_field('cantidad')
+    except FieldDoesNotExist:
+        return Value(1)
+    return F('cantidad')
+
+
+def reconstruir(apps=None, incluir_archivo=True):
+    """
+    Vuelve a calcular los resúmenes. Las existencias y la ocupación salen del contenido
+    actual de las cajas y las acciones de la tabla y del archivo. Las bajas de días
+    pasados no se pueden recuperar (los objetos ya no existen): cada objeto guardado
+    cuenta como alta el día de su acción de alta, o hoy si no la tiene.
+    `apps` permite usarlo desde una migración con los modelos históricos.
+    """
+    Cajon, Accion = _modelo('Cajon', apps), _modelo('Accion', apps)
+    CajonObjetos = Cajon._meta.get_field('objetos').remote_field.through
+    AccionObjetos = Accion._meta.get_field('objetosAfectados').remote_field.through
+    ResumenInventario, ResumenAcciones = _modelo('ResumenInventario', apps), _modelo('ResumenAcciones', apps)
+    ExistenciaTipo, OcupacionTramo = _modelo('ExistenciaTipo', apps), _modelo('OcupacionTramo', apps)
+
+    with transaction.atomic():
+        for modelo in (ResumenInventario, ResumenAcciones, ExistenciaTipo, OcupacionTramo):
+            modelo.objects.all().delete()
+
+        unidades = _unidades(CajonObjetos)
+        existencias = CajonObjetos.objects.values('objeto__tipo', 'objeto__tamanio').annotate(cantidad=Sum(unidades))
+        ExistenciaTipo.objects.bulk_create([
+            ExistenciaTipo(tipo=e['objeto__tipo'], tamanio=e['objeto__tamanio'], cantidad=e['cantidad']) for e in existencias
+        ])
+
+        tramos = defaultdict(Counter)
+        cajas = Cajon.objects.values_list('capacidadMaxima', *CAMPOS_TAMANIO.values())
+        for capacidad, *contadores in cajas.iterator(chunk_size=5000):
+            por_tamanio = dict(zip(CAMPOS_TAMANIO, contadores))
+            tramos[tramo(por_tamanio, capacidad)].update({'cajas': 1, 'objetos': sum(por_tamanio.values()), 'capacidad': capacidad})
+        OcupacionTramo.objects.bulk_create([OcupacionTramo(tramo=nombre, **valores) for nombre, valores in tramos.items()])
+
+        acciones = Counter()
+        for fila in Accion.objects.annotate(dia=TruncDate('fecha_hora')).values('dia', 'tipo').annotate(total=Count('id')):
+            acciones[(fila['dia'], fila['tipo'])] += fila['total']
+        if incluir_archivo:
+            from . import archivo
+            for registro in archivo.recorrer():
+                acciones[(timezone.localdate(parse_datetime(registro['fecha'])), registro['tipo'])] += 1
+        ResumenAcciones.objects.bulk_create(
+            [ResumenAcciones(dia=dia, tipo=tipo, total=total) for (dia, tipo), total in acciones.items()],
+            batch_size=500,
+        )
+
+        # Día de la última acción de alta de cada objeto
+        dia_alta = {
+            objeto_id: timezone.localdate(fecha)
+            for objeto_id, fecha in AccionObjetos.objects.filter(accion__tipo='agregar_objeto')
+            .values('objeto_id').annotate(fecha=Max('accion__fecha_hora')).values_list('objeto_id', 'fecha')
+            .iterator(chunk_size=5000)
+        }
+        hoy = timezone.localdate()
+        inventario = Counter()
+        contenido = (
+            CajonObjetos.objects.annotate(unidades=unidades)
+            .values_list('cajon_id', 'objeto_id', 'objeto__tipo', 'objeto__tamanio', 'unidades')
+        )
+        for cajon_id, objeto_id, tipo, tamanio, cantidad in contenido.iterator(chunk_size=5000):
+            inventario[(dia_alta.get(objeto_id, hoy), cajon_id, tipo, tamanio)] += cantidad
+        ResumenInventario.objects.bulk_create(
+            [
+                ResumenInventario(dia=dia, cajon_id=cajon_id, tipo=tipo, tamanio=tamanio, altas=n)
+                for (dia, cajon_id, tipo, tamanio), n in inventario.items()
+            ],
+            batch_size=500,
+        )
+
+    return {
+        'existencias': sum(e['cantidad'] for e in existencias),
+        'cajas': sum(valores['cajas'] for valores in tramos.values()),
+        'dias_con_acciones': len({dia for dia, _ in acciones}),
+        'filas_inventario': len(inventario),
+    }
+
+
+# Panel
+
+def panel(dias=30, cajon_id=None):
+    """
+    Datos del panel de estadísticas de los últimos `dias` días (y de una caja, si se indica)
+    """
+    Objeto, Accion = _modelo('Objeto'), _modelo('Accion')
+    desde = timezone.localdate() - timedelta(days=dias - 1)
+
+    por_tramo = {t.tramo: t for t in _modelo('OcupacionTramo').objects.all()}
+    tramos = []
+    for nombre, etiqueta in TRAMOS:
+        fila = por_tramo.get(nombre)
+        tramos.append({'tramo': nombre, 'etiqueta': etiqueta, 'cajas': fila.cajas if fila else 0})
+    total_cajas = sum(t['cajas'] for t in tramos)
+    for t in tramos:
+        t['porcentaje'] = round(t['cajas'] * 100 / total_cajas, 1) if total_cajas else 0
+    objetos = sum(t.objetos for t in por_tramo.values())
+    capacidad = sum(t.capacidad for t in por_tramo.values())
+
+    etiquetas_tipo = dict(Objeto._meta.get_field('tipo').choices)
+    etiquetas_tamanio = dict(Objeto._meta.get_field('tamanio').choices)
+    por_tipo = defaultdict(lambda: {'total': 0, 'tamanios': Counter()})
+    por_tamanio = Counter()
+    for e in _modelo('ExistenciaTipo').objects.filter(cantidad__gt=0):
+        por_tipo[e.tipo]['total'] += e.cantidad
+        por_tipo[e.tipo]['tamanios'][e.tamanio] += e.cantidad
+        por_tamanio[e.tamanio] += e.cantidad
+    # Volumen ocupado sobre la capacidad en volumen, como Cajon.porcentaje_ocupacion
+    volumen = Cajon.calcular_volumen_ocupado(por_tamanio)
+    capacidad_volumen = Cajon.calcular_capacidad(capacidad)
+    total_existencias = sum(t['total'] for t in por_tipo.values())
+    tipos = [
+        {
+            'etiqueta': etiquetas_tipo.get(tipo, tipo),
+            'total': valores['total'],
+            'porcentaje': round(valores['total'] * 100 / total_existencias, 1) if total_existencias else 0,
+            'tamanios': [(etiquetas_tamanio.get(t, t), valores['tamanios'].get(t, 0)) for t in etiquetas_tamanio],
+        }
+        for tipo, valores in sorted(por_tipo.items(), key=lambda par: -par[1]['total'])
+    ]
+
+    # Actividad por día (todos los días del periodo, aunque no tengan acciones)
+    tipos_accion = Accion._meta.get_field('tipo').choices
+    actividad = {desde + timedelta(days=n): Counter() for n in range(dias)}
+    for r in _modelo('ResumenAcciones').objects.filter(dia__gte=desde):
+        if r.dia in actividad:
+            actividad[r.dia][r.tipo] += r.total
+    maximo = max((sum(c.values()) for c in actividad.values()), default=0)
+    dias_actividad = [
+        {
+            'dia': dia,
+            'total': sum(c.values()),
+            'porcentaje': round(sum(c.values()) * 100 / maximo, 1) if maximo else 0,
+            'por_tipo': [c.get(valor, 0) for valor, _ in tipos_accion],
+        }
+        for dia, c in sorted(actividad.items(), reverse=True)
+    ]
+
+    caja = None
+    if cajon_id is not None:
+        caja = {'altas': 0, 'bajas': 0, 'por_tipo': []}
+        por_tipo_caja = defaultdict(Counter)
+        for r in _modelo('ResumenInventario').objects.filter(cajon_id=cajon_id, dia__gte=desde):
+            por_tipo_caja[r.tipo].update({'altas': r.altas, 'bajas': r.bajas})
+        for tipo, valores in sorted(por_tipo_caja.items()):
+            caja['por_tipo'].append({'etiqueta': etiquetas_tipo.get(tipo, tipo), **valores})
+            caja['altas'] += valores['altas']
+            caja['bajas'] += valores['bajas']
+
+    return {
+        'dias': dias,
+        'tramos': tramos,
+        'total_cajas': total_cajas,
+        'objetos': objetos,
+        'capacidad': capacidad,
+        'ocupacion': round(volumen * 100 / capacidad_volumen, 1) if capacidad_volumen else 0,
+        'tipos': tipos,
+        'tipos_accion': [etiqueta for _, etiqueta in tipos_accion],
+        'actividad': dias_actividad,
+        'caja': caja,
+    }
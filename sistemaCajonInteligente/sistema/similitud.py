@@ -0,0 +1,240 @@
+"""
+Similitud visual entre fotos de objetos.
+
+Cada foto tiene un hash perceptual de 64 bits (dHash). Dos fotos parecidas tienen
+hashes a poca distancia de Hamming. Para buscar sin comparar contra todo el
+inventario se usa un índice de hashing multi-índice: el hash se parte en 4 bloques
+de 16 bits y, si dos hashes están a distancia <= k, al menos un bloque está a
+distancia <= k // 4 (principio del palomar). Cada bloque se guarda ordenado en
+un array de NumPy y se busca con searchsorted.
+"""
+import threading
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .models import Objeto
+from .recarga import IndiceRecargable
+
+BLOQUES = 4
+BITS_BLOQUE = 16
+MASCARA_BLOQUE = (1 << BITS_BLOQUE) - 1
+
+# Tamaño del búfer de altas recientes antes de reordenar los bloques
+MAX_PENDIENTES = 4096
+
+
+def calcular_dhash(imagen):
+    """
+    dHash de 64 bits: compara cada píxel con su vecino derecho en una versión 9x8 en grises.
+    Se devuelve con signo para guardarlo en un BigIntegerField.
+    """
+    gris = np.asarray(imagen.convert('L').resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = (gris[:, 1:] > gris[:, :-1]).flatten()
+    valor = int(np.packbits(bits).view('>u8')[0])
+    return a_con_signo(valor)
+
+
+def a_con_signo(valor):
+    return valor - (1 << 64) if valor >= (1 << 63) else valor
+
+
+def a_sin_signo(valor):
+    return valor & ((1 << 64) - 1)
+
+
+if hasattr(np, 'bitwise_count'):
+    def _contar_bits(valores):
+        return np.bitwise_count(valores)
+else:
+    _BITS_POR_BYTE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _contar_bits(valores):
+        return _BITS_POR_BYTE[valores.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+@lru_cache(maxsize=None)
+def _vecinos(radio):
+    """
+    Máscaras de 16 bits con hasta `radio` bits a 1 (para variar un bloque)
+    """
+    mascaras = [0]
+    for _ in range(radio):
+        mascaras = sorted({m | (1 << bit) for m in mascaras for bit in range(BITS_BLOQUE)} | set(mascaras))
+    return np.array(mascaras, dtype=np.uint64)
+
+
+class IndiceSimilitud:
+    """
+    Índice en memoria de hashes perceptuales. Admite altas y bajas incrementales.
+    """
+
+    def __init__(self):
+        self._candado = threading.RLock()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.hashes = np.empty(0, dtype=np.uint64)
+        # Para cada bloque: posiciones ordenadas por el valor del bloque y los valores ordenados
+        self._orden = [np.empty(0, dtype=np.int64) for _ in range(BLOQUES)]
+        self._valores = [np.empty(0, dtype=np.uint64) for _ in range(BLOQUES)]
+        self._pendientes = {}
+        self._eliminados = set()
+        self.ultimo_id = 0
+
+    def __len__(self):
+        return len(self.ids) + len(self._pendientes) - len(self._eliminados)
+
+    def agregar(self, objeto_id, valor):
+        with self._candado:
+            self._eliminados.discard(objeto_id)
+            self._pendientes[objeto_id] = a_sin_signo(valor)
+            self.ultimo_id = max(self.ultimo_id, objeto_id)
+            if len(self._pendientes) >= MAX_PENDIENTES:
+                self._consolidar()
+
+    def quitar(self, objeto_id):
+        with self._candado:
+            if self._pendientes.pop(objeto_id, None) is None:
+                self._eliminados.add(objeto_id)
+
+    def _consolidar(self):
+        """
+        Pasa las altas pendientes a los arrays ordenados
+        """
+        if not self._pendientes and not self._eliminados:
+            return
+        conservar = ~np.isin(self.ids, list(self._eliminados) + list(self._pendientes))
+        self.ids = np.concatenate([self.ids[conservar], np.fromiter(self._pendientes.keys(), dtype=np.int64)])
+        self.hashes = np.concatenate([self.hashes[conservar], np.fromiter(self._pendientes.values(), dtype=np.uint64)])
+        for bloque in range(BLOQUES):
+            valores = (self.hashes >> np.uint64(bloque * BITS_BLOQUE)) & np.uint64(MASCARA_BLOQUE)
+            orden = np.argsort(valores, kind='stable')
+            self._orden[bloque] = orden
+            self._valores[bloque] = valores[orden]
+        self._pendientes = {}
+        self._eliminados = set()
+
+    def buscar(self, valor, distancia):
+        """
+        Devuelve [(objeto_id, distancia)] con los hashes a distancia de Hamming <= `distancia`,
+        ordenados del más parecido al menos parecido
+        """
+        valor = np.uint64(a_sin_signo(valor))
+        mascaras = _vecinos(distancia // BLOQUES)
+
+        with self._candado:
+            posiciones = []
+            for bloque in range(BLOQUES):
+                desplazamiento = np.uint64(bloque * BITS_BLOQUE)
+                objetivo = (valor >> desplazamiento) & np.uint64(MASCARA_BLOQUE)
+                # XOR con máscaras distintas da valores distintos: basta con ordenarlos
+                buscados = np.sort(objetivo ^ mascaras)
+                inicio = np.searchsorted(self._valores[bloque], buscados, side='left')
+                fin = np.searchsorted(self._valores[bloque], buscados, side='right')
+                # Concatenar los rangos [inicio, fin) sin recorrerlos uno a uno
+                longitudes = fin - inicio
+                total = int(longitudes.sum())
+                if total:
+                    desplazamientos = np.repeat(inicio - np.cumsum(longitudes) + longitudes, longitudes)
+                    posiciones.append(self._orden[bloque][desplazamientos + np.arange(total)])
+
+            resultado = []
+            if posiciones:
+                candidatos = np.concatenate(posiciones)
+                distancias = _contar_bits(self.hashes[candidatos] ^ valor)
+                cerca = distancias <= distancia
+                # Un mismo hash puede aparecer por varios bloques: se quitan repetidos al final
+                candidatos, primeras = np.unique(candidatos[cerca], return_index=True)
+                for objeto_id, d in zip(self.ids[candidatos], distancias[cerca][primeras]):
+                    if int(objeto_id) not in self._eliminados and int(objeto_id) not in self._pendientes:
+                        resultado.append((int(objeto_id), int(d)))
+
+            # Las altas recientes se comparan directamente
+            for objeto_id, otro in self._pendientes.items():
+                d = (int(valor) ^ otro).bit_count()
+                if d <= distancia:
+                    resultado.append((objeto_id, d))
+
+        resultado.sort(key=lambda par: (par[1], par[0]))
+        return resultado
+
+    def cargar(self, desde_id=0):
+        """
+        Agrega los objetos con hash cuyo id sea mayor que `desde_id`, por lotes
+        """
+        filas = (
+            Objeto.objects.filter(id__gt=desde_id, imagen_phash__isnull=False)
+            .order_by('id').values_list('id', 'imagen_phash')
+        )
+        with self._candado:
+            for objeto_id, valor in filas.iterator(chunk_size=10000):
+                self._pendientes[objeto_id] = a_sin_signo(valor)
+                self.ultimo_id = max(self.ultimo_id, objeto_id)
+            if desde_id == 0 or len(self._pendientes) >= MAX_PENDIENTES:
+                self._consolidar()
+
+
+def _construir():
+    indice = IndiceSimilitud()
+    indice.cargar()
+    return indice
+
+
+_indice = IndiceRecargable(_construir, 'indice-similitud')
+
+
+def obtener_indice():
+    """
+    Índice del proceso. Se construye la primera vez y después solo se agregan los objetos
+    nuevos; cada SIMILITUD['RECARGA_SEGUNDOS'] se reconstruye completo en segundo plano
+    para recoger cambios hechos por otros procesos, sin esperar en la petición.
+    """
+    indice = _indice.obtener(settings.SIMILITUD['RECARGA_SEGUNDOS'])
+    indice.cargar(desde_id=indice.ultimo_id)
+    return indice
+
+
+def registrar_hash(objeto_id, valor):
+    """
+    Agrega un hash recién calculado al índice del proceso, si ya está construido
+    """
+    if valor is not None:
+        _indice.aplicar(lambda indice: indice.agregar(objeto_id, valor))
+
+
+def quitar_objetos(objeto_ids):
+    objeto_ids = list(objeto_ids)
+
+    def quitar(indice):
+        for objeto_id in objeto_ids:
+            indice.quitar(objeto_id)
+    _indice.aplicar(quitar)
+
+
+def objetos_similares(objetos, distancia=None, limite=5):
+    """
+    Para cada objeto con foto, busca objetos de cualquier caja con una foto parecida.
+    Devuelve [(objeto, [objetos similares])] consultando la base de datos una sola vez.
+    """
+    distancia = settings.SIMILITUD['DISTANCIA'] if distancia is None else distancia
+    con_hash = [objeto for objeto in objetos if objeto.imagen_phash is not None]
+    if not con_hash:
+        return []
+
+    indice = obtener_indice()
+    parejas = []
+    for objeto in con_hash:
+        encontrados = [objeto_id for objeto_id, _ in indice.buscar(objeto.imagen_phash, distancia) if objeto_id != objeto.id]
+        if encontrados:
+            parejas.append((objeto, encontrados[:limite]))
+
+    similares = Objeto.objects.prefetch_related('cajones').in_bulk(
+        {objeto_id for _, encontrados in parejas for objeto_id in encontrados}
+    )
+    resultado = []
+    for objeto, encontrados in parejas:
+        lista = [similares[objeto_id] for objeto_id in encontrados if objeto_id in similares]
+        if lista:
+            resultado.append((objeto, lista))
+    return resultado
@@ -1,3 +1,2022 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import F, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import archivo, busqueda, clasificador, enrutador, eventos, exportacion, fragmentos, imagenes, instrumentacion, inventario, parecidos, similitud, views
+from .bitacora import BitacoraEnCola, EntradaAccion, obtener_bitacora
+from .busqueda import buscar
+from .caracteristicas import DIMENSION, calcular_lote
+from .carga_clasificador import foto_sintetica
+from .datos_sinteticos import generar
+from .duplicados import apilar_duplicados, cajas_con_duplicados, grupos_duplicados
+from .importacion import importar_objetos
+from .organizador import calcular_plan, organizar
+from .paginacion import codificar_cursor
+from .recarga import IndiceRecargable
+from .models import Cajon, Contenido, Objeto, Accion, ExistenciaTipo, OcupacionTramo, ResumenAcciones, ResumenInventario
+from .resumenes import reconstruir as reconstruir_resumenes
+
+
+def unidades(caja=None):
+    """
+    Unidades guardadas en la caja (o en todas): lo que cuentan total_objetos y los resúmenes
+    """
+    contenido = Contenido.objects.filter(cajon=caja) if caja else Contenido.objects.all()
+    return contenido.aggregate(total=Sum('cantidad'))['total'] or 0
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ConsultasPorVistaTests(TestCase):
+    """
+    Número de consultas de cada vista. Si una vista empieza a hacer una consulta por
+    objeto o por acción (N+1), estas pruebas fallan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        generar(objetos=400, objetos_por_caja=20, proporcion_duplicados=0.2, semilla=7)
+
+    def setUp(self):
+        cache.clear()
+        caches['fragmentos'].clear()
+
+    def cajas_por_tamanio(self):
+        cajas = Cajon.objects.order_by('total_objetos', 'id')
+        return cajas.first(), cajas.last()
+
+    def test_detalle_caja_no_depende_del_numero_de_objetos(self):
+        pequena, grande = self.cajas_por_tamanio()
+        self.assertLess(pequena.total_objetos, grande.total_objetos)
+        for orden in ('nombre', 'tipo', 'tamanio'):
+            with self.subTest(orden=orden):
+                # Caja, acción de visualizar (comprobación, savepoint, INSERT, resumen
+                # de acciones, release), primera página, grupos de duplicados de la
+                # página, objetos que comparten una banda con los de la página y objetos
+                # con nombres parecidos
+                for caja in (pequena, grande):
+                    with self.assertNumQueries(10):
+                        self.client.get(reverse('detalle_caja', args=[caja.id]), {'orden': orden})
+
+    def test_parecidos_sin_recorrer_la_caja(self):
+        # Una caja grande: los parecidos de la primera página (por tipo) se encuentran al
+        # final de la caja con las mismas consultas que en una caja pequeña, usando los
+        # índices de las bandas de la firma
+        caja = Cajon.objects.create(nombre='Enorme', capacidadMaxima=2000)
+        inventario.agregar_objetos(caja.id, [
+            Objeto(nombre=f'Tornillo {numero}', tipo='herramientas', tamanio='pequeno') for numero in range(3000)
+        ])
+        inventario.agregar_objetos(caja.id, [
+            Objeto(nombre='Alicate universal', tipo='cables', tamanio='mediano'),
+            Objeto(nombre='alicates universales', tipo='ropa', tamanio='mediano'),
+        ])
+        caja.refresh_from_db()
+        with CaptureQueriesContext(connection) as consultas:
+            with self.assertNumQueries(10):
+                respuesta = self.client.get(reverse('detalle_caja', args=[caja.id]), {'orden': 'tipo'})
+        self.assertEqual(
+            [[objeto.nombre for objeto in grupo] for grupo in respuesta.context['parecidos']],
+            [['Alicate universal', 'alicates universales']],
+        )
+        candidatos = next(consulta['sql'] for consulta in consultas if 'SUBSTR' in consulta['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {candidatos}')
+            plan = ' '.join(str(fila[-1]) for fila in cursor.fetchall())
+        self.assertIn('objeto_firma_banda', plan)
+        self.assertNotIn('SCAN', plan)
+
+    def test_detalle_caja_en_cache(self):
+        caja = self.cajas_por_tamanio()[1]
+        url = reverse('detalle_caja', args=[caja.id])
+        self.client.get(url)
+        # Sin los objetos ni los duplicados, que vienen de la caché
+        with self.assertNumQueries(6):
+            self.client.get(url)
+
+    def test_detalle_caja_paginado(self):
+        caja = Cajon.objects.create(nombre='Grande', capacidadMaxima=500)
+        tamanios = ('grande', 'pequeno', 'mediano')
+        inventario.agregar_objetos(caja.id, [
+            Objeto(nombre=f'Objeto {numero % 37}', tipo=('cables', 'papeleria')[numero % 2], tamanio=tamanios[numero % 3])
+            for numero in range(130)
+        ])
+        # Renombrar un objeto actualiza el orden guardado en su fila de Contenido
+        objeto = caja.objetos.order_by('id').first()
+        objeto.nombre = 'Abrelatas'
+        objeto.save()
+
+        rangos = {'pequeno': 1, 'mediano': 2, 'grande': 3}
+        claves = {
+            'nombre': lambda objeto: (objeto.nombre, objeto.id),
+            'tipo': lambda objeto: (objeto.tipo, objeto.nombre, objeto.id),
+            'tamanio': lambda objeto: (rangos[objeto.tamanio], objeto.nombre, objeto.id),
+        }
+        for orden, clave in claves.items():
+            with self.subTest(orden=orden):
+                respuesta = self.client.get(reverse('detalle_caja', args=[caja.id]), {'orden': orden})
+                vistos = list(respuesta.context['objetos'])
+                siguiente = respuesta.context['siguiente']
+                while siguiente:
+                    # Caja, página y duplicados de la página
+                    with self.assertNumQueries(3):
+                        respuesta = self.client.get(reverse('objetos_caja', args=[caja.id]), {'orden': orden, 'despues': siguiente})
+                    vistos.extend(respuesta.context['objetos'])
+                    siguiente = respuesta.context['siguiente']
+                self.assertEqual([objeto.id for objeto in vistos], [objeto.id for objeto in sorted(caja.objetos.all(), key=clave)])
+
+    def test_historial_acciones(self):
+        # Página, objetos afectados, conteo total y cajas del filtro
+        with self.assertNumQueries(4):
+            respuesta = self.client.get(reverse('historial_acciones'))
+        self.assertEqual(len(respuesta.context['acciones']), 20)
+
+        # El total ya está en caché
+        with self.assertNumQueries(3):
+            self.client.get(reverse('historial_acciones'), {'despues': respuesta.context['acciones'].cursor_siguiente})
+
+    def test_crear_caja(self):
+        # Con la transacción del alta, el tramo de ocupación de la caja nueva y el
+        # resumen de acciones
+        with self.assertNumQueries(9):
+            self.client.post(reverse('crear_caja'), {'nombre': 'Nueva', 'capacidadMax': '10'})
+        self.assertTrue(Cajon.objects.filter(nombre='Nueva').exists())
+
+    def test_listas_no_dependen_del_numero_de_objetos(self):
+        # Cajas, objetos y sus cajas (prefetch) para el formulario de añadir objeto
+        with self.assertNumQueries(3):
+            respuesta = self.client.get(reverse('añadir_objeto'))
+        self.assertEqual(len(respuesta.context['objetos']), Objeto.objects.count())
+        # Cajas y últimas acciones
+        with self.assertNumQueries(2):
+            self.client.get(reverse('crear_caja'))
+
+    def test_añadir_objeto(self):
+        caja = Cajon.objects.first()
+        # Los resúmenes suman un número fijo de consultas: inventario, existencias,
+        # tramo de ocupación (lectura y escritura) y acciones. Una más busca un objeto
+        # igual en la caja sobre el que apilar la unidad.
+        with self.assertNumQueries(19):
+            self.client.post(reverse('añadir_objeto'), {
+                'nombre': 'Cable HDMI', 'tipoObjeto': 'cables', 'tamanio': 'pequeno', 'caja': caja.id,
+            })
+        caja.refresh_from_db()
+        self.assertEqual(caja.total_objetos, unidades(caja))
+
+    def test_eliminar_objeto(self):
+        objeto = Objeto.objects.first()
+        with self.assertNumQueries(22):
+            self.client.post(reverse('eliminar_objeto', args=[objeto.id]))
+        self.assertFalse(Objeto.objects.filter(id=objeto.id).exists())
+
+    def test_eliminar_duplicados_no_depende_del_numero_de_duplicados(self):
+        caja_ids = list(cajas_con_duplicados())
+        self.assertGreater(len(caja_ids), 1)
+        for caja_id in caja_ids:
+            with self.assertNumQueries(24):
+                self.client.post(reverse('eliminar_duplicados', args=[caja_id]))
+        self.assertFalse(cajas_con_duplicados().exists())
+        self.assertEqual(Accion.objects.filter(tipo='organizar_caja').count(), len(caja_ids))
+
+
+class BitacoraDePrueba(BitacoraEnCola):
+    """
+    Bitácora en cola que guarda los lotes en memoria en lugar de escribirlos. Con `retener`
+    sin activar el hilo no toma lotes de la cola.
+    """
+
+    def __init__(self, **opciones):
+        super().__init__(**opciones)
+        self.lotes = []
+        self.retener = threading.Event()
+        self.retener.set()
+
+    def _tomar_lote(self):
+        self.retener.wait(5)
+        return super()._tomar_lote()
+
+    def _escribir(self, entradas):
+        self.lotes.append([entrada.descripcion for entrada in entradas])
+        self.escritas += len(entradas)
+
+
+class BitacoraEnColaTests(TestCase):
+    """
+    La bitácora en cola escribe por lotes completos o al pasar el intervalo, solo encola al
+    confirmar la transacción y descarta lo que no cabe en la cola
+    """
+
+    def crear(self, **opciones):
+        bitacora = BitacoraDePrueba(**opciones)
+        self.addCleanup(bitacora.cerrar)
+        return bitacora
+
+    def registrar(self, bitacora, *descripciones):
+        with self.captureOnCommitCallbacks(execute=True):
+            for descripcion in descripciones:
+                bitacora.registrar(EntradaAccion(tipo='visualizar_caja', descripcion=descripcion))
+
+    def test_escribe_al_completar_el_lote(self):
+        bitacora = self.crear(TAMANIO_LOTE=3, INTERVALO=2)
+        inicio = time.monotonic()
+        self.registrar(bitacora, 'a', 'b', 'c')
+        bitacora.vaciar()
+        # No espera al intervalo
+        self.assertLess(time.monotonic() - inicio, 1.5)
+        self.assertEqual(bitacora.lotes, [['a', 'b', 'c']])
+
+    def test_escribe_al_pasar_el_intervalo(self):
+        bitacora = self.crear(TAMANIO_LOTE=100, INTERVALO=0.05)
+        self.registrar(bitacora, 'a', 'b')
+        bitacora.vaciar()
+        self.assertEqual(bitacora.lotes, [['a', 'b']])
+        self.assertEqual(bitacora.estadisticas()['escritas'], 2)
+
+    def test_encola_al_confirmar(self):
+        bitacora = self.crear(TAMANIO_LOTE=100, INTERVALO=0.05)
+        with self.captureOnCommitCallbacks() as confirmar:
+            bitacora.registrar(EntradaAccion(tipo='visualizar_caja', descripcion='a'))
+        self.assertEqual(bitacora.encoladas, 0)
+        for funcion in confirmar:
+            funcion()
+        bitacora.vaciar()
+        self.assertEqual(bitacora.lotes, [['a']])
+
+    def test_lote_completo_sin_cola(self):
+        bitacora = self.crear(TAMANIO_LOTE=3, INTERVALO=0.05)
+        bitacora.registrar_varias([EntradaAccion(tipo='visualizar_caja', descripcion=letra) for letra in 'abc'])
+        # Se escribe en el hilo que registra, dentro de su transacción
+        self.assertEqual(bitacora.lotes, [['a', 'b', 'c']])
+        self.assertIsNone(bitacora._hilo)
+
+    def test_descarta_si_la_cola_esta_llena(self):
+        bitacora = self.crear(TAMANIO_LOTE=100, INTERVALO=0.05, TAMANIO_COLA=2)
+        bitacora.retener.clear()
+        with self.assertLogs('sistema.bitacora', 'WARNING'):
+            self.registrar(bitacora, 'a', 'b', 'c', 'd', 'e')
+        self.assertEqual(bitacora.pendientes(), 2)
+        bitacora.retener.set()
+        bitacora.vaciar()
+        self.assertEqual(bitacora.lotes, [['a', 'b']])
+        self.assertEqual(bitacora.estadisticas(), {
+            'encoladas': 2, 'escritas': 2, 'descartadas': 3, 'fallidas': 0, 'pendientes': 0,
+        })
+
+    def test_escribe_lo_pendiente_al_cerrar(self):
+        bitacora = self.crear(TAMANIO_LOTE=100, INTERVALO=0.2)
+        self.registrar(bitacora, 'a')
+        bitacora.cerrar()
+        self.assertEqual(bitacora.lotes, [['a']])
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ContadoresTests(TestCase):
+    """
+    recalcular_ocupacion encuentra y corrige los contadores de las cajas que no coinciden con
+    sus unidades, y mueve de tramo las cajas corregidas
+    """
+
+    def setUp(self):
+        self.caja = Cajon.objects.create(nombre='Caja', capacidadMaxima=10)
+        self.bien = Cajon.objects.create(nombre='Bien', capacidadMaxima=10)
+        for caja in (self.caja, self.bien):
+            inventario.agregar_objetos(caja.id, [
+                Objeto(nombre='Tornillo', tipo='herramientas', tamanio='pequeno'),
+                Objeto(nombre='Tornillo', tipo='herramientas', tamanio='pequeno'),
+                Objeto(nombre='Taladro', tipo='herramientas', tamanio='grande'),
+            ])
+        # Contadores desviados, con los tramos de ocupación calculados a partir de ellos
+        Cajon.objects.filter(id=self.caja.id).update(total_objetos=9, total_pequenos=0, total_grandes=9)
+        reconstruir_resumenes()
+
+    def contadores(self, caja):
+        return Cajon.objects.values_list('total_objetos', 'total_pequenos', 'total_medianos', 'total_grandes').get(id=caja.id)
+
+    def test_solo_revisar(self):
+        salida = io.StringIO()
+        call_command('recalcular_ocupacion', '--solo-revisar', stdout=salida)
+        self.assertIn(f'Caja {self.caja.id} "Caja"', salida.getvalue())
+        self.assertIn('2 cajas revisadas, 1 con diferencias', salida.getvalue())
+        self.assertEqual(self.contadores(self.caja), (9, 0, 0, 9))
+
+    def test_reparar(self):
+        version = Cajon.objects.get(id=self.caja.id).version
+        diferencias = inventario.recalcular_ocupacion([self.caja.id, self.bien.id])
+        self.assertEqual([(caja.id, real['total_objetos']) for caja, _, real in diferencias], [(self.caja.id, 3)])
+        self.assertEqual(self.contadores(self.caja), (3, 2, 0, 1))
+        self.assertEqual(self.contadores(self.bien), (3, 2, 0, 1))
+        # La caja corregida cambia de versión (cachés y ETag) y de tramo
+        self.assertEqual(Cajon.objects.get(id=self.caja.id).version, version + 1)
+        tramos = set(OcupacionTramo.objects.filter(cajas__gt=0).values_list('tramo', 'cajas', 'objetos', 'capacidad'))
+        reconstruir_resumenes()
+        self.assertEqual(tramos, set(OcupacionTramo.objects.filter(cajas__gt=0).values_list('tramo', 'cajas', 'objetos', 'capacidad')))
+
+        self.assertEqual(inventario.recalcular_ocupacion([self.caja.id, self.bien.id]), [])
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class FragmentosTests(TestCase):
+    """
+    La caché del detalle de las cajas se invalida con cada cambio de su contenido (nueva
+    versión de la caja) y no la de las demás cajas
+    """
+
+    def setUp(self):
+        caches['fragmentos'].clear()
+        self.taller = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+        self.oficina = Cajon.objects.create(nombre='Oficina', capacidadMaxima=10)
+        inventario.agregar_objetos(self.taller.id, [
+            Objeto(nombre=nombre, tipo='herramientas', tamanio='pequeno') for nombre in ('Lima', 'Martillo', 'Martillo')
+        ])
+        inventario.agregar_objetos(self.oficina.id, [Objeto(nombre='Grapadora', tipo='papeleria', tamanio='pequeno')])
+
+    def detalle(self, caja):
+        """
+        (nombre, unidades) de los objetos de la caja, los nombres de sus duplicados y si vino de la caché
+        """
+        fallos = fragmentos.estadisticas()['fallos']
+        contexto = self.client.get(reverse('detalle_caja', args=[caja.id])).context
+        objetos = [(objeto.nombre, objeto.cantidad) for objeto in contexto['objetos']]
+        sugerencias = [sugerencia['nombre'] for sugerencia in contexto['sugerencias']]
+        return objetos, sugerencias, fragmentos.estadisticas()['fallos'] == fallos
+
+    def comprobar(self, cambiar, taller, oficina_cambia=False):
+        for caja in (self.taller, self.oficina):
+            self.detalle(caja)
+        oficina = self.detalle(self.oficina)
+        self.assertTrue(oficina[2])
+
+        cambiar()
+        self.assertEqual(self.detalle(self.taller), (*taller, False))
+        self.assertEqual(self.detalle(self.oficina)[2], not oficina_cambia)
+
+    def test_añadir_y_quitar(self):
+        self.comprobar(
+            lambda: self.client.post(reverse('añadir_objeto'), {
+                'nombre': 'Alicates', 'tipoObjeto': 'herramientas', 'tamanio': 'pequeno', 'caja': self.taller.id,
+            }),
+            ([('Alicates', 1), ('Lima', 1), ('Martillo', 2)], []),
+        )
+        martillo = Objeto.objects.get(nombre='Martillo')
+        self.comprobar(
+            lambda: self.client.post(reverse('eliminar_objeto', args=[martillo.id]), {'caja': self.taller.id, 'unidades': 1}),
+            ([('Alicates', 1), ('Lima', 1), ('Martillo', 1)], []),
+        )
+        self.comprobar(
+            lambda: self.client.post(reverse('eliminar_objeto', args=[martillo.id])),
+            ([('Alicates', 1), ('Lima', 1)], []),
+        )
+
+    def test_apilar_duplicados(self):
+        # Un duplicado en su propia fila (datos anteriores al apilado)
+        lima = Objeto.objects.create(nombre='lima', tipo='herramientas', tamanio='pequeno')
+        Contenido.objects.create(cajon=self.taller, objeto=lima)
+        self.assertEqual(self.detalle(self.taller)[1], ['Lima'])
+        self.comprobar(
+            lambda: self.client.post(reverse('eliminar_duplicados', args=[self.taller.id])),
+            ([('Lima', 2), ('Martillo', 2)], []),
+        )
+
+    def test_organizar_invalida_las_dos_cajas(self):
+        Cajon.objects.filter(id=self.taller.id).update(capacidadMaxima=1)
+        self.comprobar(
+            lambda: self.client.post(reverse('organizar_cajas')),
+            ([('Martillo', 2)], []),
+            oficina_cambia=True,
+        )
+
+    def test_foto_procesada(self):
+        martillo = Objeto.objects.get(nombre='Martillo')
+        self.comprobar(lambda: inventario.invalidar_cajas_de([martillo.id]), ([('Lima', 1), ('Martillo', 2)], []))
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class CapacidadTests(TestCase):
+    """
+    Agregar objetos respeta la capacidad de las cajas (volumen según el tamaño, medida en
+    objetos medianos): la reserva de sitio se rechaza, se redirige a otra caja o, en
+    bloque, es todo o nada
+    """
+
+    def setUp(self):
+        self.llena = Cajon.objects.create(nombre='Llena', capacidadMaxima=2)
+        self.holgada = Cajon.objects.create(nombre='Holgada', capacidadMaxima=50)
+        self.justa = Cajon.objects.create(nombre='Justa', capacidadMaxima=3)
+
+    def agregar(self, caja, **datos):
+        return self.client.post(reverse('añadir_objeto'), {
+            'nombre': 'Cable', 'tipoObjeto': 'cables', 'tamanio': 'mediano', 'caja': caja.id, **datos,
+        }, follow=True)
+
+    def objetos(self, cantidad):
+        return [Objeto(nombre=f'Tornillo {numero}', tipo='herramientas', tamanio='mediano') for numero in range(cantidad)]
+
+    def comprobar_contadores(self):
+        for caja in Cajon.objects.all():
+            self.assertEqual(caja.total_objetos, unidades(caja))
+            self.assertLessEqual(caja.porcentaje_ocupacion, 100)
+
+    def test_rechaza_si_esta_llena(self):
+        for _ in range(3):
+            respuesta = self.agregar(self.llena)
+        self.assertContains(respuesta, 'no tiene sitio')
+        # El segundo cable se apila sobre el primero
+        self.assertEqual(unidades(self.llena), 2)
+        self.assertEqual(Objeto.objects.count(), 1)
+        self.comprobar_contadores()
+
+    def test_redirige_a_la_caja_mas_ajustada(self):
+        for _ in range(3):
+            respuesta = self.agregar(self.llena, redirigir='1')
+        self.assertContains(respuesta, 'el objeto se guardó en &quot;Justa&quot;')
+        self.assertEqual(self.justa.objetos.count(), 1)
+        self.assertEqual(Accion.objects.filter(tipo='agregar_objeto', cajon=self.justa).count(), 1)
+        self.comprobar_contadores()
+
+    def test_reserva_en_bloque(self):
+        with self.assertRaises(inventario.CajaLlena):
+            inventario.agregar_objetos(self.justa.id, self.objetos(4))
+        self.assertFalse(self.justa.objetos.exists())
+
+        self.assertEqual(inventario.agregar_objetos(self.justa.id, self.objetos(4), redirigir=True)[0], self.holgada.id)
+        self.assertEqual(inventario.agregar_objetos(self.justa.id, self.objetos(3))[0], self.justa.id)
+        self.assertEqual(self.justa.objetos.count(), 3)
+        self.comprobar_contadores()
+
+    def test_reserva_por_volumen(self):
+        # Un grande y un mediano llenan una caja de tres medianos; no cabe ni un pequeño
+        grande = Objeto(nombre='Caja', tipo='juguetes', tamanio='grande')
+        self.assertEqual(inventario.reservar(self.justa.id, [grande, *self.objetos(2)], parcial=True), 2)
+        self.assertEqual(inventario.reservar(self.justa.id, [Objeto(nombre='Clip', tipo='papeleria', tamanio='pequeno')]), 0)
+        self.justa.refresh_from_db()
+        self.assertEqual((self.justa.total_objetos, self.justa.porcentaje_ocupacion), (2, 100))
+
+        # Cuatro pequeños ocupan lo mismo que dos medianos
+        pequenos = [Objeto(nombre=f'Clip {numero}', tipo='papeleria', tamanio='pequeno') for numero in range(5)]
+        self.assertEqual(inventario.reservar(self.llena.id, pequenos, parcial=True), 4)
+
+    def test_organizador_usa_la_misma_capacidad(self):
+        inventario.agregar_objetos(self.justa.id, [
+            Objeto(nombre='Caja', tipo='juguetes', tamanio='grande'), Objeto(nombre='Peluche', tipo='juguetes', tamanio='mediano'),
+        ])
+        inventario.agregar_objetos(self.holgada.id, self.objetos(50))
+        # Un grande y un mediano en una caja de tres medianos no la sobrecargan: el
+        # organizador no mueve nada
+        self.client.post(reverse('organizar_cajas'))
+        self.assertEqual(unidades(self.justa), 2)
+        self.assertContains(self.agregar(self.holgada), 'no tiene sitio')
+        self.assertContains(self.agregar(self.llena), 'exitosamente')
+        self.comprobar_contadores()
+
+    def test_importacion_rechaza_las_filas_que_no_caben(self):
+        filas = ''.join(f'Tornillo {numero},herramientas,mediano,{self.justa.id}\n' for numero in range(5))
+        resultado = importar_objetos(io.StringIO('nombre,tipo,tamanio,caja\n' + filas))
+        self.assertEqual(resultado.creados, 3)
+        self.assertEqual([fila for fila, _ in resultado.errores], [5, 6])
+        self.comprobar_contadores()
+
+
+class ReservaConcurrenteTests(TransactionTestCase):
+    """
+    Varios hilos, cada uno con su conexión, reservan a la vez sitio en la misma caja: la
+    reserva condicional no deja que la llenen de más aunque todos lean la misma ocupación
+    """
+
+    HILOS = 8
+    POR_HILO = 3
+    INTENTOS_BLOQUEO = 50
+
+    def reservar_a_la_vez(self, cajon_id, objetos_por_hilo, **opciones):
+        barrera = threading.Barrier(len(objetos_por_hilo))
+        reservadas, errores = [], []
+
+        def reservar(objetos):
+            try:
+                barrera.wait(5)
+                for intento in range(self.INTENTOS_BLOQUEO):
+                    try:
+                        reservadas.append(inventario.reservar(cajon_id, objetos, **opciones))
+                        break
+                    except OperationalError as error:
+                        # La base de datos de las pruebas está en memoria con caché compartida:
+                        # SQLite no espera al bloqueo (busy_timeout) como con el archivo. La
+                        # sentencia que falla no cambia nada y se puede repetir.
+                        if 'locked' not in str(error) or intento == self.INTENTOS_BLOQUEO - 1:
+                            raise
+                        time.sleep(0.01)
+            except Exception as error:
+                errores.append(error)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=reservar, args=(objetos,)) for objetos in objetos_por_hilo]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(30)
+        self.assertEqual(errores, [])
+        return reservadas
+
+    def objetos(self, hilo, tamanios=('mediano',)):
+        return [
+            Objeto(nombre=f'Tornillo {hilo}-{numero}', tipo='herramientas', tamanio=tamanios[numero % len(tamanios)])
+            for numero in range(self.POR_HILO)
+        ]
+
+    def test_todo_o_nada(self):
+        # Caben dos lotes de tres medianos y sobra sitio para uno: solo dos hilos reservan
+        caja = Cajon.objects.create(nombre='Disputada', capacidadMaxima=2 * self.POR_HILO + 1)
+        reservadas = self.reservar_a_la_vez(caja.id, [self.objetos(hilo) for hilo in range(self.HILOS)])
+        self.assertEqual(sorted(reservadas), [0] * (self.HILOS - 2) + [self.POR_HILO] * 2)
+        caja.refresh_from_db()
+        self.assertEqual((caja.total_objetos, caja.total_medianos, caja.version), (2 * self.POR_HILO, 2 * self.POR_HILO, 2))
+
+    def test_parcial(self):
+        # Lotes de tamaños mezclados: los contadores suman justo lo reservado, sin pasarse
+        caja = Cajon.objects.create(nombre='Disputada', capacidadMaxima=self.HILOS * self.POR_HILO // 2 + 1)
+        lotes = [self.objetos(hilo, ('grande', 'pequeno', 'mediano')) for hilo in range(self.HILOS)]
+        reservadas = self.reservar_a_la_vez(caja.id, lotes, parcial=True)
+        reservados = [objeto for lote, cantidad in zip(lotes, reservadas) for objeto in lote[:cantidad]]
+        caja.refresh_from_db()
+        self.assertEqual(caja.total_objetos, len(reservados))
+        self.assertEqual(caja.volumen_ocupado, sum(Objeto.calcular_volumen(objeto.tamanio) for objeto in reservados))
+        self.assertLessEqual(caja.volumen_ocupado, Cajon.calcular_capacidad(caja.capacidadMaxima))
+        self.assertEqual(caja.version, sum(1 for cantidad in reservadas if cantidad))
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ImportacionTests(TestCase):
+    """
+    Importación masiva: lotes en su propia transacción, una acción por caja y lote, y las
+    filas con errores se informan sin detener el resto
+    """
+
+    def setUp(self):
+        self.taller = Cajon.objects.create(nombre='Taller', capacidadMaxima=50)
+        self.oficina = Cajon.objects.create(nombre='Oficina', capacidadMaxima=50)
+
+    def test_lotes(self):
+        cajas = (self.taller.id, self.oficina.id)
+        filas = ''.join(f'Pieza {numero},herramientas,pequeno,{cajas[numero % 2]}\n' for numero in range(10))
+        resultado = importar_objetos(io.StringIO('nombre,tipo,tamanio,caja\n' + filas), tamanio_lote=3)
+        self.assertEqual((resultado.filas, resultado.creados, resultado.total_errores), (10, 10, 0))
+
+        # Lotes de 3 filas alternando caja: las dos cajas en los tres primeros, la oficina en el último
+        acciones = Accion.objects.filter(tipo='agregar_objeto').order_by('id')
+        self.assertEqual(sorted(accion.cajon_id for accion in acciones), sorted([*cajas, *cajas, *cajas, self.oficina.id]))
+        self.assertEqual(
+            sorted(objeto.nombre for accion in acciones for objeto in accion.objetosAfectados.all()),
+            sorted(f'Pieza {numero}' for numero in range(10)),
+        )
+        for caja in (self.taller, self.oficina):
+            caja.refresh_from_db()
+            self.assertEqual(caja.total_objetos, 5)
+            self.assertEqual(caja.total_objetos, unidades(caja))
+
+    def test_errores(self):
+        filas = [
+            f'Martillo,herramientas,grande,{self.taller.id}',
+            f',herramientas,grande,{self.taller.id}',
+            f'Martillo,vajilla,grande,{self.taller.id}',
+            f'Martillo,herramientas,enorme,{self.taller.id}',
+            'Martillo,herramientas,grande,taller',
+            'Martillo,herramientas,grande,999999',
+            f'{"x" * 101},herramientas,grande,{self.taller.id}',
+            f'Lápiz,papeleria,,{self.oficina.id}',
+        ]
+        resultado = importar_objetos(io.StringIO('nombre,tipo,tamanio,caja\n' + '\n'.join(filas)), tamanio_lote=2)
+        self.assertEqual((resultado.filas, resultado.creados, resultado.total_errores), (8, 2, 6))
+        self.assertEqual([fila for fila, _ in resultado.errores], [3, 4, 5, 6, 7, 8])
+        self.assertIn('no existe', dict(resultado.errores)[7])
+        # Sin tamaño se importa como mediano
+        self.assertEqual(self.oficina.objetos.get().tamanio, 'mediano')
+
+    def test_ndjson(self):
+        lineas = [
+            json.dumps({'nombre': 'Cable USB', 'tipo': 'cables', 'tamanio': 'pequeno', 'caja': self.taller.id}),
+            '',
+            '{"nombre": "Cable',
+            json.dumps(['Cable', 'cables']),
+            json.dumps({'nombre': 'Cable USB', 'tipo': 'Cables', 'caja': str(self.taller.id), 'tamanio': 'pequeno'}),
+        ]
+        archivo = SimpleUploadedFile('objetos.ndjson', '\n'.join(lineas).encode())
+        with override_settings(IMPORTACION_TAMANIO_LOTE=1):
+            respuesta = self.client.post(reverse('importar_objetos'), {'archivo': archivo})
+        resultado = respuesta.context['resultado']
+        self.assertEqual((resultado.filas, resultado.creados), (4, 2))
+        self.assertEqual([fila for fila, _ in resultado.errores], [3, 4])
+        self.assertContains(respuesta, '2 filas no se pudieron importar')
+        # Dos lotes con el mismo objeto: el segundo se apila sobre el primero
+        self.assertEqual(unidades(self.taller), 2)
+        self.assertEqual(self.taller.objetos.count(), 1)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class OrganizadorTests(TestCase):
+    """
+    El plan del organizador: mide la capacidad en volumen como la reserva, saca primero
+    los objetos grandes, agrupa por tipo y se aplica en bloque con una sola acción
+    """
+
+    def guardar(self, caja, cantidad, tipo='cables', tamanio='pequeno', nombre=None):
+        objetos = [Objeto(nombre=nombre or f'{tipo} {tamanio} {numero}', tipo=tipo, tamanio=tamanio) for numero in range(cantidad)]
+        inventario.agregar_objetos(caja.id, objetos)
+
+    def sobrecargar(self, caja, capacidad):
+        # La capacidad baja por debajo de lo que ya hay en la caja
+        Cajon.objects.filter(id=caja.id).update(capacidadMaxima=capacidad)
+
+    def comprobar_dentro_de_la_reserva(self):
+        for caja in Cajon.objects.all():
+            self.assertEqual(caja.total_objetos, unidades(caja))
+            self.assertLessEqual(caja.porcentaje_ocupacion, 100)
+            # La reserva admite exactamente el sitio libre que deja el plan (en pequeños)
+            libre = Cajon.calcular_capacidad(caja.capacidadMaxima) - caja.volumen_ocupado
+            relleno = [Objeto(nombre=f'Relleno {numero}', tipo='ropa', tamanio='pequeno') for numero in range(libre + 1)]
+            self.assertEqual(inventario.reservar(caja.id, relleno[:libre]), libre)
+            self.assertEqual(inventario.reservar(caja.id, relleno[:1]), 0)
+
+    def test_no_llena_cajas_de_mas(self):
+        grandes = Cajon.objects.create(nombre='Grandes', capacidadMaxima=8)
+        llena = Cajon.objects.create(nombre='Llena', capacidadMaxima=5)
+        vacia = Cajon.objects.create(nombre='Vacía', capacidadMaxima=10)
+        self.guardar(grandes, 4, tamanio='grande')
+        self.guardar(llena, 10)
+
+        # Cuatro grandes en una caja de ocho medianos no la sobrecargan
+        plan = calcular_plan()
+        self.assertEqual((len(plan), plan.sobrecargadas_antes), (0, 0))
+
+        # Sobran dos grandes, que no caben en la caja llena de pequeños
+        self.sobrecargar(grandes, 4)
+        plan = organizar()
+        self.assertEqual((plan.sobrecargadas_antes, plan.sobrecargadas_despues, plan.sin_lugar), (1, 0, 0))
+        self.assertEqual(set(plan.destinos.tolist()), {vacia.id})
+        self.assertEqual(unidades(llena), 10)
+        self.comprobar_dentro_de_la_reserva()
+
+    def test_reorganizar_respeta_la_capacidad(self):
+        cajas = [Cajon.objects.create(nombre=f'Caja {numero}', capacidadMaxima=10) for numero in range(4)]
+        for caja, tamanio in zip(cajas, ('pequeno', 'mediano', 'grande', 'mediano')):
+            self.guardar(caja, 5, tamanio=tamanio)
+        # Volumen 45 para una capacidad de 64
+        self.sobrecargar(cajas[0], 2)
+        plan = organizar(reorganizar=True)
+        self.assertEqual((plan.sin_lugar, plan.sobrecargadas_despues, unidades()), (0, 0, 20))
+        self.comprobar_dentro_de_la_reserva()
+
+    def test_simular_no_cambia_nada(self):
+        caja = Cajon.objects.create(nombre='Caja', capacidadMaxima=5)
+        Cajon.objects.create(nombre='Otra', capacidadMaxima=5)
+        self.guardar(caja, 4, tamanio='mediano')
+        self.sobrecargar(caja, 2)
+        antes = list(Contenido.objects.values_list('cajon_id', 'objeto_id', 'cantidad'))
+        # La vista previa no abre transacción (en la prueba sería un savepoint): no toma
+        # el bloqueo de escritura
+        with CaptureQueriesContext(connection) as consultas:
+            plan = organizar(simular=True)
+        self.assertEqual(len(plan), 2)
+        self.assertFalse([consulta for consulta in consultas.captured_queries if 'SAVEPOINT' in consulta['sql']])
+        self.assertEqual(list(Contenido.objects.values_list('cajon_id', 'objeto_id', 'cantidad')), antes)
+        self.assertFalse(Accion.objects.filter(tipo='organizar_caja').exists())
+
+    def test_saca_los_grandes_y_agrupa_por_tipo(self):
+        mezcla = Cajon.objects.create(nombre='Mezcla', capacidadMaxima=10)
+        ropa = Cajon.objects.create(nombre='Ropa', capacidadMaxima=10)
+        cables = Cajon.objects.create(nombre='Cables', capacidadMaxima=10)
+        self.guardar(mezcla, 3, tipo='cables', tamanio='grande')
+        self.guardar(mezcla, 3, tipo='ropa', tamanio='pequeno')
+        self.guardar(ropa, 2, tipo='ropa')
+        self.guardar(cables, 2, tipo='cables')
+        self.sobrecargar(mezcla, 3)
+
+        plan = organizar()
+        self.assertEqual(set(plan.tamanios.tolist()), {'grande'})
+        self.assertEqual(set(plan.destinos.tolist()), {cables.id})
+        self.assertEqual(Accion.objects.filter(tipo='organizar_caja').count(), 1)
+        self.comprobar_dentro_de_la_reserva()
+
+    def test_datos_sinteticos_sin_cajas_sobrecargadas(self):
+        generar(objetos=1000, objetos_por_caja=25, semilla=1)
+        self.assertFalse(Cajon.objects.alias(libre=Cajon.volumen_libre()).filter(libre__lt=0).exists())
+        self.assertEqual(calcular_plan().sobrecargadas_antes, 0)
+        caja = Cajon.objects.order_by('id').first()
+        self.assertEqual(
+            Accion.objects.get(tipo='crear_cajon', cajon=caja).descripcion,
+            f'Se creó la caja "{caja.nombre}" con capacidad para {caja.capacidadMaxima} objetos medianos '
+            f'({caja.capacidadMaxima * 2} pequeños o {caja.capacidadMaxima // 2} grandes)',
+        )
+
+    def test_reparte_una_pila(self):
+        pila = Cajon.objects.create(nombre='Pila', capacidadMaxima=5)
+        otra = Cajon.objects.create(nombre='Otra', capacidadMaxima=5)
+        # Cinco unidades iguales apiladas en una fila
+        self.guardar(pila, 5, nombre='Tornillo')
+        self.sobrecargar(pila, 1)
+        organizar()
+        self.assertEqual(list(Contenido.objects.order_by('cajon_id').values_list('cajon_id', 'cantidad')), [(pila.id, 2), (otra.id, 3)])
+        self.comprobar_dentro_de_la_reserva()
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class PaginacionTests(TestCase):
+    """
+    Paginación por cursor: se recorre todo sin repetir ni saltar filas y los cursores que
+    el cliente modifica se rechazan con 400
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caja = Cajon.objects.create(nombre='Caja', capacidadMaxima=10)
+        ahora = timezone.now()
+        # Tres acciones por minuto: el id desempata las de la misma fecha
+        Accion.objects.bulk_create([
+            Accion(tipo='visualizar_caja', cajon=cls.caja, descripcion=f'Acción {numero}', fecha_hora=ahora - timedelta(minutes=numero // 3))
+            for numero in range(45)
+        ])
+
+    def test_recorre_el_historial(self):
+        esperado = list(Accion.objects.order_by('-fecha_hora', '-id').values_list('id', flat=True))
+        vistos, paginas, cursor = [], [], None
+        while True:
+            pagina = self.client.get(reverse('historial_acciones'), {'despues': cursor} if cursor else {}).context['acciones']
+            paginas.append([accion.id for accion in pagina])
+            vistos += paginas[-1]
+            cursor = pagina.cursor_siguiente
+            if not cursor:
+                break
+        self.assertEqual(vistos, esperado)
+
+        # Hacia atrás desde la segunda página se vuelve a la primera
+        segunda = self.client.get(reverse('historial_acciones'), {'despues': codificar_cursor(
+            list(Accion.objects.filter(id=paginas[0][-1]).values_list('fecha_hora', 'id').get())
+        )}).context['acciones']
+        self.assertEqual([accion.id for accion in segunda], paginas[1])
+        anterior = self.client.get(reverse('historial_acciones'), {'antes': segunda.cursor_anterior}).context['acciones']
+        self.assertEqual([accion.id for accion in anterior], paginas[0])
+
+    def test_cursores_no_validos(self):
+        cursores = [
+            'W10',                                  # lista vacía
+            'no es base64',
+            codificar_cursor({'id': 1}),
+            codificar_cursor([[1], [2]]),
+            codificar_cursor(['texto', 'texto']),   # tipos que no son los de los campos
+            codificar_cursor([True, None]),
+            codificar_cursor([1, 2, 3]),
+        ]
+        urls = [
+            reverse('historial_acciones'),
+            reverse('api_historial'),
+            reverse('api_cajones'),
+            reverse('api_objetos_caja', args=[self.caja.id]),
+        ]
+        for url in urls:
+            for cursor in cursores:
+                with self.subTest(url=url, cursor=cursor):
+                    self.assertEqual(self.client.get(url, {'despues': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('historial_acciones'), {'antes': 'W10'}).status_code, 400)
+
+        # El archivo no lee posiciones que el cursor no tiene
+        for valores in ([], [timezone.now()], [5, 1], ['texto', 1]):
+            self.assertIsNone(archivo._clave(valores))
+
+    def test_cursor_de_otro_orden_en_la_caja(self):
+        Cajon.objects.filter(id=self.caja.id).update(capacidadMaxima=75)
+        inventario.agregar_objetos(self.caja.id, [
+            Objeto(nombre=f'Objeto {numero}', tipo='cables', tamanio=('pequeno', 'grande')[numero % 2]) for numero in range(60)
+        ])
+        siguiente = self.client.get(reverse('detalle_caja', args=[self.caja.id]), {'orden': 'tipo'}).context['siguiente']
+        self.assertTrue(siguiente)
+
+        # Sin JavaScript el enlace de otro orden lleva a la primera página
+        respuesta = self.client.get(reverse('detalle_caja', args=[self.caja.id]), {'orden': 'tamanio', 'despues': siguiente})
+        self.assertEqual(respuesta.status_code, 200)
+        primera = self.client.get(reverse('detalle_caja', args=[self.caja.id]), {'orden': 'tamanio'}).context['objetos']
+        self.assertEqual(list(respuesta.context['objetos']), list(primera))
+
+        # "Cargar más" con ese cursor es un error del cliente
+        for orden, cursor in (('tamanio', siguiente), ('nombre', siguiente), ('tipo', 'W10')):
+            with self.subTest(orden=orden, cursor=cursor):
+                respuesta = self.client.get(reverse('objetos_caja', args=[self.caja.id]), {'orden': orden, 'despues': cursor})
+                self.assertEqual(respuesta.status_code, 400)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ApiTests(TestCase):
+    """
+    API JSON: proyección de ?campos= y respuestas 304 mientras los datos no cambian
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caja = Cajon.objects.create(nombre='Caja', capacidadMaxima=10)
+        inventario.agregar_objetos(cls.caja.id, [
+            Objeto(nombre=f'Objeto {numero}', tipo='cables', tamanio='pequeno') for numero in range(3)
+        ])
+        for objeto in Objeto.objects.all():
+            accion = Accion.objects.create(tipo='agregar_objeto', cajon=cls.caja, descripcion=objeto.nombre)
+            accion.objetosAfectados.add(objeto)
+
+    def pedir(self, url, parametros=None, etag=None):
+        cabeceras = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, parametros or {}, **cabeceras)
+
+    def test_campos(self):
+        casos = [
+            (reverse('api_cajones'), 'id,nombre'),
+            (reverse('api_objetos_caja', args=[self.caja.id]), 'nombre,cantidad'),
+            (reverse('api_historial'), 'tipo,objetos'),
+        ]
+        for url, campos in casos:
+            with self.subTest(url=url):
+                resultados = self.pedir(url, {'campos': campos}).json()['resultados']
+                self.assertTrue(resultados)
+                for fila in resultados:
+                    self.assertEqual(set(fila), set(campos.split(',')))
+                self.assertEqual(self.pedir(url, {'campos': 'id,clave'}).status_code, 400)
+
+        historial = self.pedir(reverse('api_historial'), {'campos': 'id,objetos'}).json()['resultados']
+        for fila in historial:
+            self.assertEqual(fila['objetos'], list(Accion.objects.get(id=fila['id']).objetosAfectados.values_list('id', flat=True)))
+
+    def test_campos_limitan_las_columnas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.pedir(reverse('api_cajones'), {'campos': 'nombre'})
+        pagina = [consulta['sql'] for consulta in consultas.captured_queries if 'LIMIT' in consulta['sql']][-1]
+        self.assertIn('"nombre"', pagina)
+        self.assertNotIn('"capacidadMaxima"', pagina)
+
+        # Sin pedir los objetos no se consulta la relación
+        with CaptureQueriesContext(connection) as consultas:
+            self.pedir(reverse('api_historial'), {'campos': 'id,tipo'})
+        self.assertFalse([consulta for consulta in consultas.captured_queries if 'objetosafectados' in consulta['sql'].lower()])
+
+    def test_caja_inexistente(self):
+        # La consulta del ETag basta para saber que la caja no existe
+        with self.assertNumQueries(1):
+            respuesta = self.pedir(reverse('api_objetos_caja', args=[999999]))
+        self.assertEqual(respuesta.status_code, 404)
+
+    def eliminar_objeto(self, objeto):
+        inventario.baja_objetos([objeto.id])
+        objeto.delete()
+
+    def test_etag_historial_sin_contar(self):
+        # El ETag no recorre las tablas del historial
+        with CaptureQueriesContext(connection) as consultas:
+            etag = self.pedir(reverse('api_historial'))['ETag']
+            self.assertEqual(self.pedir(reverse('api_historial'), etag=etag).status_code, 304)
+        self.assertFalse([consulta for consulta in consultas.captured_queries if 'COUNT(' in consulta['sql'].upper()])
+
+    def test_no_modificado(self):
+        casos = [
+            (reverse('api_cajones'), lambda: inventario.agregar_objetos(self.caja.id, [Objeto(nombre='Otro', tipo='cables', tamanio='pequeno')])),
+            (reverse('api_objetos_caja', args=[self.caja.id]), lambda: Cajon.objects.filter(id=self.caja.id).update(version=F('version') + 1)),
+            # Una acción archivada en medio del historial: no cambian el último id ni la última fecha
+            (reverse('api_historial'), lambda: archivo._borrar_acciones([Accion.objects.order_by('id')[1].id])),
+            # Las filas de la relación de un objeto eliminado: ninguna acción cambia
+            (reverse('api_historial'), lambda: self.eliminar_objeto(Objeto.objects.order_by('id').first())),
+        ]
+        for url, cambiar in casos:
+            with self.subTest(url=url):
+                respuesta = self.pedir(url)
+                etag = respuesta['ETag']
+                self.assertEqual(self.pedir(url, etag=etag).status_code, 304)
+                # Otros parámetros son otra respuesta
+                self.assertEqual(self.pedir(url, {'limite': 1}, etag=etag).status_code, 200)
+
+                cambiar()
+                respuesta = self.pedir(url, etag=etag)
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertNotEqual(respuesta['ETag'], etag)
+
+
+@override_settings(
+    BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'},
+    INSTRUMENTACION={**settings.INSTRUMENTACION, 'MUESTREO': 1.0},
+)
+class VistasAsincronasTests(TestCase):
+    """
+    Las vistas de lectura son asíncronas; con AsyncClient la petición sigue el camino de
+    ASGI, incluido el middleware de instrumentación
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        generar(objetos=60, objetos_por_caja=20, semilla=3)
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+
+    async def test_vistas_de_lectura(self):
+        # Server-Timing solo se envía a staff
+        await self.async_client.aforce_login(self.staff)
+        caja = await Cajon.objects.afirst()
+        for url in (reverse('crear_caja'), reverse('historial_acciones'), reverse('detalle_caja', args=[caja.id])):
+            with self.subTest(url=url):
+                respuesta = await self.async_client.get(url)
+                self.assertEqual(respuesta.status_code, 200)
+                # Las consultas hechas en los hilos de sync_to_async también se cuentan
+                self.assertRegex(respuesta['Server-Timing'], r'desc="[1-9]\d* consultas"')
+        self.assertTrue(await Accion.objects.filter(tipo='visualizar_caja', cajon=caja).aexists())
+
+    async def test_caja_inexistente(self):
+        respuesta = await self.async_client.get(reverse('detalle_caja', args=[999999]))
+        self.assertRedirects(respuesta, reverse('crear_caja'), fetch_redirect_response=False)
+
+    def test_son_corrutinas(self):
+        for vista in (views.crear_caja, views.historial_acciones, views.detalle_caja, views.objetos_caja, views.eventos_acciones):
+            with self.subTest(vista=vista.__name__):
+                self.assertTrue(asyncio.iscoroutinefunction(vista))
+
+    async def test_cargar_mas(self):
+        caja = await Cajon.objects.afirst()
+        filas = [fila async for fila in Contenido.objects.filter(cajon=caja).order_by('nombre', 'objeto_id')]
+        cursor = codificar_cursor([filas[9].nombre, filas[9].objeto_id])
+
+        respuesta = await self.async_client.get(reverse('objetos_caja', args=[caja.id]), {'despues': cursor})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([objeto.id for objeto in respuesta.context['objetos']], [fila.objeto_id for fila in filas[10:]])
+
+        respuesta = await self.async_client.get(reverse('objetos_caja', args=[caja.id]), {'despues': 'no-es-un-cursor'})
+        self.assertEqual(respuesta.status_code, 400)
+        respuesta = await self.async_client.get(reverse('objetos_caja', args=[999999]))
+        self.assertEqual(respuesta.status_code, 404)
+
+    async def test_alta_de_caja(self):
+        respuesta = await self.async_client.post(reverse('crear_caja'), {'nombre': 'Garaje', 'capacidadMax': '15'})
+        self.assertRedirects(respuesta, reverse('crear_caja'), fetch_redirect_response=False)
+        caja = await Cajon.objects.aget(nombre='Garaje')
+        self.assertEqual(caja.capacidadMaxima, 15)
+        self.assertTrue(await Accion.objects.filter(tipo='crear_cajon', cajon=caja).aexists())
+
+        # Con un error se vuelve a mostrar el formulario sin crear nada
+        respuesta = await self.async_client.post(reverse('crear_caja'), {'nombre': 'Desván', 'capacidadMax': 'muchos'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(await Cajon.objects.filter(nombre='Desván').aexists())
+
+    async def test_peticiones_concurrentes(self):
+        caja = await Cajon.objects.afirst()
+        antes = await Accion.objects.filter(tipo='visualizar_caja', cajon=caja).acount()
+        respuestas = await asyncio.gather(*[
+            self.async_client.get(reverse('detalle_caja', args=[caja.id])) for _ in range(5)
+        ])
+        self.assertEqual([respuesta.status_code for respuesta in respuestas], [200] * 5)
+        self.assertEqual(await Accion.objects.filter(tipo='visualizar_caja', cajon=caja).acount(), antes + 5)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class EventosTests(TestCase):
+    """
+    Las acciones escritas llegan en vivo a los flujos SSE con su filtro, se repiten desde la
+    base de datos al reconectar y un cliente lento se pone al día sin perder ninguna
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caja = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+        cls.otra = Cajon.objects.create(nombre='Cocina', capacidadMaxima=10)
+
+    def registrar(self, caja, cantidad=1):
+        # Los eventos se publican al confirmar la transacción de la escritura
+        with self.captureOnCommitCallbacks(execute=True):
+            obtener_bitacora().registrar_varias([
+                EntradaAccion('visualizar_caja', cajon_id=caja.id, descripcion=f'Acción {numero}') for numero in range(cantidad)
+            ])
+        return list(Accion.objects.filter(cajon=caja).order_by('-id').values_list('id', flat=True)[:cantidad])[::-1]
+
+    async def recibir(self, flujo, cantidad):
+        recibidos = []
+        while len(recibidos) < cantidad:
+            texto = await asyncio.wait_for(anext(flujo), 5)
+            if texto.startswith('event: recargar'):
+                recibidos.append('recargar')
+            elif texto.startswith('id: '):
+                recibidos.append(json.loads(texto.split('data: ', 1)[1]))
+        return recibidos
+
+    async def test_eventos_en_vivo_de_una_caja(self):
+        flujo = eventos.flujo(cajon_id=self.caja.id)
+        self.assertTrue((await anext(flujo)).startswith('retry: '))
+        lectura = asyncio.ensure_future(self.recibir(flujo, 1))
+        await sync_to_async(self.registrar)(self.otra)
+        ids = await sync_to_async(self.registrar)(self.caja)
+        datos, = await lectura
+        await flujo.aclose()
+
+        self.assertEqual(datos['id'], ids[0])
+        self.assertEqual((datos['cajon_id'], datos['caja']['nombre'], datos['tipo']), (self.caja.id, 'Taller', 'visualizar_caja'))
+        self.assertFalse(eventos.canal.hay_suscripciones())
+
+    async def test_reconectar_repite_las_acciones_perdidas(self):
+        ids = await sync_to_async(self.registrar)(self.caja, 3)
+        flujo = eventos.flujo(ultimo_id=ids[0])
+        recibidos = await self.recibir(flujo, 2)
+        await flujo.aclose()
+        self.assertEqual([datos['id'] for datos in recibidos], ids[1:])
+
+        # Con más acciones perdidas que REPETICION_MAXIMA se pide recargar la página
+        with self.settings(EVENTOS={**settings.EVENTOS, 'REPETICION_MAXIMA': 1}):
+            flujo = eventos.flujo(ultimo_id=ids[0])
+            self.assertEqual(await self.recibir(flujo, 1), ['recargar'])
+            await flujo.aclose()
+
+    async def test_cliente_lento_se_pone_al_dia(self):
+        desbordes = eventos.canal.desbordes
+        # Cola de 2 eventos y páginas de 2: se pone al día leyendo varias páginas
+        with self.settings(EVENTOS={**settings.EVENTOS, 'TAMANIO_COLA': 2, 'REPETICION_MAXIMA': 2}):
+            flujo = eventos.flujo(cajon_id=self.caja.id)
+            await anext(flujo)
+            lectura = asyncio.ensure_future(self.recibir(flujo, 5))
+            ids = await sync_to_async(self.registrar)(self.caja, 5)
+            recibidos = await lectura
+            await flujo.aclose()
+        self.assertEqual([datos['id'] for datos in recibidos], ids)
+        self.assertEqual(eventos.canal.desbordes, desbordes + 1)
+
+    def test_sin_asgi_envia_lo_pendiente(self):
+        ids = self.registrar(self.caja, 2)
+        respuesta = self.client.get(reverse('eventos_caja', args=[self.caja.id]), headers={'Last-Event-ID': str(ids[0])})
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        texto = respuesta.content.decode()
+        self.assertTrue(texto.startswith('retry: '))
+        self.assertIn(f'id: {ids[1]}\n', texto)
+        self.assertNotIn(f'id: {ids[0]}\n', texto)
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ApiladoTests(TestCase):
+    """
+    Los objetos iguales de una caja se guardan una vez con su cantidad de unidades, y las
+    unidades son lo que cuentan la ocupación, los resúmenes y la búsqueda
+    """
+
+    def setUp(self):
+        self.caja = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+
+    def agregar(self, nombre='Tornillo', **datos):
+        return self.client.post(reverse('añadir_objeto'), {
+            'nombre': nombre, 'tipoObjeto': 'herramientas', 'tamanio': 'pequeno', 'caja': self.caja.id, **datos,
+        }, follow=True)
+
+    def test_agregar_apila_la_misma_clave(self):
+        self.agregar()
+        respuesta = self.agregar(nombre='  TORNILLO ')
+        self.assertContains(respuesta, 'Se sumó una unidad')
+        contenido = Contenido.objects.get(cajon=self.caja)
+        self.assertEqual(contenido.cantidad, 2)
+        self.assertEqual(Objeto.objects.count(), 1)
+
+        # En bloque: las unidades nuevas y las existentes en las mismas sentencias
+        _, nuevos = inventario.agregar_objetos(self.caja.id, [
+            Objeto(nombre='Tornillo', tipo='herramientas', tamanio='pequeno'),
+            Objeto(nombre='Tuerca', tipo='herramientas', tamanio='pequeno'),
+            Objeto(nombre='tuerca', tipo='herramientas', tamanio='pequeno'),
+        ])
+        self.assertEqual([objeto.nombre for objeto in nuevos], ['Tuerca'])
+        self.assertEqual(dict(Contenido.objects.values_list('objeto__nombre', 'cantidad')), {'Tornillo': 3, 'Tuerca': 2})
+        self.caja.refresh_from_db()
+        self.assertEqual(self.caja.total_objetos, 5)
+        self.assertEqual(ExistenciaTipo.objects.get(tipo='herramientas', tamanio='pequeno').cantidad, 5)
+
+        resultados = buscar('tornillo')
+        self.assertEqual([(fila['nombre'], fila['cantidad']) for fila in resultados], [('Tornillo', 3)])
+
+    def test_quitar_una_unidad(self):
+        for _ in range(3):
+            self.agregar()
+        objeto = Objeto.objects.get()
+        url = reverse('eliminar_objeto', args=[objeto.id])
+        self.client.post(url, {'caja': self.caja.id, 'unidades': 1})
+        self.assertEqual(Contenido.objects.get(objeto=objeto).cantidad, 2)
+        self.caja.refresh_from_db()
+        self.assertEqual(self.caja.total_objetos, 2)
+
+        # Sin unidades de sobra se borra el objeto entero
+        self.client.post(url, {'caja': self.caja.id, 'unidades': 2})
+        self.assertFalse(Objeto.objects.exists())
+        self.caja.refresh_from_db()
+        self.assertEqual(self.caja.total_objetos, 0)
+
+    def test_apilar_duplicados_conserva_las_unidades(self):
+        # Los datos sintéticos necesitan una base de datos vacía
+        self.caja.delete()
+        generar(objetos=200, objetos_por_caja=20, proporcion_duplicados=0.3, semilla=3)
+        antes = {caja.id: caja.total_objetos for caja in Cajon.objects.all()}
+        existencias = set(ExistenciaTipo.objects.values_list('tipo', 'tamanio', 'cantidad'))
+        for caja_id in cajas_con_duplicados():
+            caja = Cajon.objects.get(id=caja_id)
+            grupos = grupos_duplicados(caja)
+            apilados, _ = apilar_duplicados(caja)
+            self.assertEqual(len(apilados), sum(grupo['objetos'] - 1 for grupo in grupos))
+            for grupo in grupos:
+                self.assertEqual(Contenido.objects.get(cajon=caja, objeto_id=grupo['conservar_id']).cantidad, grupo['unidades'])
+
+        self.assertFalse(cajas_con_duplicados().exists())
+        for caja in Cajon.objects.all():
+            self.assertEqual(caja.total_objetos, antes[caja.id])
+            self.assertEqual(caja.total_objetos, unidades(caja))
+        self.assertEqual(set(ExistenciaTipo.objects.values_list('tipo', 'tamanio', 'cantidad')), existencias)
+        reconstruir_resumenes()
+        self.assertEqual(set(ExistenciaTipo.objects.values_list('tipo', 'tamanio', 'cantidad')), existencias)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class BusquedaTests(TestCase):
+    """
+    La tabla FTS5 y el índice en memoria dan los mismos resultados, también después de
+    altas, bajas y movimientos aplicados de forma incremental
+    """
+
+    CONSULTAS = ['cam', 'camara', 'CÁMARA ref', 'cable', 'cable hd', 'taller', 'oficina cab', 'ropa', 'c', 'nada', '"cable', 'cable OR']
+
+    def setUp(self):
+        self.addCleanup(setattr, busqueda, '_usa_fts', busqueda._usa_fts)
+        self.addCleanup(busqueda._indice.descartar)
+        busqueda._indice.descartar()
+        self.taller = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+        self.oficina = Cajon.objects.create(nombre='Oficina', capacidadMaxima=10)
+        inventario.agregar_objetos(self.taller.id, [
+            Objeto(nombre=nombre, tipo=tipo, tamanio='pequeno')
+            for nombre, tipo in [('Cámara réflex', 'electronica'), ('Cable HDMI', 'cables'), ('Cable USB', 'cables'),
+                                 ('Cable USB', 'cables'), ('Camiseta', 'ropa')]
+        ])
+
+    def resultados(self, fts):
+        busqueda._usa_fts = fts
+        return {
+            consulta: sorted((fila['id'], fila['nombre'], fila['caja'], fila['cantidad']) for fila in buscar(consulta, limite=100))
+            for consulta in self.CONSULTAS
+        }
+
+    def cambiar(self):
+        self.client.post(reverse('añadir_objeto'), {
+            'nombre': 'Cargador', 'tipoObjeto': 'cables', 'tamanio': 'pequeno', 'caja': self.oficina.id,
+        })
+        self.client.post(reverse('eliminar_objeto', args=[Objeto.objects.get(nombre='Cable HDMI').id]))
+        # El organizador saca objetos del taller a la oficina
+        Cajon.objects.filter(id=self.taller.id).update(capacidadMaxima=1)
+        self.client.post(reverse('organizar_cajas'))
+
+    def test_fts_y_memoria_iguales(self):
+        self.assertTrue(busqueda.usa_fts())
+        self.cambiar()
+        fts = self.resultados(fts=True)
+        self.assertEqual(self.resultados(fts=False), fts)
+        # Sin acentos ni mayúsculas, y en la caja a la que la movió el organizador
+        self.assertEqual([fila[1:] for fila in fts['CÁMARA ref']], [('Cámara réflex', 'Oficina', 1)])
+        self.assertEqual([fila[1] for fila in fts['oficina cab']], ['Cable USB', 'Cargador'])
+        self.assertEqual(fts['nada'], [])
+
+    def test_objeto_en_varias_cajas(self):
+        # El organizador reparte una pila de 3 linternas entre el almacén y el taller
+        almacen = Cajon.objects.create(nombre='Almacén', capacidadMaxima=2)
+        inventario.agregar_objetos(almacen.id, [Objeto(nombre='Linterna', tipo='herramientas', tamanio='pequeno') for _ in range(3)])
+        Cajon.objects.filter(id=almacen.id).update(capacidadMaxima=1)
+        organizar()
+        linterna = Objeto.objects.get(nombre='Linterna')
+
+        esperado = [(linterna.id, 'Linterna', 'Almacén', 2), (linterna.id, 'Linterna', 'Taller', 1)]
+        for fts in (True, False):
+            busqueda._usa_fts = fts
+            with self.subTest(fts=fts):
+                self.assertEqual(sorted((fila['id'], fila['nombre'], fila['caja'], fila['cantidad']) for fila in buscar('linterna')), esperado)
+
+        # Al borrarlo desaparece de las dos cajas, también del índice en memoria ya cargado
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('eliminar_objeto', args=[linterna.id]))
+        for fts in (True, False):
+            busqueda._usa_fts = fts
+            with self.subTest(fts=fts):
+                self.assertEqual(buscar('linterna'), [])
+
+    def test_renombrar_actualiza_el_indice(self):
+        camara = Objeto.objects.get(nombre='Cámara réflex')
+        for fts, anterior, nombre in ((True, 'camara', 'Prismáticos'), (False, 'prismaticos', 'Telescopio')):
+            busqueda._usa_fts = fts
+            with self.subTest(fts=fts):
+                if not fts:
+                    # El índice en memoria ya cargado se actualiza al confirmar
+                    busqueda.obtener_indice()
+                camara.nombre = nombre
+                with self.captureOnCommitCallbacks(execute=True):
+                    camara.save()
+                self.assertEqual(buscar(anterior), [])
+                self.assertEqual([fila['nombre'] for fila in buscar(nombre)], [nombre])
+
+    def test_indice_en_memoria_incremental(self):
+        antes = self.resultados(fts=False)
+        self.assertEqual(antes['cable'][-1][1:], ('Cable USB', 'Taller', 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cambiar()
+        incremental = self.resultados(fts=False)
+        self.assertNotEqual(incremental, antes)
+
+        busqueda._indice.descartar()
+        self.assertEqual(self.resultados(fts=False), incremental)
+        # La tabla FTS no se tocó mientras se usaba el índice en memoria: se reconstruye
+        busqueda._usa_fts = True
+        busqueda.reconstruir()
+        self.assertEqual(self.resultados(fts=True), incremental)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class DuplicadosTests(TestCase):
+    """
+    Duplicados por la clave normalizada guardada: se agrupan en la base de datos y el
+    comando dedupe los apila sin borrar objetos que siguen en otra caja
+    """
+
+    def setUp(self):
+        self.taller = Cajon.objects.create(nombre='Taller', capacidadMaxima=50)
+        self.oficina = Cajon.objects.create(nombre='Oficina', capacidadMaxima=50)
+
+    def guardar(self, caja, nombre, cantidad=1, objeto=None):
+        # Una fila propia por objeto, como los datos anteriores al apilado
+        objeto = objeto or Objeto.objects.create(nombre=nombre, tipo='cables', tamanio='pequeno')
+        Contenido.objects.create(cajon=caja, objeto=objeto, cantidad=cantidad)
+        return objeto
+
+    def test_clave_normalizada(self):
+        self.assertEqual(Objeto.calcular_clave('  Cable HDMI ', 'cables', 'pequeno'), 'cable hdmi_cables_pequeno')
+        objeto = self.guardar(self.taller, 'Cable HDMI')
+        self.assertEqual(objeto.clave_duplicado, 'cable hdmi_cables_pequeno')
+        objeto.nombre = 'Cable USB'
+        objeto.save()
+        self.assertEqual(Objeto.objects.get(id=objeto.id).clave_duplicado, 'cable usb_cables_pequeno')
+
+        _, nuevos = inventario.agregar_objetos(self.oficina.id, [Objeto(nombre='Regleta', tipo='cables', tamanio='pequeno')])
+        self.assertEqual(Objeto.objects.get(id=nuevos[0].id).clave_duplicado, 'regleta_cables_pequeno')
+
+    def test_grupos_en_una_consulta(self):
+        primero = self.guardar(self.taller, 'Cable', cantidad=2)
+        self.guardar(self.taller, 'cable ')
+        self.guardar(self.taller, 'CABLE', cantidad=3)
+        self.guardar(self.taller, 'Regleta')
+        # En otra caja el mismo nombre no es un duplicado de estos
+        self.guardar(self.oficina, 'Cable')
+
+        with self.assertNumQueries(1):
+            grupos = grupos_duplicados(self.taller)
+        self.assertEqual(len(grupos), 1)
+        self.assertEqual(
+            {clave: grupos[0][clave] for clave in ('clave_duplicado', 'objetos', 'unidades', 'conservar_id')},
+            {'clave_duplicado': 'cable_cables_pequeno', 'objetos': 3, 'unidades': 6, 'conservar_id': primero.id},
+        )
+        self.assertEqual(list(cajas_con_duplicados()), [self.taller.id])
+
+    def test_comando_dedupe(self):
+        primero = self.guardar(self.taller, 'Cable')
+        compartido = self.guardar(self.taller, 'cable', cantidad=2)
+        self.guardar(self.oficina, None, objeto=compartido)
+        suelto = self.guardar(self.taller, 'Cable')
+
+        salida = io.StringIO()
+        # La simulación no abre transacción (en la prueba sería un savepoint)
+        with CaptureQueriesContext(connection) as consultas:
+            call_command('dedupe', '--simular', stdout=salida)
+        self.assertIn('1 cajas con duplicados, 2 objetos se apilarían', salida.getvalue())
+        self.assertFalse([consulta for consulta in consultas.captured_queries if 'SAVEPOINT' in consulta['sql']])
+        self.assertEqual(Contenido.objects.filter(cajon=self.taller).count(), 3)
+
+        salida = io.StringIO()
+        call_command('dedupe', stdout=salida)
+        self.assertIn(f'Caja {self.taller.id} "Taller": 2 duplicados, 1 objetos distintos', salida.getvalue())
+        self.assertEqual(list(Contenido.objects.filter(cajon=self.taller).values_list('objeto_id', 'cantidad')), [(primero.id, 4)])
+        # El objeto que sigue en la oficina no se elimina; el que solo estaba en el taller sí
+        self.assertTrue(Contenido.objects.filter(cajon=self.oficina, objeto=compartido).exists())
+        self.assertFalse(Objeto.objects.filter(id=suelto.id).exists())
+        self.assertEqual(Accion.objects.filter(tipo='organizar_caja', cajon=self.taller).count(), 1)
+        self.assertFalse(cajas_con_duplicados().exists())
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ParecidosTests(TestCase):
+    """
+    Nombres parecidos: la normalización, las firmas guardadas y los grupos por caja y en
+    todo el inventario
+    """
+
+    def setUp(self):
+        caches['fragmentos'].clear()
+        self.taller = Cajon.objects.create(nombre='Taller', capacidadMaxima=20)
+        self.oficina = Cajon.objects.create(nombre='Oficina', capacidadMaxima=20)
+
+    def agregar(self, caja, *nombres):
+        return inventario.agregar_objetos(caja.id, [
+            Objeto(nombre=nombre, tipo='cables', tamanio='pequeno') for nombre in nombres
+        ])[1]
+
+    def test_normalizacion(self):
+        for nombre in ('cable usb c ', 'Cables USB C', 'CÁBLE USB-C'):
+            self.assertEqual(parecidos.normalizar_nombre(nombre), parecidos.normalizar_nombre('Cable USB-C'))
+        self.assertEqual(parecidos.normalizar_nombre('Lápices'), parecidos.normalizar_nombre('lapiz'))
+        self.assertEqual(parecidos.normalizar_nombre('Pantalones'), parecidos.normalizar_nombre('pantalón'))
+        self.assertEqual(parecidos.calcular_firmas(['', '--']), ['', ''])
+
+    def test_firma_guardada_al_crear_y_al_renombrar(self):
+        objeto, = self.agregar(self.taller, 'Cable USB-C')
+        objeto.refresh_from_db()
+        self.assertEqual(len(objeto.firma_nombre), parecidos.LONGITUD_FIRMA)
+        self.assertEqual(objeto.firma_nombre, Objeto.calcular_firma('cables usb c'))
+
+        objeto.nombre = 'Martillo'
+        objeto.save(update_fields=['nombre'])
+        objeto.refresh_from_db()
+        self.assertEqual(objeto.firma_nombre, Objeto.calcular_firma('Martillo'))
+        self.assertEqual(parecidos.reconstruir(), 0)
+
+    def test_grupos_por_caja_y_en_todo_el_inventario(self):
+        self.agregar(self.taller, 'Cable USB-C', 'Cables USB C', 'Cable USBC', 'Tornillo M3', 'Tornillo M4', 'Martillo')
+        self.agregar(self.oficina, 'cable usb c ', 'Grapadora', 'Grapdora')
+
+        respuesta = self.client.get(reverse('detalle_caja', args=[self.taller.id]))
+        grupos = [sorted(objeto.nombre for objeto in grupo) for grupo in respuesta.context['parecidos']]
+        self.assertEqual(grupos, [['Cable USB-C', 'Cable USBC', 'Cables USB C']])
+
+        nombres = dict(Objeto.objects.values_list('id', 'nombre'))
+        grupos = [sorted(nombres[objeto_id] for objeto_id in grupo) for grupo in parecidos.grupos_inventario()]
+        self.assertEqual(grupos, [
+            ['Cable USB-C', 'Cable USBC', 'Cables USB C', 'cable usb c '],
+            ['Grapadora', 'Grapdora'],
+        ])
+
+        # Las firmas que faltan (objetos anteriores a la migración) se calculan al agrupar
+        Objeto.objects.update(firma_nombre='')
+        self.assertEqual(len(parecidos.grupos_inventario(cajon_id=self.oficina.id)), 1)
+        self.assertEqual(parecidos.reconstruir(), Objeto.objects.count())
+
+    def test_variantes_de_nombres_cortos(self):
+        # La errata necesita dos letras en la primera palabra
+        rng = random.Random(0)
+        for nombre in ('X 12', 'Ab 3', ''):
+            for _ in range(20):
+                self.assertIsInstance(parecidos._variante(nombre, rng), str)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ResumenesTests(TestCase):
+    """
+    Los resúmenes que se mantienen en cada operación coinciden con los que se calculan
+    desde cero
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        generar(objetos=300, objetos_por_caja=20, proporcion_duplicados=0.2, semilla=5)
+
+    def contenido(self):
+        return {
+            'existencias': set(ExistenciaTipo.objects.filter(cantidad__gt=0).values_list('tipo', 'tamanio', 'cantidad')),
+            'tramos': set(OcupacionTramo.objects.filter(cajas__gt=0).values_list('tramo', 'cajas', 'objetos', 'capacidad')),
+            'acciones': set(ResumenAcciones.objects.values_list('dia', 'tipo', 'total')),
+        }
+
+    def test_incrementales_igual_a_reconstruir(self):
+        caja = Cajon.objects.order_by('id').first()
+        self.client.post(reverse('crear_caja'), {'nombre': 'Nueva', 'capacidadMax': '2'})
+        nueva = Cajon.objects.get(nombre='Nueva')
+        for numero in range(5):
+            self.client.post(reverse('añadir_objeto'), {
+                'nombre': f'Cable {numero}', 'tipoObjeto': 'cables', 'tamanio': 'pequeno', 'caja': nueva.id,
+            })
+        self.client.post(reverse('eliminar_objeto', args=[caja.objetos.first().id]))
+        for caja_id in cajas_con_duplicados()[:3]:
+            self.client.post(reverse('eliminar_duplicados', args=[caja_id]))
+        # La caja nueva tiene capacidad para 2 medianos, 4 pequeños: el quinto cable se rechaza
+        hoy = ResumenInventario.objects.filter(cajon=nueva).values_list('tipo', 'tamanio', 'altas', 'bajas')
+        self.assertEqual(list(hoy), [('cables', 'pequeno', 4, 0)])
+
+        # Al reorganizar, el organizador saca al menos un cable
+        self.client.post(reverse('organizar_cajas'), {'reorganizar': '1'})
+        self.assertGreater(ResumenInventario.objects.get(cajon=nueva).bajas, 0)
+
+        incrementales = self.contenido()
+
+        reconstruir_resumenes()
+        self.assertEqual(incrementales, self.contenido())
+
+    def test_panel_no_depende_del_tamanio_del_inventario(self):
+        # La caja elegida, ocupación, existencias, actividad y altas y bajas de la caja
+        caja = Cajon.objects.order_by('id').first()
+        with self.assertNumQueries(5):
+            respuesta = self.client.get(reverse('estadisticas'), {'dias': 30, 'caja': caja.id})
+        self.assertEqual(respuesta.context['panel']['total_cajas'], Cajon.objects.count())
+        self.assertEqual(respuesta.context['panel']['objetos'], unidades())
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ArchivoAccionesTests(TestCase):
+    """
+    Las acciones archivadas salen de la base de datos y el historial las sigue mostrando
+    en el mismo orden que si no se hubieran movido
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        generar(objetos=300, objetos_por_caja=20, semilla=3)
+
+    def setUp(self):
+        cache.clear()
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(ARCHIVO_ACCIONES={'DIRECTORIO': directorio, 'DIAS': 180, 'TAMANIO_BLOQUE': 40})
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def recorrer_historial(self, **filtros):
+        """
+        Ids de todas las páginas del historial hacia delante y, desde la última, hacia atrás
+        """
+        hacia_delante, cursor = [], None
+        while True:
+            pagina = self.client.get(reverse('historial_acciones'), {**filtros, **({'despues': cursor} if cursor else {})}).context['acciones']
+            hacia_delante += [accion.id for accion in pagina]
+            if not pagina.cursor_siguiente:
+                break
+            cursor = pagina.cursor_siguiente
+
+        hacia_atras = [accion.id for accion in pagina]
+        while pagina.cursor_anterior:
+            pagina = self.client.get(reverse('historial_acciones'), {**filtros, 'antes': pagina.cursor_anterior}).context['acciones']
+            hacia_atras = [accion.id for accion in pagina] + hacia_atras
+        self.assertEqual(hacia_delante, hacia_atras)
+        return hacia_delante
+
+    def test_archivar_y_recorrer_historial(self):
+        todas = list(Accion.objects.order_by('-fecha_hora', '-id').values_list('id', flat=True))
+        caja = Cajon.objects.order_by('id').first()
+        de_la_caja = list(caja.acciones.order_by('-fecha_hora', '-id').values_list('id', flat=True))
+
+        archivadas = archivo.archivar()
+        self.assertGreater(archivadas, 0)
+        self.assertEqual(Accion.objects.count() + archivadas, len(todas))
+        self.assertEqual(archivo.total(), archivadas)
+
+        self.assertEqual(self.recorrer_historial(), todas)
+        self.assertEqual(self.recorrer_historial(caja=caja.id), de_la_caja)
+
+    def test_compactar_conserva_las_acciones(self):
+        todas = list(Accion.objects.order_by('-fecha_hora', '-id').values_list('id', flat=True))
+        # Varias ejecuciones dejan bloques pequeños en los mismos meses
+        for dias in (300, 250, 200):
+            archivo.archivar(dias=dias, tamanio_bloque=15)
+        bloques = len(archivo.cargar_indice()['bloques'])
+
+        self.assertGreater(archivo.compactar(), 0)
+        self.assertLess(len(archivo.cargar_indice()['bloques']), bloques)
+        self.assertEqual(self.recorrer_historial(), todas)
+
+    def test_termina_borrado_pendiente(self):
+        # Bloque escrito en el archivo pero cuyas acciones siguen en la base de datos
+        archivadas = archivo.archivar()
+        indice = archivo.cargar_indice()
+        bloque = indice['bloques'][-1]
+        ids = [registro['id'] for registro in archivo._leer_bloque(bloque['archivo'], bloque['inicio'], bloque['longitud'])[1]]
+        Accion.objects.bulk_create([Accion(id=i, tipo='visualizar_caja') for i in ids])
+        archivo._guardar_indice({**indice, 'pendientes': [[bloque['archivo'], bloque['inicio']]]})
+
+        self.assertEqual(archivo.archivar(), 0)
+        self.assertFalse(Accion.objects.filter(id__in=ids).exists())
+        self.assertEqual(archivo.total(), archivadas)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ExportacionTests(TestCase):
+    """
+    Las exportaciones se leen por lotes mientras se envían y el historial incluye las
+    acciones archivadas, en orden
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        generar(objetos=120, objetos_por_caja=20, semilla=11)
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(ARCHIVO_ACCIONES={'DIRECTORIO': directorio, 'DIAS': 180, 'TAMANIO_BLOQUE': 40})
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def contenido(self, respuesta):
+        self.assertTrue(respuesta.streaming)
+        return b''.join(respuesta.streaming_content).decode()
+
+    def test_objetos_csv(self):
+        # La vista no consulta nada: los datos se leen al enviar la respuesta
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(reverse('exportar', args=['objetos']))
+        # Un lote: objetos y sus cajas
+        with self.assertNumQueries(2):
+            filas = list(csv.DictReader(io.StringIO(self.contenido(respuesta))))
+        self.assertEqual([int(fila['id']) for fila in filas], list(Objeto.objects.order_by('id').values_list('id', flat=True)))
+
+        caja = Cajon.objects.order_by('id').first()
+        respuesta = self.client.get(reverse('exportar', args=['objetos']), {'caja': caja.id})
+        filas = list(csv.DictReader(io.StringIO(self.contenido(respuesta))))
+        self.assertEqual(len(filas), caja.objetos.count())
+        self.assertTrue(all(str(caja.id) in fila['cajas'].split(';') for fila in filas))
+
+    def test_acciones_incluye_archivadas(self):
+        todas = list(Accion.objects.order_by('fecha_hora', 'id').values_list('id', flat=True))
+        caja = Cajon.objects.order_by('id').first()
+        de_la_caja = list(caja.acciones.order_by('fecha_hora', 'id').values_list('id', flat=True))
+        archivadas = archivo.archivar()
+        self.assertGreater(archivadas, 0)
+
+        respuesta = self.client.get(reverse('exportar', args=['acciones']), {'formato': 'ndjson'})
+        filas = [json.loads(linea) for linea in self.contenido(respuesta).splitlines()]
+        self.assertEqual([fila['id'] for fila in filas], todas)
+        self.assertEqual(sum(fila['archivada'] for fila in filas), archivadas)
+
+        respuesta = self.client.get(reverse('exportar', args=['acciones']), {'formato': 'ndjson', 'caja': caja.id})
+        self.assertEqual([json.loads(linea)['id'] for linea in self.contenido(respuesta).splitlines()], de_la_caja)
+
+        # Lotes pequeños: la paginación por clave no salta ni repite filas
+        lotes = list(exportacion.acciones(tamanio_lote=7))
+        self.assertEqual([fila['id'] for lote in lotes for fila in lote], todas)
+        self.assertTrue(all(len(lote) <= 7 for lote in lotes))
+
+
+@override_settings(
+    BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'},
+    INSTRUMENTACION={**settings.INSTRUMENTACION, 'MUESTREO': 1.0},
+)
+class InstrumentacionTests(TestCase):
+    """
+    Cabecera Server-Timing, registro de peticiones lentas e histogramas por vista
+    """
+
+    def setUp(self):
+        self.caja = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+        self.staff = User.objects.create_user('admin', password='clave', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def tiempos(self, respuesta):
+        """
+        {nombre: (ms, descripción)} de la cabecera Server-Timing
+        """
+        tiempos = {}
+        for parte in respuesta['Server-Timing'].split(', '):
+            nombre, *parametros = parte.split(';')
+            valores = dict(parametro.split('=', 1) for parametro in parametros)
+            tiempos[nombre] = (float(valores['dur']), valores.get('desc', '').strip('"'))
+        return tiempos
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('crear_caja'))
+        tiempos = self.tiempos(respuesta)
+        self.assertEqual(list(tiempos), ['bd', 'plantillas', 'vista', 'total'])
+        # La sesión y el usuario se leen antes de empezar a medir
+        medidas = [c for c in consultas.captured_queries if 'django_session' not in c['sql'] and 'auth_user' not in c['sql']]
+        self.assertEqual(tiempos['bd'][1], f'{len(medidas)} consultas')
+        self.assertGreater(tiempos['plantillas'][0], 0)
+        self.assertLessEqual(tiempos['vista'][0], tiempos['total'][0])
+
+    def test_vista_asincrona(self):
+        # Las consultas se hacen en los hilos de sync_to_async y también se cuentan
+        tiempos = self.tiempos(self.client.get(reverse('detalle_caja', args=[self.caja.id])))
+        self.assertIn('bitacora', tiempos)
+        self.assertGreater(int(tiempos['bd'][1].split()[0]), 0)
+
+    def test_sin_server_timing(self):
+        with self.settings(INSTRUMENTACION={**settings.INSTRUMENTACION, 'SERVER_TIMING': False}):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('crear_caja')))
+        with self.settings(INSTRUMENTACION={**settings.INSTRUMENTACION, 'ACTIVA': False}):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('crear_caja')))
+        with self.settings(INSTRUMENTACION={**settings.INSTRUMENTACION, 'MUESTREO': 0}):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('crear_caja')))
+
+    def test_server_timing_solo_staff(self):
+        self.client.logout()
+        self.assertNotIn('Server-Timing', self.client.get(reverse('crear_caja')))
+        self.client.force_login(User.objects.create_user('usuario'))
+        self.assertNotIn('Server-Timing', self.client.get(reverse('crear_caja')))
+        with self.settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get(reverse('crear_caja')))
+
+    def test_peticiones_lentas(self):
+        with self.settings(INSTRUMENTACION={**settings.INSTRUMENTACION, 'UMBRAL_LENTO_MS': 0, 'CONSULTAS_LENTAS': 2}):
+            with self.assertLogs('sistema.instrumentacion.lentas', 'WARNING') as registro:
+                self.client.get(reverse('historial_acciones'), {'tipo': 'crear_caja'})
+        lenta = json.loads(registro.records[0].getMessage())
+        self.assertEqual((lenta['vista'], lenta['metodo'], lenta['estado']), ('historial_acciones', 'GET', 200))
+        self.assertEqual(lenta['ruta'], reverse('historial_acciones') + '?tipo=crear_caja')
+        self.assertEqual(len(lenta['consultas_lentas']), 2)
+        self.assertGreaterEqual(lenta['consultas_lentas'][0]['ms'], lenta['consultas_lentas'][1]['ms'])
+
+    def test_histogramas(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('instrumentacion')).status_code, 302)
+        self.client.login(username='admin', password='clave')
+        for _ in range(3):
+            self.client.get(reverse('crear_caja'))
+        vistas = self.client.get(reverse('instrumentacion')).json()['vistas']
+        self.assertGreaterEqual(vistas['crear_caja']['peticiones'], 3)
+        self.assertLessEqual(vistas['crear_caja']['p50_ms'], vistas['crear_caja']['max_ms'])
+
+    def test_percentiles(self):
+        histograma = instrumentacion.Histograma()
+        for ms in [1] * 90 + [30] * 9 + [4000]:
+            histograma.agregar(ms, consultas=2)
+        resumen = histograma.resumen()
+        self.assertEqual((resumen['p50_ms'], resumen['p95_ms'], resumen['p99_ms'], resumen['max_ms']), (5, 50, 50, 4000))
+        self.assertEqual(resumen['consultas_media'], 2)
+        self.assertEqual(resumen['intervalos']['<=5000'], 1)
+
+
+class EnrutadorReplicaTests(SimpleTestCase):
+    """
+    Las lecturas van a la réplica hasta que la petición escribe
+    """
+
+    def test_lee_de_la_principal_despues_de_escribir(self):
+        router = enrutador.EnrutadorReplica()
+        enrutador._empezar_peticion(sender=None)
+        self.assertEqual(router.db_for_read(Cajon), 'replica')
+        self.assertEqual(router.db_for_write(Cajon), 'default')
+        self.assertEqual(router.db_for_read(Objeto), 'default')
+        # La siguiente petición vuelve a leer de la réplica
+        enrutador._empezar_peticion(sender=None)
+        self.assertEqual(router.db_for_read(Objeto), 'replica')
+        self.assertFalse(router.allow_migrate('replica', 'sistema'))
+
+
+class IndiceSimilitudTests(SimpleTestCase):
+    """
+    El índice multi-índice de hashes perceptuales encuentra lo mismo que comparar con todos
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+
+    def fuerza_bruta(self, hashes, valor, distancia):
+        return sorted(
+            ((objeto_id, d) for objeto_id, otro in hashes.items()
+             if (d := (similitud.a_sin_signo(valor) ^ similitud.a_sin_signo(otro)).bit_count()) <= distancia),
+            key=lambda par: (par[1], par[0]),
+        )
+
+    def vecino(self, valor, bits):
+        # Mismo hash con `bits` bits cambiados
+        for bit in self.rng.choice(64, bits, replace=False):
+            valor = similitud.a_sin_signo(valor) ^ (1 << int(bit))
+        return similitud.a_con_signo(valor)
+
+    def test_igual_que_comparar_con_todos(self):
+        indice = similitud.IndiceSimilitud()
+        hashes = {}
+        bases = [similitud.a_con_signo(int(valor)) for valor in self.rng.integers(0, 2 ** 63, 50, dtype=np.int64) * 2]
+        for base in bases:
+            for bits in (0, 2, 5, 8, 12):
+                hashes[len(hashes) + 1] = self.vecino(base, bits)
+        # Unos consolidados en los arrays ordenados y otros todavía pendientes
+        for objeto_id, valor in hashes.items():
+            indice.agregar(objeto_id, valor)
+            if objeto_id == 150:
+                indice._consolidar()
+        for objeto_id in (3, 151, 200):
+            indice.quitar(objeto_id)
+            del hashes[objeto_id]
+        self.assertEqual(len(indice), len(hashes))
+
+        for base in bases[:10]:
+            for distancia in (0, 4, 8, 11):
+                self.assertEqual(indice.buscar(base, distancia), self.fuerza_bruta(hashes, base, distancia))
+
+    def test_fotos_parecidas(self):
+        imagen = Image.linear_gradient('L').rotate(30).convert('RGB')
+        parecida = imagen.point(lambda valor: min(valor + 10, 255)).resize((200, 200))
+        distinta = imagen.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        base = similitud.a_sin_signo(similitud.calcular_dhash(imagen))
+        self.assertLessEqual((base ^ similitud.a_sin_signo(similitud.calcular_dhash(parecida))).bit_count(), 8)
+        self.assertGreater((base ^ similitud.a_sin_signo(similitud.calcular_dhash(distinta))).bit_count(), 8)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ObjetosSimilaresTests(TestCase):
+    """
+    Objetos con foto parecida en cualquier caja, con el índice del proceso al día de altas y bajas
+    """
+
+    def setUp(self):
+        similitud._indice.descartar()
+        self.addCleanup(similitud._indice.descartar)
+        self.taller = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+        self.oficina = Cajon.objects.create(nombre='Oficina', capacidadMaxima=10)
+
+    def guardar(self, caja, nombre, phash):
+        _, nuevos = inventario.agregar_objetos(caja.id, [Objeto(nombre=nombre, tipo='herramientas', tamanio='pequeno')])
+        Objeto.objects.filter(id=nuevos[0].id).update(imagen_phash=phash)
+        return Objeto.objects.get(id=nuevos[0].id)
+
+    def test_objetos_similares(self):
+        sierra = self.guardar(self.taller, 'Sierra', 0b1011)
+        serrucho = self.guardar(self.oficina, 'Serrucho', 0b1001)
+        self.guardar(self.oficina, 'Cable', -1)
+        self.assertEqual(similitud.objetos_similares([sierra]), [(sierra, [serrucho])])
+        self.assertEqual(list(similitud.objetos_similares([sierra])[0][1][0].cajones.all()), [self.oficina])
+
+        # Las altas se ven en el índice ya construido sin reconstruirlo (a igual distancia, por id)
+        lima = self.guardar(self.oficina, 'Lima', 0b1111)
+        self.assertEqual(similitud.objetos_similares([sierra], distancia=1), [(sierra, [serrucho, lima])])
+        similitud.registrar_hash(lima.id, -1)
+        similitud.quitar_objetos([serrucho.id])
+        self.assertEqual(similitud.objetos_similares([sierra]), [])
+
+
+class RecargaTests(SimpleTestCase):
+    """
+    Índices en memoria: al caducar se sigue usando el anterior mientras se construye el nuevo
+    """
+
+    def setUp(self):
+        self.construidos = 0
+        self.seguir = threading.Event()
+
+    def construir(self):
+        self.construidos += 1
+        if self.construidos > 1:
+            self.seguir.wait(5)
+        return [f'versión {self.construidos}']
+
+    def test_reconstruye_en_segundo_plano(self):
+        recargable = IndiceRecargable(self.construir, 'prueba')
+        self.assertEqual(recargable.obtener(60), ['versión 1'])
+        self.assertIs(recargable.obtener(60), recargable.obtener(60))
+
+        # Caducado: la petición recibe el índice anterior sin esperar a la construcción
+        anterior = recargable.obtener(0)
+        self.assertEqual(anterior, ['versión 1'])
+        # Un cambio mientras se construye llega a los dos índices
+        recargable.aplicar(lambda indice: indice.append('alta'))
+        self.assertEqual(anterior, ['versión 1', 'alta'])
+        self.seguir.set()
+        recargable.esperar()
+
+        self.assertEqual(recargable.obtener(60), ['versión 2', 'alta'])
+        self.assertEqual(self.construidos, 2)
+
+    def test_descartar_durante_la_construccion(self):
+        recargable = IndiceRecargable(self.construir, 'prueba')
+        recargable.obtener(60)
+        recargable.obtener(0)
+        recargable.descartar()
+        self.seguir.set()
+        recargable.esperar()
+        # El índice construido en segundo plano era anterior a descartar()
+        self.assertEqual(recargable.obtener(60), ['versión 3'])
+
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ImagenesTests(TestCase):
+    """
+    Procesamiento de las fotos: orientación, tamaño, sin EXIF, nombre por el hash del
+    contenido (fotos idénticas comparten archivo) y borrado del original
+    """
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(
+            MEDIA_ROOT=os.path.join(directorio, 'media'),
+            IMAGENES={**settings.IMAGENES, 'SINCRONO': True},
+            CLASIFICADOR={**settings.CLASIFICADOR, 'SINCRONO': True, 'DIRECTORIO': os.path.join(directorio, 'indice')},
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.media = os.path.join(directorio, 'media')
+        self.caja = Cajon.objects.create(nombre='Taller', capacidadMaxima=10)
+
+    def foto(self):
+        # Apaisada en el archivo, vertical según su orientación EXIF (girada 90°)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Cámara de prueba'
+        imagen = Image.linear_gradient('L').resize((2000, 1000)).convert('RGB')
+        datos = io.BytesIO()
+        imagen.save(datos, format='JPEG', exif=exif)
+        return datos.getvalue()
+
+    def añadir(self, nombre, contenido):
+        self.client.post(reverse('añadir_objeto'), {
+            'nombre': nombre, 'tipoObjeto': 'herramientas', 'tamanio': 'pequeno', 'caja': self.caja.id,
+            'foto': SimpleUploadedFile('foto.jpg', contenido, content_type='image/jpeg'),
+        })
+        return Objeto.objects.get(nombre=nombre)
+
+    def archivos(self):
+        return sorted(
+            os.path.relpath(os.path.join(carpeta, nombre), self.media)
+            for carpeta, _, nombres in os.walk(self.media) for nombre in nombres
+        )
+
+    def test_procesa_la_foto(self):
+        contenido = self.foto()
+        objeto = self.añadir('Sierra', contenido)
+        contenido_hash = hashlib.sha256(contenido).hexdigest()
+        self.assertEqual(objeto.imagen_hash, contenido_hash)
+        self.assertEqual(objeto.imagen.name, f'objetos/{contenido_hash[:2]}/{contenido_hash}.webp')
+        self.assertIsNotNone(objeto.imagen_phash)
+
+        with Image.open(objeto.imagen.path) as imagen:
+            self.assertEqual((imagen.format, imagen.size), ('WEBP', (800, 1600)))
+            self.assertFalse(dict(imagen.getexif()))
+        with Image.open(objeto.miniatura.path) as miniatura:
+            self.assertEqual(miniatura.size, (128, 256))
+
+        # La foto subida se borra: solo quedan la procesada y su miniatura
+        self.assertEqual(self.archivos(), sorted([objeto.imagen.name, objeto.miniatura.name]))
+
+        # Procesarla otra vez no cambia nada
+        imagenes.procesar_objeto(objeto.id)
+        self.assertEqual(Objeto.objects.get(id=objeto.id).imagen.name, objeto.imagen.name)
+
+    def test_fotos_identicas_comparten_archivo(self):
+        contenido = self.foto()
+        sierra = self.añadir('Sierra', contenido)
+        serrucho = self.añadir('Serrucho', contenido)
+        self.assertEqual(serrucho.imagen.name, sierra.imagen.name)
+        self.assertEqual(serrucho.miniatura.name, sierra.miniatura.name)
+        self.assertEqual(serrucho.imagen_phash, sierra.imagen_phash)
+        self.assertEqual(len(self.archivos()), 2)
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class MediosTests(TestCase):
+    """
+    Entrega de las fotos: ETag, caché, peticiones condicionales, rangos y envío delegado
+    """
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(MEDIA_ROOT=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.contenido = bytes(range(256)) * 40
+        self.hash = 'ab' * 32
+        for nombre in (f'objetos/ab/{self.hash}.webp', 'objetos/foto.jpg'):
+            ruta = os.path.join(directorio, nombre)
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(ruta, 'wb') as archivo:
+                archivo.write(self.contenido)
+        self.url = f'/media/objetos/ab/{self.hash}.webp'
+
+    def test_foto_procesada_en_cache_para_siempre(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(b''.join(respuesta.streaming_content), self.contenido)
+        self.assertEqual(respuesta['ETag'], f'"{self.hash}"')
+        self.assertEqual(respuesta['Content-Type'], 'image/webp')
+        self.assertIn('immutable', respuesta['Cache-Control'])
+
+        respuesta = self.client.get(self.url, headers={'If-None-Match': f'"{self.hash}"'})
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], f'"{self.hash}"')
+
+        # Las fotos sin procesar se revalidan con el hash de su contenido
+        respuesta = self.client.get('/media/objetos/foto.jpg')
+        self.assertEqual(respuesta['Cache-Control'], 'no-cache')
+        self.assertEqual(respuesta['ETag'], f'"{hashlib.sha256(self.contenido).hexdigest()}"')
+        respuesta.close()
+
+    def test_rangos(self):
+        respuesta = self.client.get(self.url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(respuesta.status_code, 206)
+        self.assertEqual(respuesta['Content-Range'], f'bytes 100-199/{len(self.contenido)}')
+        self.assertEqual(b''.join(respuesta.streaming_content), self.contenido[100:200])
+
+        respuesta = self.client.get(self.url, headers={'Range': 'bytes=-10'})
+        self.assertEqual(b''.join(respuesta.streaming_content), self.contenido[-10:])
+
+        respuesta = self.client.get(self.url, headers={'Range': f'bytes={len(self.contenido)}-'})
+        self.assertEqual(respuesta.status_code, 416)
+        self.assertEqual(respuesta['Content-Range'], f'bytes */{len(self.contenido)}')
+
+        # Con varios rangos o de otra versión del archivo se envía entero
+        for cabeceras in ({'Range': 'bytes=0-1,5-6'}, {'Range': 'bytes=0-1', 'If-Range': '"otra"'}):
+            respuesta = self.client.get(self.url, headers=cabeceras)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(b''.join(respuesta.streaming_content), self.contenido)
+
+    def test_rutas_fuera_de_media(self):
+        for url in ('/media/../manage.py', '/media/objetos/', '/media/objetos/no-existe.jpg'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_envio_delegado_en_el_proxy(self):
+        opciones = {**settings.MEDIOS, 'ENVIO': 'x-accel-redirect'}
+        with override_settings(MEDIOS=opciones):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.content, b'')
+        self.assertEqual(respuesta['X-Accel-Redirect'], f'/media-interno/objetos/ab/{self.hash}.webp')
+        self.assertIn('immutable', respuesta['Cache-Control'])
+
+
+@override_settings(BITACORA_ACCIONES={'BACKEND': 'sistema.bitacora.BitacoraSincrona'})
+class ClasificadorTests(TestCase):
+    """
+    Sugerencia del tipo y el tamaño por la foto: características, índice en disco y formulario
+    """
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(
+            MEDIA_ROOT=os.path.join(directorio, 'media'),
+            IMAGENES={**settings.IMAGENES, 'SINCRONO': True},
+            CLASIFICADOR={**settings.CLASIFICADOR, 'SINCRONO': True, 'DIRECTORIO': os.path.join(directorio, 'indice')},
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.directorio = directorio
+        self.rng = random.Random(3)
+        self.caja = Cajon.objects.create(nombre='Taller', capacidadMaxima=100)
+
+    def foto(self, tipo, tamanio):
+        ruta = os.path.join(self.directorio, f'{self.rng.getrandbits(64):x}.jpg')
+        foto_sintetica(ruta, tipo, tamanio, self.rng, ancho=320, alto=240)
+        with open(ruta, 'rb') as archivo:
+            return SimpleUploadedFile('foto.jpg', archivo.read(), content_type='image/jpeg')
+
+    def añadir(self, nombre, tipo, tamanio, foto):
+        return self.client.post(reverse('añadir_objeto'), {
+            'nombre': nombre, 'tipoObjeto': tipo, 'tamanio': tamanio, 'caja': self.caja.id, 'foto': foto,
+        }, follow=True)
+
+    def etiquetar(self):
+        # Fotos de objetos ya guardados: se añaden al índice al procesarlas
+        for numero in range(4):
+            for tipo, tamanio in (('ropa', 'grande'), ('cables', 'pequeno')):
+                self.añadir(f'{tipo} {numero}', tipo, tamanio, self.foto(tipo, tamanio))
+
+    def test_caracteristicas(self):
+        matriz = calcular_lote([self.foto('juguetes', 'mediano').read(), b'no es una foto'])
+        self.assertEqual(matriz.shape, (2, DIMENSION))
+        self.assertAlmostEqual(float(np.linalg.norm(matriz[0])), 1.0, places=5)
+        self.assertFalse(matriz[1].any())
+
+    def test_indice_incremental(self):
+        self.etiquetar()
+        indice = clasificador.obtener_indice()
+        self.assertEqual(indice.filas, 8)
+        self.assertIsInstance(indice.caracteristicas, np.memmap)
+        self.assertEqual(sorted(indice.ids), sorted(Objeto.objects.values_list('id', flat=True)))
+
+        # Otro proceso (otra instancia) ve las filas que se añaden después
+        otro = clasificador.Indice(settings.CLASIFICADOR['DIRECTORIO']).actualizar()
+        self.añadir('ropa 5', 'ropa', 'grande', self.foto('ropa', 'grande'))
+        self.assertEqual(otro.actualizar().filas, 9)
+
+        # La reconstrucción escribe una generación nueva con las mismas fotos
+        self.assertEqual(clasificador.reconstruir(), 9)
+        self.assertEqual(len([nombre for nombre in os.listdir(settings.CLASIFICADOR['DIRECTORIO'])
+                              if os.path.isdir(os.path.join(settings.CLASIFICADOR['DIRECTORIO'], nombre))]), 1)
+        self.assertEqual(otro.actualizar().filas, 9)
+
+    def test_sugerencia_de_la_api(self):
+        respuesta = self.client.post(reverse('api_clasificar'), {'foto': self.foto('cables', 'pequeno')})
+        self.assertIsNone(respuesta.json()['sugerencia'])
+
+        self.etiquetar()
+        respuesta = self.client.post(reverse('api_clasificar'), {'foto': self.foto('cables', 'pequeno')})
+        sugerencia = respuesta.json()['sugerencia']
+        self.assertEqual((sugerencia['tipo'], sugerencia['tamanio']), ('cables', 'pequeno'))
+        self.assertGreaterEqual(sugerencia['confianza_tipo'], settings.CLASIFICADOR['CONFIANZA_MINIMA'])
+        self.assertEqual(self.client.post(reverse('api_clasificar')).status_code, 400)
+
+    def test_añadir_objeto_con_tipo_reconocido(self):
+        self.etiquetar()
+        respuesta = self.añadir('Bufanda', 'auto', 'auto', self.foto('ropa', 'grande'))
+        objeto = Objeto.objects.get(nombre='Bufanda')
+        self.assertEqual((objeto.tipo, objeto.tamanio), ('ropa', 'grande'))
+        self.assertContains(respuesta, 'Reconocido por la foto')
+
+        # Sin foto (o sin una sugerencia fiable) ya no se guarda como papelería
+        respuesta = self.añadir('Misterio', 'auto', 'mediano', '')
+        self.assertFalse(Objeto.objects.filter(nombre='Misterio').exists())
+        self.assertContains(respuesta, 'No se pudo reconocer el tipo')
 
-# Create your tests here.
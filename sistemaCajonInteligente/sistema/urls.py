@@ -1,13 +1,27 @@
 from django.urls import path
-from . import views
+from . import api, views
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('crear-caja/', views.crear_caja, name='crear_caja'),
     path('añadir-objeto/', views.añadir_objeto, name='añadir_objeto'),
     path('historial/', views.historial_acciones, name='historial_acciones'),
+    path('historial/eventos/', views.eventos_acciones, name='eventos_acciones'),
     path('caja/<int:caja_id>/', views.detalle_caja, name='detalle_caja'),
+    path('caja/<int:caja_id>/objetos/', views.objetos_caja, name='objetos_caja'),
+    path('caja/<int:caja_id>/eventos/', views.eventos_acciones, name='eventos_caja'),
     path('eliminar-objeto/<int:objeto_id>/', views.eliminar_objeto, name='eliminar_objeto'),
     path('eliminar-duplicados/<int:caja_id>/', views.eliminar_duplicados, name='eliminar_duplicados'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('importar-objetos/', views.importar_objetos, name='importar_objetos'),
+    path('organizar-cajas/', views.organizar_cajas, name='organizar_cajas'),
+    path('estadisticas/', views.estadisticas, name='estadisticas'),
+    path('exportar/<str:que>/', views.exportar_datos, name='exportar'),
+    path('buscar/', views.buscar_objetos, name='buscar_objetos'),
+    path('api/buscar/', api.api_buscar, name='api_buscar'),
+    path('api/cajones/', api.api_cajones, name='api_cajones'),
+    path('api/cajones/<int:caja_id>/objetos/', api.api_objetos_caja, name='api_objetos_caja'),
+    path('api/historial/', api.api_historial, name='api_historial'),
+    path('api/clasificar/', api.api_clasificar, name='api_clasificar'),
+    path('instrumentacion/', api.api_instrumentacion, name='instrumentacion'),
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:ruta>', views.servir_medio, name='medio'),
+]
@@ -1,72 +1,120 @@
+from datetime import datetime, time, timedelta
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.views.decorators.http import require_safe
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib import messages
-from .models import Cajon, Objeto, Accion
+from django.db import transaction
+from .models import Cajon, Contenido, Objeto, Accion
+from .bitacora import EntradaAccion, obtener_bitacora
+from .duplicados import grupos_duplicados, apilar_duplicados
+from .importacion import importar_archivo_subido
+from .organizador import organizar
+from .paginacion import CursorInvalido, paginar
+from . import archivo, busqueda, clasificador, eventos, exportacion, fragmentos, imagenes, instrumentacion, inventario, medios, parecidos, resumenes, similitud
 
 # Función que se llama cada que se realiza una acción, y guardarla en la base de datos
 def registrar_accion(tipo_accion, cajon=None, objeto=None, descripcion=""):
     """
-    Registra una acción en el sistema
+    Registra una acción en el sistema. La escritura la hace la bitácora configurada
+    (por defecto en lotes desde un hilo, ver sistema/bitacora.py)
     """
     try:
-        accion = Accion(
-            tipo=tipo_accion,
-            cajon=cajon,
-            descripcion=descripcion
-        )
-        accion.save()
-        
-        # Si hay un objeto involucrado, lo agregamos a la relación ManyToMany
-        if objeto:
-            accion.objetosAfectados.add(objeto)
-            
-        return accion
+        with instrumentacion.medir_seccion('bitacora'):
+            obtener_bitacora().registrar(
+                EntradaAccion.crear(tipo_accion, cajon=cajon, objetos=[objeto], descripcion=descripcion)
+            )
     except Exception as e:
         print(f"Error al registrar acción: {str(e)}")
-        return None
 
-# Creación de la caja
-def crear_caja(request):
-    if request.method == 'POST':
-        nombre = request.POST.get('nombre')
-        capacidad_maxima = request.POST.get('capacidadMax')
 
-        try:
-            nuevo_cajon = Cajon(
-                nombre=nombre,
-                capacidadMaxima=int(capacidad_maxima)
-            )
-            nuevo_cajon.save()
-            
-            # Registrar la acción
-            registrar_accion(
-                tipo_accion='crear_cajon',
-                cajon=nuevo_cajon,
-                descripcion=f'Se creó la caja "{nombre}" con capacidad máxima de {capacidad_maxima} objetos'
+async def aregistrar_accion(tipo_accion, cajon=None, objeto=None, descripcion=""):
+    """
+    registrar_accion para las vistas asíncronas: con la bitácora en cola la acción
+    solo se encola, sin esperar a la base de datos
+    """
+    try:
+        with instrumentacion.medir_seccion('bitacora'):
+            await obtener_bitacora().aregistrar(
+                EntradaAccion.crear(tipo_accion, cajon=cajon, objetos=[objeto], descripcion=descripcion)
             )
-            
-            # Mostrar mensaje de éxito
-            messages.success(request, f'Caja "{nombre}" creada exitosamente!')
+    except Exception as e:
+        print(f"Error al registrar acción: {str(e)}")
 
-            return redirect('crear_caja')
 
-        except ValueError:
-            # Error si la capacidad no es un número válido
-            messages.error(request, 'La capacidad máxima debe ser un número válido.')
-        except Exception as e:
-            # Error general
-            messages.error(request, f'Error al crear la caja: {str(e)}')
+async def arender(request, plantilla, context):
+    """
+    render() desde una vista asíncrona. Se renderiza en un hilo: la plantilla puede
+    leer la sesión (mensajes) y así no se bloquea el bucle de eventos
+    """
+    return await sync_to_async(render)(request, plantilla, context)
+
+
+# Creación de la caja
+async def crear_caja(request):
+    if request.method == 'POST':
+        # El alta escribe en la base de datos: se hace en un hilo con el ORM síncrono
+        respuesta = await sync_to_async(_crear_caja_post)(request)
+        if respuesta is not None:
+            return respuesta
 
     # Si es GET o hubo error, mostrar el formulario
     # Obtener todas las cajas existentes para mostrarlas
-    cajas = Cajon.objects.all()
+    cajas = [caja async for caja in Cajon.objects.all()]
     # Obtener las últimas 5 acciones para mostrar en el crear cajas
-    ultimas_acciones = Accion.objects.all().order_by('-fecha_hora')[:5]
+    ultimas_acciones = [accion async for accion in Accion.objects.all().order_by('-fecha_hora')[:5]]
     
     context = {
         'cajas': cajas,
         'ultimas_acciones': ultimas_acciones,
     }
-    return render(request, 'InterfazCrearCajas.html', context)
+    return await arender(request, 'InterfazCrearCajas.html', context)
+
+
+def _crear_caja_post(request):
+    """
+    Crea la caja del formulario. Devuelve la redirección si se creó o None si hubo
+    un error (ya añadido a los mensajes)
+    """
+    nombre = request.POST.get('nombre')
+    capacidad_maxima = request.POST.get('capacidadMax')
+
+    try:
+        nuevo_cajon = Cajon(
+            nombre=nombre,
+            capacidadMaxima=int(capacidad_maxima)
+        )
+        with transaction.atomic():
+            nuevo_cajon.save()
+            inventario.alta_cajas([nuevo_cajon])
+        
+        # Registrar la acción
+        registrar_accion(
+            tipo_accion='crear_cajon',
+            cajon=nuevo_cajon,
+            descripcion=f'Se creó la caja "{nombre}" con capacidad para {nuevo_cajon.descripcion_capacidad}'
+        )
+        
+        # Mostrar mensaje de éxito
+        messages.success(request, f'Caja "{nombre}" creada exitosamente!')
+
+        return redirect('crear_caja')
+
+    except ValueError:
+        # Error si la capacidad no es un número válido
+        messages.error(request, 'La capacidad máxima debe ser un número válido.')
+    except Exception as e:
+        # Error general
+        messages.error(request, f'Error al crear la caja: {str(e)}')
+    return None
 
 
 def añadir_objeto(request):
@@ -87,24 +135,57 @@ def añadir_objeto(request):
             # Obtener la caja seleccionada
             caja = Cajon.objects.get(id=caja_id)
 
-            # Validar el tipo de objeto (debe estar en las opciones válidas)
-            tipos_validos = ['ropa', 'peleria', 'cables', 'herramientas', 'juguetes', 'papeleria', 'electronica']
-            if tipo_objeto.lower() not in tipos_validos:
-                # Si el tipo no está en la lista, usamos 'papeleria' como valor por defecto
-                tipo_objeto = 'papeleria'
+            # Tipo y tamaño: 'auto' (o uno que no es válido) se sugiere por la foto
+            tipo_objeto = tipo_objeto.lower()
+            detectar_tipo = tipo_objeto not in clasificador.TIPOS
+            detectar_tamanio = tamanio_objeto not in clasificador.TAMANIOS
+            if detectar_tipo or detectar_tamanio:
+                sugerencia = (clasificador.sugerir_foto(foto) if foto else None) or {}
+                if detectar_tipo and not sugerencia.get('tipo'):
+                    messages.error(request, 'No se pudo reconocer el tipo del objeto por la foto, elige uno.')
+                    raise ValueError('Tipo no reconocido')
+                detectados = []
+                if detectar_tipo:
+                    tipo_objeto = sugerencia['tipo']
+                    detectados.append(f'tipo "{tipo_objeto}"')
+                if detectar_tamanio and sugerencia.get('tamanio'):
+                    tamanio_objeto = sugerencia['tamanio']
+                    detectados.append(f'tamaño "{tamanio_objeto}"')
+                elif detectar_tamanio:
+                    tamanio_objeto = 'mediano'
+                    messages.warning(request, 'No se pudo reconocer el tamaño por la foto, se guardó como "mediano".')
+                if detectados:
+                    messages.info(request, f'Reconocido por la foto: {" y ".join(detectados)}.')
 
             # Crear el nuevo objeto
             nuevo_objeto = Objeto(
                 nombre=nombre_objeto,
-                tipo=tipo_objeto.lower(),
+                tipo=tipo_objeto,
                 tamanio=tamanio_objeto,
                 imagen=foto
             )
-            nuevo_objeto.save()
 
-            # Añadir el objeto a la caja
-            caja.objetos.add(nuevo_objeto)
-            caja.save()
+            # Reservar sitio en la caja (o en otra si está llena y se pidió) y guardarlo,
+            # todo en la misma transacción. Si la caja ya tiene un objeto igual se suma
+            # una unidad a ese objeto.
+            caja_id_final, nuevos = inventario.agregar_objetos(
+                caja.id, [nuevo_objeto], redirigir=request.POST.get('redirigir') == '1'
+            )
+            if caja_id_final != caja.id:
+                caja_pedida = caja
+                caja = Cajon.objects.get(id=caja_id_final)
+                messages.info(request, f'La caja "{caja_pedida.nombre}" está llena, el objeto se guardó en "{caja.nombre}".')
+
+            # La foto se procesa en segundo plano (la transacción ya se confirmó). Si el
+            # objeto se apiló, la foto solo se guarda cuando el objeto existente no tenía
+            if foto and not nuevos:
+                existente = Objeto.objects.get(id=nuevo_objeto.id)
+                if not existente.imagen:
+                    existente.imagen = foto
+                    existente.save(update_fields=['imagen'])
+                    imagenes.encolar(existente.id)
+            elif nuevo_objeto.imagen:
+                imagenes.encolar(nuevo_objeto.id)
             
             # Registrar la acción
             registrar_accion(
@@ -115,19 +196,25 @@ def añadir_objeto(request):
             )
 
             # Mostrar mensaje de éxito
-            messages.success(request, f'Objeto "{nombre_objeto}" añadido a la caja "{caja.nombre}" exitosamente!')
+            if nuevos:
+                messages.success(request, f'Objeto "{nombre_objeto}" añadido a la caja "{caja.nombre}" exitosamente!')
+            else:
+                messages.success(request, f'Se sumó una unidad a "{nombre_objeto}" en la caja "{caja.nombre}".')
 
             # Redireccionar para evitar reenvío del formulario
             return redirect('añadir_objeto')
 
         except Cajon.DoesNotExist:
             messages.error(request, 'La caja seleccionada no existe.')
+        except inventario.CajaLlena:
+            messages.error(request, f'La caja "{caja.nombre}" no tiene sitio para el objeto ({caja.porcentaje_ocupacion} % ocupado).')
         except Exception as e:
             messages.error(request, f'Error al añadir el objeto: {str(e)}')
 
     # Si es GET o hubo error, mostrar el formulario
     cajas = Cajon.objects.all()
-    objetos = Objeto.objects.all()
+    # Las cajas de cada objeto en una sola consulta, no una por objeto
+    objetos = Objeto.objects.prefetch_related(Prefetch('cajones', queryset=Cajon.objects.only('id', 'nombre')))
 
     # Obtener las opciones de tipo y tamaño para el template
     tipos_objeto = [
@@ -155,109 +242,321 @@ def añadir_objeto(request):
     return render(request, 'InterfazAñadirObjetos.html', context)
 
 
-def historial_acciones(request):
+def _leer_fecha(texto):
+    try:
+        return parse_date(texto) if texto else None
+    except ValueError:
+        return None
+
+
+def filtrar_acciones(acciones, parametros):
     """
-    Vista para mostrar el historial de todas las acciones realizadas en el sistema
+    Aplica los filtros del historial (caja, tipo y rango de fechas) y devuelve
+    el queryset filtrado junto con los valores usados
     """
-    # Obtener todas las acciones ordenadas por fecha (más recientes primero)
-    acciones = Accion.objects.all().order_by('-fecha_hora')
-    
-    # Paginación opcional (mostrar 20 acciones por página)
-    from django.core.paginator import Paginator
-    paginator = Paginator(acciones, 20)  # 20 acciones por página
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    filtros = {
+        'caja': parametros.get('caja', ''),
+        'tipo': parametros.get('tipo', ''),
+        'desde': parametros.get('desde', ''),
+        'hasta': parametros.get('hasta', ''),
+    }
+
+    if filtros['caja'].isdigit():
+        acciones = acciones.filter(cajon_id=int(filtros['caja']))
+    if filtros['tipo']:
+        acciones = acciones.filter(tipo=filtros['tipo'])
+
+    # Las fechas se convierten en un rango de datetimes para que el índice sirva
+    inicio, fin = rango_fechas(filtros)
+    if inicio:
+        acciones = acciones.filter(fecha_hora__gte=inicio)
+    if fin:
+        acciones = acciones.filter(fecha_hora__lt=fin)
+
+    return acciones, filtros
+
+
+def rango_fechas(filtros):
+    """
+    Rango [inicio, fin) de datetimes de los filtros 'desde' y 'hasta' (días completos)
+    """
+    desde = _leer_fecha(filtros['desde'])
+    hasta = _leer_fecha(filtros['hasta'])
+    inicio = timezone.make_aware(datetime.combine(desde, time.min)) if desde else None
+    fin = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)) if hasta else None
+    return inicio, fin
+
+
+async def historial_acciones(request):
+    """
+    Vista para mostrar el historial de todas las acciones realizadas en el sistema.
+    Usa paginación por cursor (fecha_hora, id) para que cualquier página cueste lo mismo.
+    Al pasar de la acción más antigua de la base de datos sigue con las archivadas.
+    """
+    acciones, filtros = filtrar_acciones(Accion.objects.all(), request.GET)
+    # La página puede leer bloques del archivo (disco): se arma en un hilo
+    try:
+        pagina, total_archivadas = await sync_to_async(_pagina_historial)(acciones, filtros, request.GET)
+    except CursorInvalido:
+        return HttpResponseBadRequest('El enlace de paginación no es válido.')
+
+    # El total exacto requiere un COUNT(*) completo, así que se guarda en caché unos segundos
+    clave_total = 'historial_total:' + '|'.join(f'{k}={v}' for k, v in sorted(filtros.items()))
+    total_acciones = await cache.aget(clave_total)
+    if total_acciones is None:
+        total_acciones = await acciones.acount()
+        await cache.aset(clave_total, total_acciones, settings.HISTORIAL_TOTAL_CACHE_SEGUNDOS)
+
+    # Parámetros de los filtros para conservarlos en los enlaces de paginación
+    parametros_filtro = urlencode({k: v for k, v in filtros.items() if v})
+
     context = {
-        'acciones': page_obj,
-        'total_acciones': acciones.count(),
+        'acciones': pagina,
+        # Las acciones nuevas se añaden en vivo solo en la primera página y sin fecha final
+        'en_vivo': not (request.GET.get('despues') or request.GET.get('antes') or filtros['hasta']),
+        'desde': timezone.now().isoformat(),
+        'total_acciones': total_acciones,
+        'total_archivadas': total_archivadas,
+        'filtros': filtros,
+        'parametros_filtro': parametros_filtro,
+        'tipos_accion': Accion._meta.get_field('tipo').choices,
+        'cajas': [caja async for caja in Cajon.objects.only('id', 'nombre').order_by('nombre')],
+    }
+    return await arender(request, 'historial_acciones.html', context)
+
+
+def _pagina_historial(acciones, filtros, parametros):
+    """
+    Página del historial (base de datos y archivo) y total de acciones archivadas,
+    o None si no se puede calcular con los filtros
+    """
+    inicio, fin = rango_fechas(filtros)
+    archivadas = archivo.lector_historial(
+        cajon_id=int(filtros['caja']) if filtros['caja'].isdigit() else None,
+        tipo=filtros['tipo'] or None,
+        inicio=inicio,
+        fin=fin,
+    )
+
+    # Página de 20 acciones, cargando la caja y los objetos afectados en dos consultas fijas
+    pagina = paginar(
+        acciones.select_related('cajon').prefetch_related(
+            Prefetch('objetosAfectados', queryset=Objeto.objects.only('id', 'nombre'))
+        ),
+        campos=['-fecha_hora', '-id'],
+        tamanio=20,
+        despues=parametros.get('despues'),
+        antes=parametros.get('antes'),
+        adicionales=archivadas,
+    )
+
+    # El índice del archivo solo cuenta por tipo; con otros filtros no se muestra
+    total_archivadas = None
+    if archivadas and not (filtros['caja'] or filtros['desde'] or filtros['hasta']):
+        total_archivadas = archivo.total(filtros['tipo'] or None)
+    return pagina, total_archivadas
+
+# Objetos por página en detalle_caja ("Cargar más" pide la siguiente)
+OBJETOS_POR_PAGINA = 48
+
+# Orden de cada opción de detalle_caja sobre los campos copiados en Contenido: cada uno
+# tiene su índice (cajon, ..., objeto), así que una página no depende del tamaño de la caja
+ORDENES_CAJA = {
+    'nombre': ['nombre', 'objeto_id'],
+    'tipo': ['tipo', 'nombre', 'objeto_id'],
+    'tamanio': ['rango_tamanio', 'nombre', 'objeto_id'],
+}
+
+
+def _leer_orden(parametros):
+    orden = parametros.get('orden', 'nombre')  # Por defecto ordenar por nombre
+    return orden if orden in ORDENES_CAJA else 'nombre'
+
+
+def pagina_objetos_caja(caja, orden, despues=None):
+    """
+    Página de objetos de la caja (con sus unidades en `cantidad`) en el orden dado,
+    a partir del cursor `despues`. Lanza CursorInvalido si el cursor no es de este orden.
+    """
+    filas = Contenido.objects.filter(cajon=caja).select_related('objeto')
+    pagina = paginar(filas, campos=ORDENES_CAJA[orden], tamanio=OBJETOS_POR_PAGINA, despues=despues)
+    objetos = []
+    for fila in pagina:
+        fila.objeto.cantidad = fila.cantidad
+        objetos.append(fila.objeto)
+    pagina.elementos = objetos
+    return pagina
+
+
+def contenido_pagina(caja, objetos):
+    """
+    Sugerencias de duplicados y grupos de nombres parecidos de los objetos de una página de
+    la caja (como las fotos parecidas): solo se consultan los grupos de esos objetos, así
+    el coste no depende del tamaño de la caja
+    """
+    # Duplicados: los grupos vienen de un GROUP BY en la base de datos, con lo necesario para mostrarlos
+    grupos = grupos_duplicados(caja, {objeto.clave_duplicado for objeto in objetos})
+    tipos = dict(Objeto._meta.get_field('tipo').choices)
+    tamanios = dict(Objeto._meta.get_field('tamanio').choices)
+    sugerencias = [
+        {
+            'nombre': grupo['nombre_objeto'],
+            'tipo': tipos.get(grupo['tipo_objeto'], grupo['tipo_objeto']),
+            'tamanio': tamanios.get(grupo['tamanio_objeto'], grupo['tamanio_objeto']),
+            'cantidad': grupo['objetos'],
+            'clave': grupo['clave_duplicado'],  # Para identificar el grupo de duplicados
+        }
+        for grupo in grupos
+    ]
+
+    # Nombres parecidos (no idénticos): los objetos de la página se agrupan con los de la caja
+    # que comparten una banda de la firma y solo se cargan los objetos agrupados. Los grupos
+    # que solo tienen duplicados ya están arriba.
+    ids_parecidos = parecidos.grupos_de(objetos, caja.id)
+    agrupados = [objeto_id for grupo in ids_parecidos for objeto_id in grupo]
+    por_id = {}
+    for inicio in range(0, len(agrupados), inventario.TAMANIO_BLOQUE):
+        bloque = agrupados[inicio:inicio + inventario.TAMANIO_BLOQUE]
+        por_id.update((objeto.id, objeto) for objeto in caja.objetos_con_cantidad().filter(id__in=bloque))
+    grupos_parecidos = []
+    for grupo in ids_parecidos:
+        grupo = [por_id[objeto_id] for objeto_id in grupo if objeto_id in por_id]
+        if len({objeto.clave_duplicado for objeto in grupo}) > 1:
+            grupos_parecidos.append(grupo)
+
+    return {
+        'claves_duplicadas': {grupo['clave_duplicado'] for grupo in grupos},
+        'sugerencias': sugerencias,
+        'parecidos': grupos_parecidos,
     }
-    return render(request, 'historial_acciones.html', context)
 
-def detalle_caja(request, caja_id):
+
+def calcular_contenido_caja(caja, orden):
     """
-    Vista para mostrar el detalle de una caja específica con opciones de ordenamiento
+    Calcula la primera página de objetos de la caja con sus sugerencias de duplicados y
+    grupos de nombres parecidos
     """
+    pagina = pagina_objetos_caja(caja, orden)
+    return {'pagina': pagina, **contenido_pagina(caja, pagina.elementos)}
+
+
+async def _obtener_caja(caja_id):
     try:
-        caja = Cajon.objects.get(id=caja_id)
+        return await Cajon.objects.aget(id=caja_id)
     except Cajon.DoesNotExist:
+        return None
+
+
+async def detalle_caja(request, caja_id):
+    """
+    Vista para mostrar el detalle de una caja específica con opciones de ordenamiento.
+    Muestra una página de objetos; el resto se pide con "Cargar más" (objetos_caja).
+    """
+    caja = await _obtener_caja(caja_id)
+    if caja is None:
         messages.error(request, 'La caja no existe.')
         return redirect('crear_caja')
     
     # Registrar la acción de visualizar caja
-    registrar_accion(
+    await aregistrar_accion(
         tipo_accion='visualizar_caja',
         cajon=caja,
         descripcion=f'Se visualizó y organizó el contenido de la caja "{caja.nombre}"'
     )
     
     # Obtener parámetro de ordenamiento
-    orden = request.GET.get('orden', 'nombre')  # Por defecto ordenar por nombre
-    
-    # Ordenar objetos según el parámetro
-    if orden == 'nombre':
-        objetos = caja.objetos.all().order_by('nombre')
-    elif orden == 'tipo':
-        objetos = caja.objetos.all().order_by('tipo', 'nombre')
-    elif orden == 'tamanio':
-        # Ordenar por tamaño: pequeño, mediano, grande
-        from django.db.models import Case, When, Value, IntegerField
-        objetos = caja.objetos.all().annotate(
-            orden_tamanio=Case(
-                When(tamanio='pequeno', then=Value(1)),
-                When(tamanio='mediano', then=Value(2)),
-                When(tamanio='grande', then=Value(3)),
-                default=Value(4),
-                output_field=IntegerField(),
-            )
-        ).order_by('orden_tamanio', 'nombre')
-    else:
-        objetos = caja.objetos.all().order_by('nombre')
-    
-    # Detectar duplicados (objetos con el mismo nombre, tipo y tamaño)
-    duplicados = []
-    objetos_revisados = {}
-    
-    for objeto in objetos:
-        clave = f"{objeto.nombre.lower().strip()}_{objeto.tipo}_{objeto.tamanio}"
-        if clave in objetos_revisados:
-            # Si ya existe, agregar ambos a duplicados
-            if objetos_revisados[clave] not in duplicados:
-                duplicados.append(objetos_revisados[clave])
-            duplicados.append(objeto)
-        else:
-            objetos_revisados[clave] = objeto
-    
-    # Crear sugerencias para duplicados
-    sugerencias = []
-    duplicados_procesados = set()
-    
-    for objeto in duplicados:
-        clave = f"{objeto.nombre.lower().strip()}_{objeto.tipo}_{objeto.tamanio}"
-        if clave not in duplicados_procesados:
-            objetos_similares = [obj for obj in duplicados if f"{obj.nombre.lower().strip()}_{obj.tipo}_{obj.tamanio}" == clave]
-            if len(objetos_similares) > 1:
-                sugerencias.append({
-                    'nombre': objeto.nombre,
-                    'tipo': objeto.get_tipo_display(),
-                    'tamanio': objeto.get_tamanio_display(),
-                    'cantidad': len(objetos_similares),
-                    'objetos': objetos_similares,
-                    'clave': clave  # Para identificar el grupo de duplicados
-                })
-                duplicados_procesados.add(clave)
-    
+    orden = _leer_orden(request.GET)
+
+    # Primera página y duplicados (en caché mientras la caja no cambie)
+    contenido = await fragmentos.aobtener_detalle(caja, orden, calcular_contenido_caja)
+    pagina = contenido['pagina']
+    if request.GET.get('despues'):
+        # Sin JavaScript "Cargar más" es un enlace a la página siguiente
+        try:
+            pagina = await sync_to_async(pagina_objetos_caja)(caja, orden, request.GET['despues'])
+            contenido = await sync_to_async(contenido_pagina)(caja, pagina.elementos)
+        except CursorInvalido:
+            # Enlace de otro orden o modificado: se muestra la primera página
+            pass
+
+    # Objetos de cualquier caja con una foto parecida (índice de hashes perceptuales)
+    similares = await sync_to_async(similitud.objetos_similares)(pagina.elementos)
+
     context = {
         'caja': caja,
-        'objetos': objetos,
+        'objetos': pagina,
+        'siguiente': pagina.cursor_siguiente,
         'orden_actual': orden,
-        'duplicados': duplicados,
-        'sugerencias': sugerencias,
-        'total_objetos': objetos.count(),
-        'porcentaje_ocupacion': round((objetos.count() / caja.capacidadMaxima) * 100, 1) if caja.capacidadMaxima > 0 else 0,
+        'claves_duplicadas': contenido['claves_duplicadas'],
+        'sugerencias': contenido['sugerencias'],
+        'parecidos': contenido['parecidos'],
+        'similares': similares,
+        'desde': timezone.now().isoformat(),
+        'total_objetos': caja.total_objetos,
+        'porcentaje_ocupacion': caja.porcentaje_ocupacion,
     }
     
-    return render(request, 'detalle_caja.html', context)
+    return await arender(request, 'detalle_caja.html', context)
+
+
+async def objetos_caja(request, caja_id):
+    """
+    Siguiente página de tarjetas de objetos de la caja para "Cargar más" en detalle_caja
+    """
+    caja = await _obtener_caja(caja_id)
+    if caja is None:
+        raise Http404('La caja no existe.')
+    orden = _leer_orden(request.GET)
+    try:
+        pagina = await sync_to_async(pagina_objetos_caja)(caja, orden, request.GET.get('despues'))
+    except CursorInvalido:
+        return HttpResponseBadRequest('El enlace de paginación no es válido.')
+    grupos = await sync_to_async(grupos_duplicados)(caja, {objeto.clave_duplicado for objeto in pagina.elementos})
+
+    context = {
+        'caja': caja,
+        'objetos': pagina,
+        'siguiente': pagina.cursor_siguiente,
+        'orden_actual': orden,
+        'claves_duplicadas': {grupo['clave_duplicado'] for grupo in grupos},
+    }
+    return await arender(request, 'objetos_caja.html', context)
+
+
+async def eventos_acciones(request, caja_id=None):
+    """
+    Flujo de server-sent events con las acciones nuevas, de todas las cajas o de una (con
+    los filtros ?caja= y ?tipo= del historial). Continúa desde Last-Event-ID al reconectar, o desde
+    ?desde= (fecha de la página) en la primera conexión.
+    """
+    ultimo = request.headers.get('Last-Event-ID') or request.GET.get('ultimo', '')
+    caja = request.GET.get('caja', '')
+    if caja_id is None and caja.isdigit():
+        caja_id = int(caja)
+    desde = parse_datetime(request.GET.get('desde', '')) if request.GET.get('desde') else None
+    if desde is not None and timezone.is_naive(desde):
+        desde = timezone.make_aware(desde)
+    filtros = {
+        'ultimo_id': int(ultimo) if ultimo.isdigit() else None,
+        'desde': desde,
+        'cajon_id': caja_id,
+        'tipo': request.GET.get('tipo') or None,
+    }
+
+    if not isinstance(request, ASGIRequest):
+        # Con WSGI cada conexión ocuparía un hilo: se envía lo pendiente y el navegador
+        # vuelve a conectar pasado REINTENTO_MS
+        pendientes, _ = await sync_to_async(eventos.acciones_posteriores)(**filtros)
+        texto = f'retry: {settings.EVENTOS["REINTENTO_MS"]}\n\n' + ''.join(eventos.formatear(datos) for datos in pendientes)
+        respuesta = HttpResponse(texto, content_type='text/event-stream')
+    elif eventos.canal.lleno():
+        return HttpResponse('Demasiadas conexiones abiertas', status=503, headers={'Retry-After': '30'})
+    else:
+        respuesta = StreamingHttpResponse(eventos.flujo(**filtros), content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    # nginx no debe acumular el flujo en su búfer
+    respuesta['X-Accel-Buffering'] = 'no'
+    return respuesta
 
 def eliminar_objeto(request, objeto_id):
     """
@@ -266,8 +565,28 @@ def eliminar_objeto(request, objeto_id):
     if request.method == 'POST':
         try:
             objeto = Objeto.objects.get(id=objeto_id)
-            cajas_afectadas = list(objeto.cajones.all())
             nombre_objeto = objeto.nombre
+
+            # Quitar unidades de un objeto apilado; si no le quedan más se elimina entero
+            caja_id = request.POST.get('caja')
+            unidades = request.POST.get('unidades')
+            if caja_id and unidades:
+                caja = Cajon.objects.get(id=caja_id)
+                unidades = max(int(unidades), 1)
+                with transaction.atomic():
+                    quitadas = inventario.quitar_unidades(caja.id, objeto, unidades)
+                if quitadas:
+                    texto = 'Se quitó una unidad' if unidades == 1 else f'Se quitaron {unidades} unidades'
+                    registrar_accion(
+                        tipo_accion='eliminar_objeto',
+                        cajon=caja,
+                        objeto=objeto,
+                        descripcion=f'{texto} del objeto "{nombre_objeto}" de la caja "{caja.nombre}"'
+                    )
+                    messages.success(request, f'{texto} de "{nombre_objeto}".')
+                    return redirect('detalle_caja', caja_id=caja.id)
+
+            cajas_afectadas = list(objeto.cajones.all())
             
             # Registrar la acción antes de eliminar
             for caja in cajas_afectadas:
@@ -278,8 +597,10 @@ def eliminar_objeto(request, objeto_id):
                     descripcion=f'Se eliminó el objeto "{nombre_objeto}" de la caja "{caja.nombre}"'
                 )
             
-            # Eliminar el objeto
-            objeto.delete()
+            # Eliminar el objeto y descontarlo de la ocupación de sus cajas
+            with transaction.atomic():
+                inventario.baja_objetos([objeto.id])
+                objeto.delete()
             
             messages.success(request, f'Objeto "{nombre_objeto}" eliminado exitosamente.')
             
@@ -289,7 +610,7 @@ def eliminar_objeto(request, objeto_id):
             else:
                 return redirect('crear_caja')
                 
-        except Objeto.DoesNotExist:
+        except (Objeto.DoesNotExist, Cajon.DoesNotExist):
             messages.error(request, 'El objeto no existe.')
             return redirect('crear_caja')
         except Exception as e:
@@ -300,54 +621,20 @@ def eliminar_objeto(request, objeto_id):
 
 def eliminar_duplicados(request, caja_id):
     """
-    Vista para eliminar objetos duplicados de una caja específica
+    Vista para apilar los objetos duplicados de una caja específica (sus unidades se suman
+    al objeto más antiguo de cada grupo)
     """
     if request.method == 'POST':
         try:
             caja = Cajon.objects.get(id=caja_id)
-            objetos = caja.objetos.all()
-            
-            # Detectar duplicados
-            objetos_revisados = {}
-            duplicados_eliminados = []
-            objetos_conservados = []
-            
-            for objeto in objetos:
-                clave = f"{objeto.nombre.lower().strip()}_{objeto.tipo}_{objeto.tamanio}"
-                if clave in objetos_revisados:
-                    # Es un duplicado, lo marcamos para eliminar
-                    duplicados_eliminados.append(objeto)
-                else:
-                    # Es el primero de su tipo, lo conservamos
-                    objetos_revisados[clave] = objeto
-                    objetos_conservados.append(objeto)
-            
-            # Eliminar los duplicados
-            objetos_eliminados_nombres = []
-            for objeto in duplicados_eliminados:
-                objetos_eliminados_nombres.append(f"{objeto.nombre} ({objeto.get_tipo_display()}, {objeto.get_tamanio_display()})")
-                
-                # Registrar la acción antes de eliminar
-                registrar_accion(
-                    tipo_accion='eliminar_objeto',
-                    cajon=caja,
-                    objeto=objeto,
-                    descripcion=f'Se eliminó el objeto duplicado "{objeto.nombre}" (tipo: {objeto.get_tipo_display()}, tamaño: {objeto.get_tamanio_display()}) de la caja "{caja.nombre}"'
-                )
-                
-                objeto.delete()
-            
-            # Registrar la acción de limpieza general
-            if duplicados_eliminados:
-                registrar_accion(
-                    tipo_accion='organizar_caja',
-                    cajon=caja,
-                    descripcion=f'Se eliminaron {len(duplicados_eliminados)} objetos duplicados de la caja "{caja.nombre}". Se conservaron {len(objetos_conservados)} objetos únicos.'
-                )
-                
-                messages.success(request, f'Se eliminaron {len(duplicados_eliminados)} objetos duplicados. Se conservaron {len(objetos_conservados)} objetos únicos.')
+
+            # Detectar y apilar los duplicados en una sola transacción
+            apilados, objetos_conservados = apilar_duplicados(caja)
+
+            if apilados:
+                messages.success(request, f'Se apilaron {len(apilados)} objetos duplicados. Quedan {objetos_conservados} objetos distintos, sin perder unidades.')
             else:
-                messages.info(request, 'No se encontraron objetos duplicados para eliminar.')
+                messages.info(request, 'No se encontraron objetos duplicados para apilar.')
             
             return redirect('detalle_caja', caja_id=caja.id)
             
@@ -355,8 +642,143 @@ def eliminar_duplicados(request, caja_id):
             messages.error(request, 'La caja no existe.')
             return redirect('crear_caja')
         except Exception as e:
-            messages.error(request, f'Error al eliminar duplicados: {str(e)}')
+            messages.error(request, f'Error al apilar duplicados: {str(e)}')
             return redirect('detalle_caja', caja_id=caja_id)
     
     return redirect('crear_caja')
 
+def importar_objetos(request):
+    """
+    Vista para importar objetos de forma masiva desde un archivo CSV o NDJSON
+    """
+    resultado = None
+
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        formato = request.POST.get('formato') or None
+
+        if not archivo:
+            messages.error(request, 'Selecciona un archivo para importar.')
+        else:
+            try:
+                resultado = importar_archivo_subido(archivo, formato=formato)
+
+                if resultado.creados:
+                    messages.success(request, f'Se importaron {resultado.creados} objetos de {resultado.filas} filas en {resultado.duracion:.2f} segundos ({resultado.filas_por_segundo} filas/s).')
+                if resultado.total_errores:
+                    messages.error(request, f'{resultado.total_errores} filas no se pudieron importar.')
+            except UnicodeDecodeError:
+                messages.error(request, 'El archivo debe estar codificado en UTF-8.')
+            except Exception as e:
+                messages.error(request, f'Error al importar el archivo: {str(e)}')
+
+    context = {
+        'resultado': resultado,
+    }
+    return render(request, 'InterfazImportarObjetos.html', context)
+
+def buscar_objetos(request):
+    """
+    Vista para buscar objetos en todas las cajas por nombre, tipo o nombre de la caja
+    """
+    consulta = request.GET.get('q', '').strip()
+    resultados = busqueda.buscar(consulta) if consulta else []
+
+    context = {
+        'consulta': consulta,
+        'resultados': resultados,
+    }
+    return render(request, 'buscar_objetos.html', context)
+
+
+def organizar_cajas(request):
+    """
+    Vista para reorganizar los objetos entre las cajas según su tamaño y la capacidad de cada caja.
+    GET muestra el plan sin aplicarlo; POST lo aplica.
+    """
+    parametros = request.POST if request.method == 'POST' else request.GET
+    reorganizar = parametros.get('reorganizar') == '1'
+    # Agrupar por tipo salvo que se desmarque explícitamente
+    agrupar_por_tipo = parametros.get('agrupar', '1') == '1'
+
+    if request.method == 'POST':
+        try:
+            plan = organizar(reorganizar=reorganizar, agrupar_por_tipo=agrupar_por_tipo)
+            if len(plan):
+                messages.success(request, plan.descripcion)
+            else:
+                messages.info(request, 'Las cajas ya están organizadas, no hay objetos que mover.')
+        except Exception as e:
+            messages.error(request, f'Error al organizar las cajas: {str(e)}')
+        return redirect('organizar_cajas')
+
+    plan = organizar(reorganizar=reorganizar, agrupar_por_tipo=agrupar_por_tipo, simular=True)
+
+    # Vista previa de los primeros movimientos con los nombres de objetos y cajas
+    movimientos = plan.movimientos(limite=50)
+    nombres_objetos = dict(Objeto.objects.filter(id__in=[m[0] for m in movimientos]).values_list('id', 'nombre'))
+    nombres_cajas = dict(Cajon.objects.filter(id__in={c for m in movimientos for c in m[1:]}).values_list('id', 'nombre'))
+    vista_previa = [
+        (nombres_objetos.get(objeto_id, objeto_id), nombres_cajas.get(origen, origen), nombres_cajas.get(destino, destino))
+        for objeto_id, origen, destino in movimientos
+    ]
+
+    context = {
+        'plan': plan,
+        'vista_previa': vista_previa,
+        'reorganizar': reorganizar,
+        'agrupar_por_tipo': agrupar_por_tipo,
+    }
+    return render(request, 'organizar_cajas.html', context)
+
+
+def estadisticas(request):
+    """
+    Panel con la ocupación de las cajas, los objetos por tipo y la actividad de los
+    últimos días. Solo lee los resúmenes (sistema/resumenes.py), así que cuesta lo mismo
+    con cualquier tamaño del inventario.
+    """
+    dias = request.GET.get('dias', '30')
+    dias = min(max(int(dias), 1), 365) if dias.isdigit() else 30
+    caja_id = request.GET.get('caja', '')
+    caja = Cajon.objects.filter(id=int(caja_id)).only('id', 'nombre').first() if caja_id.isdigit() else None
+
+    context = {
+        'panel': resumenes.panel(dias=dias, cajon_id=caja.id if caja else None),
+        'caja': caja,
+    }
+    return render(request, 'estadisticas.html', context)
+
+
+def exportar_datos(request, que):
+    """
+    Descarga de los objetos o del historial de acciones en CSV o NDJSON (?formato=),
+    con los filtros caja y tipo, tamanio (objetos) o desde y hasta (acciones)
+    """
+    if que not in exportacion.EXPORTACIONES:
+        raise Http404('Exportación desconocida')
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacion.TIPOS_CONTENIDO:
+        return HttpResponseBadRequest('Formato no válido: use csv o ndjson')
+
+    caja = request.GET.get('caja', '')
+    filtros = {
+        'cajon_id': int(caja) if caja.isdigit() else None,
+        'tipo': request.GET.get('tipo') or None,
+    }
+    if que == 'objetos':
+        filtros['tamanio'] = request.GET.get('tamanio') or None
+    else:
+        filtros['inicio'], filtros['fin'] = rango_fechas({
+            'desde': request.GET.get('desde', ''),
+            'hasta': request.GET.get('hasta', ''),
+        })
+    return exportacion.respuesta(request, que, formato, **filtros)
+
+
+@require_safe
+def servir_medio(request, ruta):
+    """
+    Fotos de los objetos (MEDIA_ROOT) con ETag, caché del navegador y rangos, ver sistema/medios.py
+    """
+    return medios.respuesta(request, ruta)
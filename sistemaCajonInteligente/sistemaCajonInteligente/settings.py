@@ -47,7 +47,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-
+    # Debe ir el último: mide la vista sin el resto de middleware
+    'sistema.instrumentacion.InstrumentacionMiddleware',
 ]
 
 ROOT_URLCONF = 'sistemaCajonInteligente.urls'
@@ -71,14 +72,100 @@ WSGI_APPLICATION = 'sistemaCajonInteligente.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# Perfil configurable con variables de entorno:
+#   BD_MOTOR=sqlite3 (por defecto) o mysql
+#   BD_NOMBRE (archivo de SQLite o base de datos de MySQL), BD_USUARIO, BD_CLAVE, BD_HOST, BD_PUERTO
+#   BD_CONEXION_SEGUNDOS: segundos que se reutiliza cada conexión (CONN_MAX_AGE, 0 = una por petición)
+#   BD_REPLICA_NOMBRE y BD_REPLICA_HOST (solo con MySQL): réplica de solo lectura mantenida
+#     por la replicación del servidor; las lecturas van a ella y las escrituras a 'default'
+#     (sistema/enrutador.py). Una petición lee de 'default' después de escribir, pero la
+#     siguiente puede leer de la réplica con el retraso de la replicación (normalmente
+#     menos de un segundo). Con SQLite no hay réplica: una copia del archivo solo estaría
+#     al día al copiarla y las lecturas podrían ser tan antiguas como la última copia; con
+#     WAL los lectores de 'default' no bloquean al escritor.
+
+BD_MOTOR = os.environ.get('BD_MOTOR', 'sqlite3')
+
+# Cada conexión nueva de SQLite ejecuta estos PRAGMA:
+# - WAL: los lectores no bloquean al escritor ni el escritor a los lectores; solo hay un
+#   escritor a la vez (la bitácora y las vistas se turnan)
+# - synchronous=NORMAL: con WAL es seguro ante caídas del proceso; solo se sincroniza
+#   el disco en los checkpoint
+# - caché de páginas de 32 MB por conexión y temporales en memoria
+PRAGMAS_SQLITE = (
+    'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+    'PRAGMA cache_size=-32000; PRAGMA temp_store=MEMORY'
+)
+
+if BD_MOTOR == 'mysql':
+    BD_OPCIONES = {
+        'ENGINE': 'django.db.backends.mysql',
+        'NAME': os.environ.get('BD_NOMBRE', 'cajones'),
+        'USER': os.environ.get('BD_USUARIO', ''),
+        'PASSWORD': os.environ.get('BD_CLAVE', ''),
+        'HOST': os.environ.get('BD_HOST', ''),
+        'PORT': os.environ.get('BD_PUERTO', ''),
+        'OPTIONS': {
+            'charset': 'utf8mb4',
+            'isolation_level': 'read committed',
+            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+        },
+    }
+else:
+    BD_OPCIONES = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BD_NOMBRE', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # La bitácora escribe desde su propio hilo: las transacciones toman el bloqueo
+            # de escritura al empezar y esperan hasta `timeout` segundos si está ocupado
+            # (es el busy_timeout de SQLite)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': PRAGMAS_SQLITE,
+        },
+    }
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        **BD_OPCIONES,
+        'CONN_MAX_AGE': int(os.environ.get('BD_CONEXION_SEGUNDOS', '60')),
+        # Comprueba que una conexión reutilizada sigue viva antes de la primera consulta de la petición
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+if BD_MOTOR == 'mysql' and os.environ.get('BD_REPLICA_NOMBRE'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['BD_REPLICA_NOMBRE'],
+        'HOST': os.environ.get('BD_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+        # En las pruebas la réplica es la misma base de datos que 'default'
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['sistema.enrutador.EnrutadorReplica']
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'fragmentos' guarda el contenido calculado de detalle_caja; para compartirlo entre
+# procesos usar el backend de archivos:
+#   FRAGMENTOS_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+#   FRAGMENTOS_CACHE_LOCATION=/var/tmp/cajones_fragmentos
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragmentos': {
+        'BACKEND': os.environ.get('FRAGMENTOS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FRAGMENTOS_CACHE_LOCATION', 'fragmentos'),
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,    # al superarse se desaloja 1/CULL_FREQUENCY de las entradas
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -120,3 +207,114 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Importación masiva de objetos
+# Número de filas que se escriben por transacción (bulk_create)
+IMPORTACION_TAMANIO_LOTE = 500
+
+# Bitácora de acciones (sistema/bitacora.py)
+# BitacoraEnCola escribe las acciones por lotes desde un hilo; BitacoraSincrona las escribe
+# en el momento (usar en pruebas)
+BITACORA_ACCIONES = {
+    'BACKEND': 'sistema.bitacora.BitacoraEnCola',
+    'TAMANIO_LOTE': 200,    # acciones por escritura
+    'INTERVALO': 1.0,       # segundos máximos que una acción espera en la cola
+    'TAMANIO_COLA': 10000,  # acciones pendientes antes de empezar a descartar
+}
+
+# Historial de acciones
+# Segundos que se reutiliza el total de acciones (evita un COUNT(*) en cada página)
+HISTORIAL_TOTAL_CACHE_SEGUNDOS = 60
+
+# Archivo de acciones antiguas (sistema/archivo.py, manage.py archivar_acciones)
+ARCHIVO_ACCIONES = {
+    'DIRECTORIO': os.environ.get('ARCHIVO_ACCIONES_DIRECTORIO', os.path.join(BASE_DIR, 'archivo_acciones')),
+    'DIAS': 90,                 # se archivan las acciones con más días
+    'TAMANIO_BLOQUE': 2000,     # acciones por bloque comprimido y por transacción de borrado
+}
+
+# Procesamiento de fotos de objetos (sistema/imagenes.py)
+IMAGENES = {
+    'SINCRONO': False,          # True: procesar dentro de la petición (pruebas)
+    'HILOS': 2,                 # hilos que procesan fotos en segundo plano
+    'LADO_MAXIMO': 1600,        # píxeles del lado mayor de la foto recodificada
+    'TAMANIO_MINIATURA': 256,   # píxeles del lado mayor de la miniatura
+    'FORMATO': 'WEBP',          # WEBP, JPEG o PNG
+    'CALIDAD': 80,
+}
+
+# Entrega de las fotos de los objetos (sistema/medios.py)
+MEDIOS = {
+    # '': las envía Django; 'x-accel-redirect' (nginx) o 'x-sendfile' (Apache, lighttpd): las envía el proxy
+    'ENVIO': os.environ.get('MEDIOS_ENVIO', ''),
+    'PREFIJO_INTERNO': '/media-interno/',   # location "internal" de nginx con alias a MEDIA_ROOT
+    'CACHE_SEGUNDOS': 365 * 24 * 3600,      # max-age de las fotos nombradas por su hash (immutable)
+    'TAMANIO_BLOQUE': 256 * 1024,           # bytes por lectura cuando Django envía el archivo
+}
+
+# Búsqueda de fotos parecidas (sistema/similitud.py)
+SIMILITUD = {
+    'DISTANCIA': 8,             # bits distintos (de 64) para considerar dos fotos parecidas
+    'RECARGA_SEGUNDOS': 300,    # cada cuánto se reconstruye el índice en memoria
+}
+
+# Sugerencia del tipo y el tamaño por la foto (sistema/clasificador.py)
+CLASIFICADOR = {
+    'DIRECTORIO': os.environ.get('CLASIFICADOR_DIRECTORIO', os.path.join(BASE_DIR, 'clasificador')),
+    'SINCRONO': False,          # True: calcular las características en el proceso que las pide (pruebas)
+    'PROCESOS': 2,              # procesos que calculan las características de las fotos
+    'LOTE': 32,                 # fotos pendientes por lote enviado a un proceso
+    'ESPERA_MS': 20,            # espera máxima a que se llene un lote
+    'ESPERA_SEGUNDOS': 10,      # espera máxima de la sugerencia al subir una foto
+    'VECINOS': 10,              # fotos más parecidas que votan
+    'CONFIANZA_MINIMA': 0.5,    # fracción de los votos para sugerir una etiqueta
+}
+
+# Objetos con nombres parecidos (sistema/parecidos.py)
+PARECIDOS = {
+    'UMBRAL': 0.5,              # similitud de Jaccard de los trigramas del nombre normalizado
+    'MAXIMO_CUBETA': 200,       # nombres distintos con una misma clave de banda que se comparan entre sí
+}
+
+# Búsqueda de objetos (sistema/busqueda.py)
+BUSQUEDA = {
+    'BACKEND': 'auto',          # auto: FTS5 si SQLite lo admite, si no en memoria; 'fts5' o 'memoria'
+    'RECARGA_SEGUNDOS': 300,    # cada cuánto se reconstruye el índice en memoria
+    'LIMITE': 20,               # resultados por búsqueda
+}
+
+# Actividad en vivo del historial y del detalle de las cajas (sistema/eventos.py)
+EVENTOS = {
+    'TAMANIO_COLA': 1000,           # eventos pendientes por conexión antes de ponerla al día con la base de datos
+    'REPETICION_MAXIMA': 200,       # acciones que se repiten al reconectar; con más se recarga la página
+    'LATIDO_SEGUNDOS': 15,          # sin eventos: comentario de latido y consulta de acciones de otros procesos
+    'REINTENTO_MS': 3000,           # espera del navegador antes de reconectar
+    'MAXIMO_SUSCRIPCIONES': 500,    # conexiones abiertas por proceso
+}
+
+# Medición de las peticiones (sistema/instrumentacion.py)
+INSTRUMENTACION = {
+    'ACTIVA': os.environ.get('INSTRUMENTACION_ACTIVA', '1') == '1',
+    'MUESTREO': float(os.environ.get('INSTRUMENTACION_MUESTREO', '0')),  # fracción de peticiones medidas (0: sin medir)
+    'SERVER_TIMING': True,      # cabecera Server-Timing con los tiempos, solo para staff o con DEBUG
+    'UMBRAL_LENTO_MS': 500,     # peticiones más lentas se escriben en el registro de lentas
+    'CONSULTAS_LENTAS': 5,      # consultas más lentas que se guardan por petición
+    'SEGUNDOS_VENTANA': 300,    # histogramas por vista: duración de cada ventana
+    'VENTANAS': 12,             # y cuántas se conservan (la última hora)
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Una línea JSON por petición lenta
+        'sistema.instrumentacion.lentas': {
+            'handlers': ['consola'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}